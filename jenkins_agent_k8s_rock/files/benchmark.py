@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Run fixed micro-benchmarks of the agent and print the results as JSON.
+
+The work of each benchmark is fixed so that the results of different units are comparable: the
+SHA-256 digest of 256 MiB, 16 copies of a 64 MiB buffer, writing and reading back a 128 MiB file
+in the agent working directory and sequential requests to the Jenkins controller.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+BLOCK_SIZE = 2**20
+CPU_MIB = 256
+MEMORY_BUFFER_MIB = 64
+MEMORY_COPIES = 16
+DISK_MIB = 128
+ROUND_TRIPS = 5
+ROUND_TRIP_TIMEOUT_SECONDS = 10
+
+
+def benchmark_cpu() -> float:
+    """Measure the single core SHA-256 throughput.
+
+    Returns:
+        The throughput in MiB per second.
+    """
+    block = os.urandom(BLOCK_SIZE)
+    digest = hashlib.sha256()
+    start = time.perf_counter()
+    for _ in range(CPU_MIB):
+        digest.update(block)
+    return CPU_MIB / (time.perf_counter() - start)
+
+
+def benchmark_memory() -> float:
+    """Measure the memory copy bandwidth.
+
+    Returns:
+        The bandwidth in GiB per second.
+    """
+    source = bytearray(MEMORY_BUFFER_MIB * BLOCK_SIZE)
+    destination = bytearray(len(source))
+    start = time.perf_counter()
+    for _ in range(MEMORY_COPIES):
+        destination[:] = source
+    return MEMORY_BUFFER_MIB * MEMORY_COPIES / 1024 / (time.perf_counter() - start)
+
+
+def benchmark_disk(workdir: Path) -> tuple[float, float]:
+    """Measure the sequential write and read throughput of the working directory.
+
+    The file is synced to disk after writing and dropped from the page cache before reading, so
+    that the read comes from the disk rather than memory.
+
+    Args:
+        workdir: The agent working directory.
+
+    Returns:
+        The write and read throughput in MiB per second.
+    """
+    path = workdir / f".benchmark-{os.getpid()}"
+    block = os.urandom(BLOCK_SIZE)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            start = time.perf_counter()
+            for _ in range(DISK_MIB):
+                os.write(fd, block)
+            os.fsync(fd)
+            write_seconds = time.perf_counter() - start
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            start = time.perf_counter()
+            while os.read(fd, BLOCK_SIZE):
+                pass
+            read_seconds = time.perf_counter() - start
+        finally:
+            os.close(fd)
+    finally:
+        path.unlink(missing_ok=True)
+    return DISK_MIB / write_seconds, DISK_MIB / read_seconds
+
+
+def benchmark_controller(url: str) -> float:
+    """Measure the median round trip time of a request to the Jenkins controller.
+
+    Each request opens a new connection, as the agent does when it reconnects.
+
+    Args:
+        url: The Jenkins controller URL.
+
+    Returns:
+        The median round trip time in milliseconds.
+    """
+    round_trips = []
+    for _ in range(ROUND_TRIPS):
+        request = urllib.request.Request(f"{url.rstrip('/')}/login", method="HEAD")
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=ROUND_TRIP_TIMEOUT_SECONDS):  # nosec
+                pass
+        except urllib.error.HTTPError:
+            # Any HTTP response is a complete round trip.
+            pass
+        round_trips.append((time.perf_counter() - start) * 1000)
+    return statistics.median(round_trips)
+
+
+def main() -> None:
+    """Run the benchmarks and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workdir", type=Path, required=True)
+    parser.add_argument("--url", default="")
+    args = parser.parse_args()
+    disk_write, disk_read = benchmark_disk(args.workdir)
+    results = {
+        "cpu_mib_per_second": benchmark_cpu(),
+        "memory_gib_per_second": benchmark_memory(),
+        "disk_write_mib_per_second": disk_write,
+        "disk_read_mib_per_second": disk_read,
+    }
+    if args.url:
+        try:
+            results["controller_round_trip_ms"] = benchmark_controller(args.url)
+        except OSError as exc:
+            results["controller_error"] = str(exc)
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Time the network phases of the connection of the agent to the Jenkins controller.
+
+The phases are timed in the order the agent goes through them: resolving the controller host
+name, connecting to it, the TLS handshake, the agent JAR HEAD request and the JNLP file fetch.
+The timings are printed as JSON, up to the first phase that failed.
+"""
+
+import argparse
+import json
+import socket
+import ssl
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+TIMEOUT_SECONDS = 10
+
+
+def time_request(request: urllib.request.Request) -> tuple[float, int]:
+    """Time an HTTP request on a new connection, up to the end of the response body.
+
+    Args:
+        request: The HTTP request.
+
+    Returns:
+        The time in milliseconds and the response status.
+    """
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=TIMEOUT_SECONDS) as response:  # nosec
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as exc:
+        # Any HTTP response is a complete round trip.
+        status = exc.code
+    return (time.perf_counter() - start) * 1000, status
+
+
+def diagnose(url: str, agent: str) -> dict:
+    """Time the network phases of the connection to the controller.
+
+    Args:
+        url: The Jenkins controller URL.
+        agent: The Jenkins agent name.
+
+    Returns:
+        The milliseconds of each phase, the HTTP statuses, the controller address and the error
+        of the failed phase.
+    """
+    parsed_url = urllib.parse.urlparse(url)
+    hostname = parsed_url.hostname or ""
+    port = parsed_url.port or (443 if parsed_url.scheme == "https" else 80)
+    result: dict = {"phases": {}, "statuses": {}}
+    phase = "dns"
+    try:
+        start = time.perf_counter()
+        address = socket.getaddrinfo(hostname, port, type=socket.SOCK_STREAM)[0][4]
+        result["phases"][phase] = (time.perf_counter() - start) * 1000
+        result["address"] = address[0]
+        phase = "tcp-connect"
+        start = time.perf_counter()
+        with socket.create_connection(address[:2], timeout=TIMEOUT_SECONDS) as sock:
+            result["phases"][phase] = (time.perf_counter() - start) * 1000
+            if parsed_url.scheme == "https":
+                phase = "tls-handshake"
+                start = time.perf_counter()
+                with ssl.create_default_context().wrap_socket(sock, server_hostname=hostname):
+                    result["phases"][phase] = (time.perf_counter() - start) * 1000
+        for phase, request in (
+            (
+                "agent-jar-head",
+                urllib.request.Request(f"{url}/jnlpJars/agent.jar", method="HEAD"),
+            ),
+            ("jnlp-fetch", urllib.request.Request(f"{url}/computer/{agent}/slave-agent.jnlp")),
+        ):
+            result["phases"][phase], result["statuses"][phase] = time_request(request)
+    except OSError as exc:
+        result["error"] = f"{phase}: {exc}"
+    return result
+
+
+def main() -> None:
+    """Time the connection phases and print the timings."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", required=True)
+    parser.add_argument("--agent", required=True)
+    args = parser.parse_args()
+    print(json.dumps(diagnose(args.url.rstrip("/"), args.agent)))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@
 # See LICENSE file for licensing details.
 
 set -eu -o pipefail
+# Run the last pipeline command in the current shell to keep the agent state it updates.
+shopt -s lastpipe
 
 export LC_ALL=C
 export TERM=xterm
@@ -23,20 +25,66 @@ typeset JENKINS_AGENT="${JENKINS_AGENT:?"Jenkins agent name must be provided"}"
 typeset JENKINS_TOKEN="${JENKINS_TOKEN:?"Jenkins agent token must be provided"}"
 
 typeset JENKINS_HOME="/var/lib/jenkins"
+# The agents of secondary controllers run in their own working directory.
+typeset JENKINS_WORKDIR="${JENKINS_WORKDIR:-${JENKINS_HOME}}"
+typeset JENKINS_CONTROLLER="${JENKINS_CONTROLLER:-}"
 
-# Ensure working directory is at $JENKINS_HOME
+# Ensure working directory is at $JENKINS_WORKDIR
 # -workDir parameter might be unreliable from experiences
 # and jenkins can sometime ignore it (to be verified!)
-cd $JENKINS_HOME
+mkdir -p "${JENKINS_WORKDIR}/agents"
+cd "${JENKINS_WORKDIR}"
 # Path of the agent.jar
-typeset AGENT_JAR="${JENKINS_HOME}/agent.jar"
+typeset AGENT_JAR="${JENKINS_WORKDIR}/agent.jar"
+typeset PEBBLE="/charm/bin/pebble"
+export PEBBLE_SOCKET="${PEBBLE_SOCKET:-/charm/container/pebble.socket}"
+
+# Notify the charm of the agent connection state, custom notices require Juju 3.4 or later.
+notify() {
+    "${PEBBLE}" notify "$@" "agent=${JENKINS_AGENT}" "controller=${JENKINS_CONTROLLER}" \
+        || echo "Failed to notify the charm."
+}
+
+# The agent state served by the metrics exporter, connections are counted across restarts.
+typeset AGENT_STATE="${JENKINS_WORKDIR}/metrics/agent.state"
+typeset -i connections=0
+if [[ -f "${AGENT_STATE}" ]]; then
+    connections=$(sed -n 's/^connections=//p' "${AGENT_STATE}")
+fi
+typeset started_at
+started_at=$(date +%s.%N)
+typeset connected_at=0
+
+write_agent_state() {
+    mkdir -p "${JENKINS_WORKDIR}/metrics"
+    printf "started_at=%s\nconnected_at=%s\nconnections=%s\n" \
+        "${started_at}" "${connected_at}" "${connections}" > "${AGENT_STATE}.tmp"
+    mv "${AGENT_STATE}.tmp" "${AGENT_STATE}"
+}
+write_agent_state
 
 # Specify the pod as ready
-touch "${JENKINS_HOME}/agents/.ready"
+touch "${JENKINS_WORKDIR}/agents/.ready"
 
 # Start Jenkins agent
 echo "${JENKINS_AGENT}"
-${JAVA} -jar ${AGENT_JAR} -jnlpUrl "${JENKINS_URL}/computer/${JENKINS_AGENT}/jenkins-agent.jnlp" -workDir "${JENKINS_HOME}" -noReconnect -secret "${JENKINS_TOKEN}" || echo "Invalid or already used credentials."
+# JAVA_OPTS is split into the JVM options.
+# shellcheck disable=SC2086
+${JAVA} ${JAVA_OPTS:-} -jar ${AGENT_JAR} -jnlpUrl "${JENKINS_URL}/computer/${JENKINS_AGENT}/jenkins-agent.jnlp" -workDir "${JENKINS_WORKDIR}" -noReconnect -secret "${JENKINS_TOKEN}" 2>&1 \
+    | while IFS= read -r line; do
+        echo "${line}"
+        if [[ "${line}" == *"INFO: Connected"* ]]; then
+            connected_at=$(date +%s.%N)
+            connections+=1
+            write_agent_state
+            notify jenkins.io/agent-connected
+        fi
+    done || echo "Invalid or already used credentials."
 
 # Remove ready mark if unsuccessful
-rm ${JENKINS_HOME}/agents/.ready
+rm "${JENKINS_WORKDIR}/agents/.ready"
+connected_at=0
+write_agent_state
+
+# Pebble restarts the agent, repeated disconnections only notify the charm once a minute.
+notify --repeat-after=1m jenkins.io/agent-disconnected
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Serve the Jenkins agent and charm metrics in the Prometheus text exposition format.
+
+The charm writes its metrics to the charm metrics file. The agent entrypoint of each controller
+records the service start time, the connection time and the number of connections to the agent
+state file of its working directory. The agent metrics are labelled by controller, "primary" for
+the agent running in the Jenkins home directory.
+"""
+
+import http.server
+import os
+import time
+from pathlib import Path
+
+JENKINS_WORKDIR = Path("/var/lib/jenkins")
+METRICS_DIR = JENKINS_WORKDIR / "metrics"
+CHARM_METRICS_PATH = METRICS_DIR / "charm.prom"
+AGENT_STATE_PATH = METRICS_DIR / "agent.state"
+# The working directories of the secondary controller agents, named after the controller.
+CONTROLLERS_DIR = JENKINS_WORKDIR / "controllers"
+PRIMARY_CONTROLLER = "primary"
+# The type and help text of the agent metrics.
+AGENT_METRICS = {
+    "jenkins_agent_up": ("gauge", "Whether the agent is connected."),
+    "jenkins_agent_uptime_seconds": ("gauge", "Time since the agent connected."),
+    "jenkins_agent_time_to_connected_seconds": (
+        "gauge",
+        "Time from the agent start to its last connection.",
+    ),
+    "jenkins_agent_reconnects_total": ("counter", "Connections of the agent after the first one."),
+}
+
+
+def find_agent_state_paths() -> dict[str, Path]:
+    """Find the agent state files of the controller agents.
+
+    Returns:
+        The agent state file paths, by controller name.
+    """
+    return {
+        PRIMARY_CONTROLLER: AGENT_STATE_PATH,
+        **{
+            path.parents[1].name: path
+            for path in sorted(
+                CONTROLLERS_DIR.glob(f"*/{METRICS_DIR.name}/{AGENT_STATE_PATH.name}")
+            )
+        },
+    }
+
+
+def read_agent_state(path: Path) -> dict[str, float]:
+    """Read the agent state recorded by the entrypoint.
+
+    Args:
+        path: The agent state file path.
+
+    Returns:
+        The agent state values, by key, empty if the agent never started.
+    """
+    agent_state: dict[str, float] = {}
+    try:
+        content = path.read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return agent_state
+    for line in content.splitlines():
+        key, _, value = line.partition("=")
+        try:
+            agent_state[key] = float(value)
+        except ValueError:
+            continue
+    return agent_state
+
+
+def get_agent_samples(agent_state: dict[str, float], now: float) -> dict[str, float]:
+    """Get the agent metric values.
+
+    Args:
+        agent_state: The agent state recorded by the entrypoint.
+        now: The current time, in seconds since the epoch.
+
+    Returns:
+        The agent metric values, by metric name.
+    """
+    started_at = agent_state.get("started_at", 0.0)
+    connected_at = agent_state.get("connected_at", 0.0)
+    connected = connected_at >= started_at > 0
+    return {
+        "jenkins_agent_up": float(connected),
+        "jenkins_agent_uptime_seconds": now - connected_at if connected else 0.0,
+        "jenkins_agent_time_to_connected_seconds": (
+            connected_at - started_at if connected else 0.0
+        ),
+        "jenkins_agent_reconnects_total": max(agent_state.get("connections", 0.0) - 1, 0.0),
+    }
+
+
+def render_agent_metrics(agent_states: dict[str, dict[str, float]], now: float) -> str:
+    """Render the agent metrics of each controller agent.
+
+    Args:
+        agent_states: The agent states recorded by the entrypoints, by controller name.
+        now: The current time, in seconds since the epoch.
+
+    Returns:
+        The agent metrics in the Prometheus text exposition format.
+    """
+    samples = {
+        controller: get_agent_samples(agent_state, now)
+        for controller, agent_state in agent_states.items()
+    }
+    return "".join(
+        f"# HELP {name} {help_text}\n# TYPE {name} {metric_type}\n"
+        + "".join(
+            f'{name}{{controller="{controller}"}} {values[name]}\n'
+            for controller, values in samples.items()
+        )
+        for name, (metric_type, help_text) in AGENT_METRICS.items()
+    )
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the metrics on the /metrics path."""
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Serve the agent and charm metrics."""
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        try:
+            charm_metrics = CHARM_METRICS_PATH.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            charm_metrics = ""
+        agent_states = {
+            controller: read_agent_state(path)
+            for controller, path in find_agent_state_paths().items()
+        }
+        body = (render_agent_metrics(agent_states, time.time()) + charm_metrics).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:  # pylint: disable=redefined-builtin
+        """Do not log scrapes."""
+
+
+if __name__ == "__main__":
+    http.server.ThreadingHTTPServer(
+        ("", int(os.environ.get("METRICS_PORT", "9100"))), MetricsHandler
+    ).serve_forever()
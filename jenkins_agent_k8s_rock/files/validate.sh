@@ -0,0 +1,44 @@
+#!/bin/bash
+
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+# Validate Jenkins agent name and token pairs outside of the charm hooks.
+# The candidates file holds one "<agent name> <token>" pair per line. The name of the first agent
+# that connects successfully, or an empty line if none does, is written to the result file.
+
+set -u -o pipefail
+
+export LC_ALL=C
+
+typeset JAVA=/usr/bin/java
+typeset JENKINS_URL="${JENKINS_URL:?"URL of a jenkins server must be provided"}"
+typeset VALIDATION_TIMEOUT="${VALIDATION_TIMEOUT:-5}"
+typeset JENKINS_HOME="/var/lib/jenkins"
+typeset AGENT_JAR="${JENKINS_HOME}/agent.jar"
+typeset CANDIDATES="${JENKINS_HOME}/agents/.candidates"
+typeset RESULT="${JENKINS_HOME}/agents/.validated"
+typeset PEBBLE="/charm/bin/pebble"
+export PEBBLE_SOCKET="${PEBBLE_SOCKET:-/charm/container/pebble.socket}"
+
+cd "${JENKINS_HOME}"
+
+valid_agent=""
+while read -r agent token; do
+    # The agent either fails to connect or keeps running until the timeout.
+    output=$(timeout "${VALIDATION_TIMEOUT}" ${JAVA} -jar "${AGENT_JAR}" \
+        -jnlpUrl "${JENKINS_URL}/computer/${agent}/slave-agent.jnlp" \
+        -workDir "${JENKINS_HOME}" -noReconnect -secret "${token}" 2>&1)
+    if grep -q "INFO: Connected" <<< "${output}" && ! grep -q "INFO: Terminated" <<< "${output}"; then
+        valid_agent="${agent}"
+        break
+    fi
+done < "${CANDIDATES}"
+rm -f "${CANDIDATES}"
+
+echo "${valid_agent}" > "${RESULT}.tmp"
+mv "${RESULT}.tmp" "${RESULT}"
+
+# Notify the charm, custom notices require Juju 3.4 or later. The charm otherwise picks up the
+# result on the next update-status.
+"${PEBBLE}" notify jenkins.io/agent-validation || echo "Failed to notify the charm."
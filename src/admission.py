@@ -0,0 +1,168 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""The agent JAR download admission module.
+
+Units that need to download the agent JAR executable request a download slot in their peer
+relation databag. The leader admits up to the configured number of concurrent downloaders in the
+application databag and admits the next requesting units as admitted units release their slot.
+Units whose download failed back off exponentially before requesting a slot again.
+"""
+
+import json
+import logging
+import random
+import time
+import typing
+
+import ops
+
+logger = logging.getLogger(__name__)
+
+PEER_RELATION = "agent-peers"
+CONCURRENCY_CONFIG = "jar_download_concurrency"
+# The unit databag key holding the server URL the unit requests to download from.
+REQUEST_KEY = "jar-download-requested"
+# The application databag key holding the names of the units admitted to download.
+ADMITTED_KEY = "jar-download-admitted"
+# The time in seconds after which a unit that is not admitted downloads anyway, in case the
+# leader is unavailable. The time is jittered by up to the same amount so that units waiting
+# since the same scale-out do not download all at once.
+ADMISSION_TIMEOUT_SECONDS = 600
+# The time in seconds a unit whose download failed waits before requesting a download slot again,
+# doubled on each consecutive failure up to the maximum. The time is jittered down to half of it
+# so that the units that failed against the same server do not retry all at once.
+RETRY_DELAY_SECONDS = 30
+RETRY_MAX_DELAY_SECONDS = 1800
+
+
+class DownloadAdmission(ops.Object):
+    """Admit units to download the agent JAR executable.
+
+    Attrs:
+        _stored: The time after which the unit downloads without being admitted, the number of
+            consecutive failed downloads and the time before which the unit does not request a
+            download slot again.
+    """
+
+    _stored = ops.StoredState()
+
+    def __init__(self, charm: ops.CharmBase):
+        """Initialize the download admission and register event handlers.
+
+        Args:
+            charm: The parent charm to attach the download admission to.
+        """
+        super().__init__(charm, "download-admission")
+        self.charm = charm
+        self._stored.set_default(deadline=0.0, failures=0, retry_time=0.0)
+
+        charm.framework.observe(charm.on[PEER_RELATION].relation_changed, self._on_peers_changed)
+        charm.framework.observe(charm.on[PEER_RELATION].relation_departed, self._on_peers_changed)
+        charm.framework.observe(charm.on.leader_elected, self._on_peers_changed)
+        charm.framework.observe(charm.on.config_changed, self._on_peers_changed)
+
+    def _on_peers_changed(self, _: ops.HookEvent) -> None:
+        """Admit requesting units to the released download slots."""
+        relation = self.charm.model.get_relation(PEER_RELATION)
+        if relation and self.charm.unit.is_leader():
+            self._update_admitted(relation)
+
+    def _get_admitted(self, relation: ops.Relation) -> typing.List[str]:
+        """Get the units admitted to download.
+
+        Args:
+            relation: The peer relation.
+
+        Returns:
+            The names of the admitted units.
+        """
+        return json.loads(relation.data[self.charm.app].get(ADMITTED_KEY, "[]"))
+
+    def _update_admitted(self, relation: ops.Relation) -> None:
+        """Admit requesting units up to the concurrent downloaders limit.
+
+        Units keep their slot until they withdraw their request, also when the limit is lowered.
+
+        Args:
+            relation: The peer relation.
+        """
+        requesting = sorted(
+            unit.name
+            for unit in relation.units | {self.charm.unit}
+            if relation.data[unit].get(REQUEST_KEY)
+        )
+        admitted = [name for name in self._get_admitted(relation) if name in requesting]
+        limit = max(int(self.charm.config.get(CONCURRENCY_CONFIG, 1)), 1)
+        admitted.extend(
+            name for name in requesting if name not in admitted and len(admitted) < limit
+        )
+        admitted_value = json.dumps(admitted)
+        if relation.data[self.charm.app].get(ADMITTED_KEY) != admitted_value:
+            relation.data[self.charm.app][ADMITTED_KEY] = admitted_value
+
+    @property
+    def retry_time(self) -> float:
+        """The time before which the unit does not download again after a failed download."""
+        return typing.cast(float, self._stored.retry_time)
+
+    def is_backing_off(self) -> bool:
+        """Check whether the unit backs off after a failed download.
+
+        Returns:
+            True if the retry time of the last failed download is not reached yet.
+        """
+        return time.time() < self.retry_time
+
+    def request(self, server_url: str) -> bool:
+        """Request a download slot.
+
+        Args:
+            server_url: The Jenkins server URL address to download from.
+
+        Returns:
+            True if the unit may download, because it was admitted, it has no peers or the
+            leader did not admit it in time, unless it backs off after a failed download.
+        """
+        if self.is_backing_off():
+            logger.info("Backing off after a failed agent JAR download.")
+            return False
+        relation = self.charm.model.get_relation(PEER_RELATION)
+        if not relation or not relation.units:
+            return True
+        unit_databag = relation.data[self.charm.unit]
+        if unit_databag.get(REQUEST_KEY) != server_url:
+            unit_databag[REQUEST_KEY] = server_url
+            # It's okay to use random since it's not used for sensitive data.
+            jitter = random.uniform(0, ADMISSION_TIMEOUT_SECONDS)  # nosec
+            self._stored.deadline = time.time() + ADMISSION_TIMEOUT_SECONDS + jitter
+        if self.charm.unit.is_leader():
+            self._update_admitted(relation)
+        if self.charm.unit.name in self._get_admitted(relation):
+            return True
+        if time.time() >= typing.cast(float, self._stored.deadline):
+            logger.warning("Agent JAR download not admitted in time, downloading anyway.")
+            return True
+        return False
+
+    def release(self, failed: bool = False) -> None:
+        """Withdraw the download request, releasing the download slot.
+
+        Args:
+            failed: Whether the download failed, the unit then backs off before requesting a
+                download slot again.
+        """
+        failures = typing.cast(int, self._stored.failures)
+        if failed:
+            delay = min(RETRY_DELAY_SECONDS * 2**failures, RETRY_MAX_DELAY_SECONDS)
+            # It's okay to use random since it's not used for sensitive data.
+            self._stored.retry_time = time.time() + random.uniform(delay / 2, delay)  # nosec
+            self._stored.failures = failures + 1
+        elif failures:
+            self._stored.failures = 0
+        relation = self.charm.model.get_relation(PEER_RELATION)
+        if not relation or REQUEST_KEY not in relation.data[self.charm.unit]:
+            return
+        del relation.data[self.charm.unit][REQUEST_KEY]
+        if self.charm.unit.is_leader():
+            self._update_admitted(relation)
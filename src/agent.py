@@ -4,32 +4,49 @@
 """The agent relation observer module."""
 
 import logging
+import typing
 
 import ops
 
-import pebble
-import server
+import admission
+import hook_stats
+import metrics
+import reconciler
 from state import AGENT_RELATION, State
 
 logger = logging.getLogger()
 
 
 class Observer(ops.Object):
-    """The Jenkins agent relation observer."""
+    """The Jenkins agent relation observer.
 
-    def __init__(self, charm: ops.CharmBase, state: State, pebble_service: pebble.PebbleService):
+    Each agent relation is a controller, next to the configured controller if any.
+    """
+
+    def __init__(
+        self,
+        charm: ops.CharmBase,
+        state: State,
+        reconcilers: typing.Sequence[reconciler.Reconciler],
+    ):
         """Initialize the observer and register event handlers.
 
         Args:
             charm: The parent charm to attach the observer to.
             state: The charm state.
-            pebble_service: Service manager that controls Jenkins agent service through pebble.
+            reconcilers: The reconcilers of the controllers, the primary controller first.
         """
         super().__init__(charm, "agent-observer")
         self.charm = charm
         self.state = state
-        self.pebble_service = pebble_service
+        self.reconcilers = reconcilers
 
+        charm.framework.observe(charm.on.config_changed, self._on_agent_metadata_changed)
+        charm.framework.observe(charm.on.upgrade_charm, self._on_agent_metadata_changed)
+        # The leader records the CPU quantity of the applied pod template the executors follow.
+        charm.framework.observe(
+            charm.on[admission.PEER_RELATION].relation_changed, self._on_agent_metadata_changed
+        )
         charm.framework.observe(
             charm.on[AGENT_RELATION].relation_joined, self._on_agent_relation_joined
         )
@@ -39,102 +56,111 @@ class Observer(ops.Object):
         charm.framework.observe(
             charm.on[AGENT_RELATION].relation_departed, self._on_agent_relation_departed
         )
+        charm.framework.observe(
+            charm.on[AGENT_RELATION].relation_broken, self._on_agent_relation_broken
+        )
 
+    @hook_stats.timed
     def _on_agent_relation_joined(self, event: ops.RelationJoinedEvent) -> None:
         """Handle agent relation joined event.
 
+        The executors shares of the other controllers shrink, their metadata is published too.
+
         Args:
             event: The event fired when an agent has joined the relation.
         """
-        if self.state.jenkins_config:
-            logger.warning(
-                "Jenkins configuration already exists. Ignoring %s relation.", event.relation.name
-            )
-            return
-
         logger.info("%s relation joined.", event.relation.name)
         self.charm.unit.status = ops.MaintenanceStatus(
             f"Setting up '{event.relation.name}' relation."
         )
 
-        relation_data = self.state.agent_meta.get_jenkins_agent_v0_interface_dict()
-        logger.debug("Agent relation data set: %s", relation_data)
-        event.relation.data[self.charm.unit].update(relation_data)
+        self._publish_agent_metadata(event.relation)
+        for relation in self.charm.model.relations[AGENT_RELATION]:
+            if relation.id != event.relation.id:
+                self._publish_agent_metadata(relation)
 
-    def _on_agent_relation_changed(self, event: ops.RelationChangedEvent) -> None:
-        """Handle agent relation changed event.
+    @hook_stats.timed
+    def _on_agent_metadata_changed(self, _: ops.HookEvent) -> None:
+        """Republish agent metadata when executors or labels may have changed."""
+        self.publish_agent_metadata()
+
+    def publish_agent_metadata(self) -> None:
+        """Publish the agent metadata to all agent relations."""
+        for relation in self.charm.model.relations[AGENT_RELATION]:
+            self._publish_agent_metadata(relation)
+
+    def _publish_agent_metadata(self, relation: ops.Relation) -> None:
+        """Write the agent metadata keys that differ from the unit databag.
+
+        Each key written triggers relation-changed on the Jenkins server side, hence only the
+        changed keys are written, in a single update.
 
         Args:
-            event: The event fired when the agent relation data has changed.
+            relation: The agent relation to publish the metadata to.
         """
-        logger.info("%s relation changed.", event.relation.name)
-
-        if self.state.jenkins_config:
-            logger.warning(
-                "Jenkins configuration already exists. Ignoring %s relation.", event.relation.name
-            )
+        metrics.REGISTRY.set(
+            "jenkins_agent_executors",
+            sum(controller.num_executors for controller in self.state.controllers),
+        )
+        if relation.id in self.state.unserved_relation_ids:
+            logger.warning("Not enough executors to serve the controller of %s.", relation)
             return
-
-        container = self.charm.unit.get_container(self.state.jenkins_agent_service_name)
-        if not container.can_connect():
-            logger.warning("Jenkins agent container not yet ready. Deferring.")
-            event.defer()
+        unit_databag = relation.data[self.charm.unit]
+        relation_data = self.state.get_agent_meta(
+            relation.id
+        ).get_jenkins_agent_v0_interface_dict()
+        changed_data = {
+            key: value for key, value in relation_data.items() if unit_databag.get(key) != value
+        }
+        if not changed_data:
+            logger.debug("Agent relation data up to date.")
             return
+        logger.debug("Agent relation data set: %s", changed_data)
+        unit_databag.update(changed_data)
 
-        # Check if the pebble service has started and set agent ready.
-        if container.exists(str(server.AGENT_READY_PATH)):
-            logger.warning("Given agent already registered. Skipping.")
-            return
+    @hook_stats.timed
+    def _on_agent_relation_changed(self, event: ops.RelationChangedEvent) -> None:
+        """Handle agent relation changed event.
 
-        if not self.state.agent_relation_credentials:
-            self.charm.unit.status = ops.WaitingStatus("Waiting for complete relation data.")
-            logger.info("Waiting for complete relation data.")
-            # The event needs to be retried after the agent credentials have been set.
-            event.defer()
-            return
+        Args:
+            event: The event fired when the agent relation data has changed.
+        """
+        logger.info("%s relation changed.", event.relation.name)
 
-        self.start_agent_from_relation(
-            container=container,
-            credentials=self.state.agent_relation_credentials,
-            agent_name=self.state.agent_meta.name,
-        )
+        # The Jenkins server writes the secrets of all agent units to a single databag, every
+        # agent unit is notified when any unit is added. The reconcilers return early without any
+        # workload container calls if this unit's data is unchanged.
+        reconciler.reconcile_all(self.reconcilers)
 
-    def start_agent_from_relation(
-        self, container: ops.Container, credentials: server.Credentials, agent_name: str
-    ) -> None:
-        """Start agent from agent relation.
+    @hook_stats.timed
+    def _on_agent_relation_departed(self, event: ops.RelationDepartedEvent) -> None:
+        """Handle agent relation departed event.
 
         Args:
-            container: The Jenkins agent workload container.
-            credentials: The agent registration details for jenkins server.
-            agent_name: The jenkins agent to register as.
-
-        Raises:
-            AgentJarDownloadError: if the agent jar executable failed to download.
+            event: The event fired when the Jenkins server unit departed the relation.
         """
-        self.charm.unit.status = ops.MaintenanceStatus("Downloading Jenkins agent executable.")
-        try:
-            server.download_jenkins_agent(server_url=credentials.address, container=container)
-        except server.AgentJarDownloadError as exc:
-            logger.error("Failed to download Jenkins agent executable, %s", exc)
-            raise server.AgentJarDownloadError("Failed to download Jenkins agent.") from exc
-
-        self.charm.unit.status = ops.MaintenanceStatus("Starting agent pebble service.")
-        self.pebble_service.reconcile(
-            server_url=credentials.address,
-            agent_token_pair=(
-                agent_name,
-                credentials.secret,
-            ),
-            container=container,
-        )
-        self.charm.unit.status = ops.ActiveStatus()
-
-    def _on_agent_relation_departed(self, _: ops.RelationDepartedEvent) -> None:
-        """Handle agent relation departed event."""
-        container = self.charm.unit.get_container(self.state.jenkins_agent_service_name)
-        if not container.can_connect():
-            logger.warning("Relation departed before service ready.")
-            return
-        self.pebble_service.stop_agent(container=container)
-        self.charm.unit.status = ops.BlockedStatus("Waiting for config/relation.")
+        for agent_reconciler in self.reconcilers:
+            if agent_reconciler.controller.relation_id == event.relation.id:
+                agent_reconciler.stop_agent()
+        if len(self.reconcilers) == 1:
+            self.charm.unit.status = ops.BlockedStatus("Waiting for config/relation.")
+
+    @hook_stats.timed
+    def _on_agent_relation_broken(self, _: ops.RelationBrokenEvent) -> None:
+        """Handle agent relation broken event.
+
+        The remaining controllers get the executors of the removed one and the next agent
+        relation becomes the primary controller if the removed one was.
+        """
+        primary_reconciler = self.reconcilers[0]
+        if primary_reconciler.container.can_connect():
+            primary_reconciler.pebble_service.stop_stale_agents(
+                [
+                    agent_reconciler.pebble_service.agent_service_name
+                    for agent_reconciler in self.reconcilers
+                ],
+                primary_reconciler.container,
+            )
+        for relation in self.charm.model.relations[AGENT_RELATION]:
+            self._publish_agent_metadata(relation)
+        reconciler.reconcile_all(self.reconcilers)
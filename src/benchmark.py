@@ -0,0 +1,267 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""The agent benchmark module.
+
+The benchmark script of the workload image runs a fixed amount of work so that the results of
+different units are comparable. The results are scored against a reference unit and turned into
+a performance tier pipelines can select agents by.
+"""
+
+import json
+import logging
+import math
+import typing
+from dataclasses import MISSING, asdict, dataclass, fields
+
+import ops
+
+import hook_stats
+import pebble
+import server
+import tracing
+from state import State
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_ACTION = "benchmark"
+# The benchmarks run a fixed amount of work, which takes well under a minute on a loaded unit.
+BENCHMARK_TIMEOUT_SECONDS = 300
+# The results of the reference unit, which scores 100. Higher is better, but for round trips.
+REFERENCE_RESULTS = {
+    "cpu_mib_per_second": 500.0,
+    "memory_gib_per_second": 5.0,
+    "disk_write_mib_per_second": 200.0,
+    "disk_read_mib_per_second": 500.0,
+    "controller_round_trip_ms": 5.0,
+}
+# The minimum score of each performance tier, the fastest tier first.
+PERFORMANCE_TIER_SCORES = (200, 100, 50)
+PERFORMANCE_TIER_LABEL_PREFIX = "perf-tier-"
+
+
+class BenchmarkError(Exception):
+    """Exception raised when the benchmarks could not be run."""
+
+    def __init__(self, msg: str = ""):
+        """Initialize a new instance of the BenchmarkError exception.
+
+        Args:
+            msg: Explanation of the error.
+        """
+        self.msg = msg
+
+
+@dataclass(frozen=True, slots=True)
+class BenchmarkResults:
+    """The results of the agent benchmarks.
+
+    Attrs:
+        cpu_mib_per_second: The single core SHA-256 throughput.
+        memory_gib_per_second: The memory copy bandwidth.
+        disk_write_mib_per_second: The sequential write throughput of the working directory.
+        disk_read_mib_per_second: The sequential read throughput of the working directory.
+        controller_round_trip_ms: The median round trip time to the Jenkins controller, None if
+            the agent has no controller or the controller could not be reached.
+        score: The geometric mean of the results relative to the reference unit, times 100.
+        tier: The performance tier, 1 for the fastest units.
+    """
+
+    cpu_mib_per_second: float
+    memory_gib_per_second: float
+    disk_write_mib_per_second: float
+    disk_read_mib_per_second: float
+    controller_round_trip_ms: typing.Optional[float] = None
+
+    @property
+    def score(self) -> int:
+        """The geometric mean of the results relative to the reference unit, times 100."""
+        ratios = [
+            value / REFERENCE_RESULTS[name]
+            for name, value in asdict(self).items()
+            if name != "controller_round_trip_ms"
+        ]
+        if self.controller_round_trip_ms is not None:
+            ratios.append(
+                REFERENCE_RESULTS["controller_round_trip_ms"]
+                / max(self.controller_round_trip_ms, 0.1)
+            )
+        return round(100 * math.prod(ratios) ** (1 / len(ratios)))
+
+    @property
+    def tier(self) -> int:
+        """The performance tier, 1 for the fastest units."""
+        return next(
+            (
+                tier
+                for tier, min_score in enumerate(PERFORMANCE_TIER_SCORES, start=1)
+                if self.score >= min_score
+            ),
+            len(PERFORMANCE_TIER_SCORES) + 1,
+        )
+
+
+class PerformanceTierChangedEvent(ops.EventBase):
+    """Event emitted when the advertised performance tier label changed."""
+
+
+class BenchmarkEvents(ops.ObjectEvents):
+    """The agent benchmark events.
+
+    Attrs:
+        performance_tier_changed: Emitted when the advertised performance tier label changed.
+    """
+
+    performance_tier_changed = ops.EventSource(PerformanceTierChangedEvent)
+
+
+@tracing.traced("benchmark.run")
+def run(container: pebble.WorkloadContainer, server_url: str) -> BenchmarkResults:
+    """Run the benchmark script in the workload container.
+
+    Args:
+        container: The Jenkins agent workload container.
+        server_url: The Jenkins controller URL, empty to skip the round trip benchmark.
+
+    Raises:
+        BenchmarkError: if the benchmark script failed or its output could not be read.
+
+    Returns:
+        The benchmark results.
+    """
+    command = [
+        "python3",
+        str(server.BENCHMARK_SCRIPT_PATH),
+        "--workdir",
+        str(server.JENKINS_WORKDIR),
+    ]
+    if server_url:
+        command.extend(("--url", server_url))
+    try:
+        proc = container.exec(
+            command,
+            timeout=BENCHMARK_TIMEOUT_SECONDS,
+            user=server.USER,
+            working_dir=str(server.JENKINS_WORKDIR),
+        )
+        stdout, _ = proc.wait_output()
+    except (ops.pebble.ChangeError, ops.pebble.ExecError, ops.pebble.APIError) as exc:
+        logger.error("Benchmark failed, %s", exc)
+        raise BenchmarkError("Benchmark failed, see the unit logs.") from exc
+    try:
+        output = json.loads(stdout)
+        controller_error = output.pop("controller_error", None)
+        if controller_error:
+            logger.warning("Controller round trip not measured, %s", controller_error)
+        return BenchmarkResults(**output)
+    except (TypeError, ValueError) as exc:
+        logger.error("Unexpected benchmark output %r, %s", stdout, exc)
+        raise BenchmarkError("Unexpected benchmark output.") from exc
+
+
+class Observer(ops.Object):
+    """The agent benchmark observer.
+
+    Attrs:
+        on: The agent benchmark events.
+        _stored: The results of the last benchmark.
+    """
+
+    on = BenchmarkEvents()
+    _stored = ops.StoredState()
+
+    def __init__(self, charm: ops.CharmBase, state: State, container: pebble.WorkloadContainer):
+        """Initialize the observer, set the performance tier label and register event handlers.
+
+        Args:
+            charm: The parent charm to attach the observer to.
+            state: The charm state.
+            container: The Jenkins agent workload container.
+        """
+        super().__init__(charm, "benchmark-observer")
+        self.charm = charm
+        self.state = state
+        self.container = container
+        self._stored.set_default(results={})
+        self._set_performance_tier_label()
+
+        charm.framework.observe(charm.on[BENCHMARK_ACTION].action, self._on_benchmark_action)
+
+    def _get_stored_results(self) -> typing.Optional[BenchmarkResults]:
+        """Get the results of the last benchmark.
+
+        Results stored by another charm revision are only used if they have every required field,
+        the fields that no longer exist are ignored.
+
+        Returns:
+            The results, None if the unit was never benchmarked.
+        """
+        names = {field.name for field in fields(BenchmarkResults)}
+        required_names = {
+            field.name for field in fields(BenchmarkResults) if field.default is MISSING
+        }
+        stored = {
+            name: value
+            for name, value in typing.cast(
+                typing.Dict[str, typing.Any], self._stored.results
+            ).items()
+            if name in names
+        }
+        if not required_names <= stored.keys():
+            return None
+        return BenchmarkResults(**stored)
+
+    def _set_performance_tier_label(self) -> None:
+        """Set the performance tier label of the last benchmark on the state."""
+        results = self._get_stored_results()
+        self.state.performance_tier_label = (
+            f"{PERFORMANCE_TIER_LABEL_PREFIX}{results.tier}"
+            if results and self.state.publish_performance_tier
+            else ""
+        )
+
+    def _get_server_url(self) -> str:
+        """Get the controller URL the primary agent connects to.
+
+        Returns:
+            The controller URL, empty if the agent is not running.
+        """
+        service = self.container.get_plan().services.get(self.state.jenkins_agent_service_name)
+        return str(service.environment.get("JENKINS_URL", "")) if service else ""
+
+    @hook_stats.timed
+    def _on_benchmark_action(self, event: ops.ActionEvent) -> None:
+        """Handle benchmark action.
+
+        Args:
+            event: The event fired by the benchmark action.
+        """
+        if not self.container.can_connect():
+            event.fail("Workload container not ready.")
+            return
+        previous = self._get_stored_results()
+        event.log("Running the benchmarks.")
+        try:
+            results = run(self.container, self._get_server_url())
+        except BenchmarkError as exc:
+            event.fail(exc.msg)
+            return
+        logger.info("Benchmark results: %s, score %s", results, results.score)
+        self._stored.results = asdict(results)
+        performance_tier_label = self.state.performance_tier_label
+        self._set_performance_tier_label()
+        if self.state.performance_tier_label != performance_tier_label:
+            self.on.performance_tier_changed.emit()
+        event.set_results(
+            {
+                **{
+                    name.replace("_", "-"): f"{value:.2f}"
+                    for name, value in asdict(results).items()
+                    if value is not None
+                },
+                "score": results.score,
+                "tier": results.tier,
+                "previous-score": previous.score if previous else "none",
+                "label": self.state.performance_tier_label or "not published",
+            }
+        )
@@ -0,0 +1,309 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""The unit capabilities detection module.
+
+The capabilities are detected from inside the workload container, whose cgroup limits and
+mounts differ from the charm container, and turned into agent labels with the configured label
+template.
+"""
+
+import itertools
+import logging
+import math
+import os
+import re
+import string
+import typing
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+
+import ops
+
+import hook_stats
+import k8s
+import pebble
+import server
+from state import State
+
+logger = logging.getLogger(__name__)
+
+CPUINFO_PATH = Path("/proc/cpuinfo")
+MEMINFO_PATH = Path("/proc/meminfo")
+MOUNTINFO_PATH = Path("/proc/self/mountinfo")
+CGROUP_CPU_MAX_PATH = Path("/sys/fs/cgroup/cpu.max")
+CGROUP_MEMORY_MAX_PATH = Path("/sys/fs/cgroup/memory.max")
+BLOCK_DEVICES_PATH = Path("/sys/class/block")
+# The CPU flags jobs select agents by, x86 flags and arm64 features.
+NOTABLE_CPU_FLAGS = ("aes", "avx", "avx2", "avx512f", "sha_ni", "asimd", "sve", "sve2")
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "ceph", "glusterfs", "9p")
+
+
+@dataclass(frozen=True, slots=True)
+class Capabilities:
+    """The capabilities of the unit, as seen from the workload container.
+
+    Attrs:
+        arch: The machine hardware name, e.g. "x86_64".
+        cores: The CPU cores the workload container may use.
+        memory_gib: The memory in GiB the workload container may use.
+        cpu_flags: The notable CPU flags, comma separated.
+        storage: The storage type of the agent working directory, "nvme", "ssd", "hdd",
+            "network" or "memory", empty if unknown.
+        zone: The zone of the node, empty if unknown.
+    """
+
+    arch: str
+    cores: int
+    memory_gib: int
+    cpu_flags: str
+    storage: str
+    zone: str
+
+
+class CapabilitiesChangedEvent(ops.EventBase):
+    """Event emitted when the detected unit capabilities changed."""
+
+
+class CapabilitiesEvents(ops.ObjectEvents):
+    """The unit capabilities events.
+
+    Attrs:
+        capabilities_changed: Emitted when the detected unit capabilities changed.
+    """
+
+    capabilities_changed = ops.EventSource(CapabilitiesChangedEvent)
+
+
+def format_labels(template: str, capabilities: Capabilities) -> typing.Tuple[str, ...]:
+    """Generate the labels of the capabilities.
+
+    Labels referring to an unknown capability are left out. A capability with several values,
+    such as the CPU flags, generates a label per value.
+
+    Args:
+        template: The comma separated label templates, e.g. "cores-{cores},{cpu_flags}".
+        capabilities: The unit capabilities.
+
+    Returns:
+        The labels, in template order.
+    """
+    values = {
+        name: str(value).split(",") if value else []
+        for name, value in asdict(capabilities).items()
+    }
+    labels: typing.List[str] = []
+    for label_template in filter(None, (entry.strip() for entry in template.split(","))):
+        names = [name for _, name, _, _ in string.Formatter().parse(label_template) if name]
+        for combination in itertools.product(*(values[name] for name in names)):
+            label = label_template.format(**dict(zip(names, combination)))
+            if label not in labels:
+                labels.append(label)
+    return tuple(labels)
+
+
+def _read(container: pebble.WorkloadContainer, path: Path) -> str:
+    """Read a file of the workload container.
+
+    Args:
+        container: The workload container.
+        path: The file path.
+
+    Returns:
+        The file content, empty if it cannot be read.
+    """
+    try:
+        return str(container.pull(path).read())
+    except (ops.pebble.PathError, ops.pebble.APIError) as exc:
+        logger.debug("Capability source %s not readable, %s", path, exc)
+        return ""
+
+
+def _get_cores(cpu_max: str, cpuinfo: str) -> int:
+    """Get the CPU cores from the cgroup CPU quota, or the CPUs if unlimited.
+
+    Args:
+        cpu_max: The cgroup v2 cpu.max content, e.g. "200000 100000" or "max 100000".
+        cpuinfo: The /proc/cpuinfo content.
+
+    Returns:
+        The CPU cores, at least one.
+    """
+    quota, _, period = cpu_max.strip().partition(" ")
+    if quota.isdigit() and period.isdigit() and int(period):
+        return max(math.floor(int(quota) / int(period)), 1)
+    processors = len(re.findall(r"^processor\s*:", cpuinfo, re.MULTILINE))
+    return processors or os.cpu_count() or 1
+
+
+def _get_memory_gib(memory_max: str, meminfo: str) -> int:
+    """Get the memory in GiB from the cgroup memory limit, or the node memory if unlimited.
+
+    Args:
+        memory_max: The cgroup v2 memory.max content, e.g. "4294967296" or "max".
+        meminfo: The /proc/meminfo content.
+
+    Returns:
+        The memory in GiB, rounded down.
+    """
+    if memory_max.strip().isdigit():
+        return int(memory_max.strip()) // 2**30
+    match = re.search(r"^MemTotal:\s*(\d+) kB", meminfo, re.MULTILINE)
+    return int(match.group(1)) // 2**20 if match else 0
+
+
+def _get_cpu_flags(cpuinfo: str) -> str:
+    """Get the notable CPU flags.
+
+    Args:
+        cpuinfo: The /proc/cpuinfo content.
+
+    Returns:
+        The notable CPU flags, comma separated.
+    """
+    match = re.search(r"^(flags|Features)\s*:(.*)$", cpuinfo, re.MULTILINE)
+    flags = set(match.group(2).split()) if match else set()
+    return ",".join(flag for flag in NOTABLE_CPU_FLAGS if flag in flags)
+
+
+def _get_storage(container: pebble.WorkloadContainer, mountinfo: str, workdir: Path) -> str:
+    """Get the storage type of the mount holding a directory.
+
+    Args:
+        container: The workload container.
+        mountinfo: The /proc/self/mountinfo content of the workload container.
+        workdir: The directory.
+
+    Returns:
+        The storage type, empty if unknown, e.g. for the container root filesystem.
+    """
+    mounts = {}
+    for line in mountinfo.splitlines():
+        mount, _, filesystem = line.partition(" - ")
+        mount_fields, filesystem_fields = mount.split(), filesystem.split()
+        if len(mount_fields) >= 5 and len(filesystem_fields) >= 2:
+            mounts[mount_fields[4]] = (filesystem_fields[0], filesystem_fields[1])
+    mount_point = max(
+        (point for point in mounts if workdir.is_relative_to(point)), key=len, default=""
+    )
+    if not mount_point:
+        return ""
+    filesystem_type, source = mounts[mount_point]
+    if filesystem_type in NETWORK_FILESYSTEMS or filesystem_type.startswith("fuse."):
+        return "network"
+    if filesystem_type == "tmpfs":
+        return "memory"
+    if not source.startswith("/dev/"):
+        return ""
+    device = source.removeprefix("/dev/")
+    if device.startswith("nvme"):
+        return "nvme"
+    # The queue of a partition, e.g. sda1, is the queue of its disk.
+    disk = re.sub(r"\d+$", "", device)
+    rotational = _read(container, BLOCK_DEVICES_PATH / disk / "queue" / "rotational").strip()
+    return {"0": "ssd", "1": "hdd"}.get(rotational, "")
+
+
+def detect(container: pebble.WorkloadContainer, workdir: Path, zone: str) -> Capabilities:
+    """Detect the unit capabilities from inside the workload container.
+
+    Args:
+        container: The workload container.
+        workdir: The agent working directory.
+        zone: The zone of the node.
+
+    Returns:
+        The unit capabilities.
+    """
+    cpuinfo = _read(container, CPUINFO_PATH)
+    return Capabilities(
+        arch=os.uname().machine,
+        cores=_get_cores(_read(container, CGROUP_CPU_MAX_PATH), cpuinfo),
+        memory_gib=_get_memory_gib(
+            _read(container, CGROUP_MEMORY_MAX_PATH), _read(container, MEMINFO_PATH)
+        ),
+        cpu_flags=_get_cpu_flags(cpuinfo),
+        storage=_get_storage(container, _read(container, MOUNTINFO_PATH), workdir),
+        zone=zone,
+    )
+
+
+class Observer(ops.Object):
+    """The unit capabilities observer.
+
+    Attrs:
+        on: The unit capabilities events.
+        _stored: The last detected unit capabilities.
+    """
+
+    on = CapabilitiesEvents()
+    _stored = ops.StoredState()
+
+    def __init__(self, charm: ops.CharmBase, state: State, container: pebble.WorkloadContainer):
+        """Initialize the observer, set the capability labels and register event handlers.
+
+        Args:
+            charm: The parent charm to attach the observer to.
+            state: The charm state.
+            container: The Jenkins agent workload container.
+        """
+        super().__init__(charm, "capabilities-observer")
+        self.charm = charm
+        self.state = state
+        self.container = container
+        self._stored.set_default(capabilities={})
+        self._set_capability_labels()
+
+        charm.framework.observe(charm.on.config_changed, self._on_capabilities_may_change)
+        charm.framework.observe(charm.on.upgrade_charm, self._on_capabilities_may_change)
+        charm.framework.observe(
+            charm.on.jenkins_agent_k8s_pebble_ready, self._on_capabilities_may_change
+        )
+
+    def _set_capability_labels(self) -> None:
+        """Set the labels of the last detected capabilities on the state.
+
+        Capabilities stored by another charm revision are only used if they have every field,
+        they are detected again on upgrade.
+        """
+        names = {field.name for field in fields(Capabilities)}
+        stored = {
+            name: value
+            for name, value in typing.cast(
+                typing.Dict[str, typing.Any], self._stored.capabilities
+            ).items()
+            if name in names
+        }
+        if not self.state.label_template or stored.keys() != names:
+            self.state.capability_labels = ()
+            return
+        self.state.capability_labels = format_labels(
+            self.state.label_template, Capabilities(**stored)
+        )
+
+    def _get_zone(self) -> str:
+        """Get the zone of the node of the unit.
+
+        Returns:
+            The zone, empty if the Kubernetes API is not available to the application.
+        """
+        try:
+            return k8s.get_node_zone(self.charm.model.name, self.charm.unit.name.replace("/", "-"))
+        except k8s.KubernetesError as exc:
+            logger.debug("Node zone not detected, %s", exc.msg)
+            return ""
+
+    @hook_stats.timed
+    def _on_capabilities_may_change(self, _: ops.HookEvent) -> None:
+        """Detect the unit capabilities, the pod may have been rescheduled or resized."""
+        if not self.state.label_template or not self.container.can_connect():
+            return
+        capabilities = detect(self.container, server.JENKINS_WORKDIR, self._get_zone())
+        if asdict(capabilities) == dict(
+            typing.cast(typing.Dict[str, typing.Any], self._stored.capabilities)
+        ):
+            return
+        logger.info("Unit capabilities detected: %s", capabilities)
+        self._stored.capabilities = asdict(capabilities)
+        self._set_capability_labels()
+        self.on.capabilities_changed.emit()
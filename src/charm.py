@@ -6,20 +6,34 @@
 """Charm k8s jenkins agent."""
 
 import logging
+import shutil
+import time
 import typing
+from pathlib import Path
 
 import ops
 from ops.main import main
 
+import admission
 import agent
+import benchmark
+import capabilities
+import diagnostics
+import hook_stats
+import k8s
+import metrics
 import pebble
-import server
-from state import AGENT_RELATION, InvalidStateError, State
+import reconciler
+import tracing
+from state import APPLIED_CPU_KEY, InvalidStateError, ResourceConfig, SchedulingConfig, State
 
 logger = logging.getLogger()
 
+# The charm container directory the dump-jfr action writes the flight recording to.
+JFR_DUMP_DIR = Path("/tmp/jenkins-agent-k8s-jfr")  # nosec
 
-class JenkinsAgentCharm(ops.CharmBase):
+
+class JenkinsAgentCharm(ops.CharmBase):  # pylint: disable=too-many-instance-attributes
     """Charm Jenkins agent k8s."""
 
     def __init__(self, *args: typing.Any):
@@ -29,94 +43,131 @@ class JenkinsAgentCharm(ops.CharmBase):
             args: Arguments to initialize the charm base.
         """
         super().__init__(*args)
+        self.tracing_observer = tracing.Observer(self)
         try:
             self.state = State.from_charm(self)
         except InvalidStateError as exc:
             self.unit.status = ops.BlockedStatus(exc.msg)
             return
 
-        self.pebble_service = pebble.PebbleService(self.state)
-        self.agent_observer = agent.Observer(self, self.state, self.pebble_service)
+        self.container = pebble.CachedContainer(
+            self.unit.get_container(self.state.jenkins_agent_service_name)
+        )
+        self.download_admission = admission.DownloadAdmission(self)
+        self.reconcilers = [
+            reconciler.Reconciler(
+                self,
+                self.state,
+                pebble.PebbleService(self.state, controller.name),
+                self.container,
+                self.download_admission,
+                controller,
+            )
+            for controller in self.state.controllers
+        ]
+        self.reconciler = self.reconcilers[0]
+        self.pebble_service = self.reconciler.pebble_service
+        # The generated labels are set on the state before the agent metadata is published.
+        self.capabilities_observer = capabilities.Observer(self, self.state, self.container)
+        self.benchmark_observer = benchmark.Observer(self, self.state, self.container)
+        self.agent_observer = agent.Observer(self, self.state, self.reconcilers)
+        self.metrics_observer = metrics.Observer(
+            self, self.state, self.pebble_service, self.container
+        )
+        self.hook_stats_observer = hook_stats.Observer(self, self.container)
+        self.diagnostics_observer = diagnostics.Observer(
+            self, self.container, self.state.jenkins_agent_service_name
+        )
 
         self.framework.observe(self.on.config_changed, self._on_config_changed)
         self.framework.observe(self.on.upgrade_charm, self._on_upgrade_charm)
+        self.framework.observe(self.on.update_status, self._on_update_status)
+        self.framework.observe(
+            self.on[admission.PEER_RELATION].relation_changed, self._on_agent_peers_changed
+        )
 
         self.framework.observe(
             self.on.jenkins_agent_k8s_pebble_ready, self._on_jenkins_agent_k8s_pebble_ready
         )
+        self.framework.observe(
+            self.on.jenkins_agent_k8s_pebble_custom_notice,
+            self._on_jenkins_agent_k8s_pebble_custom_notice,
+        )
+        self.framework.observe(
+            self.capabilities_observer.on.capabilities_changed, self._on_agent_labels_changed
+        )
+        self.framework.observe(
+            self.benchmark_observer.on.performance_tier_changed, self._on_agent_labels_changed
+        )
+        self.framework.observe(self.on.dump_jfr_action, self._on_dump_jfr_action)
+        self.framework.observe(self.framework.on.commit, self._on_commit)
 
-    def _register_via_config(
-        self, event: typing.Union[ops.ConfigChangedEvent, ops.UpgradeCharmEvent]
-    ) -> None:
-        """Register the agent to server from configuration values.
+    def _patch_pod_template(self) -> bool:
+        """Set the configured compute resources and scheduling constraints on the unit pods.
 
-        Args:
-            event: The event fired on config changed or upgrade charm.
+        The leader patches the application StatefulSet, which restarts the pods of all units when
+        the pod template changed, and records the applied CPU quantity the executors follow.
 
-        Raises:
-            AgentJarDownloadError: if the Jenkins agent failed to download.
+        Returns:
+            False if the configured pod template could not be applied.
         """
-        container = self.unit.get_container(self.state.jenkins_agent_service_name)
-        if not container.can_connect():
-            logger.warning("Jenkins agent container not yet ready. Deferring.")
-            event.defer()
-            return
-
-        if not self.state.jenkins_config and not self.model.get_relation(AGENT_RELATION):
-            self.model.unit.status = ops.BlockedStatus("Waiting for config/relation.")
-            return
-
-        if not self.state.jenkins_config:
-            self.model.unit.status = ops.BlockedStatus(
-                "Please remove and re-relate agent relation."
-            )
-            return
-
+        if not self.unit.is_leader():
+            return True
         try:
-            server.download_jenkins_agent(
-                server_url=self.state.jenkins_config.server_url,
-                container=container,
+            k8s.patch_pod_template(
+                self.app.name,
+                self.model.name,
+                self.state.jenkins_agent_service_name,
+                self.state.resources,
+                self.state.scheduling,
             )
-        except server.AgentJarDownloadError as exc:
-            logger.error("Failed to download agent JAR executable, %s", exc)
-            raise
-
-        valid_agent_token = server.find_valid_credentials(
-            agent_name_token_pairs=self.state.jenkins_config.agent_name_token_pairs,
-            server_url=self.state.jenkins_config.server_url,
-            container=container,
-        )
-        if not valid_agent_token:
-            logger.error("No valid agent-token pair found.")
-            self.model.unit.status = ops.BlockedStatus(
-                "Additional valid agent-token pairs required."
+        except k8s.KubernetesError as exc:
+            if self.state.resources == ResourceConfig() and (
+                self.state.scheduling == SchedulingConfig()
+            ):
+                logger.debug("Pod template not checked, %s", exc.msg)
+                self._record_applied_cpu()
+                return True
+            self.unit.status = ops.BlockedStatus(
+                "Failed to patch the pod template, run juju trust."
             )
-            return
+            return False
+        self._record_applied_cpu()
+        return True
 
-        self.model.unit.status = ops.MaintenanceStatus("Starting agent pebble service.")
-        self.pebble_service.reconcile(
-            server_url=self.state.jenkins_config.server_url,
-            agent_token_pair=valid_agent_token,
-            container=container,
-        )
-        self.model.unit.status = ops.ActiveStatus()
+    def _record_applied_cpu(self) -> None:
+        """Record the CPU quantity of the applied pod template in the peer application databag."""
+        relation = self.model.get_relation(admission.PEER_RELATION)
+        if not relation:
+            return
+        app_databag = relation.data[self.app]
+        applied_cpu = self.state.resources.cpu or ""
+        if app_databag.get(APPLIED_CPU_KEY, "") != applied_cpu:
+            app_databag[APPLIED_CPU_KEY] = applied_cpu
 
-    def _on_config_changed(self, event: ops.ConfigChangedEvent) -> None:
-        """Handle config changed event.
+    @hook_stats.timed
+    def _on_config_changed(self, _: ops.ConfigChangedEvent) -> None:
+        """Handle config changed event."""
+        if self._patch_pod_template():
+            reconciler.reconcile_all(self.reconcilers)
 
-        Args:
-            event: The event fired on configuration change.
-        """
-        self._register_via_config(event)
+    @hook_stats.timed
+    def _on_upgrade_charm(self, _: ops.UpgradeCharmEvent) -> None:
+        """Handle upgrade charm event, Juju may have reset the StatefulSet."""
+        if self._patch_pod_template():
+            reconciler.reconcile_all(self.reconcilers)
 
-    def _on_upgrade_charm(self, event: ops.UpgradeCharmEvent) -> None:
-        """Handle upgrade charm event.
+    @hook_stats.timed
+    def _on_update_status(self, _: ops.UpdateStatusEvent) -> None:
+        """Handle update status event."""
+        reconciler.reconcile_all(self.reconcilers, check_health=True)
 
-        Args:
-            event: The event fired on upgrade charm.
-        """
-        self._register_via_config(event)
+    @hook_stats.timed
+    def _on_agent_peers_changed(self, _: ops.RelationChangedEvent) -> None:
+        """Handle agent peers relation changed event, download slots may have been admitted."""
+        reconciler.reconcile_all(self.reconcilers)
 
+    @hook_stats.timed
     def _on_jenkins_agent_k8s_pebble_ready(self, _: ops.PebbleReadyEvent) -> None:
         """Handle pebble ready event.
 
@@ -125,17 +176,84 @@ class JenkinsAgentCharm(ops.CharmBase):
             2. when the container has restarted for various reasons.
         It is necessary to handle case 2 for recovery cases.
         """
-        container = self.unit.get_container(self.state.jenkins_agent_service_name)
-        if not container.can_connect() or not self.state.agent_relation_credentials:
-            logger.warning("Preconditions not ready.")
+        reconciler.reconcile_all(self.reconcilers, check_health=True)
+
+    @hook_stats.timed
+    def _on_jenkins_agent_k8s_pebble_custom_notice(
+        self, event: ops.PebbleCustomNoticeEvent
+    ) -> None:
+        """Handle pebble custom notice event.
+
+        Args:
+            event: The event fired when the workload container emits a custom notice.
+        """
+        if event.notice.key == pebble.VALIDATION_NOTICE_KEY:
+            logger.info("Credentials validation completed.")
+            reconciler.reconcile_all(self.reconcilers)
             return
+        # The agents of secondary controllers set the controller name in their notices.
+        controller_name = event.notice.last_data.get("controller", "")
+        agent_reconciler = next(
+            (
+                agent_reconciler
+                for agent_reconciler in self.reconcilers
+                if agent_reconciler.controller.name == controller_name
+            ),
+            None,
+        )
+        if not agent_reconciler:
+            logger.debug("Ignoring notice of departed controller %s.", controller_name)
+            return
+        if event.notice.key == pebble.AGENT_CONNECTED_NOTICE_KEY:
+            agent_reconciler.agent_connected(event.notice.last_data.get("agent", ""))
+        elif event.notice.key == pebble.AGENT_DISCONNECTED_NOTICE_KEY:
+            agent_reconciler.agent_disconnected(event.notice.last_data.get("agent", ""))
+
+    def _on_agent_labels_changed(self, _: ops.EventBase) -> None:
+        """Handle capabilities and performance tier changed events, republish the labels."""
+        self.agent_observer.publish_agent_metadata()
 
-        self.agent_observer.start_agent_from_relation(
-            container=container,
-            credentials=self.state.agent_relation_credentials,
-            agent_name=self.state.agent_meta.name,
+    @hook_stats.timed
+    def _on_dump_jfr_action(self, event: ops.ActionEvent) -> None:
+        """Handle dump-jfr action.
+
+        The completed chunks of the flight recording are concatenated into a single recording in
+        the charm container, replacing the previous dump.
+
+        Args:
+            event: The event fired by the dump-jfr action.
+        """
+        if not self.state.jvm_config.jfr_recording:
+            event.fail("Flight recording not enabled, set the jfr_recording option.")
+            return
+        if not self.container.can_connect():
+            event.fail("Workload container not ready.")
+            return
+        chunk_paths = self.pebble_service.get_jfr_chunk_paths(self.container)
+        if not chunk_paths:
+            event.fail("No completed flight recording chunk yet.")
+            return
+        shutil.rmtree(JFR_DUMP_DIR, ignore_errors=True)
+        JFR_DUMP_DIR.mkdir(parents=True)
+        dump_path = JFR_DUMP_DIR / f"{self.unit.name.replace('/', '-')}-{int(time.time())}.jfr"
+        with dump_path.open("wb") as dump_file:
+            for chunk_path in chunk_paths:
+                with self.container.pull(chunk_path, encoding=None) as chunk:
+                    shutil.copyfileobj(chunk, dump_file)
+        event.set_results(
+            {
+                "path": str(dump_path),
+                "chunks": len(chunk_paths),
+                "size": dump_path.stat().st_size,
+                "command": f"juju scp --container charm {self.unit.name}:{dump_path} .",
+            }
         )
 
+    def _on_commit(self, _: ops.CommitEvent) -> None:
+        """Log the Pebble calls made within the hook."""
+        if self.container.call_stats:
+            logger.debug("Pebble calls: %s", self.container.get_call_summary())
+
 
 if __name__ == "__main__":  # pragma: no cover
     main(JenkinsAgentCharm)
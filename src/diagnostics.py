@@ -0,0 +1,238 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""The connection diagnostics module.
+
+The connection of the agent to the Jenkins controller is timed from the workload container, phase
+by phase, so that a slow connection can be attributed to name resolution, the network, the
+controller or the agent JVM. Each run is compared with the previous runs of the unit.
+"""
+
+import json
+import logging
+import statistics
+import typing
+
+import ops
+
+import hook_stats
+import pebble
+import server
+import tracing
+
+logger = logging.getLogger(__name__)
+
+DIAGNOSE_CONNECTION_ACTION = "diagnose-connection"
+# The network phases take at most the script timeout each, on a resolvable controller.
+DIAGNOSE_TIMEOUT_SECONDS = 60
+# The number of runs kept to compare with.
+HISTORY_SIZE = 10
+# A phase is reported as slower when it takes this many times its median of the previous runs.
+REGRESSION_FACTOR = 2.0
+# The remoting phases, in the order the agent goes through them. Each phase lasts from the
+# previous phase reached, or the agent launch, to its log message.
+REMOTING_PHASE_ORDER = (
+    "first-output",
+    "locating-server",
+    "agent-discovery-successful",
+    "handshaking",
+    "connecting",
+    "remote-identity-confirmed",
+    "connected",
+)
+
+PhaseTimings = typing.Dict[str, float]
+
+
+class DiagnosticsError(Exception):
+    """Exception raised when the connection could not be diagnosed."""
+
+    def __init__(self, msg: str = ""):
+        """Initialize a new instance of the DiagnosticsError exception.
+
+        Args:
+            msg: Explanation of the error.
+        """
+        self.msg = msg
+
+
+@tracing.traced("diagnostics.time_network_phases")
+def time_network_phases(
+    container: pebble.WorkloadContainer, server_url: str, agent_name: str
+) -> typing.Tuple[PhaseTimings, typing.Dict[str, typing.Any]]:
+    """Run the diagnose script in the workload container.
+
+    Args:
+        container: The Jenkins agent workload container.
+        server_url: The Jenkins controller URL.
+        agent_name: The Jenkins agent name.
+
+    Raises:
+        DiagnosticsError: if the diagnose script failed or its output could not be read.
+
+    Returns:
+        The milliseconds of each network phase reached, and the controller address, the HTTP
+        statuses and the error of the failed phase.
+    """
+    try:
+        proc = container.exec(
+            [
+                "python3",
+                str(server.DIAGNOSE_SCRIPT_PATH),
+                "--url",
+                server_url,
+                "--agent",
+                agent_name,
+            ],
+            timeout=DIAGNOSE_TIMEOUT_SECONDS,
+            user=server.USER,
+            working_dir=str(server.JENKINS_WORKDIR),
+        )
+        stdout, _ = proc.wait_output()
+    except (ops.pebble.ChangeError, ops.pebble.ExecError, ops.pebble.APIError) as exc:
+        logger.error("Connection diagnosis failed, %s", exc)
+        raise DiagnosticsError("Connection diagnosis failed, see the unit logs.") from exc
+    try:
+        output = json.loads(stdout)
+        phases = {str(phase): float(value) for phase, value in output.pop("phases").items()}
+    except (AttributeError, KeyError, TypeError, ValueError) as exc:
+        logger.error("Unexpected diagnose output %r, %s", stdout, exc)
+        raise DiagnosticsError("Unexpected diagnose output.") from exc
+    return phases, output
+
+
+def get_remoting_phases(phase_seconds: PhaseTimings) -> PhaseTimings:
+    """Get the milliseconds of each remoting phase from the time it was reached.
+
+    Args:
+        phase_seconds: The seconds from the agent launch to each phase reached.
+
+    Returns:
+        The milliseconds of each phase reached, by phase name prefixed with "remoting-".
+    """
+    phases = {}
+    previous_seconds = 0.0
+    for phase in REMOTING_PHASE_ORDER:
+        if phase in phase_seconds:
+            phases[f"remoting-{phase}"] = (phase_seconds[phase] - previous_seconds) * 1000
+            previous_seconds = phase_seconds[phase]
+    return phases
+
+
+def compare(
+    phases: PhaseTimings, history: typing.Sequence[PhaseTimings]
+) -> typing.Dict[str, typing.Dict[str, float]]:
+    """Compare the phase timings with the timings of the previous runs.
+
+    Args:
+        phases: The milliseconds of each phase.
+        history: The phase timings of the previous runs, the most recent last.
+
+    Returns:
+        The milliseconds, the milliseconds of the previous run and the median milliseconds of the
+        previous runs, when the phase was reached, of each phase.
+    """
+    comparison = {}
+    for phase, milliseconds in phases.items():
+        previous_runs = [run[phase] for run in history if phase in run]
+        comparison[phase] = {"ms": round(milliseconds, 1)}
+        if previous_runs:
+            comparison[phase]["previous-ms"] = round(previous_runs[-1], 1)
+            comparison[phase]["median-ms"] = round(statistics.median(previous_runs), 1)
+    return comparison
+
+
+class Observer(ops.Object):
+    """The connection diagnostics observer.
+
+    Attrs:
+        _stored: The phase timings of the recent runs, the most recent last.
+    """
+
+    _stored = ops.StoredState()
+
+    def __init__(
+        self, charm: ops.CharmBase, container: pebble.WorkloadContainer, service_name: str
+    ):
+        """Initialize the observer and register event handlers.
+
+        Args:
+            charm: The parent charm to attach the observer to.
+            container: The Jenkins agent workload container.
+            service_name: The Jenkins agent service name of the primary controller.
+        """
+        super().__init__(charm, "diagnostics-observer")
+        self.charm = charm
+        self.container = container
+        self.service_name = service_name
+        self._stored.set_default(history=[])
+
+        charm.framework.observe(
+            charm.on[DIAGNOSE_CONNECTION_ACTION].action, self._on_diagnose_connection_action
+        )
+
+    def _get_agent_environment(self) -> typing.Dict[str, str]:
+        """Get the controller URL and agent name the primary agent connects with.
+
+        Returns:
+            The agent service environment, empty if the agent is not configured.
+        """
+        service = self.container.get_plan().services.get(self.service_name)
+        return (
+            {str(key): str(value) for key, value in service.environment.items()} if service else {}
+        )
+
+    @hook_stats.timed
+    def _on_diagnose_connection_action(self, event: ops.ActionEvent) -> None:
+        """Handle diagnose-connection action.
+
+        Args:
+            event: The event fired by the diagnose-connection action.
+        """
+        if not self.container.can_connect():
+            event.fail("Workload container not ready.")
+            return
+        environment = self._get_agent_environment()
+        if not environment.get("JENKINS_URL"):
+            event.fail("Agent not configured, no Jenkins controller to diagnose.")
+            return
+        server_url, agent_name = environment["JENKINS_URL"], environment["JENKINS_AGENT"]
+        event.log(f"Timing the network phases of the connection to {server_url}.")
+        try:
+            phases, details = time_network_phases(self.container, server_url, agent_name)
+        except DiagnosticsError as exc:
+            event.fail(exc.msg)
+            return
+        if "error" not in details and self.container.exists(server.AGENT_JAR_PATH):
+            event.log("Timing the remoting phases with a probe agent.")
+            try:
+                remoting_phases = server.probe_remoting_handshake(
+                    server_url, agent_name, self.container
+                )
+            except (ops.pebble.ChangeError, ops.pebble.APIError) as exc:
+                logger.error("Remoting handshake probe failed, %s", exc)
+                event.fail("Remoting handshake probe failed, see the unit logs.")
+                return
+            phases.update(get_remoting_phases(remoting_phases))
+        history = [
+            dict(run) for run in typing.cast(typing.List[PhaseTimings], self._stored.history)
+        ]
+        comparison = compare(phases, history)
+        slower_phases = [
+            phase
+            for phase, timings in comparison.items()
+            if timings["ms"] > REGRESSION_FACTOR * timings.get("median-ms", timings["ms"])
+        ]
+        logger.info("Connection phases to %s: %s", server_url, comparison)
+        self._stored.history = [*history, phases][-HISTORY_SIZE:]
+        event.set_results(
+            {
+                "url": server_url,
+                "address": details.get("address", "unresolved"),
+                "phases": json.dumps(comparison, indent=2),
+                "http-statuses": json.dumps(details.get("statuses", {})),
+                "total-ms": f"{sum(phases.values()):.1f}",
+                "slower-phases": ",".join(slower_phases) or "none",
+                "error": details.get("error", "none"),
+            }
+        )
@@ -0,0 +1,284 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""The hook timing and profiling module.
+
+Observed handlers are timed with the timed decorator. The time spent in Pebble calls, network
+requests and processes executed in the workload container is taken from the I/O timings recorded
+within the hook.
+"""
+
+import functools
+import io
+import json
+import logging
+import time
+import typing
+from dataclasses import dataclass
+
+import ops
+
+import io_timing
+import pebble
+import server
+import tracing
+
+logger = logging.getLogger(__name__)
+
+PROFILING_CONFIG = "hook_profiling"
+SHOW_HOOK_STATS_ACTION = "show-hook-stats"
+# The number of most recent timings kept for each handler.
+ROLLING_WINDOW = 50
+# The upper bounds, in seconds, of the wall time histogram buckets.
+HISTOGRAM_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+# The number of tracemalloc statistics written to the profile.
+TRACEMALLOC_TOP = 20
+
+Handler = typing.TypeVar("Handler", bound=typing.Callable[..., None])
+
+
+@dataclass(frozen=True, slots=True)
+class HookTiming:
+    """The time spent in an observed handler.
+
+    Attrs:
+        handler: The qualified name of the handler.
+        wall_seconds: The wall time of the handler.
+        pebble_seconds: The time spent in Pebble calls.
+        http_seconds: The time spent in HTTP requests.
+        exec_seconds: The time spent in processes executed in the workload container.
+    """
+
+    handler: str
+    wall_seconds: float
+    pebble_seconds: float
+    http_seconds: float
+    exec_seconds: float
+
+
+@dataclass(frozen=True, slots=True)
+class HookProfile:
+    """The profile of an observed handler.
+
+    Attrs:
+        handler: The qualified name of the handler.
+        wall_seconds: The wall time of the handler.
+        content: The cProfile statistics and tracemalloc top allocations, as text.
+    """
+
+    handler: str
+    wall_seconds: float
+    content: str
+
+
+# The timings and profiles of the handlers run within the hook.
+TIMINGS: typing.List[HookTiming] = []
+PROFILES: typing.List[HookProfile] = []
+
+
+def _run_profiled(
+    handler: typing.Callable[..., None], *args: typing.Any
+) -> typing.Tuple[float, str]:
+    """Run the handler under cProfile and tracemalloc.
+
+    Args:
+        handler: The handler to run.
+        args: The handler arguments.
+
+    Returns:
+        The wall time of the handler and its profile.
+    """
+    # The profilers are only imported when profiling is enabled to keep the hook start up time low.
+    import cProfile  # pylint: disable=import-outside-toplevel
+    import pstats  # pylint: disable=import-outside-toplevel
+    import tracemalloc  # pylint: disable=import-outside-toplevel
+
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    start_time = time.monotonic()
+    try:
+        profiler.runcall(handler, *args)
+    finally:
+        wall_seconds = time.monotonic() - start_time
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(30)
+    output.write("Top memory allocations:\n")
+    for statistic in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]:
+        output.write(f"{statistic}\n")
+    return wall_seconds, output.getvalue()
+
+
+def timed(handler: Handler) -> Handler:
+    """Record the time spent in an observed handler.
+
+    The handler is profiled when the hook_profiling configuration option is enabled.
+
+    Args:
+        handler: The observed handler, a method of an ops.Object.
+
+    Returns:
+        The handler wrapped to record its timing.
+    """
+
+    @functools.wraps(handler)
+    def wrapper(self: ops.Object, *args: typing.Any) -> None:
+        """Run the handler and record its timing.
+
+        Args:
+            self: The object observing the event.
+            args: The handler arguments.
+        """
+        io_seconds_before = io_timing.get_seconds()
+        with tracing.span(handler.__qualname__):
+            if self.model.config.get(PROFILING_CONFIG):
+                wall_seconds, content = _run_profiled(handler, self, *args)
+                PROFILES.append(HookProfile(handler.__qualname__, wall_seconds, content))
+            else:
+                start_time = time.monotonic()
+                try:
+                    handler(self, *args)
+                finally:
+                    wall_seconds = time.monotonic() - start_time
+        pebble_seconds, http_seconds, exec_seconds = (
+            after - before for after, before in zip(io_timing.get_seconds(), io_seconds_before)
+        )
+        TIMINGS.append(
+            HookTiming(
+                handler=handler.__qualname__,
+                wall_seconds=wall_seconds,
+                pebble_seconds=pebble_seconds,
+                http_seconds=http_seconds,
+                exec_seconds=exec_seconds,
+            )
+        )
+
+    return typing.cast(Handler, wrapper)
+
+
+def _get_percentile(values: typing.Sequence[float], percentile: float) -> float:
+    """Get the nearest-rank percentile of the values.
+
+    Args:
+        values: The sorted values.
+        percentile: The percentile, between 0 and 100.
+
+    Returns:
+        The value at the percentile.
+    """
+    rank = max(round(percentile / 100 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarize(
+    samples: typing.Mapping[str, typing.Sequence[typing.Sequence[float]]],
+) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    """Summarize the recent timings of each handler.
+
+    Args:
+        samples: The recent wall, Pebble, HTTP and exec seconds of each handler.
+
+    Returns:
+        The count, wall time percentiles, mean Pebble, HTTP and exec time and the wall time
+        histogram of each handler, slowest handler first.
+    """
+    summary: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+    for handler, timings in samples.items():
+        if not timings:
+            continue
+        wall = sorted(timing[0] for timing in timings)
+        histogram = {
+            f"le-{bound:g}": sum(1 for value in wall if value <= bound)
+            for bound in HISTOGRAM_BUCKETS
+        }
+        histogram["le-inf"] = len(wall)
+        summary[handler] = {
+            "count": len(timings),
+            "wall-p50": round(_get_percentile(wall, 50), 4),
+            "wall-p95": round(_get_percentile(wall, 95), 4),
+            "wall-max": round(wall[-1], 4),
+            "pebble-mean": round(sum(timing[1] for timing in timings) / len(timings), 4),
+            "http-mean": round(sum(timing[2] for timing in timings) / len(timings), 4),
+            "exec-mean": round(sum(timing[3] for timing in timings) / len(timings), 4),
+            "histogram": histogram,
+        }
+    return dict(sorted(summary.items(), key=lambda item: item[1]["wall-p95"], reverse=True))
+
+
+class Observer(ops.Object):
+    """The hook statistics observer.
+
+    Attrs:
+        _stored: The recent timings of each handler and the wall time of the slowest profiled
+            handler.
+    """
+
+    _stored = ops.StoredState()
+
+    def __init__(self, charm: ops.CharmBase, container: pebble.WorkloadContainer):
+        """Initialize the observer and register event handlers.
+
+        Args:
+            charm: The parent charm to attach the observer to.
+            container: The Jenkins agent workload container.
+        """
+        super().__init__(charm, "hook-stats-observer")
+        self.charm = charm
+        self.container = container
+        self._stored.set_default(samples={}, slowest_profile_seconds=0.0)
+
+        charm.framework.observe(
+            charm.on[SHOW_HOOK_STATS_ACTION].action, self._on_show_hook_stats_action
+        )
+        charm.framework.observe(charm.framework.on.pre_commit, self._on_pre_commit)
+
+    def _on_show_hook_stats_action(self, event: ops.ActionEvent) -> None:
+        """Handle show-hook-stats action.
+
+        Args:
+            event: The event fired by the show-hook-stats action.
+        """
+        samples = typing.cast(
+            typing.Dict[str, typing.List[typing.List[float]]], self._stored.samples
+        )
+        event.set_results({"stats": json.dumps(summarize(samples), indent=2)})
+
+    def _on_pre_commit(self, _: ops.PreCommitEvent) -> None:
+        """Persist the handler timings and write the profile of the slowest handler."""
+        if TIMINGS:
+            samples = {
+                handler: [list(timing) for timing in timings]
+                for handler, timings in typing.cast(
+                    typing.Dict[str, typing.List[typing.List[float]]], self._stored.samples
+                ).items()
+            }
+            for timing in TIMINGS:
+                logger.debug("Handler timing: %s", timing)
+                handler_samples = samples.setdefault(timing.handler, [])
+                handler_samples.append(
+                    [
+                        timing.wall_seconds,
+                        timing.pebble_seconds,
+                        timing.http_seconds,
+                        timing.exec_seconds,
+                    ]
+                )
+                del handler_samples[:-ROLLING_WINDOW]
+            self._stored.samples = samples
+            TIMINGS.clear()
+        if not PROFILES:
+            return
+        slowest = max(PROFILES, key=lambda profile: profile.wall_seconds)
+        PROFILES.clear()
+        if slowest.wall_seconds <= typing.cast(float, self._stored.slowest_profile_seconds):
+            return
+        if not self.container.can_connect():
+            return
+        self.container.push(
+            server.HOOK_PROFILE_PATH,
+            f"{slowest.handler}: {slowest.wall_seconds:.3f}s\n{slowest.content}",
+            make_dirs=True,
+            user=server.USER,
+        )
+        self._stored.slowest_profile_seconds = slowest.wall_seconds
@@ -0,0 +1,47 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""The I/O timing module.
+
+The time the charm waits on the Pebble API, on network requests and on processes executed in the
+workload container is accumulated by kind where the calls are made: the instrumented Pebble
+client, the HTTP, Kubernetes API and endpoint probe calls, and the processes returned by the
+workload container exec.
+"""
+
+import contextlib
+import time
+import typing
+
+PEBBLE = "pebble"
+HTTP = "http"
+EXEC = "exec"
+
+# The seconds waited on each kind of I/O within the hook.
+SECONDS: typing.Dict[str, float] = {PEBBLE: 0.0, HTTP: 0.0, EXEC: 0.0}
+
+
+@contextlib.contextmanager
+def timed(kind: str) -> typing.Iterator[None]:
+    """Add the time spent in the block to the seconds waited on a kind of I/O.
+
+    Args:
+        kind: The kind of I/O, PEBBLE, HTTP or EXEC.
+
+    Yields:
+        Nothing, the block is timed.
+    """
+    start_time = time.monotonic()
+    try:
+        yield
+    finally:
+        SECONDS[kind] += time.monotonic() - start_time
+
+
+def get_seconds() -> typing.Tuple[float, float, float]:
+    """Get the seconds waited on each kind of I/O so far within the hook.
+
+    Returns:
+        The Pebble, HTTP and exec seconds.
+    """
+    return SECONDS[PEBBLE], SECONDS[HTTP], SECONDS[EXEC]
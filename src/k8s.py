@@ -0,0 +1,329 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""The Kubernetes workload pod management module."""
+
+import logging
+import typing
+
+import io_timing
+import tracing
+from state import ResourceConfig, SchedulingConfig
+
+if typing.TYPE_CHECKING:
+    import lightkube  # pragma: no cover
+    from lightkube.models.core_v1 import PodSpec  # pragma: no cover
+
+logger = logging.getLogger(__name__)
+
+RESOURCE_NAMES = ("cpu", "memory")
+# The label Juju sets on the unit pods with the application name.
+APP_NAME_LABEL = "app.kubernetes.io/name"
+HOSTNAME_TOPOLOGY_KEY = "kubernetes.io/hostname"
+ZONE_TOPOLOGY_KEY = "topology.kubernetes.io/zone"
+
+
+class KubernetesError(Exception):
+    """Exception raised when the Kubernetes API cannot be reached or refuses a request."""
+
+    def __init__(self, msg: str = ""):
+        """Initialize a new instance of the KubernetesError exception.
+
+        Args:
+            msg: Explanation of the error.
+        """
+        self.msg = msg
+
+
+def _get_client(field_manager: str) -> "lightkube.Client":
+    """Get a Kubernetes API client from the in-cluster configuration.
+
+    Args:
+        field_manager: The name of the manager of the fields patched by the client.
+
+    Raises:
+        KubernetesError: if the Kubernetes API configuration is not available.
+
+    Returns:
+        The Kubernetes API client.
+    """
+    # lightkube is only imported when the API is used to keep the hook start up time low.
+    import lightkube  # pylint: disable=import-outside-toplevel
+    from lightkube.core.exceptions import ConfigError  # pylint: disable=import-outside-toplevel
+
+    try:
+        return lightkube.Client(field_manager=field_manager)
+    except ConfigError as exc:
+        raise KubernetesError("Kubernetes API configuration not found.") from exc
+
+
+def _get_http_error() -> typing.Type[Exception]:
+    """Get the base exception of the Kubernetes API requests.
+
+    The base exception covers the API errors as well as the connection and timeout errors.
+
+    Returns:
+        The HTTP error of the HTTP client of lightkube.
+    """
+    # httpx is only imported when the API is used to keep the hook start up time low.
+    # pylint: disable=import-outside-toplevel,import-error
+    try:
+        from httpx import HTTPError
+    except ImportError:  # pragma: no cover
+        # lightkube 1 depends on the httpx2 fork of httpx.
+        from httpx2 import HTTPError  # type: ignore[no-redef]
+    return HTTPError
+
+
+def _quantities_equal(
+    current: typing.Optional[typing.Dict[str, str]], desired: typing.Dict[str, str]
+) -> bool:
+    """Check whether resource quantities are equal, regardless of their notation.
+
+    Args:
+        current: The resource quantities set on the container, None if unset.
+        desired: The resource quantities to set.
+
+    Returns:
+        True if the same resources are set to the same quantities.
+    """
+    # lightkube is only imported when the API is used to keep the hook start up time low.
+    from lightkube.utils.quantity import parse_quantity  # pylint: disable=import-outside-toplevel
+
+    current = current or {}
+    return all(
+        parse_quantity(current.get(name)) == parse_quantity(desired.get(name))
+        for name in RESOURCE_NAMES
+    )
+
+
+def _drop_none(value: typing.Any) -> typing.Any:
+    """Remove the unset fields of a Kubernetes object, as the API does.
+
+    Args:
+        value: The Kubernetes object, or a field of it.
+
+    Returns:
+        The object without None fields.
+    """
+    if isinstance(value, dict):
+        return {key: _drop_none(item) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [_drop_none(item) for item in value]
+    return value
+
+
+def _get_scheduling_patch(
+    app_name: str, scheduling: SchedulingConfig, current_node_selector: typing.Dict[str, str]
+) -> typing.Dict[str, typing.Any]:
+    """Get the pod spec fields setting the scheduling constraints.
+
+    The charm owns these fields, unset constraints are null so that the strategic merge patch
+    removes them.
+
+    Args:
+        app_name: The application name, which labels the unit pods.
+        scheduling: The scheduling constraints of the unit pods.
+        current_node_selector: The node selector of the pod template, to remove stale labels.
+
+    Returns:
+        The pod spec fields.
+    """
+    unit_pods = {"matchLabels": {APP_NAME_LABEL: app_name}}
+    pod_anti_affinity: typing.Optional[typing.Dict[str, typing.Any]] = None
+    if scheduling.pod_anti_affinity == "required":
+        pod_anti_affinity = {
+            "requiredDuringSchedulingIgnoredDuringExecution": [
+                {"labelSelector": unit_pods, "topologyKey": HOSTNAME_TOPOLOGY_KEY}
+            ],
+            "preferredDuringSchedulingIgnoredDuringExecution": None,
+        }
+    elif scheduling.pod_anti_affinity == "preferred":
+        pod_anti_affinity = {
+            "requiredDuringSchedulingIgnoredDuringExecution": None,
+            "preferredDuringSchedulingIgnoredDuringExecution": [
+                {
+                    "weight": 100,
+                    "podAffinityTerm": {
+                        "labelSelector": unit_pods,
+                        "topologyKey": HOSTNAME_TOPOLOGY_KEY,
+                    },
+                }
+            ],
+        }
+    return {
+        "affinity": {"podAntiAffinity": pod_anti_affinity},
+        "topologySpreadConstraints": (
+            [
+                {
+                    "maxSkew": 1,
+                    "topologyKey": ZONE_TOPOLOGY_KEY,
+                    # Zones without capacity must not block scale-out.
+                    "whenUnsatisfiable": "ScheduleAnyway",
+                    "labelSelector": unit_pods,
+                }
+            ]
+            if scheduling.zone_spread
+            else None
+        ),
+        "nodeSelector": (
+            {**{key: None for key in current_node_selector}, **scheduling.node_selector}
+            if scheduling.node_selector
+            else None
+        ),
+        "tolerations": [
+            {
+                "key": toleration.key,
+                "operator": "Exists" if toleration.value is None else "Equal",
+                "value": toleration.value,
+                "effect": toleration.effect,
+            }
+            for toleration in scheduling.tolerations
+        ]
+        or None,
+    }
+
+
+def _is_scheduling_applied(
+    pod_spec: "PodSpec", scheduling_patch: typing.Dict[str, typing.Any]
+) -> bool:
+    """Check whether the pod spec has the scheduling constraints.
+
+    Args:
+        pod_spec: The pod spec of the pod template.
+        scheduling_patch: The pod spec fields setting the scheduling constraints.
+
+    Returns:
+        True if the pod spec fields match the scheduling constraints.
+    """
+    current = pod_spec.to_dict()
+    # The node affinity is left to Juju, which sets it from the application constraints.
+    current["affinity"] = {"podAntiAffinity": current.get("affinity", {}).get("podAntiAffinity")}
+    return all(
+        (_drop_none(current.get(name)) or None) == (_drop_none(value) or None)
+        for name, value in scheduling_patch.items()
+    )
+
+
+@tracing.traced("k8s.patch_pod_template")
+def patch_pod_template(
+    app_name: str,
+    namespace: str,
+    container_name: str,
+    resources: ResourceConfig,
+    scheduling: SchedulingConfig,
+) -> bool:
+    """Set the workload container resources and scheduling constraints on the StatefulSet.
+
+    The StatefulSet is only patched when the pod template differs, since patching the pod
+    template restarts the pods of all units.
+
+    Args:
+        app_name: The application name, which is the StatefulSet name.
+        namespace: The Kubernetes namespace of the model.
+        container_name: The workload container name.
+        resources: The compute resources of the workload container.
+        scheduling: The scheduling constraints of the unit pods.
+
+    Raises:
+        KubernetesError: if the StatefulSet could not be read or patched.
+
+    Returns:
+        True if the StatefulSet was patched.
+    """
+    # lightkube is only imported when the API is used to keep the hook start up time low.
+    from lightkube.resources.apps_v1 import (  # pylint: disable=import-outside-toplevel
+        StatefulSet,
+    )
+
+    http_error = _get_http_error()
+    client = _get_client(field_manager=app_name)
+    try:
+        with io_timing.timed(io_timing.HTTP):
+            stateful_set = client.get(StatefulSet, app_name, namespace=namespace)
+        pod_spec = stateful_set.spec.template.spec if stateful_set.spec else None
+        container = next(
+            (
+                container
+                for container in (pod_spec.containers if pod_spec else [])
+                if container.name == container_name
+            ),
+            None,
+        )
+        if not pod_spec or not container:
+            raise KubernetesError(f"Workload container {container_name} not found.")
+        scheduling_patch = _get_scheduling_patch(
+            app_name, scheduling, dict(pod_spec.nodeSelector or {})
+        )
+        current = container.resources
+        if (
+            _quantities_equal(current.requests if current else None, resources.requests)
+            and _quantities_equal(current.limits if current else None, resources.limits)
+            and _is_scheduling_applied(pod_spec, scheduling_patch)
+        ):
+            return False
+        # Unset resources are null so that the strategic merge patch removes them.
+        patch = {
+            "spec": {
+                "template": {
+                    "spec": {
+                        "containers": [
+                            {
+                                "name": container_name,
+                                "resources": {
+                                    "requests": {
+                                        name: resources.requests.get(name)
+                                        for name in RESOURCE_NAMES
+                                    },
+                                    "limits": {
+                                        name: resources.limits.get(name) for name in RESOURCE_NAMES
+                                    },
+                                },
+                            }
+                        ],
+                        **scheduling_patch,
+                    }
+                }
+            }
+        }
+        with io_timing.timed(io_timing.HTTP):
+            client.patch(StatefulSet, app_name, patch, namespace=namespace)
+    except http_error as exc:
+        logger.error("Failed to patch the pod template, %s", exc)
+        raise KubernetesError("Failed to patch the pod template.") from exc
+    logger.info("Pod template patched, resources %s, %s.", resources, scheduling)
+    return True
+
+
+@tracing.traced("k8s.get_node_zone")
+def get_node_zone(namespace: str, pod_name: str) -> str:
+    """Get the zone of the node a pod runs on.
+
+    Args:
+        namespace: The Kubernetes namespace of the model.
+        pod_name: The pod name.
+
+    Raises:
+        KubernetesError: if the pod or its node could not be read.
+
+    Returns:
+        The node zone label, empty if the node has none.
+    """
+    # lightkube is only imported when the API is used to keep the hook start up time low.
+    from lightkube.resources.core_v1 import Node, Pod  # pylint: disable=import-outside-toplevel
+
+    http_error = _get_http_error()
+    client = _get_client(field_manager=pod_name)
+    try:
+        with io_timing.timed(io_timing.HTTP):
+            pod = client.get(Pod, pod_name, namespace=namespace)
+        node_name = pod.spec.nodeName if pod.spec else None
+        if not node_name:
+            raise KubernetesError(f"Pod {pod_name} is not scheduled.")
+        with io_timing.timed(io_timing.HTTP):
+            node = client.get(Node, node_name)
+    except http_error as exc:
+        logger.error("Failed to get the node of pod %s, %s", pod_name, exc)
+        raise KubernetesError("Failed to get the node of the pod.") from exc
+    labels = node.metadata.labels if node.metadata else None
+    return (labels or {}).get(ZONE_TOPOLOGY_KEY, "")
@@ -4,11 +4,11 @@
 """The module for handling agent metadata."""
 
 import typing
+from dataclasses import dataclass
 
-from pydantic import BaseModel, Field
 
-
-class Agent(BaseModel):
+@dataclass(frozen=True, slots=True)
+class Agent:
     """The Jenkins agent metadata.
 
     Attrs:
@@ -17,10 +17,19 @@ class Agent(BaseModel):
         name: The name of the agent.
     """
 
-    num_executors: int = Field(..., ge=1)
+    num_executors: int
     labels: str
     name: str
 
+    def __post_init__(self) -> None:
+        """Validate the agent metadata.
+
+        Raises:
+            ValueError: if the number of executors is less than 1.
+        """
+        if self.num_executors < 1:
+            raise ValueError(f"Invalid number of executors {self.num_executors}, must be >= 1.")
+
     def get_jenkins_agent_v0_interface_dict(self) -> typing.Dict[str, str]:
         """Generate dictionary representation of agent metadata.
 
@@ -0,0 +1,340 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""The Jenkins agent metrics module.
+
+Charm metrics are recorded in a registry within a hook, accumulated in the charm state and written
+to the workload container, where the metrics exporter serves them with the agent metrics.
+
+The metrics endpoint relation implements the provider side of the prometheus_scrape interface
+for static scrape jobs only: the unit address and name in the unit databag, and the scrape jobs
+and scrape metadata in the application databag. Alert and recording rules and dashboards are not
+published.
+"""
+
+import json
+import logging
+import socket
+import typing
+
+import ops
+
+if typing.TYPE_CHECKING:  # pragma: no cover
+    import pebble
+    from state import State
+
+logger = logging.getLogger(__name__)
+
+METRICS_RELATION = "metrics-endpoint"
+METRICS_PORT = 9100
+JVM_METRICS_PORT = 9404
+METRICS_PATH = "/metrics"
+
+# The type and help text of the charm metrics, by metric name.
+METRICS: typing.Dict[str, typing.Tuple[str, str]] = {
+    "jenkins_agent_jar_download_seconds": (
+        "summary",
+        "Time spent downloading the agent JAR executable.",
+    ),
+    "jenkins_agent_jar_download_bytes_total": (
+        "counter",
+        "Bytes of agent JAR executable downloaded.",
+    ),
+    "jenkins_agent_jar_downloads_total": (
+        "counter",
+        "Agent JAR executable downloads, by source.",
+    ),
+    "jenkins_agent_credentials_validation_seconds": (
+        "summary",
+        "Time spent validating agent-token pairs, by outcome.",
+    ),
+    "jenkins_agent_reconciles_total": (
+        "counter",
+        "Reconciles of the agent workload, by result.",
+    ),
+    "jenkins_agent_pebble_call_seconds": (
+        "summary",
+        "Time spent in Pebble API calls, by operation.",
+    ),
+    "jenkins_agent_endpoint_latency_seconds": (
+        "gauge",
+        "TCP connect and TLS handshake latency to the Jenkins server, by endpoint.",
+    ),
+    "jenkins_agent_endpoint_failovers_total": (
+        "counter",
+        "Failovers of the agent to another Jenkins server endpoint.",
+    ),
+    "jenkins_agent_executors": (
+        "gauge",
+        "Number of executors advertised to the Jenkins controllers.",
+    ),
+}
+
+
+def _get_series(name: str, labels: typing.Mapping[str, str]) -> str:
+    """Get the series identifier of a metric sample.
+
+    Args:
+        name: The sample name.
+        labels: The sample labels.
+
+    Returns:
+        The sample name followed by its sorted labels, in the Prometheus text format.
+    """
+    if not labels:
+        return name
+    label_pairs = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{label_pairs}}}"
+
+
+def _get_metric_name(series: str) -> str:
+    """Get the name of the metric a series belongs to.
+
+    Args:
+        series: The series identifier.
+
+    Returns:
+        The metric name, without the summary sample suffix.
+    """
+    name = series.split("{", 1)[0]
+    for suffix in ("_sum", "_count"):
+        base_name = name.removesuffix(suffix)
+        if base_name != name and METRICS.get(base_name, ("",))[0] == "summary":
+            return base_name
+    return name
+
+
+class Registry:
+    """The metric samples recorded within a hook.
+
+    Attrs:
+        counters: The increments of counter samples, by series.
+        gauges: The values of gauge samples, by series.
+        workload_changed: Whether the agent or its service changed state within the hook.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the registry."""
+        self.counters: typing.Dict[str, float] = {}
+        self.gauges: typing.Dict[str, float] = {}
+        self.workload_changed = False
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        """Increment a counter.
+
+        Args:
+            name: The counter name.
+            value: The increment.
+            labels: The counter labels.
+        """
+        series = _get_series(name, labels)
+        self.counters[series] = self.counters.get(series, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Observe a summary sample.
+
+        Args:
+            name: The summary name.
+            value: The observed value.
+            labels: The summary labels.
+        """
+        self.inc(f"{name}_sum", value, **labels)
+        self.inc(f"{name}_count", 1.0, **labels)
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        """Set a gauge.
+
+        Args:
+            name: The gauge name.
+            value: The gauge value.
+            labels: The gauge labels.
+        """
+        self.gauges[_get_series(name, labels)] = value
+
+    def mark_workload_changed(self) -> None:
+        """Record that the agent or its service changed state, the metrics are written."""
+        self.workload_changed = True
+
+    def is_empty(self) -> bool:
+        """Check whether no sample was recorded.
+
+        Returns:
+            True if no sample was recorded.
+        """
+        return not self.counters and not self.gauges
+
+    def get_total(self, name: str) -> float:
+        """Get the total of a counter across its labels.
+
+        Args:
+            name: The counter name.
+
+        Returns:
+            The sum of the counter increments of all series of the counter.
+        """
+        return sum(
+            value for series, value in self.counters.items() if series.split("{", 1)[0] == name
+        )
+
+    def merge_into(self, samples: typing.Mapping[str, float]) -> typing.Dict[str, float]:
+        """Merge the recorded samples into accumulated samples.
+
+        Args:
+            samples: The accumulated sample values, by series.
+
+        Returns:
+            The accumulated samples with the counters incremented and the gauges replaced.
+        """
+        merged = dict(samples)
+        for series, value in self.counters.items():
+            merged[series] = merged.get(series, 0.0) + value
+        merged.update(self.gauges)
+        return merged
+
+    def clear(self) -> None:
+        """Discard the recorded samples."""
+        self.counters.clear()
+        self.gauges.clear()
+        self.workload_changed = False
+
+
+# The registry of the running hook, the charm and its helper modules record samples to it.
+REGISTRY = Registry()
+
+
+def render(samples: typing.Mapping[str, float]) -> str:
+    """Render the samples in the Prometheus text exposition format.
+
+    Args:
+        samples: The sample values, by series.
+
+    Returns:
+        The samples of the known metrics, grouped by metric.
+    """
+    lines = []
+    for name, (metric_type, help_text) in METRICS.items():
+        metric_series = sorted(series for series in samples if _get_metric_name(series) == name)
+        if not metric_series:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(f"{series} {samples[series]}" for series in metric_series)
+    return "".join(f"{line}\n" for line in lines)
+
+
+class Observer(ops.Object):
+    """The metrics endpoint observer.
+
+    The accumulated charm metrics are written to the workload container when the agent or its
+    service changed state, or on update-status, so that hooks that change nothing make no Pebble
+    calls.
+
+    Attrs:
+        _stored: The accumulated charm metric samples.
+    """
+
+    _stored = ops.StoredState()
+
+    def __init__(
+        self,
+        charm: ops.CharmBase,
+        state: "State",
+        pebble_service: "pebble.PebbleService",
+        container: "pebble.WorkloadContainer",
+    ):
+        """Initialize the observer and register event handlers.
+
+        Args:
+            charm: The parent charm to attach the observer to.
+            state: The charm state.
+            pebble_service: Service manager that controls Jenkins agent service through pebble.
+            container: The Jenkins agent workload container.
+        """
+        super().__init__(charm, "metrics-observer")
+        self.charm = charm
+        self.state = state
+        self.pebble_service = pebble_service
+        self.container = container
+        self._stored.set_default(samples={})
+        self._update_status = False
+
+        charm.framework.observe(
+            charm.on[METRICS_RELATION].relation_joined, self._on_metrics_endpoint_changed
+        )
+        charm.framework.observe(charm.on.config_changed, self._on_metrics_endpoint_changed)
+        charm.framework.observe(charm.on.leader_elected, self._on_metrics_endpoint_changed)
+        charm.framework.observe(charm.on.upgrade_charm, self._on_metrics_endpoint_changed)
+        charm.framework.observe(charm.on.update_status, self._on_update_status)
+        charm.framework.observe(charm.framework.on.pre_commit, self._on_pre_commit)
+
+    def _on_metrics_endpoint_changed(self, _: ops.HookEvent) -> None:
+        """Publish the scrape jobs of the metrics exporters to the metrics endpoint relations."""
+        scrape_jobs = [
+            {"metrics_path": METRICS_PATH, "static_configs": [{"targets": [f"*:{METRICS_PORT}"]}]}
+        ]
+        if self.state.jvm_config.metrics_exporter:
+            scrape_jobs.append(
+                {
+                    "job_name": "jvm",
+                    "metrics_path": METRICS_PATH,
+                    "static_configs": [{"targets": [f"*:{JVM_METRICS_PORT}"]}],
+                }
+            )
+        for relation in self.charm.model.relations[METRICS_RELATION]:
+            _update_databag(
+                relation.data[self.charm.unit],
+                {
+                    "prometheus_scrape_unit_address": socket.getfqdn(),
+                    "prometheus_scrape_unit_name": self.charm.unit.name,
+                },
+            )
+            if not self.charm.unit.is_leader():
+                continue
+            _update_databag(
+                relation.data[self.charm.app],
+                {
+                    "scrape_metadata": json.dumps(
+                        {
+                            "model": self.charm.model.name,
+                            "model_uuid": self.charm.model.uuid,
+                            "application": self.charm.app.name,
+                            "charm_name": self.charm.meta.name,
+                        }
+                    ),
+                    "scrape_jobs": json.dumps(scrape_jobs),
+                },
+            )
+
+    def _on_update_status(self, _: ops.UpdateStatusEvent) -> None:
+        """Write the charm metrics to the workload container on commit."""
+        self._update_status = True
+
+    def _on_pre_commit(self, _: ops.PreCommitEvent) -> None:
+        """Accumulate the samples recorded within the hook and write them to the workload."""
+        write_metrics = REGISTRY.workload_changed or self._update_status
+        if not REGISTRY.is_empty():
+            self._stored.samples = REGISTRY.merge_into(
+                typing.cast(typing.Dict[str, float], self._stored.samples)
+            )
+        REGISTRY.clear()
+        if not write_metrics:
+            return
+        if not self.container.can_connect():
+            logger.debug("Workload container not ready, metrics written on a later hook.")
+            return
+        self.pebble_service.push_charm_metrics(
+            render(typing.cast(typing.Dict[str, float], self._stored.samples)),
+            container=self.container,
+        )
+
+
+def _update_databag(databag: ops.RelationDataContent, data: typing.Mapping[str, str]) -> None:
+    """Write the keys that differ from the databag.
+
+    Args:
+        databag: The relation databag to write to.
+        data: The desired relation data.
+    """
+    changed_data = {key: value for key, value in data.items() if databag.get(key) != value}
+    if changed_data:
+        databag.update(changed_data)
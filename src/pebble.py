@@ -3,27 +3,483 @@
 
 """The agent pebble service module."""
 
+import hashlib
+import json
 import logging
+import time
 import typing
+from dataclasses import dataclass
+from pathlib import Path, PurePath
 
 import ops
 
+import io_timing
+import metrics
 import server
+import tracing
 from state import State
 
 logger = logging.getLogger(__name__)
 
+# The key of the pebble custom notice emitted once the credentials validation service is done.
+VALIDATION_NOTICE_KEY = "jenkins.io/agent-validation"
+# The keys of the pebble custom notices emitted by the agent entrypoint on connection changes.
+AGENT_CONNECTED_NOTICE_KEY = "jenkins.io/agent-connected"
+AGENT_DISCONNECTED_NOTICE_KEY = "jenkins.io/agent-disconnected"
+
+# Pebble client operations that do not change the workload container.
+READ_ONLY_OPERATIONS = frozenset(
+    ("get_system_info", "get_plan", "get_services", "get_checks", "list_files")
+)
+
+
+@dataclass(slots=True)
+class PebbleCallStats:
+    """The statistics of a Pebble operation within a hook.
+
+    Attrs:
+        count: The number of Pebble API calls made.
+        cache_hits: The number of calls answered from the memoized results.
+        total_seconds: The time spent in the Pebble API calls.
+    """
+
+    count: int = 0
+    cache_hits: int = 0
+    total_seconds: float = 0.0
+
+
+class InstrumentedPebbleClient:
+    """Pebble client proxy that memoizes read-only calls and records call statistics.
+
+    Any operation that is not read-only discards the memoized results. Failed calls are not
+    memoized so that a transient error is not returned again.
+
+    Attrs:
+        call_stats: The statistics of each Pebble operation, by operation name.
+        total_seconds: The total time spent in Pebble calls.
+    """
+
+    def __init__(self, client: ops.pebble.Client):
+        """Initialize the instrumented Pebble client.
+
+        Args:
+            client: The Pebble client to proxy.
+        """
+        self.call_stats: typing.Dict[str, PebbleCallStats] = {}
+        self._client = client
+        self._cache: typing.Dict[str, typing.Any] = {}
+
+    @property
+    def total_seconds(self) -> float:
+        """The total time spent in Pebble calls."""
+        return sum(stats.total_seconds for stats in self.call_stats.values())
+
+    def get_call_summary(self) -> str:
+        """Summarize the Pebble calls made within the hook.
+
+        Returns:
+            The count, cache hits and latency of each Pebble operation.
+        """
+        return ", ".join(
+            f"{operation}: {stats.count} calls, {stats.cache_hits} cached, "
+            f"{stats.total_seconds * 1000:.1f}ms"
+            for operation, stats in sorted(self.call_stats.items())
+        )
+
+    def __getattr__(self, name: str) -> typing.Any:
+        """Get the proxied Pebble client attribute, instrumenting methods.
+
+        Args:
+            name: The attribute name.
+
+        Returns:
+            The attribute, methods are wrapped to memoize results and record statistics.
+        """
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+            """Call the Pebble operation.
+
+            Args:
+                args: The positional arguments of the operation.
+                kwargs: The keyword arguments of the operation.
+
+            Returns:
+                The result of the operation.
+            """
+            stats = self.call_stats.setdefault(name, PebbleCallStats())
+            key = repr((name, args, sorted(kwargs.items())))
+            if name not in READ_ONLY_OPERATIONS:
+                self._cache.clear()
+            elif key in self._cache:
+                stats.cache_hits += 1
+                return self._cache[key]
+            start_time = time.monotonic()
+            try:
+                with io_timing.timed(io_timing.PEBBLE):
+                    result = attribute(*args, **kwargs)
+            finally:
+                elapsed = time.monotonic() - start_time
+                stats.count += 1
+                stats.total_seconds += elapsed
+                metrics.REGISTRY.observe(
+                    "jenkins_agent_pebble_call_seconds", elapsed, operation=name
+                )
+            if name in READ_ONLY_OPERATIONS:
+                self._cache[key] = result
+            return result
+
+        return call
+
+
+class TimedExecProcess:
+    """Process executed in the workload container that records the time waited on it.
+
+    Attrs:
+        stdout: The lines of the standard output of the process, None if it was redirected.
+    """
+
+    def __init__(self, process: ops.pebble.ExecProcess):
+        """Initialize the timed process.
+
+        Args:
+            process: The process to proxy.
+        """
+        self._process = process
+
+    @property
+    def stdout(self) -> typing.Optional[typing.Iterator[str]]:
+        """The lines of the standard output of the process, None if it was redirected."""
+        if self._process.stdout is None:
+            return None
+        return self._iter_stdout(self._process.stdout)
+
+    @staticmethod
+    def _iter_stdout(stdout: typing.Iterable[str]) -> typing.Iterator[str]:
+        """Iterate the lines of the standard output, timing the wait for each line.
+
+        Args:
+            stdout: The standard output of the process.
+
+        Yields:
+            The lines of the standard output.
+        """
+        lines = iter(stdout)
+        while True:
+            with io_timing.timed(io_timing.EXEC):
+                line = next(lines, None)
+            if line is None:
+                return
+            yield line
+
+    def wait(self) -> None:
+        """Wait for the process to finish."""
+        with io_timing.timed(io_timing.EXEC):
+            self._process.wait()
+
+    def wait_output(self) -> typing.Tuple[typing.Any, typing.Any]:
+        """Wait for the process to finish and read its output.
+
+        Returns:
+            The standard output and standard error of the process.
+        """
+        with io_timing.timed(io_timing.EXEC):
+            return self._process.wait_output()
+
+
+class CachedContainer:
+    """The workload container with memoized read-only Pebble calls within a hook.
+
+    The container operations used by the charm are made through an instrumented client of the
+    container Pebble API.
+
+    Attrs:
+        name: The workload container name.
+        pebble: The instrumented Pebble client of the container.
+        call_stats: The statistics of each Pebble operation, by operation name.
+        total_seconds: The total time spent in Pebble calls.
+    """
+
+    def __init__(self, container: ops.Container):
+        """Initialize the cached container.
+
+        Args:
+            container: The workload container to wrap.
+        """
+        self.name = container.name
+        self._client = InstrumentedPebbleClient(container.pebble)
+        self.pebble = typing.cast(ops.pebble.Client, self._client)
+
+    @property
+    def call_stats(self) -> typing.Dict[str, PebbleCallStats]:
+        """The statistics of each Pebble operation, by operation name."""
+        return self._client.call_stats
+
+    @property
+    def total_seconds(self) -> float:
+        """The total time spent in Pebble calls."""
+        return self._client.total_seconds
+
+    def get_call_summary(self) -> str:
+        """Summarize the Pebble calls made within the hook.
+
+        Returns:
+            The count, cache hits and latency of each Pebble operation.
+        """
+        return self._client.get_call_summary()
+
+    def can_connect(self) -> bool:
+        """Check whether the Pebble API is reachable.
+
+        Returns:
+            True if the Pebble API is reachable.
+        """
+        try:
+            self.pebble.get_system_info()
+        except (ops.pebble.ConnectionError, ops.pebble.APIError, FileNotFoundError) as exc:
+            logger.debug("Pebble API is not ready, %s", exc)
+            return False
+        return True
+
+    def exists(self, path: typing.Union[str, PurePath]) -> bool:
+        """Check whether a path exists in the container.
+
+        Args:
+            path: The path in the container.
+
+        Raises:
+            APIError: if the path could not be looked up.
+
+        Returns:
+            True if the path exists.
+        """
+        try:
+            self.pebble.list_files(str(path), itself=True)
+        except ops.pebble.APIError as exc:
+            if exc.code == 404:
+                return False
+            raise
+        return True
+
+    def list_files(
+        self, path: typing.Union[str, PurePath], **kwargs: typing.Any
+    ) -> typing.List[ops.pebble.FileInfo]:
+        """List the files of a directory in the container.
+
+        Args:
+            path: The directory path in the container.
+            kwargs: The options of the Pebble list files operation.
+
+        Returns:
+            The files of the directory.
+        """
+        return self.pebble.list_files(str(path), **kwargs)
+
+    def push(
+        self,
+        path: typing.Union[str, PurePath],
+        source: typing.Union[bytes, str, typing.BinaryIO, typing.TextIO],
+        **kwargs: typing.Any,
+    ) -> None:
+        """Write a file to the container.
+
+        Args:
+            path: The file path in the container.
+            source: The file content.
+            kwargs: The options of the Pebble push operation.
+        """
+        self.pebble.push(str(path), source, **kwargs)
+
+    def pull(self, path: typing.Union[str, PurePath], **kwargs: typing.Any) -> typing.Any:
+        """Read a file from the container.
+
+        Args:
+            path: The file path in the container.
+            kwargs: The options of the Pebble pull operation.
+
+        Returns:
+            The readable file content.
+        """
+        return self.pebble.pull(str(path), **kwargs)
+
+    def remove_path(self, path: typing.Union[str, PurePath], **kwargs: typing.Any) -> None:
+        """Remove a path from the container.
+
+        Args:
+            path: The path in the container.
+            kwargs: The options of the Pebble remove path operation.
+        """
+        self.pebble.remove_path(str(path), **kwargs)
+
+    def get_plan(self) -> ops.pebble.Plan:
+        """Get the Pebble plan of the container.
+
+        Returns:
+            The Pebble plan.
+        """
+        return self.pebble.get_plan()
+
+    def add_layer(
+        self,
+        label: str,
+        layer: typing.Union[str, ops.pebble.LayerDict, ops.pebble.Layer],
+        **kwargs: typing.Any,
+    ) -> None:
+        """Add a layer to the Pebble plan.
+
+        Args:
+            label: The layer label.
+            layer: The layer.
+            kwargs: The options of the Pebble add layer operation.
+        """
+        self.pebble.add_layer(label, layer, **kwargs)
+
+    def replan(self) -> None:
+        """Start, or restart, the services of the Pebble plan that changed."""
+        self.pebble.replan_services()
+
+    def restart(self, *service_names: str) -> None:
+        """Restart services.
+
+        Args:
+            service_names: The names of the services.
+        """
+        self.pebble.restart_services(service_names)
+
+    def stop(self, *service_names: str) -> None:
+        """Stop services.
+
+        Args:
+            service_names: The names of the services.
+        """
+        self.pebble.stop_services(service_names)
+
+    def get_services(self, *service_names: str) -> typing.Dict[str, ops.pebble.ServiceInfo]:
+        """Get the status of services.
+
+        Args:
+            service_names: The names of the services, all services if none are given.
+
+        Returns:
+            The status of each service, by service name.
+        """
+        return {
+            service.name: service for service in self.pebble.get_services(service_names or None)
+        }
+
+    def get_service(self, service_name: str) -> ops.pebble.ServiceInfo:
+        """Get the status of a service.
+
+        Args:
+            service_name: The name of the service.
+
+        Raises:
+            ModelError: if the service is not in the Pebble plan.
+
+        Returns:
+            The status of the service.
+        """
+        services = self.get_services(service_name)
+        if service_name not in services:
+            raise ops.ModelError(f"service {service_name!r} not found")
+        return services[service_name]
+
+    def exec(self, command: typing.List[str], **kwargs: typing.Any) -> TimedExecProcess:
+        """Execute a command in the container.
+
+        Args:
+            command: The command and its arguments.
+            kwargs: The options of the Pebble exec operation.
+
+        Returns:
+            The process of the command, recording the time waited on it.
+        """
+        return TimedExecProcess(self.pebble.exec(command, **kwargs))
+
+
+# The workload container, either wrapped for the hook or as given by ops.
+WorkloadContainer = typing.Union[ops.Container, CachedContainer]
+
 
 class PebbleService:
-    """The charm pebble service manager."""
+    """The charm pebble service manager.
+
+    The primary controller agent runs in the Jenkins home directory, next to the metrics exporter.
+    The agent of each secondary controller runs in its own service and working directory.
 
-    def __init__(self, state: State):
+    Attrs:
+        agent_service_name: The Jenkins agent service name.
+        workdir: The Jenkins agent working directory.
+        agent_jar_path: The path of the agent JAR executable.
+        validation_service_name: The one-shot credentials validation service name.
+        metrics_service_name: The metrics exporter service name.
+    """
+
+    def __init__(self, state: State, controller_name: str = ""):
         """Initialize the pebble service.
 
         Args:
             state: The Jenkins agent k8s state.
+            controller_name: The name of the controller of the agent, empty for the primary.
         """
         self.state = state
+        self.controller_name = controller_name
+
+    @property
+    def agent_service_name(self) -> str:
+        """The Jenkins agent service name."""
+        if not self.controller_name:
+            return self.state.jenkins_agent_service_name
+        return f"{self.state.jenkins_agent_service_name}-{self.controller_name}"
+
+    @property
+    def workdir(self) -> Path:
+        """The Jenkins agent working directory."""
+        if not self.controller_name:
+            return server.JENKINS_WORKDIR
+        return server.CONTROLLERS_WORKDIR / self.controller_name
+
+    @property
+    def agent_jar_path(self) -> Path:
+        """The path of the agent JAR executable."""
+        return self.workdir / server.AGENT_JAR_PATH.name
+
+    @property
+    def validation_service_name(self) -> str:
+        """The one-shot credentials validation service name."""
+        return f"{self.state.jenkins_agent_service_name}-validation"
+
+    @property
+    def metrics_service_name(self) -> str:
+        """The metrics exporter service name."""
+        return f"{self.state.jenkins_agent_service_name}-metrics"
+
+    def _get_java_opts(self) -> str:
+        """Get the JVM options enabling the configured observability features.
+
+        Only the agent of the primary controller is instrumented, the JMX exporter port and the
+        flight recorder repository are not shared between agent JVMs.
+
+        Returns:
+            The JVM options of the Jenkins agent.
+        """
+        if self.controller_name:
+            return ""
+        java_opts = []
+        if self.state.jvm_config.metrics_exporter:
+            java_opts.append(
+                f"-javaagent:{server.JMX_EXPORTER_JAR_PATH}="
+                f"{metrics.JVM_METRICS_PORT}:{server.JMX_EXPORTER_CONFIG_PATH}"
+            )
+        if self.state.jvm_config.jfr_recording:
+            java_opts.append(f"-XX:FlightRecorderOptions=repository={server.JFR_REPOSITORY_PATH}")
+            java_opts.append(
+                "-XX:StartFlightRecording=name=jenkins-agent,disk=true,"
+                f"maxsize={server.JFR_MAX_SIZE}"
+            )
+        return " ".join(java_opts)
 
     def _get_pebble_layer(
         self, server_url: str, agent_token_pair: typing.Tuple[str, str]
@@ -37,19 +493,45 @@ class PebbleService:
         Returns:
             The pebble layer defining Jenkins service layer.
         """
+        environment = {
+            "JENKINS_URL": server_url,
+            "JENKINS_AGENT": agent_token_pair[0],
+            "JENKINS_TOKEN": agent_token_pair[1],
+        }
+        # JAVA_OPTS is only set when needed so that the layer of agents without observability
+        # features, and hence their fingerprint, is unchanged.
+        if java_opts := self._get_java_opts():
+            environment["JAVA_OPTS"] = java_opts
+        agent_service: ops.pebble.ServiceDict = {
+            "override": "replace",
+            "summary": "Jenkins agent k8s",
+            "command": str(server.ENTRYSCRIPT_PATH),
+            "environment": environment,
+            "startup": "enabled",
+            "user": server.USER,
+        }
+        if self.controller_name:
+            environment["JENKINS_CONTROLLER"] = self.controller_name
+            environment["JENKINS_WORKDIR"] = str(self.workdir)
+            return ops.pebble.Layer(
+                {
+                    "summary": f"Jenkins agent k8s {self.controller_name} layer",
+                    "description": (
+                        f"pebble config layer for Jenkins agent k8s of {self.controller_name}."
+                    ),
+                    "services": {self.agent_service_name: agent_service},
+                }
+            )
         layer: ops.pebble.LayerDict = {
             "summary": "Jenkins agent k8s layer",
             "description": "pebble config layer for Jenkins agent k8s.",
             "services": {
-                self.state.jenkins_agent_service_name: {
+                self.agent_service_name: agent_service,
+                self.metrics_service_name: {
                     "override": "replace",
-                    "summary": "Jenkins agent k8s",
-                    "command": str(server.ENTRYSCRIPT_PATH),
-                    "environment": {
-                        "JENKINS_URL": server_url,
-                        "JENKINS_AGENT": agent_token_pair[0],
-                        "JENKINS_TOKEN": agent_token_pair[1],
-                    },
+                    "summary": "Jenkins agent k8s metrics exporter",
+                    "command": f"/usr/bin/python3 {server.EXPORTER_SCRIPT_PATH}",
+                    "environment": {"METRICS_PORT": str(metrics.METRICS_PORT)},
                     "startup": "enabled",
                     "user": server.USER,
                 },
@@ -66,8 +548,34 @@ class PebbleService:
         }
         return ops.pebble.Layer(layer)
 
+    def get_fingerprint(
+        self, server_url: str, agent_token_pair: typing.Tuple[str, str], agent_jar_sha256: str
+    ) -> str:
+        """Get the fingerprint of the Jenkins agent workload.
+
+        The fingerprint covers the server URL, the agent token pair and the environment through
+        the pebble layer, and the agent JAR executable through its hash.
+
+        Args:
+            server_url: The Jenkins server address.
+            agent_token_pair: Matching pair of agent name to agent token.
+            agent_jar_sha256: The sha256 hex digest of the agent JAR executable.
+
+        Returns:
+            The sha256 hex digest of the Jenkins agent workload.
+        """
+        agent_layer = self._get_pebble_layer(
+            server_url=server_url, agent_token_pair=agent_token_pair
+        )
+        workload = {"layer": agent_layer.to_dict(), "agent_jar_sha256": agent_jar_sha256}
+        return hashlib.sha256(json.dumps(workload, sort_keys=True).encode()).hexdigest()
+
+    @tracing.traced("PebbleService.reconcile")
     def reconcile(
-        self, server_url: str, agent_token_pair: typing.Tuple[str, str], container: ops.Container
+        self,
+        server_url: str,
+        agent_token_pair: typing.Tuple[str, str],
+        container: WorkloadContainer,
     ) -> None:
         """Reconcile the Jenkins agent service.
 
@@ -79,12 +587,11 @@ class PebbleService:
         agent_layer = self._get_pebble_layer(
             server_url=server_url, agent_token_pair=agent_token_pair
         )
-        container.add_layer(
-            label=self.state.jenkins_agent_service_name, layer=agent_layer, combine=True
-        )
+        container.add_layer(label=self.agent_service_name, layer=agent_layer, combine=True)
         container.replan()
 
-    def stop_agent(self, container: ops.Container) -> None:
+    @tracing.traced("PebbleService.stop_agent")
+    def stop_agent(self, container: WorkloadContainer) -> None:
         """Stop Jenkins agent.
 
         Args:
@@ -93,8 +600,148 @@ class PebbleService:
         try:
             # use get_service to check if service should be stopped rather than stopping and
             # catching ops.pebble.APIError and parsing error message to determine type of error.
-            container.get_service(self.state.jenkins_agent_service_name)
+            container.get_service(self.agent_service_name)
         except ops.ModelError:
             return
-        container.stop(self.state.jenkins_agent_service_name)
-        container.remove_path(str(server.AGENT_READY_PATH))
+        container.stop(self.agent_service_name)
+        # The ready file is removed by the entrypoint once the agent exits, recursive removal does
+        # not fail on a missing path.
+        container.remove_path(
+            str(self.workdir / server.AGENT_READY_PATH.relative_to(server.JENKINS_WORKDIR)),
+            recursive=True,
+        )
+
+    def stop_stale_agents(
+        self, active_service_names: typing.Collection[str], container: WorkloadContainer
+    ) -> None:
+        """Stop the agents of secondary controllers that are no longer related.
+
+        Their agent state is removed, so that the metrics exporter no longer serves their agent
+        metrics.
+
+        Args:
+            active_service_names: The agent service names of the current controllers.
+            container: The agent workload container.
+        """
+        prefix = f"{self.state.jenkins_agent_service_name}-agent-"
+        stale_service_names = [
+            name
+            for name, service in container.get_services().items()
+            if name.startswith(prefix)
+            and name not in active_service_names
+            and service.is_running()
+        ]
+        if stale_service_names:
+            logger.info("Stopping agents of departed controllers: %s", stale_service_names)
+            container.stop(*stale_service_names)
+        for name in stale_service_names:
+            controller_name = name.removeprefix(f"{self.state.jenkins_agent_service_name}-")
+            metrics_dir = server.CONTROLLERS_WORKDIR / controller_name / "metrics"
+            container.remove_path(str(metrics_dir / server.AGENT_STATE_PATH.name), recursive=True)
+
+    def push_charm_metrics(self, content: str, container: WorkloadContainer) -> None:
+        """Write the charm metrics for the metrics exporter to serve.
+
+        Args:
+            content: The charm metrics in the Prometheus text exposition format.
+            container: The agent workload container.
+        """
+        container.push(server.CHARM_METRICS_PATH, content, make_dirs=True, user=server.USER)
+
+    def get_jfr_chunk_paths(self, container: WorkloadContainer) -> typing.List[str]:
+        """Get the completed chunks of the flight recording of the running agent.
+
+        The flight recorder writes a repository directory per JVM, the newest one belongs to the
+        running agent. Its newest chunk is still being written and is left out.
+
+        Args:
+            container: The agent workload container.
+
+        Returns:
+            The paths of the completed recording chunks, oldest first.
+        """
+        if not container.exists(str(server.JFR_REPOSITORY_PATH)):
+            return []
+        repositories = sorted(
+            file_info.path
+            for file_info in container.list_files(server.JFR_REPOSITORY_PATH)
+            if file_info.type == ops.pebble.FileType.DIRECTORY
+        )
+        if not repositories:
+            return []
+        chunks = sorted(
+            file_info.path for file_info in container.list_files(repositories[-1], pattern="*.jfr")
+        )
+        return chunks[:-1]
+
+    def start_validation(
+        self,
+        server_url: str,
+        agent_name_token_pairs: typing.Iterable[typing.Tuple[str, str]],
+        container: WorkloadContainer,
+    ) -> None:
+        """Start validating the credentials in a one-shot service in the workload container.
+
+        The service writes the name of the first valid agent, or an empty line if none is valid,
+        to the validation result file and emits a pebble custom notice once it is done.
+
+        Args:
+            server_url: The Jenkins server address.
+            agent_name_token_pairs: Matching agent name and token pairs to validate.
+            container: The agent workload container.
+        """
+        container.remove_path(str(server.VALIDATION_RESULT_PATH), recursive=True)
+        container.push(
+            server.VALIDATION_CANDIDATES_PATH,
+            "".join(f"{name} {token}\n" for name, token in agent_name_token_pairs),
+            make_dirs=True,
+            permissions=0o600,
+            user=server.USER,
+        )
+        layer: ops.pebble.LayerDict = {
+            "summary": "Jenkins agent k8s validation layer",
+            "description": "pebble config layer for Jenkins agent k8s credentials validation.",
+            "services": {
+                self.validation_service_name: {
+                    "override": "replace",
+                    "summary": "Jenkins agent k8s credentials validation",
+                    "command": str(server.VALIDATION_SCRIPT_PATH),
+                    "environment": {
+                        "JENKINS_URL": server_url,
+                        "VALIDATION_TIMEOUT": str(server.VALIDATION_TIMEOUT_SECONDS),
+                    },
+                    "startup": "disabled",
+                    "on-success": "ignore",
+                    "on-failure": "ignore",
+                    "user": server.USER,
+                },
+            },
+        }
+        container.add_layer(label=self.validation_service_name, layer=layer, combine=True)
+        container.restart(self.validation_service_name)
+
+    def is_validation_running(self, container: WorkloadContainer) -> bool:
+        """Check whether the credentials validation service is running.
+
+        Args:
+            container: The agent workload container.
+
+        Returns:
+            True if the credentials validation service is running.
+        """
+        services = container.get_services(self.validation_service_name)
+        return any(service.is_running() for service in services.values())
+
+    def get_validation_result(self, container: WorkloadContainer) -> typing.Optional[str]:
+        """Get the result of the credentials validation service.
+
+        Args:
+            container: The agent workload container.
+
+        Returns:
+            The name of the valid agent, empty string if no agent is valid. None if the validation
+            has not completed.
+        """
+        if not container.exists(str(server.VALIDATION_RESULT_PATH)):
+            return None
+        return str(container.pull(server.VALIDATION_RESULT_PATH, encoding="utf-8").read()).strip()
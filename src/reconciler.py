@@ -0,0 +1,539 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""The Jenkins agent reconciler module."""
+
+import hashlib
+import json
+import logging
+import typing
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+import ops
+
+import admission
+import metrics
+import pebble
+import server
+from state import Controller, State
+
+logger = logging.getLogger(__name__)
+
+# The time in seconds that credentials validation may take within a hook. Validation that cannot
+# complete within the budget continues in a one-shot service in the workload container.
+SYNC_VALIDATION_BUDGET_SECONDS = 30
+# The Juju resource carrying the agent JAR executable, tried before the mirror and the server.
+AGENT_JAR_RESOURCE = "agent-jar"
+
+
+@dataclass(frozen=True)
+class Target:
+    """The Jenkins server the agent should be registered to.
+
+    Attrs:
+        server_url: The Jenkins server URL address.
+        agent_name_token_pairs: Candidate agent name and token pairs to register with.
+        validate: Whether the candidate pairs need to be validated against the server.
+        background_validation: Whether the candidate pairs are validated in the workload.
+    """
+
+    server_url: str
+    agent_name_token_pairs: typing.Sequence[typing.Tuple[str, str]]
+    validate: bool
+    background_validation: bool = False
+
+    @property
+    def digest(self) -> str:
+        """The sha256 hex digest of the target."""
+        return hashlib.sha256(
+            json.dumps([self.server_url, list(self.agent_name_token_pairs)]).encode()
+        ).hexdigest()
+
+
+class Reconciler(ops.Object):
+    """Reconcile the Jenkins agent workload with the desired state.
+
+    Attrs:
+        _stored: The fingerprint, agent name and agent JAR hash last applied to the workload, the
+            server the agent JAR was downloaded from, the target being validated in the
+            background, the agent that last disconnected from the server and the configured
+            Jenkins server endpoint the agent registers through.
+    """
+
+    _stored = ops.StoredState()
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        charm: ops.CharmBase,
+        state: State,
+        pebble_service: pebble.PebbleService,
+        container: pebble.WorkloadContainer,
+        download_admission: admission.DownloadAdmission,
+        controller: Controller,
+    ):
+        """Initialize the reconciler.
+
+        Args:
+            charm: The parent charm to attach the reconciler to.
+            state: The charm state.
+            pebble_service: Service manager that controls Jenkins agent service through pebble.
+            container: The Jenkins agent workload container.
+            download_admission: The admission of units to download the agent JAR executable.
+            controller: The Jenkins controller the agent registers to.
+        """
+        super().__init__(
+            charm, f"reconciler-{controller.name}" if controller.name else "reconciler"
+        )
+        self.charm = charm
+        self.state = state
+        self.pebble_service = pebble_service
+        self.container = container
+        self.download_admission = download_admission
+        self.controller = controller
+        self._stored.set_default(
+            fingerprint="",
+            agent_name="",
+            jar_sha256="",
+            jar_url="",
+            validation_digest="",
+            disconnected_agent="",
+            endpoint="",
+        )
+
+    def _get_endpoint(self, endpoints: typing.Sequence[server.Endpoint], probe: bool) -> str:
+        """Get the configured Jenkins server endpoint to register through.
+
+        The endpoints are probed when there are several of them and no configured endpoint was
+        selected yet, or when requested.
+
+        Args:
+            endpoints: The configured Jenkins server endpoints.
+            probe: Whether to probe the endpoints and fail over from a degraded active endpoint.
+
+        Returns:
+            The URL of the Jenkins server endpoint.
+        """
+        if len(endpoints) == 1:
+            return endpoints[0].url
+        active_url = typing.cast(str, self._stored.endpoint)
+        if active_url not in (endpoint.url for endpoint in endpoints):
+            active_url = ""
+        elif not probe:
+            return active_url
+        self._stored.endpoint = server.select_endpoint(endpoints, active_url)
+        return typing.cast(str, self._stored.endpoint)
+
+    def _get_target(self, probe_endpoints: bool = False) -> typing.Optional[Target]:
+        """Get the Jenkins server to register to from configuration or agent relation.
+
+        The unit status is set if the target is not available.
+
+        Args:
+            probe_endpoints: Whether to probe the configured Jenkins server endpoints.
+
+        Returns:
+            The registration target, None if configuration and relation data are not available.
+        """
+        if self.state.jenkins_config and self.controller.relation_id is None:
+            # The agent that disconnected is tried last so that another valid pair is rotated in.
+            agent_name_token_pairs = sorted(
+                self.state.jenkins_config.agent_name_token_pairs,
+                key=lambda pair: pair[0] == self._stored.disconnected_agent,
+            )
+            return Target(
+                server_url=self._get_endpoint(
+                    self.state.jenkins_config.endpoints, probe=probe_endpoints
+                ),
+                agent_name_token_pairs=tuple(agent_name_token_pairs),
+                validate=True,
+                background_validation=self.state.jenkins_config.background_validation,
+            )
+        if self.controller.relation_id is None:
+            self.charm.unit.status = ops.BlockedStatus("Waiting for config/relation.")
+            return None
+        credentials = self.state.get_agent_relation_credentials(self.controller.relation_id)
+        if not credentials:
+            server_url = self.state.get_agent_relation_server_url(self.controller.relation_id)
+            if server_url:
+                self._prefetch_agent_jar(server_url)
+            self.charm.unit.status = ops.WaitingStatus("Waiting for complete relation data.")
+            logger.info("Waiting for complete relation data.")
+            return None
+        return Target(
+            server_url=credentials.address,
+            agent_name_token_pairs=((self.state.agent_meta.name, credentials.secret),),
+            validate=False,
+        )
+
+    def _is_applied(self, target: Target) -> bool:
+        """Check whether the target has already been applied to the workload.
+
+        No container or network calls are made.
+
+        Args:
+            target: The registration target.
+
+        Returns:
+            True if the last applied fingerprint matches the target.
+        """
+        fingerprint = typing.cast(str, self._stored.fingerprint)
+        if not fingerprint:
+            return False
+        for agent_token_pair in target.agent_name_token_pairs:
+            if agent_token_pair[0] != self._stored.agent_name:
+                continue
+            return fingerprint == self.pebble_service.get_fingerprint(
+                server_url=target.server_url,
+                agent_token_pair=agent_token_pair,
+                agent_jar_sha256=typing.cast(str, self._stored.jar_sha256),
+            )
+        return False
+
+    def _is_healthy(self) -> bool:
+        """Check whether the Jenkins agent service is running.
+
+        Returns:
+            True if the Jenkins agent service is running.
+        """
+        if not self.container.can_connect():
+            return False
+        services = self.container.get_services(self.pebble_service.agent_service_name)
+        return any(service.is_running() for service in services.values())
+
+    def _is_agent_jar_current(self, server_url: str) -> bool:
+        """Check whether the agent JAR executable of the server is in the workload container.
+
+        The agent JAR executable downloaded from the same server URL is compared with the one the
+        server advertises, by sha256 digest or, when the server does not advertise it, by size,
+        since the server may have been upgraded since.
+
+        Args:
+            server_url: The Jenkins server URL address.
+
+        Returns:
+            True if the agent JAR executable matches the server, or was downloaded from the server
+            and cannot be checked against it.
+        """
+        agent_jar_path = self.pebble_service.agent_jar_path
+        if self._stored.jar_url != server_url or not self.container.exists(agent_jar_path):
+            return False
+        digest = server.get_agent_jar_digest(server_url)
+        if not digest:
+            # The server is not reachable, the agent JAR executable could not be downloaded either.
+            return True
+        if digest.sha256:
+            current = digest.sha256 == self._stored.jar_sha256
+        else:
+            current = self.container.list_files(agent_jar_path, itself=True)[0].size == digest.size
+        if not current:
+            logger.info("Agent JAR executable does not match the server, downloading it again.")
+        return current
+
+    def _is_download_admitted(self, server_url: str) -> bool:
+        """Check whether the unit may download the agent JAR executable.
+
+        The unit status is set if the unit waits for a download slot or backs off after a failed
+        download.
+
+        Args:
+            server_url: The Jenkins server URL address.
+
+        Returns:
+            True if the unit was admitted to download.
+        """
+        if self.download_admission.request(server_url):
+            return True
+        if self.download_admission.is_backing_off():
+            self._set_download_failed_status()
+            return False
+        logger.info("Waiting for an agent JAR download slot.")
+        self.charm.unit.status = ops.WaitingStatus("Waiting for agent JAR download slot.")
+        return False
+
+    def _set_download_failed_status(self) -> None:
+        """Set the status of a unit backing off after a failed download, naming the retry time."""
+        retry_time = datetime.fromtimestamp(self.download_admission.retry_time, tz=timezone.utc)
+        self.charm.unit.status = ops.WaitingStatus(
+            f"Agent JAR download failed, retrying after {retry_time:%H:%M:%S} UTC."
+        )
+
+    def _get_agent_jar_resource(self) -> typing.Optional[Path]:
+        """Get the agent JAR executable attached as Juju resource.
+
+        Returns:
+            The path of the agent JAR executable, None if the resource is not attached or empty.
+        """
+        try:
+            resource_path = self.charm.model.resources.fetch(AGENT_JAR_RESOURCE)
+        except (ops.ModelError, NameError):
+            return None
+        return resource_path if resource_path.stat().st_size else None
+
+    def _ensure_agent_jar(self, server_url: str) -> bool:
+        """Download the agent JAR executable unless the one of the server is already downloaded.
+
+        Units that already have the agent JAR executable do not request a download slot. A failed
+        download releases the download slot and the unit backs off before downloading again. The
+        unit status is set if the agent JAR executable is not available.
+
+        Args:
+            server_url: The Jenkins server URL address.
+
+        Returns:
+            True if the agent JAR executable of the server is in the workload container.
+        """
+        if self._is_agent_jar_current(server_url):
+            return True
+        if not self._is_download_admitted(server_url):
+            return False
+        self.charm.unit.status = ops.MaintenanceStatus("Downloading Jenkins agent executable.")
+        try:
+            agent_jar_sha256 = server.download_jenkins_agent(
+                server_url=server_url,
+                container=self.container,
+                sources=server.AgentJarSources(
+                    resource_path=self._get_agent_jar_resource(),
+                    mirror_url=self.state.agent_jar_mirror_url,
+                ),
+                agent_jar_path=self.pebble_service.agent_jar_path,
+            )
+        except server.AgentJarDownloadError as exc:
+            logger.error("Failed to download agent JAR executable, %s", exc)
+            self.download_admission.release(failed=True)
+            self._set_download_failed_status()
+            return False
+        self.download_admission.release()
+        self._stored.jar_url = server_url
+        self._stored.jar_sha256 = agent_jar_sha256
+        return True
+
+    def _prefetch_agent_jar(self, server_url: str) -> None:
+        """Download the agent JAR executable ahead of the registration credentials.
+
+        Failures are retried on registration.
+
+        Args:
+            server_url: The Jenkins server URL address.
+        """
+        if self.container.can_connect():
+            self._ensure_agent_jar(server_url)
+
+    def _set_no_valid_credentials_status(self) -> None:
+        """Block the unit since none of the agent-token pairs is valid."""
+        logger.error("No valid agent-token pair found.")
+        self.charm.unit.status = ops.BlockedStatus("Additional valid agent-token pairs required.")
+
+    def _validate_in_background(self, target: Target) -> typing.Optional[typing.Tuple[str, str]]:
+        """Validate the candidate pairs in a one-shot service in the workload container.
+
+        The first call starts the validation, later calls pick up its result.
+
+        Args:
+            target: The registration target.
+
+        Returns:
+            The valid agent name and token pair, None if the validation is running or no
+            candidate pair is valid.
+        """
+        if self._stored.validation_digest == target.digest:
+            valid_agent_name = self.pebble_service.get_validation_result(self.container)
+            if valid_agent_name is not None:
+                agent_token_pair = next(
+                    (
+                        pair
+                        for pair in target.agent_name_token_pairs
+                        if pair[0] == valid_agent_name
+                    ),
+                    None,
+                )
+                if not agent_token_pair:
+                    self._set_no_valid_credentials_status()
+                return agent_token_pair
+            if self.pebble_service.is_validation_running(self.container):
+                self.charm.unit.status = ops.WaitingStatus("Validating agent-token pairs.")
+                return None
+            logger.warning("Credentials validation stopped without result. Restarting.")
+
+        logger.info("Starting credentials validation in the workload container.")
+        self.pebble_service.start_validation(
+            server_url=target.server_url,
+            agent_name_token_pairs=target.agent_name_token_pairs,
+            container=self.container,
+        )
+        self._stored.validation_digest = target.digest
+        self.charm.unit.status = ops.WaitingStatus("Validating agent-token pairs.")
+        return None
+
+    def _select_agent_token_pair(self, target: Target) -> typing.Optional[typing.Tuple[str, str]]:
+        """Select the agent name and token pair to register with.
+
+        Validation within the hook is bounded by SYNC_VALIDATION_BUDGET_SECONDS, it continues in
+        the background when the budget is not enough.
+
+        Args:
+            target: The registration target.
+
+        Returns:
+            The agent name and token pair, None if no candidate pair is valid or the validation
+            is running in the background.
+        """
+        if not target.validate:
+            return target.agent_name_token_pairs[0]
+        if (
+            target.background_validation
+            or self._stored.validation_digest == target.digest
+            or len(target.agent_name_token_pairs) * server.VALIDATION_TIMEOUT_SECONDS
+            > SYNC_VALIDATION_BUDGET_SECONDS
+        ):
+            return self._validate_in_background(target)
+        try:
+            agent_token_pair = server.find_valid_credentials(
+                agent_name_token_pairs=target.agent_name_token_pairs,
+                server_url=target.server_url,
+                container=self.container,
+                time_budget=SYNC_VALIDATION_BUDGET_SECONDS,
+            )
+        except server.ValidationBudgetExceededError:
+            logger.warning("Credentials validation out of time budget, moving to background.")
+            return self._validate_in_background(target)
+        if not agent_token_pair:
+            self._set_no_valid_credentials_status()
+        return agent_token_pair
+
+    def reconcile(self, check_health: bool = False) -> None:
+        """Reconcile the Jenkins agent with the desired state.
+
+        The fingerprint of the desired state is compared against the last applied fingerprint.
+        Nothing is done if they match, unless the health check finds that the agent service is
+        not running or that the configured Jenkins server endpoint degraded.
+
+        Args:
+            check_health: Whether to probe the configured Jenkins server endpoints and to check
+                that the Jenkins agent service is running when the desired state has already been
+                applied.
+        """
+        target = self._get_target(probe_endpoints=check_health)
+        if not target:
+            return
+
+        if self._is_applied(target) and (not check_health or self._is_healthy()):
+            logger.debug("Jenkins agent up to date.")
+            metrics.REGISTRY.inc("jenkins_agent_reconciles_total", result="skipped")
+            return
+
+        if not self.container.can_connect():
+            logger.warning("Jenkins agent container not yet ready.")
+            self.charm.unit.status = ops.WaitingStatus("Waiting for workload container.")
+            return
+
+        if not self._ensure_agent_jar(target.server_url):
+            return
+        agent_jar_sha256 = typing.cast(str, self._stored.jar_sha256)
+        agent_token_pair = self._select_agent_token_pair(target)
+        if not agent_token_pair:
+            return
+
+        self.charm.unit.status = ops.MaintenanceStatus("Starting agent pebble service.")
+        self.pebble_service.reconcile(
+            server_url=target.server_url,
+            agent_token_pair=agent_token_pair,
+            container=self.container,
+        )
+        self._stored.fingerprint = self.pebble_service.get_fingerprint(
+            server_url=target.server_url,
+            agent_token_pair=agent_token_pair,
+            agent_jar_sha256=agent_jar_sha256,
+        )
+        self._stored.agent_name = agent_token_pair[0]
+        self._stored.validation_digest = ""
+        metrics.REGISTRY.inc("jenkins_agent_reconciles_total", result="applied")
+        metrics.REGISTRY.mark_workload_changed()
+        self.charm.unit.status = ops.ActiveStatus()
+
+    def agent_connected(self, agent_name: str) -> None:
+        """Mark the unit active once the Jenkins agent connected to the server.
+
+        Args:
+            agent_name: The name of the agent that connected.
+        """
+        if agent_name != self._stored.agent_name:
+            logger.debug("Ignoring connection of stale agent %s.", agent_name)
+            return
+        logger.info("Jenkins agent %s connected.", agent_name)
+        metrics.REGISTRY.mark_workload_changed()
+        self._stored.disconnected_agent = ""
+        self.charm.unit.status = ops.ActiveStatus()
+
+    def agent_disconnected(self, agent_name: str) -> None:
+        """React to the Jenkins agent disconnecting from the server.
+
+        Pebble restarts the agent service with the same credentials. Configured agent-token pairs
+        are validated again, preferring a pair other than the disconnected one, through the
+        configured endpoint that is healthy.
+
+        Args:
+            agent_name: The name of the agent that disconnected.
+        """
+        if agent_name != self._stored.agent_name:
+            logger.debug("Ignoring disconnection of stale agent %s.", agent_name)
+            return
+        logger.warning("Jenkins agent %s disconnected.", agent_name)
+        metrics.REGISTRY.mark_workload_changed()
+        if self.controller.relation_id is not None:
+            self.charm.unit.status = ops.WaitingStatus("Jenkins agent disconnected, reconnecting.")
+            return
+        self._stored.fingerprint = ""
+        self._stored.disconnected_agent = agent_name
+        self.reconcile(check_health=True)
+
+    def stop_agent(self) -> None:
+        """Stop the Jenkins agent and forget the applied state."""
+        self._stored.fingerprint = ""
+        if not self.container.can_connect():
+            logger.warning("Relation departed before service ready.")
+            return
+        self.pebble_service.stop_agent(container=self.container)
+        metrics.REGISTRY.mark_workload_changed()
+
+
+def reconcile_all(reconcilers: typing.Sequence[Reconciler], check_health: bool = False) -> None:
+    """Reconcile the Jenkins agents of all controllers, the primary controller first.
+
+    The unit status is the status of the first controller agent that is not active. The messages
+    of secondary controllers are prefixed with the controller name, secondary controllers that
+    are up to date are active. The unit is blocked if agent relations are not served since the
+    controllers outnumber the unit executors.
+
+    Args:
+        reconcilers: The reconcilers of the controllers, the primary controller first.
+        check_health: Whether to check the health of the agents that are up to date.
+    """
+    unit = reconcilers[0].charm.unit
+    statuses = []
+    for agent_reconciler in reconcilers:
+        previous_status = unit.status
+        agent_reconciler.reconcile(check_health=check_health)
+        status = unit.status
+        if agent_reconciler.controller.name:
+            if status is previous_status:
+                status = ops.ActiveStatus()
+            elif not isinstance(status, ops.ActiveStatus):
+                status = ops.StatusBase.from_name(
+                    status.name, f"{agent_reconciler.controller.name}: {status.message}"
+                )
+        statuses.append(status)
+    if unserved_relation_ids := reconcilers[0].state.unserved_relation_ids:
+        statuses.insert(
+            0,
+            ops.BlockedStatus(
+                "More controllers than executors, relations "
+                f"{', '.join(map(str, unserved_relation_ids))} not served."
+            ),
+        )
+    unit_status = next(
+        (status for status in statuses if not isinstance(status, ops.ActiveStatus)), statuses[0]
+    )
+    if unit.status != unit_status:
+        unit.status = unit_status
@@ -3,27 +3,80 @@
 
 """Functions to interact with jenkins server."""
 
+import base64
+import binascii
+import hashlib
 import logging
 import random
+import secrets
+import socket
+import ssl
 import time
 import typing
+import urllib.parse
+from dataclasses import dataclass
 from pathlib import Path
 
-import ops
-import requests
-from pydantic import BaseModel
+import io_timing
+import metrics
+import tracing
+
+if typing.TYPE_CHECKING:  # pragma: no cover
+    import pebble
 
 logger = logging.getLogger(__name__)
 
 JENKINS_WORKDIR = Path("/var/lib/jenkins")
 AGENT_JAR_PATH = Path(JENKINS_WORKDIR / "agent.jar")
 AGENT_READY_PATH = Path(JENKINS_WORKDIR / "agents/.ready")
+# The parent of the working directories of the agents of secondary controllers.
+CONTROLLERS_WORKDIR = Path(JENKINS_WORKDIR / "controllers")
 ENTRYSCRIPT_PATH = Path(JENKINS_WORKDIR / "entrypoint.sh")
+VALIDATION_SCRIPT_PATH = Path(JENKINS_WORKDIR / "validate.sh")
+VALIDATION_CANDIDATES_PATH = Path(JENKINS_WORKDIR / "agents/.candidates")
+VALIDATION_RESULT_PATH = Path(JENKINS_WORKDIR / "agents/.validated")
+EXPORTER_SCRIPT_PATH = Path(JENKINS_WORKDIR / "exporter.py")
+BENCHMARK_SCRIPT_PATH = Path(JENKINS_WORKDIR / "benchmark.py")
+DIAGNOSE_SCRIPT_PATH = Path(JENKINS_WORKDIR / "diagnose.py")
+# The working directory of the agent launched to probe the connection, apart from the agent's.
+PROBE_WORKDIR = Path(JENKINS_WORKDIR / "agents/probe")
+CHARM_METRICS_PATH = Path(JENKINS_WORKDIR / "metrics/charm.prom")
+AGENT_STATE_PATH = Path(JENKINS_WORKDIR / "metrics/agent.state")
+HOOK_PROFILE_PATH = Path(JENKINS_WORKDIR / "profiles/slowest-hook.txt")
+JMX_EXPORTER_JAR_PATH = Path(JENKINS_WORKDIR / "jmx_prometheus_javaagent.jar")
+JMX_EXPORTER_CONFIG_PATH = Path(JENKINS_WORKDIR / "jmx-exporter.yaml")
+JFR_REPOSITORY_PATH = Path(JENKINS_WORKDIR / "jfr")
+# The maximum size of the continuous flight recording, older recording chunks are discarded.
+JFR_MAX_SIZE = "64m"
+# The time given to the agent to connect to the server when validating credentials.
+VALIDATION_TIMEOUT_SECONDS = 5
+# The time given to the agent launched to probe the connection to reach the server.
+PROBE_TIMEOUT_SECONDS = 15
+# The agent log messages marking the phases of the connection to the server, by span event name.
+REMOTING_PHASES = {
+    "locating-server": "INFO: Locating server among",
+    "agent-discovery-successful": "INFO: Agent discovery successful",
+    "handshaking": "INFO: Handshaking",
+    "connecting": "INFO: Connecting to",
+    "remote-identity-confirmed": "INFO: Remote identity confirmed",
+    "connected": "INFO: Connected",
+    "terminated": "INFO: Terminated",
+}
+
+# The sources of the agent JAR executable, in the order they are tried.
+AGENT_JAR_SOURCES = ("resource", "mirror", "server")
+
+# The time given to a Jenkins server endpoint to accept a connection when measuring latency.
+ENDPOINT_PROBE_TIMEOUT_SECONDS = 5
+# The active endpoint is kept until its weighted latency is this many times the best endpoint's,
+# so that latency jitter does not restart the agent.
+DEGRADED_LATENCY_FACTOR = 2.0
 
 USER = "_daemon_"
 
 
-class Credentials(BaseModel):
+@dataclass(frozen=True, slots=True)
+class Credentials:
     """The credentials used to register to the Jenkins server.
 
     Attrs:
@@ -35,6 +88,19 @@ class Credentials(BaseModel):
     secret: str
 
 
+@dataclass(frozen=True, slots=True)
+class Endpoint:
+    """A Jenkins server endpoint the agent can register through.
+
+    Attrs:
+        url: The Jenkins server URL address.
+        weight: The preference for the endpoint, its latency is divided by the weight.
+    """
+
+    url: str
+    weight: float = 1.0
+
+
 class ServerBaseError(Exception):
     """Represents errors with interacting with Jenkins server."""
 
@@ -43,32 +109,216 @@ class AgentJarDownloadError(ServerBaseError):
     """Represents an error downloading agent JAR executable."""
 
 
-def download_jenkins_agent(server_url: str, container: ops.Container) -> None:
-    """Download Jenkins agent JAR executable from server.
+class ValidationBudgetExceededError(ServerBaseError):
+    """Represents credentials validation running out of its time budget."""
+
+
+@dataclass(frozen=True, slots=True)
+class AgentJarSources:
+    """The sources of the agent JAR executable tried before the Jenkins server, in order.
+
+    Attrs:
+        resource_path: The agent JAR executable attached as Juju resource, None if not attached.
+        mirror_url: The agent JAR executable URL on a mirror, None if not configured.
+    """
+
+    resource_path: typing.Optional[Path] = None
+    mirror_url: typing.Optional[str] = None
+
+
+@dataclass(frozen=True, slots=True)
+class AgentJarDigest:
+    """The agent JAR executable advertised by the Jenkins server.
+
+    Attrs:
+        size: The size of the agent JAR executable in bytes.
+        sha256: The sha256 hex digest of the agent JAR executable, None if not advertised.
+    """
+
+    size: int
+    sha256: typing.Optional[str] = None
+
+    def matches(self, content: bytes) -> bool:
+        """Check whether an agent JAR executable is the one advertised by the server.
+
+        Args:
+            content: The agent JAR executable.
+
+        Returns:
+            True if the size and, when advertised, the sha256 hex digest match.
+        """
+        if len(content) != self.size:
+            return False
+        return self.sha256 is None or hashlib.sha256(content).hexdigest() == self.sha256
+
+
+def _parse_sha256_digest(headers: typing.Mapping[str, str]) -> typing.Optional[str]:
+    """Parse the sha256 digest of the Repr-Digest (RFC 9530) or Digest (RFC 3230) header.
+
+    Args:
+        headers: The response headers.
+
+    Returns:
+        The sha256 hex digest, None if no header carries a valid sha256 digest.
+    """
+    for header, separator in (("Repr-Digest", "=:"), ("Digest", "=")):
+        for digest in headers.get(header, "").split(","):
+            algorithm, _, value = digest.strip().partition(separator)
+            if algorithm.lower() != "sha-256" or not value:
+                continue
+            try:
+                return base64.b64decode(value.rstrip(":"), validate=True).hex()
+            except binascii.Error:
+                logger.warning("Invalid %s header %r.", header, digest)
+    return None
+
+
+def get_agent_jar_digest(server_url: str) -> typing.Optional[AgentJarDigest]:
+    """Get the agent JAR executable advertised by the server without downloading it.
+
+    Jenkins advertises the size of the agent JAR executable, the sha256 digest is only known when
+    the server, or a proxy in front of it, sets a Repr-Digest or Digest header.
+
+    Args:
+        server_url: The Jenkins server URL address.
+
+    Returns:
+        The advertised agent JAR executable, None if the server could not be reached.
+    """
+    # requests is only imported when a download happens to keep the hook start up time low.
+    import requests  # pylint: disable=import-outside-toplevel
+
+    try:
+        with io_timing.timed(io_timing.HTTP):
+            res = requests.head(
+                f"{server_url}/jnlpJars/agent.jar", timeout=30, allow_redirects=True
+            )
+        res.raise_for_status()
+        size = int(res.headers["Content-Length"])
+    except (requests.RequestException, KeyError, ValueError) as exc:
+        logger.warning("Failed to get agent JAR executable digest from server, %s", exc)
+        return None
+    return AgentJarDigest(size=size, sha256=_parse_sha256_digest(res.headers))
+
+
+def _read_alternative_source(source: str, sources: AgentJarSources) -> typing.Optional[bytes]:
+    """Read the agent JAR executable from a source other than the Jenkins server.
+
+    Args:
+        source: The source name, resource or mirror.
+        sources: The sources of the agent JAR executable.
+
+    Returns:
+        The agent JAR executable, None if the source is not set or failed.
+    """
+    # requests is only imported when a download happens to keep the hook start up time low.
+    import requests  # pylint: disable=import-outside-toplevel
+
+    try:
+        if source == "resource" and sources.resource_path:
+            return sources.resource_path.read_bytes()
+        if source == "mirror" and sources.mirror_url:
+            with io_timing.timed(io_timing.HTTP):
+                res = requests.get(sources.mirror_url, timeout=300)
+            res.raise_for_status()
+            return res.content
+    except (OSError, requests.RequestException) as exc:
+        logger.warning("Failed to read agent JAR executable from %s, %s", source, exc)
+    return None
+
+
+def _download_from_alternative_sources(
+    server_url: str, sources: AgentJarSources
+) -> typing.Tuple[typing.Optional[bytes], str]:
+    """Download the agent JAR executable matching the server digest from the first source.
+
+    Args:
+        server_url: The Jenkins server URL address.
+        sources: The sources of the agent JAR executable.
+
+    Returns:
+        The agent JAR executable and its source, None and server if no source matched.
+    """
+    if not sources.resource_path and not sources.mirror_url:
+        return None, "server"
+    digest = get_agent_jar_digest(server_url)
+    if not digest:
+        logger.warning("Agent JAR executable cannot be verified, downloading from server.")
+        return None, "server"
+    for source in AGENT_JAR_SOURCES[:-1]:
+        content = _read_alternative_source(source, sources)
+        if content is None:
+            continue
+        if digest.matches(content):
+            return content, source
+        logger.warning("Agent JAR executable from %s does not match the server, skipping.", source)
+    return None, "server"
+
+
+@tracing.traced("download_jenkins_agent")
+def download_jenkins_agent(
+    server_url: str,
+    container: "pebble.WorkloadContainer",
+    sources: typing.Optional[AgentJarSources] = None,
+    agent_jar_path: Path = AGENT_JAR_PATH,
+) -> str:
+    """Download Jenkins agent JAR executable.
+
+    The Juju resource and the mirror are tried first, in AGENT_JAR_SOURCES order, and used if
+    they match the agent JAR executable advertised by the server. The server is the last source.
 
     Args:
         server_url: The Jenkins server URL address.
         container: The agent workload container.
+        sources: The sources of the agent JAR executable tried before the server.
+        agent_jar_path: The path to install the agent JAR executable to.
+
+    Returns:
+        The sha256 hex digest of the agent JAR executable.
 
     Raises:
         AgentJarDownloadError: If an error occurred downloading the JAR executable.
     """
+    # requests is only imported when a download happens to keep the hook start up time low.
+    import requests  # pylint: disable=import-outside-toplevel
+
+    download_span = tracing.get_current_span()
+    if download_span:
+        download_span.attributes["server_url"] = server_url
+    start_time = time.monotonic()
     try:
-        res = requests.get(f"{server_url}/jnlpJars/agent.jar", timeout=300)
-        res.raise_for_status()
+        content, source = _download_from_alternative_sources(
+            server_url, sources or AgentJarSources()
+        )
+        if content is None:
+            with io_timing.timed(io_timing.HTTP):
+                res = requests.get(f"{server_url}/jnlpJars/agent.jar", timeout=300)
+            res.raise_for_status()
+            content = res.content
     except (requests.HTTPError, requests.Timeout, requests.ConnectionError) as exc:
         logger.error("Failed to download agent JAR executable from server, %s", exc)
         raise AgentJarDownloadError(
             "Failed to download agent JAR executable from server."
         ) from exc
+    finally:
+        metrics.REGISTRY.observe(
+            "jenkins_agent_jar_download_seconds", time.monotonic() - start_time
+        )
 
-    container.push(path=AGENT_JAR_PATH, make_dirs=True, source=res.content, user=USER)
+    metrics.REGISTRY.inc("jenkins_agent_jar_download_bytes_total", len(content))
+    metrics.REGISTRY.inc("jenkins_agent_jar_downloads_total", source=source)
+    if download_span:
+        download_span.attributes["bytes"] = len(content)
+        download_span.attributes["source"] = source
+    container.push(path=agent_jar_path, make_dirs=True, source=content, user=USER)
+    return hashlib.sha256(content).hexdigest()
 
 
+@tracing.traced("validate_credentials")
 def validate_credentials(
     agent_name: str,
     credentials: Credentials,
-    container: ops.Container,
+    container: "pebble.WorkloadContainer",
     add_random_delay: bool = False,
 ) -> bool:
     """Check if the credentials can be used to register to the server.
@@ -87,7 +337,9 @@ def validate_credentials(
     if add_random_delay:
         # It's okay to use random since it's not used for sensitive data.
         time.sleep(random.random())  # nosec
-    proc: ops.pebble.ExecProcess = container.exec(
+    validation_span = tracing.get_current_span()
+    start_time = time.monotonic()
+    proc = container.exec(
         [
             "java",
             "-jar",
@@ -100,7 +352,7 @@ def validate_credentials(
             "-secret",
             credentials.secret,
         ],
-        timeout=5,
+        timeout=VALIDATION_TIMEOUT_SECONDS,
         user=USER,
         working_dir=str(JENKINS_WORKDIR),
         combine_stderr=True,
@@ -112,19 +364,153 @@ def validate_credentials(
     lines = ""
     # The proc.stdout is iterable according to process.exec documentation
     for line in proc.stdout:  # type: ignore
+        if validation_span:
+            if not lines:
+                validation_span.add_event("first-output")
+            for phase, message in REMOTING_PHASES.items():
+                if message in line:
+                    validation_span.add_event(phase)
         lines += line
         if "INFO: Connected" in line:
             connected = True
         if "INFO: Terminated" in line:
             terminated = True
     logger.debug(lines)
-    return connected and not terminated
+    valid = connected and not terminated
+    if validation_span:
+        validation_span.attributes.update(agent_name=agent_name, valid=valid)
+    metrics.REGISTRY.observe(
+        "jenkins_agent_credentials_validation_seconds",
+        time.monotonic() - start_time,
+        outcome="valid" if valid else "invalid",
+    )
+    return valid
+
+
+@tracing.traced("probe_remoting_handshake")
+def probe_remoting_handshake(
+    server_url: str, agent_name: str, container: "pebble.WorkloadContainer"
+) -> typing.Dict[str, float]:
+    """Time the phases of the connection of an agent to the server, up to the handshake.
+
+    The probe agent presents a random secret rather than the agent secret, so that the server
+    rejects it after the handshake and the agent connection is never taken over, whether the
+    agent is online or not. The probe agent does not reconnect.
+
+    Args:
+        server_url: The Jenkins server URL address.
+        agent_name: The Jenkins agent name.
+        container: The Jenkins agent workload container.
+
+    Returns:
+        The seconds from the agent launch to its first output and to each phase reached, by phase
+        name.
+    """
+    start_time = time.monotonic()
+    proc = container.exec(
+        [
+            "java",
+            "-jar",
+            str(AGENT_JAR_PATH),
+            "-url",
+            server_url,
+            "-name",
+            agent_name,
+            "-workDir",
+            str(PROBE_WORKDIR),
+            "-noReconnect",
+            "-secret",
+            secrets.token_hex(32),
+        ],
+        timeout=PROBE_TIMEOUT_SECONDS,
+        user=USER,
+        working_dir=str(JENKINS_WORKDIR),
+        combine_stderr=True,
+    )
+    phases: typing.Dict[str, float] = {}
+    # The proc.stdout is iterable according to process.exec documentation
+    for line in proc.stdout:  # type: ignore
+        phases.setdefault("first-output", time.monotonic() - start_time)
+        for phase, message in REMOTING_PHASES.items():
+            if message in line:
+                phases.setdefault(phase, time.monotonic() - start_time)
+        logger.debug(line.rstrip())
+    return phases
+
+
+@tracing.traced("measure_endpoint_latency")
+def measure_endpoint_latency(url: str) -> typing.Optional[float]:
+    """Measure the TCP connect and TLS handshake latency to a Jenkins server endpoint.
+
+    Args:
+        url: The Jenkins server URL address.
+
+    Returns:
+        The latency in seconds, None if the endpoint is unhealthy.
+    """
+    parsed_url = urllib.parse.urlparse(url)
+    hostname = parsed_url.hostname or ""
+    port = parsed_url.port or (443 if parsed_url.scheme == "https" else 80)
+    probe_span = tracing.get_current_span()
+    if probe_span:
+        probe_span.attributes["server_url"] = url
+    start_time = time.monotonic()
+    try:
+        with (
+            io_timing.timed(io_timing.HTTP),
+            socket.create_connection(
+                (hostname, port), timeout=ENDPOINT_PROBE_TIMEOUT_SECONDS
+            ) as sock,
+        ):
+            if parsed_url.scheme == "https":
+                with ssl.create_default_context().wrap_socket(sock, server_hostname=hostname):
+                    pass
+    except OSError as exc:
+        logger.warning("Jenkins server endpoint %s is unhealthy, %s", url, exc)
+        return None
+    latency = time.monotonic() - start_time
+    metrics.REGISTRY.set("jenkins_agent_endpoint_latency_seconds", latency, endpoint=url)
+    if probe_span:
+        probe_span.attributes["latency_seconds"] = latency
+    return latency
+
+
+def select_endpoint(endpoints: typing.Sequence[Endpoint], active_url: str) -> str:
+    """Select the healthy endpoint with the lowest weighted latency.
+
+    The active endpoint is kept while it is healthy and not degraded, that is, while its weighted
+    latency is within DEGRADED_LATENCY_FACTOR of the best endpoint's. Ties go to the endpoint
+    listed first.
+
+    Args:
+        endpoints: The Jenkins server endpoints, in order of preference.
+        active_url: The URL of the endpoint the agent is registered through, empty if none.
+
+    Returns:
+        The URL of the selected endpoint, the active or first endpoint if none is healthy.
+    """
+    scores = {}
+    for endpoint in endpoints:
+        latency = measure_endpoint_latency(endpoint.url)
+        if latency is not None:
+            scores[endpoint.url] = latency / endpoint.weight
+    if not scores:
+        logger.warning("No healthy Jenkins server endpoint.")
+        return active_url or endpoints[0].url
+    best_url = min(scores, key=scores.__getitem__)
+    if active_url in scores and scores[active_url] <= DEGRADED_LATENCY_FACTOR * scores[best_url]:
+        return active_url
+    if active_url and active_url != best_url:
+        logger.warning("Failing over from Jenkins server endpoint %s to %s.", active_url, best_url)
+        metrics.REGISTRY.inc("jenkins_agent_endpoint_failovers_total")
+    return best_url
 
 
 def find_valid_credentials(
     agent_name_token_pairs: typing.Iterable[typing.Tuple[str, str]],
     server_url: str,
-    container: ops.Container,
+    container: "pebble.WorkloadContainer",
+    time_budget: typing.Optional[float] = None,
 ) -> typing.Optional[typing.Tuple[str, str]]:
     """Find credentials that can be applied if available.
 
@@ -132,11 +518,21 @@ def find_valid_credentials(
         agent_name_token_pairs: Matching agent name and token pair to check.
         server_url: The jenkins server url address.
         container: The Jenkins agent workload container.
+        time_budget: The time in seconds after which no further pair is validated. No limit if
+            None.
+
+    Raises:
+        ValidationBudgetExceededError: if the time budget ran out before a valid pair was found.
 
     Returns:
         Agent name and token pair that can be used. None if no pair is available.
     """
+    deadline = time.monotonic() + time_budget if time_budget is not None else None
     for agent_name, agent_token in agent_name_token_pairs:
+        if deadline is not None and time.monotonic() >= deadline:
+            raise ValidationBudgetExceededError(
+                f"Credentials validation exceeded its {time_budget}s time budget."
+            )
         logger.debug("Validating %s", agent_name)
         if not validate_credentials(
             agent_name=agent_name,
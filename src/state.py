@@ -3,19 +3,40 @@
 
 """The module for managing charm state."""
 
+import functools
 import logging
+import math
 import os
+import re
+import string
 import typing
-from dataclasses import dataclass
+import urllib.parse
+from dataclasses import dataclass, field, replace
 
 import ops
-from pydantic import AnyHttpUrl, BaseModel, Field, ValidationError, tools
 
+import admission
 import metadata
 import server
+import tracing
 
 # agent relation name
 AGENT_RELATION = "agent"
+# The peer application databag key holding the CPU quantity of the pod template the leader applied.
+APPLIED_CPU_KEY = "applied-cpu"
+# Kubernetes CPU quantities in cores or millicores and memory quantities in bytes with an
+# optional binary or decimal suffix.
+CPU_QUANTITY_PATTERN = re.compile(r"^(?P<value>\d+(\.\d+)?)(?P<milli>m)?$")
+MEMORY_QUANTITY_PATTERN = re.compile(r"^\d+(\.\d+)?([KMGTPE]i?|k)?$")
+POD_ANTI_AFFINITY_MODES = ("", "preferred", "required")
+# The capabilities of the unit the label template may refer to.
+LABEL_TEMPLATE_FIELDS = ("arch", "cores", "memory_gib", "cpu_flags", "storage", "zone")
+TAINT_EFFECTS = ("NoSchedule", "PreferNoSchedule", "NoExecute")
+# Kubernetes label keys, with an optional DNS subdomain prefix, and label values.
+LABEL_KEY_PATTERN = re.compile(
+    r"^([a-z0-9]([-a-z0-9.]*[a-z0-9])?/)?[A-Za-z0-9]([-A-Za-z0-9_.]{0,61}[A-Za-z0-9])?$"
+)
+LABEL_VALUE_PATTERN = re.compile(r"^([A-Za-z0-9]([-A-Za-z0-9_.]{0,61}[A-Za-z0-9])?)?$")
 
 logger = logging.getLogger()
 
@@ -36,23 +57,74 @@ class InvalidStateError(CharmStateBaseError):
         self.msg = msg
 
 
-class JenkinsConfig(BaseModel):
+def _validate_server_url(server_url: str) -> str:
+    """Validate the Jenkins server URL.
+
+    Args:
+        server_url: The Jenkins server URL to validate.
+
+    Raises:
+        ValueError: if the URL is not an absolute http or https URL.
+
+    Returns:
+        The validated Jenkins server URL.
+    """
+    parsed_url = urllib.parse.urlparse(server_url)
+    if parsed_url.scheme not in ("http", "https") or not parsed_url.hostname:
+        raise ValueError(f"Invalid Jenkins server URL {server_url!r}.")
+    return server_url
+
+
+def _parse_server_endpoints(value: str) -> typing.Tuple[server.Endpoint, ...]:
+    """Parse the comma separated Jenkins server endpoints, each a URL and an optional weight.
+
+    Args:
+        value: The Jenkins server endpoints, e.g. "https://jenkins-a 2, https://jenkins-b".
+
+    Raises:
+        ValueError: if a URL is invalid or a weight is not a finite positive number.
+
+    Returns:
+        The Jenkins server endpoints, in configured order.
+    """
+    endpoints = []
+    for entry in value.split(","):
+        url, *weights = entry.split() or [""]
+        weight = float(weights[0]) if weights else 1.0
+        if len(weights) > 1 or not (math.isfinite(weight) and weight > 0):
+            raise ValueError(f"Invalid Jenkins server endpoint {entry.strip()!r}.")
+        endpoints.append(server.Endpoint(url=_validate_server_url(url), weight=weight))
+    return tuple(endpoints)
+
+
+@dataclass
+class JenkinsConfig:
     """The Jenkins config from juju config values.
 
     Attrs:
-        server_url_not_validated: The Jenkins server url, to be validated with pydantic.
-        server_url: The Jenkins server url, to be used by the charm.
+        endpoints: The Jenkins server endpoints, in configured order.
+        server_url: The first Jenkins server url, to be used by the charm.
         agent_name_token_pairs: Jenkins agent names paired with corresponding token value.
+        background_validation: Whether to validate the pairs in the workload container.
     """
 
-    server_url_not_validated: AnyHttpUrl
+    endpoints: typing.Tuple[server.Endpoint, ...]
+    agent_name_token_pairs: typing.List[typing.Tuple[str, str]]
+    background_validation: bool = False
+
+    def __post_init__(self) -> None:
+        """Validate the Jenkins config.
 
-    agent_name_token_pairs: typing.List[typing.Tuple[str, str]] = Field(..., min_items=1)
+        Raises:
+            ValueError: if no agent name and token pair is configured.
+        """
+        if not self.agent_name_token_pairs:
+            raise ValueError("At least one agent name and token pair is required.")
 
     @property
     def server_url(self) -> str:
-        """Convert validated server_url to string."""
-        return str(self.server_url_not_validated)
+        """The first Jenkins server url."""
+        return self.endpoints[0].url
 
     @classmethod
     def from_charm_config(cls, config: ops.ConfigData) -> typing.Optional["JenkinsConfig"]:
@@ -64,7 +136,7 @@ class JenkinsConfig(BaseModel):
         Returns:
             JenkinsConfig if configuration exists, None otherwise.
         """
-        server_url = config.get("jenkins_url")
+        server_url = str(config.get("jenkins_url") or "")
         agent_name_config = str(config.get("jenkins_agent_name"))
         agent_token_config = str(config.get("jenkins_agent_token"))
         # None represents an unset Jenkins configuration values, meaning configuration values from
@@ -75,11 +147,270 @@ class JenkinsConfig(BaseModel):
         agent_tokens = agent_token_config.split(":") if agent_token_config else []
         agent_name_token_pairs = list(zip(agent_names, agent_tokens))
         return cls(
-            server_url_not_validated=tools.parse_obj_as(AnyHttpUrl, server_url) or "",
+            endpoints=_parse_server_endpoints(server_url),
             agent_name_token_pairs=agent_name_token_pairs,
+            background_validation=bool(config.get("background_validation", False)),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class JvmConfig:
+    """The Jenkins agent JVM observability configuration.
+
+    Attrs:
+        metrics_exporter: Whether the JMX exporter serves the JVM runtime metrics.
+        jfr_recording: Whether a continuous Java Flight Recorder recording is running.
+    """
+
+    metrics_exporter: bool = False
+    jfr_recording: bool = False
+
+    @classmethod
+    def from_charm_config(cls, config: ops.ConfigData) -> "JvmConfig":
+        """Instantiate JvmConfig from charm config.
+
+        Args:
+            config: Charm configuration data.
+
+        Returns:
+            The JVM observability configuration.
+        """
+        return cls(
+            metrics_exporter=bool(config.get("jvm_metrics_exporter", False)),
+            jfr_recording=bool(config.get("jfr_recording", False)),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class ResourceConfig:
+    """The Kubernetes compute resources of the workload container.
+
+    Attrs:
+        cpu: The CPU quantity requested, e.g. "2" or "500m", None if unset.
+        memory: The memory quantity requested, e.g. "4Gi", None if unset.
+        guaranteed_qos: Whether the limits equal the requests for the Guaranteed QoS class.
+        cpu_cores: The number of CPU cores requested, None if unset.
+        requests: The resource requests of the workload container.
+        limits: The resource limits of the workload container.
+    """
+
+    cpu: typing.Optional[str] = None
+    memory: typing.Optional[str] = None
+    guaranteed_qos: bool = False
+
+    def __post_init__(self) -> None:
+        """Validate the resource quantities.
+
+        Raises:
+            ValueError: if a quantity is invalid or the Guaranteed QoS class is requested without
+                both a CPU and a memory quantity.
+        """
+        if self.cpu is not None and not CPU_QUANTITY_PATTERN.match(self.cpu):
+            raise ValueError(f"Invalid CPU quantity {self.cpu!r}.")
+        if self.memory is not None and not MEMORY_QUANTITY_PATTERN.match(self.memory):
+            raise ValueError(f"Invalid memory quantity {self.memory!r}.")
+        if self.guaranteed_qos and (self.cpu is None or self.memory is None):
+            raise ValueError("Guaranteed QoS requires both a CPU and a memory quantity.")
+
+    @property
+    def cpu_cores(self) -> typing.Optional[float]:
+        """The number of CPU cores requested, None if unset."""
+        match = CPU_QUANTITY_PATTERN.match(self.cpu or "")
+        if not match:
+            return None
+        value = float(match.group("value"))
+        return value / 1000 if match.group("milli") else value
+
+    @property
+    def requests(self) -> typing.Dict[str, str]:
+        """The resource requests of the workload container."""
+        return {
+            name: quantity
+            for name, quantity in (("cpu", self.cpu), ("memory", self.memory))
+            if quantity is not None
+        }
+
+    @property
+    def limits(self) -> typing.Dict[str, str]:
+        """The resource limits of the workload container.
+
+        Limits are only set for the Guaranteed QoS class so that agents may otherwise burst
+        above their CPU request rather than being throttled.
+        """
+        return self.requests if self.guaranteed_qos else {}
+
+    @classmethod
+    def from_charm_config(cls, config: ops.ConfigData) -> "ResourceConfig":
+        """Instantiate ResourceConfig from charm config.
+
+        Args:
+            config: Charm configuration data.
+
+        Returns:
+            The workload container compute resources.
+        """
+        return cls(
+            cpu=str(config.get("cpu") or "") or None,
+            memory=str(config.get("memory") or "") or None,
+            guaranteed_qos=bool(config.get("guaranteed_qos", False)),
+        )
+
+
+def _get_applied_cpu_cores(charm: ops.CharmBase) -> typing.Optional[float]:
+    """Get the CPU cores requested by the pod template the leader applied.
+
+    Args:
+        charm: The root k8s Jenkins agent charm.
+
+    Returns:
+        The CPU cores of the workload container, None if unset or not applied yet.
+    """
+    relation = charm.model.get_relation(admission.PEER_RELATION)
+    if not relation:
+        return None
+    try:
+        return ResourceConfig(cpu=relation.data[charm.app].get(APPLIED_CPU_KEY) or None).cpu_cores
+    except ValueError as exc:
+        logging.warning("Invalid applied CPU quantity, %s", exc)
+        return None
+
+
+def _parse_node_selector(value: str) -> typing.Dict[str, str]:
+    """Parse the comma separated node labels of the node selector.
+
+    Args:
+        value: The node labels, e.g. "pool=builds,disk=nvme".
+
+    Raises:
+        ValueError: if a node label is not a valid key=value pair.
+
+    Returns:
+        The node labels by key.
+    """
+    node_selector = {}
+    for entry in filter(None, (entry.strip() for entry in value.split(","))):
+        key, equals, label_value = entry.partition("=")
+        if (
+            not equals
+            or not LABEL_KEY_PATTERN.match(key)
+            or not LABEL_VALUE_PATTERN.match(label_value)
+        ):
+            raise ValueError(f"Invalid node label {entry!r}.")
+        node_selector[key] = label_value
+    return node_selector
+
+
+@dataclass(frozen=True, slots=True)
+class Toleration:
+    """A toleration of a node taint.
+
+    Attrs:
+        key: The taint key.
+        value: The taint value, None to tolerate any value.
+        effect: The taint effect, None to tolerate any effect.
+    """
+
+    key: str
+    value: typing.Optional[str] = None
+    effect: typing.Optional[str] = None
+
+    @classmethod
+    def from_string(cls, value: str) -> "Toleration":
+        """Parse a toleration in the kubectl taint notation.
+
+        Args:
+            value: The toleration, e.g. "dedicated=builds:NoSchedule" or "gpu".
+
+        Raises:
+            ValueError: if the toleration is invalid.
+
+        Returns:
+            The toleration.
+        """
+        taint, _, effect = value.partition(":")
+        key, equals, taint_value = taint.partition("=")
+        if (
+            not LABEL_KEY_PATTERN.match(key)
+            or not LABEL_VALUE_PATTERN.match(taint_value)
+            or (effect and effect not in TAINT_EFFECTS)
+        ):
+            raise ValueError(f"Invalid toleration {value!r}.")
+        return cls(key=key, value=taint_value if equals else None, effect=effect or None)
+
+
+@dataclass(frozen=True)
+class SchedulingConfig:
+    """The Kubernetes scheduling constraints of the unit pods.
+
+    Attrs:
+        pod_anti_affinity: Whether units avoid the nodes of other units, "preferred" or
+            "required", empty for no anti-affinity.
+        zone_spread: Whether units are spread evenly across zones.
+        node_selector: The labels of the nodes units may run on.
+        tolerations: The node taints units tolerate.
+    """
+
+    pod_anti_affinity: str = ""
+    zone_spread: bool = False
+    node_selector: typing.Dict[str, str] = field(default_factory=dict)
+    tolerations: typing.Tuple[Toleration, ...] = ()
+
+    def __post_init__(self) -> None:
+        """Validate the scheduling constraints.
+
+        Raises:
+            ValueError: if the pod anti-affinity mode is unknown.
+        """
+        if self.pod_anti_affinity not in POD_ANTI_AFFINITY_MODES:
+            raise ValueError(f"Invalid pod anti-affinity {self.pod_anti_affinity!r}.")
+
+    @classmethod
+    def from_charm_config(cls, config: ops.ConfigData) -> "SchedulingConfig":
+        """Instantiate SchedulingConfig from charm config.
+
+        Args:
+            config: Charm configuration data.
+
+        Returns:
+            The scheduling constraints of the unit pods.
+        """
+        return cls(
+            pod_anti_affinity=str(config.get("pod_anti_affinity") or ""),
+            zone_spread=bool(config.get("zone_spread", False)),
+            node_selector=_parse_node_selector(str(config.get("node_selector") or "")),
+            tolerations=tuple(
+                Toleration.from_string(entry.strip())
+                for entry in str(config.get("tolerations") or "").split(",")
+                if entry.strip()
+            ),
         )
 
 
+def _validate_label_template(template: str) -> str:
+    """Validate the template of the capability labels.
+
+    Args:
+        template: The comma separated label templates, e.g. "cores-{cores},zone-{zone}".
+
+    Raises:
+        ValueError: if the template is malformed or refers to an unknown capability.
+
+    Returns:
+        The validated template.
+    """
+    fields = list(string.Formatter().parse(template))
+    unknown_fields = [
+        field_name
+        for _, field_name, _, _ in fields
+        if field_name not in (None, *LABEL_TEMPLATE_FIELDS)
+    ]
+    if unknown_fields:
+        raise ValueError(f"Unknown label template capabilities {unknown_fields}.")
+    if any(format_spec or conversion for _, _, format_spec, conversion in fields):
+        raise ValueError("Label template fields take no format specification or conversion.")
+    return template
+
+
 def _get_jenkins_unit(
     all_units: typing.Set[ops.Unit], current_app_name: str
 ) -> typing.Optional[ops.Unit]:
@@ -120,24 +451,231 @@ def _get_credentials_from_agent_relation(
     return server.Credentials(address=address, secret=secret)
 
 
+@dataclass(frozen=True, slots=True)
+class Controller:
+    """A Jenkins controller the agent registers to.
+
+    Attrs:
+        name: The controller name, empty for the primary controller.
+        relation_id: The agent relation ID, None for the configured controller.
+        num_executors: The share of the unit executors the controller gets.
+    """
+
+    name: str
+    relation_id: typing.Optional[int]
+    num_executors: int
+
+
 @dataclass
-class State:
+class State:  # pylint: disable=too-many-instance-attributes
     """The k8s Jenkins agent state.
 
+    The agent relation databags are only read from the relation when first accessed and are
+    memoized for the rest of the hook.
+
     Attrs:
         agent_meta: The Jenkins agent metadata to register on Jenkins server.
         jenkins_config: Jenkins configuration value from juju config.
-        agent_relation_credentials: The full set of credentials from the agent relation. None if
-            partial data is set or the credentials do not belong to current agent.
+        controllers: The Jenkins controllers to register to, the primary controller first.
+        agent_relation_credentials: The full set of credentials from the primary agent relation.
+            None if partial data is set or the credentials do not belong to current agent.
+        agent_relation_server_url: The Jenkins server URL from the primary agent relation,
+            available before the credentials of this agent.
+        jvm_config: The Jenkins agent JVM observability configuration.
+        agent_jar_mirror_url: The agent JAR executable URL on a mirror, tried before the Jenkins
+            server.
+        resources: The Kubernetes compute resources of the workload container.
+        scheduling: The Kubernetes scheduling constraints of the unit pods.
+        label_template: The template of the labels generated from the unit capabilities.
+        capability_labels: The labels generated from the detected unit capabilities, advertised
+            next to the configured labels.
+        publish_performance_tier: Whether to advertise the performance tier label of the last
+            benchmark.
+        performance_tier_label: The performance tier label of the last benchmark, empty if not
+            advertised.
         jenkins_agent_service_name: The Jenkins agent workload container name.
     """
 
     agent_meta: metadata.Agent
     jenkins_config: typing.Optional[JenkinsConfig]
-    agent_relation_credentials: typing.Optional[server.Credentials]
+    _charm: ops.CharmBase = field(repr=False, compare=False)
+    jvm_config: JvmConfig = JvmConfig()
+    agent_jar_mirror_url: typing.Optional[str] = None
+    resources: ResourceConfig = ResourceConfig()
+    scheduling: SchedulingConfig = SchedulingConfig()
+    label_template: str = ""
+    capability_labels: typing.Tuple[str, ...] = ()
+    publish_performance_tier: bool = False
+    performance_tier_label: str = ""
     jenkins_agent_service_name: str = "jenkins-agent-k8s"
+    _agent_relation_jenkins_databags: typing.Dict[
+        int, typing.Optional[ops.RelationDataContent]
+    ] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    @functools.cached_property
+    def _controller_relation_ids(self) -> typing.Dict[str, typing.Optional[int]]:
+        """The agent relation IDs of the Jenkins controllers by controller name.
+
+        The primary controller is the configured one, or the agent relation with the lowest ID
+        when there is no configuration. The other agent relations are secondary controllers.
+
+        Returns:
+            The agent relation ID of each controller, the primary controller first.
+        """
+        relation_ids = sorted(
+            relation.id for relation in self._charm.model.relations[AGENT_RELATION]
+        )
+        primary_relation_id = (
+            None if self.jenkins_config or not relation_ids else relation_ids.pop(0)
+        )
+        return {
+            "": primary_relation_id,
+            **{f"agent-{relation_id}": relation_id for relation_id in relation_ids},
+        }
+
+    @functools.cached_property
+    def controllers(self) -> typing.Tuple[Controller, ...]:
+        """The Jenkins controllers to register to, the primary controller first.
+
+        The unit executors are split evenly across the controllers. Each controller gets at least
+        one executor, the agent relations in excess of the unit executors are not served.
+
+        Returns:
+            The Jenkins controllers.
+        """
+        served = list(self._controller_relation_ids.items())[
+            : max(self.agent_meta.num_executors, 1)
+        ]
+        share, remainder = divmod(self.agent_meta.num_executors, len(served))
+        return tuple(
+            Controller(
+                name=name,
+                relation_id=relation_id,
+                num_executors=max(share + (index < remainder), 1),
+            )
+            for index, (name, relation_id) in enumerate(served)
+        )
+
+    @property
+    def unserved_relation_ids(self) -> typing.Tuple[int, ...]:
+        """The agent relation IDs not served since the controllers outnumber the executors."""
+        served = {controller.relation_id for controller in self.controllers}
+        return tuple(
+            relation_id
+            for relation_id in self._controller_relation_ids.values()
+            if relation_id is not None and relation_id not in served
+        )
+
+    def get_agent_meta(self, relation_id: int) -> metadata.Agent:
+        """Get the agent metadata to publish to an agent relation.
+
+        Args:
+            relation_id: The agent relation ID.
+
+        Returns:
+            The agent metadata, with the executors share of the controller of the relation, the
+            capability labels and the performance tier label.
+        """
+        controller = next(
+            (
+                controller
+                for controller in self.controllers
+                if controller.relation_id == relation_id
+            ),
+            None,
+        )
+        labels = self.agent_meta.labels.split(",")
+        generated_labels = (*self.capability_labels, self.performance_tier_label)
+        labels.extend(label for label in generated_labels if label and label not in labels)
+        return replace(
+            self.agent_meta,
+            num_executors=(
+                controller.num_executors if controller else self.agent_meta.num_executors
+            ),
+            labels=",".join(labels),
+        )
+
+    def _get_agent_relation_jenkins_databag(
+        self, relation_id: typing.Optional[int]
+    ) -> typing.Optional[ops.RelationDataContent]:
+        """Get the Jenkins server unit databag of an agent relation.
+
+        Args:
+            relation_id: The agent relation ID.
+
+        Returns:
+            The Jenkins server unit databag, None if there is no agent relation or server unit.
+        """
+        if relation_id is None:
+            return None
+        if relation_id not in self._agent_relation_jenkins_databags:
+            agent_relation = self._charm.model.get_relation(AGENT_RELATION, relation_id)
+            agent_relation_jenkins_unit = (
+                _get_jenkins_unit(agent_relation.units, self._charm.app.name)
+                if agent_relation
+                else None
+            )
+            self._agent_relation_jenkins_databags[relation_id] = (
+                agent_relation.data[agent_relation_jenkins_unit]
+                if agent_relation and agent_relation_jenkins_unit
+                else None
+            )
+        return self._agent_relation_jenkins_databags[relation_id]
+
+    def get_agent_relation_credentials(
+        self, relation_id: typing.Optional[int]
+    ) -> typing.Optional[server.Credentials]:
+        """Read the agent registration credentials from an agent relation.
+
+        Args:
+            relation_id: The agent relation ID.
+
+        Returns:
+            The credentials of this agent if complete values(url, secret) are set. None otherwise.
+        """
+        databag = self._get_agent_relation_jenkins_databag(relation_id)
+        if databag is None:
+            return None
+        return _get_credentials_from_agent_relation(databag, self.agent_meta.name)
+
+    def get_agent_relation_server_url(
+        self, relation_id: typing.Optional[int]
+    ) -> typing.Optional[str]:
+        """Read the Jenkins server URL from an agent relation.
+
+        The URL is set by the server before the secret of this agent.
+
+        Args:
+            relation_id: The agent relation ID.
+
+        Returns:
+            The Jenkins server URL if set. None otherwise.
+        """
+        databag = self._get_agent_relation_jenkins_databag(relation_id)
+        if databag is None:
+            return None
+        return databag.get("url") or None
+
+    @property
+    def agent_relation_credentials(self) -> typing.Optional[server.Credentials]:
+        """Read the agent registration credentials from the primary agent relation.
+
+        Returns:
+            The credentials of this agent if complete values(url, secret) are set. None otherwise.
+        """
+        return self.get_agent_relation_credentials(self.controllers[0].relation_id)
+
+    @property
+    def agent_relation_server_url(self) -> typing.Optional[str]:
+        """Read the Jenkins server URL from the primary agent relation.
+
+        Returns:
+            The Jenkins server URL if set. None otherwise.
+        """
+        return self.get_agent_relation_server_url(self.controllers[0].relation_id)
 
     @classmethod
+    @tracing.traced("State.from_charm")
     def from_charm(cls, charm: ops.CharmBase) -> "State":
         """Initialize the state from charm.
 
@@ -150,33 +688,56 @@ class State:
         Returns:
             Current state of k8s Jenkins agent.
         """
+        try:
+            resources = ResourceConfig.from_charm_config(charm.config)
+            scheduling = SchedulingConfig.from_charm_config(charm.config)
+        except ValueError as exc:
+            logging.error("Invalid pod config values, %s", exc)
+            raise InvalidStateError("Invalid pod config values.") from exc
+
+        # The executors match the CPU cores requested by the applied pod template so that the
+        # Jenkins capacity matches the Kubernetes scheduling, a fraction of a core still runs one
+        # executor. The configured CPU quantity is not used since the pod template patch may fail.
+        cpu_cores = _get_applied_cpu_cores(charm)
         try:
             agent_meta = metadata.Agent(
-                num_executors=os.cpu_count() or 0,
-                labels=charm.model.config.get("jenkins_agent_labels", "") or os.uname().machine,
+                num_executors=(
+                    max(math.floor(cpu_cores), 1) if cpu_cores else os.cpu_count() or 0
+                ),
+                labels=str(
+                    charm.model.config.get("jenkins_agent_labels", "") or os.uname().machine
+                ),
                 name=charm.unit.name.replace("/", "-"),
             )
-        except ValidationError as exc:
-            logging.error("Invalid executor state, %s", exc)
-            raise InvalidStateError("Invalid executor state.") from exc
+            label_template = _validate_label_template(
+                str(charm.config.get("jenkins_agent_label_template") or "")
+            )
+        except ValueError as exc:
+            logging.error("Invalid agent metadata, %s", exc)
+            raise InvalidStateError("Invalid agent metadata.") from exc
 
         try:
             jenkins_config = JenkinsConfig.from_charm_config(charm.config)
-        except ValidationError as exc:
+        except ValueError as exc:
             logging.error("Invalid jenkins config values, %s", exc)
             raise InvalidStateError("Invalid jenkins config values.") from exc
 
-        agent_relation = charm.model.get_relation(AGENT_RELATION)
-        agent_relation_credentials: typing.Optional[server.Credentials] = None
-        if agent_relation and (
-            agent_relation_jenkins_unit := _get_jenkins_unit(agent_relation.units, charm.app.name)
-        ):
-            agent_relation_credentials = _get_credentials_from_agent_relation(
-                agent_relation.data[agent_relation_jenkins_unit], agent_meta.name
-            )
+        agent_jar_mirror_url = str(charm.config.get("agent_jar_mirror_url") or "") or None
+        try:
+            if agent_jar_mirror_url:
+                _validate_server_url(agent_jar_mirror_url)
+        except ValueError as exc:
+            logging.error("Invalid agent JAR mirror URL, %s", exc)
+            raise InvalidStateError("Invalid agent JAR mirror URL.") from exc
 
         return cls(
             agent_meta=agent_meta,
             jenkins_config=jenkins_config,
-            agent_relation_credentials=agent_relation_credentials,
+            _charm=charm,
+            jvm_config=JvmConfig.from_charm_config(charm.config),
+            agent_jar_mirror_url=agent_jar_mirror_url,
+            resources=resources,
+            scheduling=scheduling,
+            label_template=label_template,
+            publish_performance_tier=bool(charm.config.get("publish_performance_tier")),
         )
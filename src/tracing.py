@@ -0,0 +1,378 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""The charm tracing module.
+
+Spans are recorded within a hook and exported at its end in the OTLP JSON encoding to the
+OTLP/HTTP receiver of the collector related over the tracing relation. The export is sent by a
+detached process, so that a slow or unreachable collector cannot stall the hook. When no
+collector is related, the spans are written to a local JSONL file if enabled in the
+configuration.
+"""
+
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import time
+import typing
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import ops
+
+logger = logging.getLogger(__name__)
+
+TRACING_RELATION = "tracing"
+# The receiver protocol requested from the collector over the tracing relation.
+OTLP_HTTP_PROTOCOL = "otlp_http"
+TRACES_FILE_CONFIG = "tracing_traces_file"
+TRACES_PATH = Path("/var/log/jenkins-agent-k8s/traces.jsonl")
+# The size after which the local traces file is rotated.
+TRACES_MAX_BYTES = 5 * 1024 * 1024
+EXPORT_TIMEOUT_SECONDS = 5
+SERVICE_NAME = "jenkins-agent-k8s"
+
+# The OTLP span status code of a span that raised an exception.
+_STATUS_CODE_ERROR = 2
+# The OTLP span kind of a span internal to the charm.
+_SPAN_KIND_INTERNAL = 1
+
+
+@dataclass(slots=True)
+class Span:  # pylint: disable=too-many-instance-attributes
+    """A unit of work within a hook.
+
+    Attrs:
+        name: The span name.
+        trace_id: The hex identifier of the trace, shared by the spans of a hook.
+        span_id: The hex identifier of the span.
+        parent_span_id: The hex identifier of the enclosing span, empty for root spans.
+        start_time_ns: The start time, in nanoseconds since the epoch.
+        end_time_ns: The end time, in nanoseconds since the epoch.
+        attributes: The span attributes.
+        events: The names and times, in nanoseconds since the epoch, of the span events.
+        error: Whether the span raised an exception.
+    """
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: str
+    start_time_ns: int
+    end_time_ns: int = 0
+    attributes: typing.Dict[str, typing.Union[str, int, float, bool]] = field(default_factory=dict)
+    events: typing.List[typing.Tuple[str, int]] = field(default_factory=list)
+    error: bool = False
+
+    def add_event(self, name: str) -> None:
+        """Record an event at the current time.
+
+        Args:
+            name: The event name.
+        """
+        self.events.append((name, time.time_ns()))
+
+    def to_otlp(self) -> typing.Dict[str, typing.Any]:
+        """Encode the span in the OTLP JSON encoding.
+
+        Returns:
+            The OTLP span.
+        """
+        otlp_span: typing.Dict[str, typing.Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": _SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns),
+            "attributes": _encode_attributes(self.attributes),
+            "events": [
+                {"name": name, "timeUnixNano": str(time_ns)} for name, time_ns in self.events
+            ],
+        }
+        if self.parent_span_id:
+            otlp_span["parentSpanId"] = self.parent_span_id
+        if self.error:
+            otlp_span["status"] = {"code": _STATUS_CODE_ERROR}
+        return otlp_span
+
+
+def _encode_attributes(
+    attributes: typing.Mapping[str, typing.Union[str, int, float, bool]],
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    """Encode attributes in the OTLP JSON encoding.
+
+    Args:
+        attributes: The attribute values, by key.
+
+    Returns:
+        The OTLP key values.
+    """
+    encoded = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            encoded_value: typing.Dict[str, typing.Any] = {"boolValue": value}
+        elif isinstance(value, int):
+            encoded_value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            encoded_value = {"doubleValue": value}
+        else:
+            encoded_value = {"stringValue": str(value)}
+        encoded.append({"key": key, "value": encoded_value})
+    return encoded
+
+
+Function = typing.TypeVar("Function", bound=typing.Callable[..., typing.Any])
+
+# The spans of the running hook, ended spans are exported at the end of the hook.
+SPANS: typing.List[Span] = []
+_TRACE_ID = os.urandom(16).hex()
+_active_spans: typing.List[Span] = []
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: typing.Union[str, int, float, bool]) -> typing.Iterator[Span]:
+    """Record a span around a unit of work.
+
+    Spans started within the span are its children.
+
+    Args:
+        name: The span name.
+        attributes: The span attributes.
+
+    Yields:
+        The span, to add attributes and events to.
+    """
+    current = Span(
+        name=name,
+        trace_id=_TRACE_ID,
+        span_id=os.urandom(8).hex(),
+        parent_span_id=_active_spans[-1].span_id if _active_spans else "",
+        start_time_ns=time.time_ns(),
+        attributes=dict(attributes),
+    )
+    _active_spans.append(current)
+    try:
+        yield current
+    except Exception:
+        current.error = True
+        raise
+    finally:
+        current.end_time_ns = time.time_ns()
+        _active_spans.remove(current)
+        SPANS.append(current)
+
+
+def traced(name: str) -> typing.Callable[[Function], Function]:
+    """Record a span around each call of the decorated function.
+
+    Args:
+        name: The span name.
+
+    Returns:
+        The decorator.
+    """
+
+    def decorator(function: Function) -> Function:
+        """Wrap the function in a span.
+
+        Args:
+            function: The function to trace.
+
+        Returns:
+            The traced function.
+        """
+
+        @functools.wraps(function)
+        def wrapper(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+            """Call the function within a span.
+
+            Args:
+                args: The positional arguments of the function.
+                kwargs: The keyword arguments of the function.
+
+            Returns:
+                The result of the function.
+            """
+            with span(name):
+                return function(*args, **kwargs)
+
+        return typing.cast(Function, wrapper)
+
+    return decorator
+
+
+def get_current_span() -> typing.Optional[Span]:
+    """Get the innermost span being recorded.
+
+    Returns:
+        The current span, None outside of any span.
+    """
+    return _active_spans[-1] if _active_spans else None
+
+
+def _export_otlp(endpoint: str, resource_spans: typing.Dict[str, typing.Any]) -> None:
+    """Export the spans to an OTLP/HTTP collector.
+
+    Args:
+        endpoint: The OTLP/HTTP collector base URL.
+        resource_spans: The spans in the OTLP JSON encoding.
+    """
+    # urllib is only imported when exporting to keep the hook start up time low.
+    import urllib.request  # pylint: disable=import-outside-toplevel
+
+    request = urllib.request.Request(
+        f"{endpoint.rstrip('/')}/v1/traces",
+        data=json.dumps(resource_spans).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=EXPORT_TIMEOUT_SECONDS):  # nosec
+        pass
+
+
+def _start_export(endpoint: str, resource_spans: typing.Dict[str, typing.Any]) -> None:
+    """Export the spans to an OTLP/HTTP collector in a detached process.
+
+    The hook does not wait for the process, which outlives it.
+
+    Args:
+        endpoint: The OTLP/HTTP collector base URL.
+        resource_spans: The spans in the OTLP JSON encoding.
+    """
+    # subprocess and tempfile are only imported when exporting to keep the hook start up time low.
+    import subprocess  # nosec # pylint: disable=import-outside-toplevel
+    import tempfile  # pylint: disable=import-outside-toplevel
+
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", prefix="traces-", suffix=".json", delete=False
+    ) as spans_file:
+        json.dump(resource_spans, spans_file)
+    subprocess.Popen(  # nosec # pylint: disable=consider-using-with
+        [sys.executable, __file__, endpoint, spans_file.name],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def _write_jsonl(otlp_spans: typing.Iterable[typing.Dict[str, typing.Any]]) -> None:
+    """Append the spans to the local traces file, one span per line.
+
+    Args:
+        otlp_spans: The spans in the OTLP JSON encoding.
+    """
+    TRACES_PATH.parent.mkdir(parents=True, exist_ok=True)
+    if TRACES_PATH.exists() and TRACES_PATH.stat().st_size > TRACES_MAX_BYTES:
+        TRACES_PATH.replace(TRACES_PATH.with_suffix(".jsonl.1"))
+    with TRACES_PATH.open("a", encoding="utf-8") as traces_file:
+        for otlp_span in otlp_spans:
+            traces_file.write(f"{json.dumps(otlp_span)}\n")
+
+
+def _get_receiver_url(relation: ops.Relation) -> str:
+    """Get the URL of the OTLP/HTTP receiver the collector published on the tracing relation.
+
+    Args:
+        relation: The tracing relation.
+
+    Returns:
+        The receiver URL, empty if the collector has not published it.
+    """
+    if not relation.app:
+        return ""
+    try:
+        receivers = json.loads(relation.data[relation.app].get("receivers", "[]"))
+        return next(
+            (
+                str(receiver["url"])
+                for receiver in receivers
+                if receiver["protocol"]["name"] == OTLP_HTTP_PROTOCOL
+            ),
+            "",
+        )
+    except (KeyError, TypeError, ValueError) as exc:
+        logger.warning("Invalid tracing receivers, %s", exc)
+        return ""
+
+
+class Observer(ops.Object):
+    """The tracing observer, exporting the spans of each hook."""
+
+    def __init__(self, charm: ops.CharmBase):
+        """Initialize the observer and register event handlers.
+
+        Args:
+            charm: The parent charm to attach the observer to.
+        """
+        super().__init__(charm, "tracing-observer")
+        self.charm = charm
+
+        charm.framework.observe(
+            charm.on[TRACING_RELATION].relation_created, self._on_tracing_relation_changed
+        )
+        charm.framework.observe(charm.on.leader_elected, self._on_tracing_relation_changed)
+        charm.framework.observe(charm.framework.on.pre_commit, self._on_pre_commit)
+
+    def _on_tracing_relation_changed(self, _: ops.HookEvent) -> None:
+        """Request an OTLP/HTTP receiver from the related collector."""
+        relation = self.charm.model.get_relation(TRACING_RELATION)
+        if not relation or not self.charm.unit.is_leader():
+            return
+        receivers = json.dumps([OTLP_HTTP_PROTOCOL])
+        if relation.data[self.charm.app].get("receivers") != receivers:
+            relation.data[self.charm.app]["receivers"] = receivers
+
+    def _on_pre_commit(self, _: ops.PreCommitEvent) -> None:
+        """Export the spans recorded within the hook."""
+        if not SPANS:
+            return
+        otlp_spans = [recorded.to_otlp() for recorded in SPANS]
+        SPANS.clear()
+        resource_attributes = {"service.name": SERVICE_NAME, "juju.unit": self.charm.unit.name}
+        relation = self.charm.model.get_relation(TRACING_RELATION)
+        if relation:
+            endpoint = _get_receiver_url(relation)
+            if not endpoint:
+                logger.debug("Tracing receiver not published yet, spans dropped.")
+                return
+            resource_spans = {
+                "resourceSpans": [
+                    {
+                        "resource": {"attributes": _encode_attributes(resource_attributes)},
+                        "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": otlp_spans}],
+                    }
+                ]
+            }
+            try:
+                _start_export(endpoint, resource_spans)
+            except OSError as exc:
+                logger.warning("Failed to export spans to %s, %s", endpoint, exc)
+            return
+        if not self.charm.config.get(TRACES_FILE_CONFIG):
+            return
+        try:
+            _write_jsonl(
+                {**otlp_span, "resource": resource_attributes} for otlp_span in otlp_spans
+            )
+        except OSError as exc:
+            logger.warning("Failed to write spans to %s, %s", TRACES_PATH, exc)
+
+
+def main() -> None:
+    """Export the spans of a hook, written to a file by the charm, to an OTLP/HTTP collector."""
+    endpoint, spans_path = sys.argv[1:3]
+    try:
+        with open(spans_path, encoding="utf-8") as spans_file:
+            resource_spans = json.load(spans_file)
+        _export_otlp(endpoint, resource_spans)
+    finally:
+        os.remove(spans_path)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,297 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Fixtures for jenkins-agent-k8s charm hook benchmarks.
+
+Pebble and network calls are charged to a simulated clock instead of sleeping, so that the
+simulated cost of a hook is deterministic and comparable against the committed baseline.
+"""
+
+import functools
+import json
+import os
+import typing
+from dataclasses import dataclass
+from pathlib import Path
+
+import pytest
+import requests
+import yaml
+from ops.testing import ExecArgs, ExecResult, Harness
+
+try:
+    from ops._private.harness import _TestingPebbleClient
+except ImportError:  # pragma: no cover
+    from ops.testing import _TestingPebbleClient  # type: ignore
+
+from charm import JenkinsAgentCharm
+
+CONTAINER_NAME = "jenkins-agent-k8s"
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+# The relative increase of a simulated measure over its baseline that fails the benchmark.
+BASELINE_TOLERANCE = 0.1
+UPDATE_BASELINE_ENV = "UPDATE_BENCHMARK_BASELINE"
+ROUNDS = 3
+
+PEER_RELATIONS = list(
+    yaml.safe_load((Path(__file__).parents[2] / "metadata.yaml").read_text(encoding="utf-8")).get(
+        "peers", {}
+    )
+)
+# The number of units of the application, only relevant once the charm has a peer relation.
+PEER_UNIT_COUNTS = (1, 3, 10) if PEER_RELATIONS else (1,)
+
+# The simulated latency in seconds of Pebble API calls, by client method.
+PEBBLE_LATENCIES = {
+    "add_layer": 0.01,
+    "exec": 0.05,
+    "get_checks": 0.005,
+    "get_plan": 0.005,
+    "get_services": 0.005,
+    "get_system_info": 0.005,
+    "list_files": 0.005,
+    "make_dir": 0.005,
+    "notify": 0.005,
+    "pull": 0.01,
+    "push": 0.02,
+    "remove_path": 0.005,
+    "replan_services": 0.5,
+    "restart_services": 0.6,
+    "start_services": 0.3,
+    "stop_services": 0.3,
+}
+PUSH_SECONDS_PER_MIB = 0.01
+JAR_SIZE_BYTES = 1_400_000
+JAR_DOWNLOAD_SECONDS = 1.5
+# The time for the agent to connect with valid credentials, invalid ones run until the timeout.
+CONNECTION_SECONDS = 2.5
+CONNECTION_LOG = "INFO: Setting up agent\nINFO: Handshaking\nINFO: Connected\n"
+
+
+@dataclass
+class SimulatedClock:
+    """The simulated time spent in Pebble and network calls.
+
+    Attrs:
+        seconds: The simulated time in seconds.
+        pebble_calls: The number of Pebble API calls.
+    """
+
+    seconds: float = 0.0
+    pebble_calls: int = 0
+
+    def charge(self, seconds: float) -> None:
+        """Advance the simulated time.
+
+        Args:
+            seconds: The simulated duration of a call.
+        """
+        self.seconds += seconds
+
+    def reset(self) -> None:
+        """Restart the simulated time."""
+        self.seconds = 0.0
+        self.pebble_calls = 0
+
+
+class FakeResponse:  # pylint: disable=too-few-public-methods
+    """The agent JAR download response.
+
+    Attrs:
+        content: The agent JAR executable.
+    """
+
+    content = b"0" * JAR_SIZE_BYTES
+
+    def raise_for_status(self) -> None:
+        """Accept the response."""
+
+
+@pytest.fixture(name="simulated_clock")
+def simulated_clock_fixture(monkeypatch: pytest.MonkeyPatch):
+    """Charge Pebble calls and agent JAR downloads to a simulated clock."""
+    clock = SimulatedClock()
+
+    def charged(operation: str, method: typing.Callable[..., typing.Any]):
+        """Wrap a Pebble client method to charge its latency.
+
+        Args:
+            operation: The Pebble client method name.
+            method: The Pebble client method.
+
+        Returns:
+            The wrapped method.
+        """
+
+        @functools.wraps(method)
+        def wrapper(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+            """Charge the call latency and make the call.
+
+            Args:
+                args: The positional arguments of the call.
+                kwargs: The keyword arguments of the call.
+
+            Returns:
+                The result of the call.
+            """
+            clock.pebble_calls += 1
+            clock.charge(PEBBLE_LATENCIES[operation])
+            source = kwargs.get("source", args[2] if len(args) > 2 else b"")
+            if operation == "push" and isinstance(source, (bytes, str)):
+                clock.charge(len(source) / (1024 * 1024) * PUSH_SECONDS_PER_MIB)
+            return method(*args, **kwargs)
+
+        return wrapper
+
+    for operation in PEBBLE_LATENCIES:
+        monkeypatch.setattr(
+            _TestingPebbleClient,
+            operation,
+            charged(operation, getattr(_TestingPebbleClient, operation)),
+        )
+
+    def download(*_args: typing.Any, **_kwargs: typing.Any) -> FakeResponse:
+        """Charge the agent JAR download.
+
+        Returns:
+            The agent JAR download response.
+        """
+        clock.charge(JAR_DOWNLOAD_SECONDS)
+        return FakeResponse()
+
+    monkeypatch.setattr(requests, "get", download)
+
+    return clock
+
+
+@pytest.fixture(name="make_harness")
+def make_harness_fixture(simulated_clock: SimulatedClock):
+    """Create harnesses for a unit of an application of a number of units."""
+    harnesses: typing.List[Harness] = []
+
+    def make_harness(peer_units: int, valid_agent_name: str = "") -> Harness:
+        """Create a harness with a connectable workload container.
+
+        Args:
+            peer_units: The number of units of the application.
+            valid_agent_name: The agent name the Jenkins server accepts credentials of.
+
+        Returns:
+            The harness, not yet begun.
+        """
+        harness = Harness(JenkinsAgentCharm)
+        harnesses.append(harness)
+        harness.set_can_connect(CONTAINER_NAME, True)
+        harness.set_planned_units(peer_units)
+        harness.set_leader(True)
+        for peer_relation in PEER_RELATIONS:
+            relation_id = harness.add_relation(peer_relation, harness.model.app.name)
+            for unit_number in range(1, peer_units):
+                harness.add_relation_unit(relation_id, f"{harness.model.app.name}/{unit_number}")
+
+        def validate(args: ExecArgs) -> ExecResult:
+            """Charge the agent connection attempt.
+
+            Args:
+                args: The agent command.
+
+            Returns:
+                The agent connection log if the credentials are valid.
+            """
+            jnlp_url = args.command[args.command.index("-jnlpUrl") + 1]
+            if f"/computer/{valid_agent_name}/" in jnlp_url:
+                simulated_clock.charge(CONNECTION_SECONDS)
+                return ExecResult(stdout=CONNECTION_LOG)
+            simulated_clock.charge(args.timeout or 0.0)
+            return ExecResult(exit_code=1)
+
+        harness.handle_exec(CONTAINER_NAME, ["java"], handler=validate)
+        return harness
+
+    yield make_harness
+
+    for harness in harnesses:
+        harness.cleanup()
+
+
+@pytest.fixture(scope="session", name="baseline")
+def baseline_fixture():
+    """The simulated measures of each benchmark, rewritten on request at the end of the run."""
+    baseline = (
+        json.loads(BASELINE_PATH.read_text(encoding="utf-8")) if BASELINE_PATH.exists() else {}
+    )
+
+    yield baseline
+
+    if os.environ.get(UPDATE_BASELINE_ENV):
+        BASELINE_PATH.write_text(
+            f"{json.dumps(dict(sorted(baseline.items())), indent=2)}\n", encoding="utf-8"
+        )
+
+
+@pytest.fixture(name="run_hook")
+def run_hook_fixture(
+    benchmark: typing.Any,
+    simulated_clock: SimulatedClock,
+    baseline: typing.Dict[str, typing.Dict[str, float]],
+    request: pytest.FixtureRequest,
+):
+    """Benchmark a hook and compare its simulated measures against the baseline."""
+
+    def run_hook(
+        make: typing.Callable[[], Harness],
+        emit: typing.Callable[[Harness], None],
+        begin: bool = True,
+    ) -> Harness:
+        """Benchmark a hook, from the charm initialization to the commit of its changes.
+
+        Args:
+            make: Create the harness the hook runs in.
+            emit: Emit the hook event.
+            begin: Whether the hook initializes the charm, False if make already did.
+
+        Returns:
+            The harness of the last round.
+        """
+        harnesses: typing.List[Harness] = []
+
+        def setup() -> typing.Tuple[typing.Tuple[Harness], typing.Dict[str, typing.Any]]:
+            """Create the harness of a round.
+
+            Returns:
+                The hook arguments.
+            """
+            harness = make()
+            harnesses.append(harness)
+            simulated_clock.reset()
+            return (harness,), {}
+
+        def hook(harness: Harness) -> None:
+            """Run the hook.
+
+            Args:
+                harness: The harness the hook runs in.
+            """
+            if begin:
+                harness.begin()
+            emit(harness)
+            harness.framework.commit()
+
+        benchmark.pedantic(hook, setup=setup, rounds=ROUNDS)
+        measures = {
+            "simulated_seconds": round(simulated_clock.seconds, 3),
+            "pebble_calls": simulated_clock.pebble_calls,
+        }
+        benchmark.extra_info.update(measures)
+        if os.environ.get(UPDATE_BASELINE_ENV):
+            baseline[request.node.name] = measures
+            return harnesses[-1]
+        assert request.node.name in baseline, f"No baseline, rerun with {UPDATE_BASELINE_ENV}=1"
+        expected = baseline[request.node.name]
+        for measure, value in measures.items():
+            assert value <= expected[measure] * (
+                1 + BASELINE_TOLERANCE
+            ), f"{measure} regressed from {expected[measure]} to {value}"
+        return harnesses[-1]
+
+    return run_hook
@@ -0,0 +1,285 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Benchmarks of the charm hooks."""
+
+import secrets
+import typing
+
+import ops
+import pytest
+from ops.testing import Harness
+
+import state
+
+from .conftest import CONTAINER_NAME, PEER_UNIT_COUNTS
+
+# The number of configured agent-token pairs, the last pair being the valid one.
+TOKEN_COUNTS = (1, 10, 100, 500)
+SERVER_URL = "http://jenkins.test"
+
+RunHook = typing.Callable[..., Harness]
+MakeHarness = typing.Callable[..., Harness]
+
+
+def get_config(token_count: int) -> typing.Dict[str, str]:
+    """Get the configuration of a number of agent-token pairs.
+
+    Args:
+        token_count: The number of agent-token pairs.
+
+    Returns:
+        The charm configuration.
+    """
+    return {
+        "jenkins_url": SERVER_URL,
+        "jenkins_agent_name": ":".join(f"agent-{index}" for index in range(token_count)),
+        "jenkins_agent_token": ":".join(secrets.token_hex(16) for _ in range(token_count)),
+    }
+
+
+def make_configured(
+    make_harness: MakeHarness, token_count: int, peer_units: int
+) -> typing.Callable[[], Harness]:
+    """Create harnesses configured with a number of agent-token pairs.
+
+    Args:
+        make_harness: The harness factory.
+        token_count: The number of agent-token pairs.
+        peer_units: The number of units of the application.
+
+    Returns:
+        The configured harness factory.
+    """
+
+    def make() -> Harness:
+        """Create a configured harness.
+
+        Returns:
+            The harness, not yet begun.
+        """
+        harness = make_harness(peer_units, valid_agent_name=f"agent-{token_count - 1}")
+        harness.update_config(get_config(token_count))
+        return harness
+
+    return make
+
+
+def make_related(
+    make_harness: MakeHarness, peer_units: int, data: bool
+) -> typing.Callable[[], Harness]:
+    """Create harnesses related to a Jenkins server.
+
+    Args:
+        make_harness: The harness factory.
+        peer_units: The number of units of the application.
+        data: Whether the Jenkins server published the registration credentials.
+
+    Returns:
+        The related harness factory.
+    """
+
+    def make() -> Harness:
+        """Create a related harness.
+
+        Returns:
+            The harness, not yet begun.
+        """
+        harness = make_harness(peer_units)
+        relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+        harness.add_relation_unit(relation_id, "jenkins/0")
+        if data:
+            harness.update_relation_data(
+                relation_id,
+                "jenkins/0",
+                {"url": SERVER_URL, "jenkins-agent-k8s-0_secret": secrets.token_hex(16)},
+            )
+        return harness
+
+    return make
+
+
+def get_agent_relation(harness: Harness) -> ops.Relation:
+    """Get the agent relation of a harness.
+
+    Args:
+        harness: The harness.
+
+    Returns:
+        The agent relation.
+    """
+    relation = harness.model.get_relation(state.AGENT_RELATION)
+    assert relation
+    return relation
+
+
+@pytest.mark.parametrize("peer_units", PEER_UNIT_COUNTS)
+@pytest.mark.parametrize("token_count", TOKEN_COUNTS)
+def test_config_changed(
+    run_hook: RunHook, make_harness: MakeHarness, token_count: int, peer_units: int
+):
+    """
+    arrange: given a unit configured with agent-token pairs.
+    act: when the config changed hook runs.
+    assert: the hook stays within its baseline.
+    """
+    harness = run_hook(
+        make_configured(make_harness, token_count, peer_units),
+        lambda harness: harness.charm.on.config_changed.emit(),
+    )
+
+    assert isinstance(harness.model.unit.status, (ops.ActiveStatus, ops.WaitingStatus))
+
+
+@pytest.mark.parametrize("peer_units", PEER_UNIT_COUNTS)
+@pytest.mark.parametrize("token_count", TOKEN_COUNTS)
+def test_upgrade_charm(
+    run_hook: RunHook, make_harness: MakeHarness, token_count: int, peer_units: int
+):
+    """
+    arrange: given a unit configured with agent-token pairs.
+    act: when the upgrade charm hook runs.
+    assert: the hook stays within its baseline.
+    """
+    harness = run_hook(
+        make_configured(make_harness, token_count, peer_units),
+        lambda harness: harness.charm.on.upgrade_charm.emit(),
+    )
+
+    assert isinstance(harness.model.unit.status, (ops.ActiveStatus, ops.WaitingStatus))
+
+
+@pytest.mark.parametrize("peer_units", PEER_UNIT_COUNTS)
+@pytest.mark.parametrize("token_count", TOKEN_COUNTS)
+def test_pebble_ready(
+    run_hook: RunHook, make_harness: MakeHarness, token_count: int, peer_units: int
+):
+    """
+    arrange: given a unit configured with agent-token pairs.
+    act: when the pebble ready hook runs.
+    assert: the hook stays within its baseline.
+    """
+    harness = run_hook(
+        make_configured(make_harness, token_count, peer_units),
+        lambda harness: harness.charm.on[CONTAINER_NAME].pebble_ready.emit(
+            harness.model.unit.get_container(CONTAINER_NAME)
+        ),
+    )
+
+    assert isinstance(harness.model.unit.status, (ops.ActiveStatus, ops.WaitingStatus))
+
+
+@pytest.mark.parametrize("peer_units", PEER_UNIT_COUNTS)
+def test_update_status_applied(run_hook: RunHook, make_harness: MakeHarness, peer_units: int):
+    """
+    arrange: given a unit with a running agent.
+    act: when the update status hook runs.
+    assert: the hook stays within its baseline.
+    """
+    make = make_configured(make_harness, 1, peer_units)
+
+    def make_applied() -> Harness:
+        """Create a harness with a running agent.
+
+        Returns:
+            The begun harness.
+        """
+        harness = make()
+        harness.begin_with_initial_hooks()
+        harness.framework.commit()
+        return harness
+
+    harness = run_hook(
+        make_applied, lambda harness: harness.charm.on.update_status.emit(), begin=False
+    )
+
+    assert harness.model.unit.status == ops.ActiveStatus()
+
+
+@pytest.mark.parametrize("peer_units", PEER_UNIT_COUNTS)
+def test_relation_joined(run_hook: RunHook, make_harness: MakeHarness, peer_units: int):
+    """
+    arrange: given a unit related to a Jenkins server.
+    act: when the agent relation joined hook runs.
+    assert: the hook stays within its baseline.
+    """
+
+    def emit(harness: Harness) -> None:
+        """Emit the agent relation joined event.
+
+        Args:
+            harness: The harness.
+        """
+        relation = get_agent_relation(harness)
+        harness.charm.on[state.AGENT_RELATION].relation_joined.emit(
+            relation, relation.app, harness.model.get_unit("jenkins/0")
+        )
+
+    harness = run_hook(make_related(make_harness, peer_units, data=False), emit)
+
+    assert get_agent_relation(harness).data[harness.model.unit]["executors"]
+
+
+@pytest.mark.parametrize("peer_units", PEER_UNIT_COUNTS)
+def test_relation_changed(run_hook: RunHook, make_harness: MakeHarness, peer_units: int):
+    """
+    arrange: given a unit related to a Jenkins server that published credentials.
+    act: when the agent relation changed hook runs.
+    assert: the hook stays within its baseline.
+    """
+
+    def emit(harness: Harness) -> None:
+        """Emit the agent relation changed event.
+
+        Args:
+            harness: The harness.
+        """
+        relation = get_agent_relation(harness)
+        harness.charm.on[state.AGENT_RELATION].relation_changed.emit(
+            relation, relation.app, harness.model.get_unit("jenkins/0")
+        )
+
+    harness = run_hook(make_related(make_harness, peer_units, data=True), emit)
+
+    assert harness.model.unit.status == ops.ActiveStatus()
+
+
+@pytest.mark.parametrize("peer_units", PEER_UNIT_COUNTS)
+def test_relation_departed(run_hook: RunHook, make_harness: MakeHarness, peer_units: int):
+    """
+    arrange: given a unit registered to a Jenkins server through the agent relation.
+    act: when the agent relation departed hook runs.
+    assert: the hook stays within its baseline.
+    """
+    make = make_related(make_harness, peer_units, data=True)
+
+    def make_registered() -> Harness:
+        """Create a harness registered to the Jenkins server.
+
+        Returns:
+            The begun harness.
+        """
+        harness = make()
+        harness.begin()
+        relation = get_agent_relation(harness)
+        harness.charm.on[state.AGENT_RELATION].relation_changed.emit(
+            relation, relation.app, harness.model.get_unit("jenkins/0")
+        )
+        harness.framework.commit()
+        return harness
+
+    def emit(harness: Harness) -> None:
+        """Emit the agent relation departed event.
+
+        Args:
+            harness: The harness.
+        """
+        relation = get_agent_relation(harness)
+        harness.charm.on[state.AGENT_RELATION].relation_departed.emit(
+            relation, relation.app, harness.model.get_unit("jenkins/0"), "jenkins/0"
+        )
+
+    harness = run_hook(make_registered, emit, begin=False)
+
+    container = harness.model.unit.get_container(CONTAINER_NAME)
+    assert not container.get_service(harness.charm.state.jenkins_agent_service_name).is_running()
@@ -0,0 +1,189 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Benchmark of units registering concurrently against one Jenkins controller."""
+
+import concurrent.futures
+import logging
+import multiprocessing
+import secrets
+import time
+import typing
+from dataclasses import dataclass
+from pathlib import Path
+
+import ops
+import pytest
+from ops.testing import Harness
+
+import pebble
+import server
+import tracing
+from charm import JenkinsAgentCharm
+from tests.fake_jenkins import JNLP_ENDPOINT, FakeAgent, FakeJenkins
+
+from .conftest import CONTAINER_NAME
+
+logger = logging.getLogger(__name__)
+
+UNIT_COUNTS = (10, 50)
+# The hooks a unit may run to register before it is considered stuck.
+MAX_HOOKS = 20
+# The time a validation agent stays connected before its exec timeout kills it, scaled down.
+VALIDATION_HOLD_SECONDS = 0.05
+
+
+@dataclass(frozen=True)
+class UnitResult:
+    """The outcome of the registration of a unit.
+
+    Attrs:
+        ready: Whether the unit agent connected to the controller.
+        seconds: The time from the start of the scale-out to the unit agent connection.
+        hooks: The number of hooks the unit ran.
+    """
+
+    ready: bool
+    seconds: float
+    hooks: int
+
+
+def _run_validation_service(harness: Harness, fake_agent: FakeAgent) -> None:
+    """Run the credentials validation service of the workload container to completion.
+
+    Args:
+        harness: The harness of the unit.
+        fake_agent: The agent JVM connecting to the Jenkins controller.
+    """
+    container = harness.model.unit.get_container(CONTAINER_NAME)
+    candidates = str(container.pull(server.VALIDATION_CANDIDATES_PATH).read())
+    valid_agent = ""
+    for candidate in candidates.splitlines():
+        agent, token = candidate.split()
+        result = fake_agent.launch_agent(
+            f"{fake_agent.url}/computer/{agent}/slave-agent.jnlp", token
+        )
+        if "INFO: Connected" in str(result.stdout):
+            valid_agent = agent
+            break
+    container.push(server.VALIDATION_RESULT_PATH, f"{valid_agent}\n", make_dirs=True)
+    container.stop(harness.charm.pebble_service.validation_service_name)
+    harness.pebble_notify(CONTAINER_NAME, pebble.VALIDATION_NOTICE_KEY)
+
+
+def register_unit(
+    fake_agent: FakeAgent, config: typing.Dict[str, str], start_time: float
+) -> UnitResult:
+    """Register a unit, running the workload services the charm starts along its hooks.
+
+    Args:
+        fake_agent: The agent JVM connecting to the Jenkins controller.
+        config: The charm configuration.
+        start_time: The time.monotonic time of the start of the scale-out.
+
+    Returns:
+        The outcome of the registration.
+    """
+    harness = Harness(JenkinsAgentCharm)
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.handle_exec(CONTAINER_NAME, ["java"], handler=fake_agent.handle_exec)
+    harness.update_config(config)
+    harness.begin()
+    harness.charm.on.config_changed.emit()
+    hooks = 1
+    container = harness.model.unit.get_container(CONTAINER_NAME)
+    try:
+        while hooks < MAX_HOOKS:
+            hooks += 1
+            if harness.charm.pebble_service.is_validation_running(container):
+                _run_validation_service(harness, fake_agent)
+                continue
+            if not isinstance(harness.model.unit.status, ops.ActiveStatus):
+                break
+            environment = (
+                harness.get_container_pebble_plan(CONTAINER_NAME)
+                .services[harness.charm.state.jenkins_agent_service_name]
+                .environment
+            )
+            agent = environment["JENKINS_AGENT"]
+            result = fake_agent.launch_agent(
+                f"{fake_agent.url}/computer/{agent}/jenkins-agent.jnlp",
+                environment["JENKINS_TOKEN"],
+                stay_connected=True,
+            )
+            if "INFO: Connected" in str(result.stdout):
+                return UnitResult(ready=True, seconds=time.monotonic() - start_time, hooks=hooks)
+            harness.pebble_notify(
+                CONTAINER_NAME, pebble.AGENT_DISCONNECTED_NOTICE_KEY, data={"agent": agent}
+            )
+        return UnitResult(ready=False, seconds=time.monotonic() - start_time, hooks=hooks)
+    finally:
+        harness.cleanup()
+
+
+def simulate_scale_out(fake_jenkins: FakeJenkins, unit_count: int) -> typing.Dict[str, float]:
+    """Register units concurrently, each in its own process as in separate pods.
+
+    Args:
+        fake_jenkins: The Jenkins controller, with an agent node per unit.
+        unit_count: The number of units.
+
+    Returns:
+        The scale-out report.
+    """
+    config = {
+        "jenkins_url": fake_jenkins.url,
+        "jenkins_agent_name": ":".join(fake_jenkins.agents),
+        "jenkins_agent_token": ":".join(agent.secret for agent in fake_jenkins.agents.values()),
+    }
+    start_time = time.monotonic()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=unit_count, mp_context=multiprocessing.get_context("fork")
+    ) as executor:
+        results = list(
+            executor.map(
+                register_unit,
+                [FakeAgent(fake_jenkins.url, VALIDATION_HOLD_SECONDS)] * unit_count,
+                [config] * unit_count,
+                [start_time] * unit_count,
+            )
+        )
+    ready_units = sum(result.ready for result in results)
+    return {
+        "units": unit_count,
+        "ready_units": ready_units,
+        "time_to_all_ready_seconds": round(max(result.seconds for result in results), 3),
+        "controller_requests": sum(fake_jenkins.requests.values()),
+        "collisions": fake_jenkins.collisions,
+        # Each unit needs one validation agent launch and one agent service launch.
+        "wasted_jvm_launches": fake_jenkins.requests[JNLP_ENDPOINT] - 2 * ready_units,
+        "hooks": sum(result.hooks for result in results),
+    }
+
+
+@pytest.mark.parametrize("unit_count", UNIT_COUNTS)
+def test_scale_out(
+    benchmark: typing.Any, monkeypatch: pytest.MonkeyPatch, tmp_path: Path, unit_count: int
+):
+    """
+    arrange: given a Jenkins controller with an agent node per unit.
+    act: when the units register concurrently with the same agent-token pairs.
+    assert: every unit agent connects with its own agent node.
+    """
+    monkeypatch.setattr(tracing, "TRACES_PATH", tmp_path / "traces.jsonl")
+    reports = []
+
+    def scale_out() -> None:
+        """Run the scale-out against a fresh controller."""
+        with FakeJenkins() as fake_jenkins:
+            for index in range(unit_count):
+                fake_jenkins.add_agent(f"agent-{index}", secrets.token_hex(32))
+            reports.append(simulate_scale_out(fake_jenkins, unit_count))
+            assert fake_jenkins.get_online_agents() == sorted(fake_jenkins.agents)
+
+    benchmark.pedantic(scale_out, rounds=1)
+
+    report = reports[-1]
+    benchmark.extra_info.update(report)
+    logger.info("Scale-out report: %s", report)
+    assert report["ready_units"] == unit_count
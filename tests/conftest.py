@@ -3,8 +3,15 @@
 
 """Fixtures for jenkins-agent-k8s charm tests."""
 
+from pathlib import Path
+
 import pytest
 
+import hook_stats
+import io_timing
+import metrics
+import tracing
+
 
 def pytest_addoption(parser: pytest.Parser):
     """Parse additional pytest options.
@@ -18,3 +25,17 @@ def pytest_addoption(parser: pytest.Parser):
     parser.addoption("--charm-file", action="store", default="")
     # The path to kubernetes config.
     parser.addoption("--kube-config", action="store", default="~/.kube/config")
+
+
+@pytest.fixture(autouse=True)
+def recorded_samples_fixture(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """Discard the metric samples, handler and I/O timings and spans recorded by each test."""
+    monkeypatch.setattr(tracing, "TRACES_PATH", tmp_path / "traces.jsonl")
+    monkeypatch.setattr(io_timing, "SECONDS", dict.fromkeys(io_timing.SECONDS, 0.0))
+
+    yield
+
+    metrics.REGISTRY.clear()
+    hook_stats.TIMINGS.clear()
+    hook_stats.PROFILES.clear()
+    tracing.SPANS.clear()
@@ -0,0 +1,31 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Fixtures for offline end-to-end tests against a fake Jenkins controller."""
+
+import pytest
+from ops.testing import Harness
+
+from charm import JenkinsAgentCharm
+from tests.fake_jenkins import FakeAgent, FakeJenkins
+
+CONTAINER_NAME = "jenkins-agent-k8s"
+
+
+@pytest.fixture(name="fake_jenkins")
+def fake_jenkins_fixture():
+    """A running fake Jenkins controller."""
+    with FakeJenkins() as fake_jenkins:
+        yield fake_jenkins
+
+
+@pytest.fixture(name="harness")
+def harness_fixture(fake_jenkins: FakeJenkins):
+    """A harness whose Jenkins agent JVM launches connect to the fake Jenkins controller."""
+    harness = Harness(JenkinsAgentCharm)
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.handle_exec(CONTAINER_NAME, ["java"], handler=FakeAgent(fake_jenkins.url).handle_exec)
+
+    yield harness
+
+    harness.cleanup()
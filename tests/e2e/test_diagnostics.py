@@ -0,0 +1,98 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Offline end-to-end tests of the connection diagnostics against a fake Jenkins controller."""
+
+import json
+import subprocess  # nosec
+import sys
+from pathlib import Path
+
+import pytest
+from ops.testing import ExecArgs, ExecResult, Harness
+
+import server
+from tests.fake_jenkins import JNLP_ENDPOINT, FakeJenkins
+
+from .conftest import CONTAINER_NAME
+
+DIAGNOSE_SCRIPT_PATH = Path(__file__).parents[2] / "jenkins_agent_k8s_rock/files/diagnose.py"
+
+
+def run_diagnose_script(args: ExecArgs) -> ExecResult:
+    """Run the diagnose script of the workload image.
+
+    Args:
+        args: The diagnose script command.
+
+    Returns:
+        The diagnose script output.
+    """
+    completed = subprocess.run(  # nosec
+        [sys.executable, str(DIAGNOSE_SCRIPT_PATH), *args.command[2:]],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    return ExecResult(
+        exit_code=completed.returncode, stdout=completed.stdout, stderr=completed.stderr
+    )
+
+
+@pytest.mark.parametrize(
+    "online",
+    [pytest.param(True, id="online"), pytest.param(False, id="offline")],
+)
+def test_diagnose_connection(harness: Harness, fake_jenkins: FakeJenkins, online: bool):
+    """
+    arrange: given an agent of a fake Jenkins controller, online or offline.
+    act: when the diagnose-connection action is run.
+    assert: the network phases are timed and the probe agent is rejected after the handshake
+        without changing whether the agent is online.
+    """
+    secret = fake_jenkins.add_agent("jenkins-agent-k8s-0")
+    if online:
+        fake_jenkins.connect("jenkins-agent-k8s-0", secret)
+    harness.handle_exec(CONTAINER_NAME, ["python3"], handler=run_diagnose_script)
+    harness.begin()
+    container = harness.model.unit.get_container(CONTAINER_NAME)
+    container.push(server.AGENT_JAR_PATH, "agent.jar", make_dirs=True)
+    container.add_layer(
+        "jenkins-agent-k8s-layer",
+        {
+            "services": {
+                CONTAINER_NAME: {
+                    "override": "replace",
+                    "command": str(server.ENTRYSCRIPT_PATH),
+                    "environment": {
+                        "JENKINS_URL": fake_jenkins.url,
+                        "JENKINS_AGENT": "jenkins-agent-k8s-0",
+                        "JENKINS_TOKEN": secret,
+                    },
+                }
+            }
+        },
+    )
+
+    output = harness.run_action("diagnose-connection")
+
+    phases = json.loads(output.results["phases"])
+    assert list(phases) == [
+        "dns",
+        "tcp-connect",
+        "agent-jar-head",
+        "jnlp-fetch",
+        "remoting-first-output",
+        "remoting-locating-server",
+        "remoting-agent-discovery-successful",
+        "remoting-handshaking",
+        "remoting-connecting",
+    ]
+    assert json.loads(output.results["http-statuses"]) == {
+        "agent-jar-head": 200,
+        "jnlp-fetch": 200,
+    }
+    assert fake_jenkins.requests[JNLP_ENDPOINT] == 2
+    assert fake_jenkins.rejections == 1
+    assert fake_jenkins.collisions == 0
+    assert fake_jenkins.get_online_agents() == (["jenkins-agent-k8s-0"] if online else [])
@@ -0,0 +1,203 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Offline end-to-end tests of the agent registration against a fake Jenkins controller."""
+
+import hashlib
+import secrets
+from pathlib import Path
+
+import ops
+import pytest
+from ops.testing import Harness
+
+import server
+import state
+from tests.fake_jenkins import (
+    AGENT_JAR_ENDPOINT,
+    AGENT_JAR_HEAD_ENDPOINT,
+    CONNECT_ENDPOINT,
+    DEFAULT_AGENT_JAR,
+    JNLP_ENDPOINT,
+    FakeJenkins,
+)
+
+from .conftest import CONTAINER_NAME
+
+
+def test_download_jenkins_agent(harness: Harness, fake_jenkins: FakeJenkins):
+    """
+    arrange: given a fake Jenkins controller.
+    act: when the agent JAR executable is downloaded.
+    assert: the executable served by the controller is pushed to the container.
+    """
+    harness.begin()
+    container = harness.model.unit.get_container(CONTAINER_NAME)
+
+    agent_jar_sha256 = server.download_jenkins_agent(fake_jenkins.url, container)
+
+    assert agent_jar_sha256 == fake_jenkins.agent_jar_sha256
+    pushed_jar = container.pull(server.AGENT_JAR_PATH, encoding=None).read()
+    assert hashlib.sha256(pushed_jar).hexdigest() == fake_jenkins.agent_jar_sha256
+    assert fake_jenkins.requests[AGENT_JAR_ENDPOINT] == 1
+
+
+@pytest.mark.parametrize(
+    "resource_content, expected_downloads",
+    [
+        pytest.param(DEFAULT_AGENT_JAR, 0, id="matching resource"),
+        pytest.param(b"PK\x03\x04stale", 1, id="stale resource"),
+    ],
+)
+def test_download_jenkins_agent_resource(
+    harness: Harness,
+    fake_jenkins: FakeJenkins,
+    tmp_path: Path,
+    resource_content: bytes,
+    expected_downloads: int,
+):
+    """
+    arrange: given a fake Jenkins controller and an agent JAR resource.
+    act: when the agent JAR executable is downloaded.
+    assert: the resource is checked against the controller, which only serves a stale resource.
+    """
+    harness.begin()
+    resource_path = tmp_path / "agent.jar"
+    resource_path.write_bytes(resource_content)
+
+    agent_jar_sha256 = server.download_jenkins_agent(
+        fake_jenkins.url,
+        harness.model.unit.get_container(CONTAINER_NAME),
+        sources=server.AgentJarSources(resource_path=resource_path),
+    )
+
+    assert agent_jar_sha256 == fake_jenkins.agent_jar_sha256
+    assert fake_jenkins.requests[AGENT_JAR_HEAD_ENDPOINT] == 1
+    assert fake_jenkins.requests[AGENT_JAR_ENDPOINT] == expected_downloads
+
+
+def test_download_jenkins_agent_failure(harness: Harness, fake_jenkins: FakeJenkins):
+    """
+    arrange: given a fake Jenkins controller failing the next agent JAR download.
+    act: when the agent JAR executable is downloaded.
+    assert: AgentJarDownloadError is raised.
+    """
+    harness.begin()
+    fake_jenkins.failures[AGENT_JAR_ENDPOINT] = 1
+
+    with pytest.raises(server.AgentJarDownloadError):
+        server.download_jenkins_agent(
+            fake_jenkins.url, harness.model.unit.get_container(CONTAINER_NAME)
+        )
+
+
+def test_find_valid_credentials(harness: Harness, fake_jenkins: FakeJenkins):
+    """
+    arrange: given a fake Jenkins controller with one registered agent.
+    act: when the valid credentials are searched among an invalid secret, an unknown agent and
+        the registered agent.
+    assert: the registered agent pair is found after a JVM launch per pair.
+    """
+    harness.begin()
+    secret = fake_jenkins.add_agent("agent-0")
+    pairs = (("agent-0", secrets.token_hex(32)), ("agent-1", secret), ("agent-0", secret))
+
+    valid_pair = server.find_valid_credentials(
+        pairs, fake_jenkins.url, harness.model.unit.get_container(CONTAINER_NAME)
+    )
+
+    assert valid_pair == ("agent-0", secret)
+    assert fake_jenkins.requests[JNLP_ENDPOINT] == 3
+    assert fake_jenkins.rejections == 1
+
+
+def test_find_valid_credentials_online_agent(harness: Harness, fake_jenkins: FakeJenkins):
+    """
+    arrange: given a fake Jenkins controller with an agent already online.
+    act: when the valid credentials are searched.
+    assert: the online agent collides and the other agent is found.
+    """
+    harness.begin()
+    online_secret = fake_jenkins.add_agent("agent-0")
+    secret = fake_jenkins.add_agent("agent-1")
+    fake_jenkins.connect("agent-0", online_secret)
+
+    valid_pair = server.find_valid_credentials(
+        (("agent-0", online_secret), ("agent-1", secret)),
+        fake_jenkins.url,
+        harness.model.unit.get_container(CONTAINER_NAME),
+    )
+
+    assert valid_pair == ("agent-1", secret)
+    assert fake_jenkins.collisions == 1
+
+
+def test_find_valid_credentials_latency(harness: Harness, fake_jenkins: FakeJenkins):
+    """
+    arrange: given a fake Jenkins controller delaying each request.
+    act: when the valid credentials are searched.
+    assert: the controller is requested once per JNLP file and connection.
+    """
+    harness.begin()
+    secret = fake_jenkins.add_agent("agent-0")
+    fake_jenkins.latency = 0.01
+
+    valid_pair = server.find_valid_credentials(
+        (("agent-0", secret),), fake_jenkins.url, harness.model.unit.get_container(CONTAINER_NAME)
+    )
+
+    assert valid_pair == ("agent-0", secret)
+    assert fake_jenkins.requests[CONNECT_ENDPOINT] == 1
+
+
+def test_config_registration(harness: Harness, fake_jenkins: FakeJenkins):
+    """
+    arrange: given a fake Jenkins controller and a unit configured with its agents.
+    act: when the charm reconciles on config changed.
+    assert: the agent service is started with the valid agent and the unit is active.
+    """
+    fake_jenkins.add_agent("agent-0")
+    secret = fake_jenkins.add_agent("agent-1")
+    harness.update_config(
+        {
+            "jenkins_url": fake_jenkins.url,
+            "jenkins_agent_name": "agent-0:agent-1",
+            "jenkins_agent_token": f"{secrets.token_hex(32)}:{secret}",
+        }
+    )
+    harness.begin()
+
+    harness.charm.on.config_changed.emit()
+
+    assert harness.model.unit.status == ops.ActiveStatus()
+    environment = (
+        harness.get_container_pebble_plan(CONTAINER_NAME)
+        .services[harness.charm.state.jenkins_agent_service_name]
+        .environment
+    )
+    assert environment["JENKINS_AGENT"] == "agent-1"
+    assert environment["JENKINS_URL"] == fake_jenkins.url
+
+
+def test_relation_registration(harness: Harness, fake_jenkins: FakeJenkins):
+    """
+    arrange: given a fake Jenkins controller and a unit related to it.
+    act: when the agent relation changed with the agent credentials.
+    assert: the agent JAR executable is downloaded once and the unit is active.
+    """
+    secret = fake_jenkins.add_agent("jenkins-agent-k8s-0")
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+    harness.add_relation_unit(relation_id, "jenkins/0")
+    harness.update_relation_data(
+        relation_id, "jenkins/0", {"url": fake_jenkins.url, "jenkins-agent-k8s-0_secret": secret}
+    )
+    harness.begin()
+    relation = harness.model.get_relation(state.AGENT_RELATION, relation_id)
+    assert relation
+
+    harness.charm.on[state.AGENT_RELATION].relation_changed.emit(
+        relation, relation.app, harness.model.get_unit("jenkins/0")
+    )
+
+    assert harness.model.unit.status == ops.ActiveStatus()
+    assert fake_jenkins.requests[AGENT_JAR_ENDPOINT] == 1
@@ -0,0 +1,386 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""A local stand-in for a Jenkins controller, to test agent registration without a network.
+
+The controller serves the agent JAR executable and the agent JNLP files, checks agent secrets and
+tracks which agents are online. The agent side is emulated by
+FakeAgent, whose exec handler replaces the Jenkins agent JVM launched in the workload container,
+connecting to the controller over HTTP and printing the remoting log lines the charm parses.
+"""
+
+import collections
+import hashlib
+import http
+import http.server
+import secrets
+import threading
+import time
+import typing
+import urllib.error
+import urllib.parse
+import urllib.request
+from dataclasses import dataclass, field
+
+from ops.testing import ExecArgs, ExecResult
+
+# The endpoints of the controller, requests are counted and failures injected by endpoint.
+AGENT_JAR_ENDPOINT = "agent.jar"
+AGENT_JAR_HEAD_ENDPOINT = "agent.jar head"
+JNLP_ENDPOINT = "jnlp"
+CONNECT_ENDPOINT = "connect"
+DISCONNECT_ENDPOINT = "disconnect"
+
+SECRET_HEADER = "X-Agent-Secret"
+DEFAULT_AGENT_JAR = b"PK\x03\x04" + b"\0" * 1024
+
+JNLP_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<jnlp codebase="{url}/computer/{name}/">
+  <application-desc main-class="hudson.remoting.jnlp.Main">
+    <argument>{secret}</argument>
+    <argument>{name}</argument>
+    <argument>-url</argument>
+    <argument>{url}/</argument>
+  </application-desc>
+</jnlp>
+"""
+
+
+@dataclass
+class Agent:
+    """An agent node registered on the controller.
+
+    Attrs:
+        secret: The agent secret.
+        online: Whether an agent is connected to the node.
+    """
+
+    secret: str
+    online: bool = False
+
+
+@dataclass
+class FakeJenkins:  # pylint: disable=too-many-instance-attributes
+    """A fake Jenkins controller serving HTTP on the loopback interface.
+
+    Attrs:
+        agent_jar: The agent JAR executable served.
+        latency: The time in seconds each request is delayed by.
+        failures: The number of upcoming requests to fail, by endpoint.
+        failure_status: The HTTP status of injected failures.
+        agents: The registered agent nodes, by name.
+        requests: The number of requests, by endpoint.
+        collisions: The number of connections rejected because the node was already online.
+        rejections: The number of connections rejected for an invalid secret or unknown node.
+        url: The controller URL.
+        agent_jar_sha256: The sha256 hex digest of the agent JAR executable.
+    """
+
+    agent_jar: bytes = DEFAULT_AGENT_JAR
+    latency: float = 0.0
+    failures: typing.Dict[str, int] = field(default_factory=dict)
+    failure_status: int = http.HTTPStatus.SERVICE_UNAVAILABLE
+    agents: typing.Dict[str, Agent] = field(default_factory=dict)
+    requests: typing.Counter[str] = field(default_factory=collections.Counter)
+    collisions: int = 0
+    rejections: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _server: typing.Optional[http.server.ThreadingHTTPServer] = field(default=None, repr=False)
+
+    @property
+    def url(self) -> str:
+        """The controller URL."""
+        assert self._server, "The fake Jenkins controller is not started."
+        host, port = self._server.server_address[:2]
+        return f"http://{host!s}:{port}"
+
+    @property
+    def agent_jar_sha256(self) -> str:
+        """The sha256 hex digest of the agent JAR executable."""
+        return hashlib.sha256(self.agent_jar).hexdigest()
+
+    def start(self) -> "FakeJenkins":
+        """Serve the controller on an ephemeral port in a background thread.
+
+        Returns:
+            The started controller.
+        """
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _RequestHandler)
+        self._server.daemon_threads = True
+        setattr(self._server, "jenkins", self)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving the controller."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FakeJenkins":
+        """Start the controller.
+
+        Returns:
+            The started controller.
+        """
+        return self.start()
+
+    def __exit__(self, *_: typing.Any) -> None:
+        """Stop the controller."""
+        self.stop()
+
+    def add_agent(self, name: str, secret: typing.Optional[str] = None) -> str:
+        """Register an agent node.
+
+        Args:
+            name: The agent name.
+            secret: The agent secret, a random secret if None.
+
+        Returns:
+            The agent secret.
+        """
+        agent_secret = secret or secrets.token_hex(32)
+        with self._lock:
+            self.agents[name] = Agent(secret=agent_secret)
+        return agent_secret
+
+    def get_online_agents(self) -> typing.List[str]:
+        """Get the names of the agent nodes an agent is connected to.
+
+        Returns:
+            The sorted names of the online agent nodes.
+        """
+        with self._lock:
+            return sorted(name for name, agent in self.agents.items() if agent.online)
+
+    def connect(self, name: str, secret: str) -> int:
+        """Connect an agent to a node.
+
+        Args:
+            name: The agent name.
+            secret: The agent secret.
+
+        Returns:
+            The HTTP status of the connection.
+        """
+        with self._lock:
+            agent = self.agents.get(name)
+            if not agent or not secrets.compare_digest(agent.secret, secret):
+                self.rejections += 1
+                return http.HTTPStatus.FORBIDDEN
+            if agent.online:
+                self.collisions += 1
+                return http.HTTPStatus.CONFLICT
+            agent.online = True
+            return http.HTTPStatus.OK
+
+    def disconnect(self, name: str) -> None:
+        """Disconnect the agent connected to a node.
+
+        Args:
+            name: The agent name.
+        """
+        with self._lock:
+            if name in self.agents:
+                self.agents[name].online = False
+
+    def record_request(self, endpoint: str) -> typing.Optional[int]:
+        """Count a request and apply the injected latency and failures.
+
+        Args:
+            endpoint: The requested endpoint.
+
+        Returns:
+            The HTTP status of an injected failure, None if the request should be served.
+        """
+        with self._lock:
+            self.requests[endpoint] += 1
+            fail = self.failures.get(endpoint, 0) > 0
+            if fail:
+                self.failures[endpoint] -= 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.failure_status if fail else None
+
+
+@dataclass(frozen=True)
+class FakeAgent:
+    """The Jenkins agent JVM, connecting to a fake Jenkins controller.
+
+    Attrs:
+        url: The controller URL.
+        validation_hold_seconds: The time an agent launched for credentials validation stays
+            connected before its exec timeout kills it.
+    """
+
+    url: str
+    validation_hold_seconds: float = 0.0
+
+    def handle_exec(self, args: ExecArgs) -> ExecResult:
+        """Run the Jenkins agent JVM launched in the workload container for validation.
+
+        The agent stays connected for validation_hold_seconds, until the exec timeout kills it.
+
+        Args:
+            args: The Jenkins agent command.
+
+        Returns:
+            The remoting log and exit code of the agent.
+        """
+        command = args.command
+        if "-jnlpUrl" in command:
+            jnlp_url = command[command.index("-jnlpUrl") + 1]
+        else:
+            # Agents launched with the controller URL and their name discover the controller
+            # rather than loading their JNLP file, which the fake controller serves alike.
+            url, name = command[command.index("-url") + 1], command[command.index("-name") + 1]
+            jnlp_url = f"{url}/computer/{name}/slave-agent.jnlp"
+        return self.launch_agent(
+            jnlp_url=jnlp_url,
+            secret=command[command.index("-secret") + 1],
+            timeout=args.timeout,
+        )
+
+    def launch_agent(
+        self,
+        jnlp_url: str,
+        secret: str,
+        timeout: typing.Optional[float] = None,
+        stay_connected: bool = False,
+    ) -> ExecResult:
+        """Run a Jenkins agent JVM.
+
+        The agent loads its JNLP file and connects with its secret, printing the remoting log.
+
+        Args:
+            jnlp_url: The agent JNLP file URL.
+            secret: The agent secret.
+            timeout: The time in seconds after which requests to the controller fail.
+            stay_connected: Whether the agent stays connected once the agent JVM returns, as the
+                agent service does.
+
+        Returns:
+            The remoting log and exit code of the agent.
+        """
+        name = urllib.parse.urlparse(jnlp_url).path.split("/")[-2]
+        log = [f"INFO: Setting up agent: {name}", f"INFO: Locating server among [{self.url}/]"]
+        try:
+            with urllib.request.urlopen(jnlp_url, timeout=timeout):  # nosec
+                pass
+            log.extend(
+                ["INFO: Agent discovery successful", "INFO: Handshaking", "INFO: Connecting to"]
+            )
+            self._post(f"computer/{name}/connect", {SECRET_HEADER: secret}, timeout)
+        except urllib.error.HTTPError as exc:
+            if exc.code == http.HTTPStatus.CONFLICT:
+                log.append(
+                    "SEVERE: The server rejected the connection: "
+                    f"{name} is already connected to this controller. Rejecting this connection."
+                )
+            elif exc.code == http.HTTPStatus.FORBIDDEN:
+                log.append("SEVERE: The server rejected the connection: Authorization failure")
+            else:
+                log.append(f"SEVERE: Failed to connect to {jnlp_url}: {exc.code} {exc.reason}")
+            return ExecResult(exit_code=1, stdout="\n".join(log) + "\n")
+        log.extend(["INFO: Remote identity confirmed: controller", "INFO: Connected"])
+        if not stay_connected:
+            time.sleep(self.validation_hold_seconds)
+            self._post(f"computer/{name}/disconnect", {}, timeout)
+        return ExecResult(stdout="\n".join(log) + "\n")
+
+    def _post(
+        self, path: str, headers: typing.Dict[str, str], timeout: typing.Optional[float]
+    ) -> None:
+        """Make a POST request to the controller.
+
+        Args:
+            path: The request path, relative to the controller URL.
+            headers: The request headers.
+            timeout: The time in seconds after which the request fails.
+        """
+        request = urllib.request.Request(f"{self.url}/{path}", headers=headers, method="POST")
+        with urllib.request.urlopen(request, timeout=timeout):  # nosec
+            pass
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    """The fake Jenkins controller request handler."""
+
+    @property
+    def jenkins(self) -> FakeJenkins:
+        """The controller the request is made to."""
+        return typing.cast(FakeJenkins, getattr(self.server, "jenkins"))
+
+    def log_message(self, *_: typing.Any) -> None:
+        """Silence the access log."""
+
+    def _respond(self, status: int, body: bytes = b"", content_type: str = "text/plain") -> None:
+        """Write the response.
+
+        Args:
+            status: The HTTP status.
+            body: The response body.
+            content_type: The response content type.
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:  # noqa: N802 pylint: disable=invalid-name
+        """Serve the agent JAR executable and the agent JNLP files."""
+        parts = urllib.parse.urlparse(self.path).path.strip("/").split("/")
+        if parts == ["jnlpJars", "agent.jar"]:
+            failure = self.jenkins.record_request(AGENT_JAR_ENDPOINT)
+            if failure:
+                self._respond(failure)
+                return
+            self._respond(http.HTTPStatus.OK, self.jenkins.agent_jar, "application/java-archive")
+            return
+        if (
+            len(parts) == 3
+            and parts[0] == "computer"
+            and parts[2] in ("slave-agent.jnlp", "jenkins-agent.jnlp")
+        ):
+            failure = self.jenkins.record_request(JNLP_ENDPOINT)
+            agent = self.jenkins.agents.get(parts[1])
+            if failure or not agent:
+                self._respond(failure or http.HTTPStatus.NOT_FOUND)
+                return
+            jnlp = JNLP_TEMPLATE.format(url=self.jenkins.url, name=parts[1], secret=agent.secret)
+            self._respond(http.HTTPStatus.OK, jnlp.encode(), "application/x-java-jnlp-file")
+            return
+        self._respond(http.HTTPStatus.NOT_FOUND)
+
+    def do_HEAD(self) -> None:  # noqa: N802 pylint: disable=invalid-name
+        """Advertise the agent JAR executable size, as Jenkins does, without serving it."""
+        parts = urllib.parse.urlparse(self.path).path.strip("/").split("/")
+        if parts != ["jnlpJars", "agent.jar"]:
+            self.send_response(http.HTTPStatus.NOT_FOUND)
+            self.end_headers()
+            return
+        failure = self.jenkins.record_request(AGENT_JAR_HEAD_ENDPOINT)
+        self.send_response(failure or http.HTTPStatus.OK)
+        self.send_header("Content-Type", "application/java-archive")
+        self.send_header("Content-Length", str(0 if failure else len(self.jenkins.agent_jar)))
+        self.end_headers()
+
+    def do_POST(self) -> None:  # noqa: N802 pylint: disable=invalid-name
+        """Connect and disconnect agents."""
+        parts = urllib.parse.urlparse(self.path).path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "computer":
+            self._respond(http.HTTPStatus.NOT_FOUND)
+            return
+        if parts[2] == "connect":
+            failure = self.jenkins.record_request(CONNECT_ENDPOINT)
+            status = failure or self.jenkins.connect(parts[1], self.headers.get(SECRET_HEADER, ""))
+            self._respond(status)
+            return
+        if parts[2] == "disconnect":
+            self.jenkins.record_request(DISCONNECT_ENDPOINT)
+            self.jenkins.disconnect(parts[1])
+            self._respond(http.HTTPStatus.OK)
+            return
+        self._respond(http.HTTPStatus.NOT_FOUND)
@@ -0,0 +1,198 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""A local stand-in for the Kubernetes API, to test pod template patches without a cluster.
+
+The API holds the application StatefulSet created by Juju, the unit pods and the cluster nodes.
+It applies strategic merge patches to the StatefulSet, merging the lists the Kubernetes API merges
+by key and replacing the other lists. It counts the pod template revisions, each of which
+restarts the pods of all units.
+"""
+
+import copy
+import typing
+from dataclasses import dataclass, field
+
+from lightkube.core.exceptions import ApiError
+from lightkube.models.meta_v1 import Status
+from lightkube.resources.apps_v1 import StatefulSet
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    # lightkube 1 depends on the httpx2 fork of httpx.
+    import httpx2 as httpx  # type: ignore[no-redef]
+
+ObjectKey = typing.Tuple[str, str, str]
+
+# The merge keys of the lists of a pod spec the Kubernetes API merges rather than replaces.
+LIST_MERGE_KEYS = {"containers": "name", "topologySpreadConstraints": "topologyKey"}
+
+
+def _merge(current: typing.Any, patch: typing.Any, name: str = "") -> typing.Any:
+    """Apply a strategic merge patch.
+
+    Args:
+        current: The current object or field.
+        patch: The patch of the object or field.
+        name: The field name.
+
+    Returns:
+        The patched object or field.
+    """
+    if isinstance(patch, dict) and isinstance(current, dict):
+        merged = dict(current)
+        for key, value in patch.items():
+            if value is None:
+                merged.pop(key, None)
+            else:
+                merged[key] = _merge(current.get(key), value, key)
+        return merged
+    if isinstance(patch, list) and isinstance(current, list) and name in LIST_MERGE_KEYS:
+        merge_key = LIST_MERGE_KEYS[name]
+        merged_items = {item[merge_key]: item for item in current}
+        for item in patch:
+            merged_items[item[merge_key]] = _merge(merged_items.get(item[merge_key]), item)
+        return list(merged_items.values())
+    if isinstance(patch, dict):
+        return _merge({}, patch)
+    if isinstance(patch, list):
+        return [_merge(None, item) for item in patch]
+    return copy.deepcopy(patch)
+
+
+@dataclass
+class FakeKubernetes:
+    """A fake Kubernetes API client, replacing lightkube.Client.
+
+    Attrs:
+        objects: The API objects, by kind, namespace, empty for nodes, and name.
+        forbidden: Whether requests are refused, as for an application that is not trusted.
+        unreachable: Whether the API cannot be connected to.
+        patches: The number of patch requests.
+        template_revisions: The number of pod template changes, by StatefulSet name.
+    """
+
+    objects: typing.Dict[ObjectKey, typing.Dict[str, typing.Any]] = field(default_factory=dict)
+    forbidden: bool = False
+    unreachable: bool = False
+    patches: int = 0
+    template_revisions: typing.Dict[str, int] = field(default_factory=dict)
+
+    def add_stateful_set(self, name: str, namespace: str, container_names: typing.List[str]):
+        """Add the StatefulSet Juju creates for an application.
+
+        Args:
+            name: The application name.
+            namespace: The model name.
+            container_names: The names of the containers of the unit pods.
+        """
+        self.objects[("StatefulSet", namespace, name)] = {
+            "metadata": {"name": name, "namespace": namespace},
+            "spec": {
+                "selector": {"matchLabels": {"app.kubernetes.io/name": name}},
+                "serviceName": f"{name}-endpoints",
+                "template": {
+                    "metadata": {"labels": {"app.kubernetes.io/name": name}},
+                    "spec": {"containers": [{"name": name} for name in container_names]},
+                },
+            },
+        }
+        self.template_revisions[name] = 0
+
+    def add_node(self, name: str, labels: typing.Dict[str, str]) -> None:
+        """Add a cluster node.
+
+        Args:
+            name: The node name.
+            labels: The node labels.
+        """
+        self.objects[("Node", "", name)] = {"metadata": {"name": name, "labels": labels}}
+
+    def add_pod(self, name: str, namespace: str, node_name: str) -> None:
+        """Add a unit pod scheduled on a node.
+
+        Args:
+            name: The pod name.
+            namespace: The model name.
+            node_name: The name of the node the pod runs on, empty if not scheduled.
+        """
+        self.objects[("Pod", namespace, name)] = {
+            "metadata": {"name": name, "namespace": namespace},
+            "spec": {"containers": [], "nodeName": node_name},
+        }
+
+    def get_pod_spec(self, name: str, namespace: str) -> typing.Dict[str, typing.Any]:
+        """Get the pod spec of the pod template of a StatefulSet.
+
+        Args:
+            name: The StatefulSet name.
+            namespace: The StatefulSet namespace.
+
+        Returns:
+            The pod spec as an API object.
+        """
+        return self.objects[("StatefulSet", namespace, name)]["spec"]["template"]["spec"]
+
+    def _get_object(self, kind: str, name: str, namespace: str) -> typing.Dict[str, typing.Any]:
+        """Get an API object, failing requests when unreachable or forbidden.
+
+        Args:
+            kind: The object kind.
+            name: The object name.
+            namespace: The object namespace, empty for cluster objects.
+
+        Raises:
+            ConnectError: if the API is unreachable.
+            ApiError: if requests are forbidden or the object does not exist.
+
+        Returns:
+            The API object.
+        """
+        if self.unreachable:
+            raise httpx.ConnectError("connection refused")
+        if self.forbidden:
+            raise ApiError(status=Status(code=403, message="forbidden", reason="Forbidden"))
+        if (kind, namespace, name) not in self.objects:
+            raise ApiError(status=Status(code=404, message="not found", reason="NotFound"))
+        return self.objects[(kind, namespace, name)]
+
+    def get(self, res: typing.Any, name: str, *, namespace: str = "") -> typing.Any:
+        """Get an API object.
+
+        Args:
+            res: The resource type.
+            name: The object name.
+            namespace: The object namespace, empty for cluster objects.
+
+        Returns:
+            The object.
+        """
+        return res.from_dict(copy.deepcopy(self._get_object(res.__name__, name, namespace)))
+
+    def patch(
+        self,
+        res: typing.Type[StatefulSet],
+        name: str,
+        obj: typing.Dict[str, typing.Any],
+        *,
+        namespace: str,
+    ) -> StatefulSet:
+        """Apply a strategic merge patch to a StatefulSet.
+
+        Args:
+            res: The StatefulSet resource type.
+            name: The StatefulSet name.
+            obj: The patch.
+            namespace: The StatefulSet namespace.
+
+        Returns:
+            The patched StatefulSet.
+        """
+        current = self._get_object("StatefulSet", name, namespace)
+        self.patches += 1
+        patched = _merge(current, obj)
+        if patched["spec"]["template"] != current["spec"]["template"]:
+            self.template_revisions[name] += 1
+        self.objects[("StatefulSet", namespace, name)] = patched
+        return typing.cast(StatefulSet, res.from_dict(copy.deepcopy(patched)))
@@ -11,9 +11,16 @@ import ops
 import pytest
 from ops.testing import Harness
 
+try:
+    from ops._private.harness import _TestingPebbleClient
+except ImportError:  # pragma: no cover
+    from ops.testing import _TestingPebbleClient  # type: ignore
+
+import k8s
 import server
 import state
 from charm import JenkinsAgentCharm
+from tests.fake_kubernetes import FakeKubernetes
 
 
 @pytest.fixture(scope="function", name="harness")
@@ -26,6 +33,93 @@ def harness_fixture():
     harness.cleanup()
 
 
+@pytest.fixture(scope="function", name="begin_charm")
+def begin_charm_fixture(monkeypatch: pytest.MonkeyPatch, harness: Harness):
+    """Begin the charm with the workload container ready and the agent JAR download mocked."""
+
+    def begin_charm(
+        config: typing.Mapping[str, typing.Any], valid: bool = True
+    ) -> JenkinsAgentCharm:
+        """Begin the charm.
+
+        Args:
+            config: The charm configuration.
+            valid: Whether the agent credentials are valid.
+
+        Returns:
+            The charm.
+        """
+        monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: "sha256")
+        monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: valid)
+        harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+        harness.update_config(dict(config))
+        harness.begin()
+        return typing.cast(JenkinsAgentCharm, harness.charm)
+
+    return begin_charm
+
+
+@pytest.fixture(scope="function", name="fake_kubernetes")
+def fake_kubernetes_fixture(monkeypatch: pytest.MonkeyPatch, harness: Harness):
+    """The Kubernetes API of the model, with the StatefulSet of the application."""
+    fake_kubernetes = FakeKubernetes()
+    fake_kubernetes.add_stateful_set(
+        "jenkins-agent-k8s", harness.model.name, ["charm", state.State.jenkins_agent_service_name]
+    )
+    monkeypatch.setattr(k8s, "_get_client", lambda **_kwargs: fake_kubernetes)
+    return fake_kubernetes
+
+
+# The workload container methods calling the Pebble API.
+@pytest.fixture(scope="function", name="record_pebble_calls")
+def record_pebble_calls_fixture(monkeypatch: pytest.MonkeyPatch):
+    """Start recording the Pebble API requests the harness receives."""
+
+    def record_pebble_calls() -> typing.List[str]:
+        """Record the Pebble API requests from now on.
+
+        The requests are recorded at the testing Pebble client of the harness, below the
+        memoization of the charm Pebble client, so that memoized reads are not recorded.
+
+        Returns:
+            The names of the Pebble client methods called, appended as they are called.
+        """
+        pebble_calls: typing.List[str] = []
+
+        def get_recording_method(method: str) -> typing.Callable[..., typing.Any]:
+            """Get a Pebble client method that records its calls.
+
+            Args:
+                method: The Pebble client method name.
+
+            Returns:
+                The Pebble client method, recording its name on each call.
+            """
+            original = getattr(_TestingPebbleClient, method)
+
+            def recording_method(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+                """Record the call and call the Pebble client method.
+
+                Args:
+                    args: The positional arguments of the method.
+                    kwargs: The keyword arguments of the method.
+
+                Returns:
+                    The result of the method.
+                """
+                pebble_calls.append(method)
+                return original(*args, **kwargs)
+
+            return recording_method
+
+        for method, attribute in vars(_TestingPebbleClient).items():
+            if callable(attribute) and not method.startswith("_"):
+                monkeypatch.setattr(_TestingPebbleClient, method, get_recording_method(method))
+        return pebble_calls
+
+    return record_pebble_calls
+
+
 @pytest.fixture(scope="function", name="config")
 def config_fixture():
     """The Jenkins testing configuration values."""
@@ -81,6 +175,61 @@ def get_valid_relation_data_fixture():
     return get_valid_relation_data
 
 
+@pytest.fixture(scope="function", name="begin_with_agent_relation")
+def begin_with_agent_relation_fixture(
+    monkeypatch: pytest.MonkeyPatch,
+    harness: Harness,
+    get_valid_relation_data: typing.Callable[[str], typing.Dict[str, str]],
+):
+    """Begin the charm with an agent started from the agent relation."""
+
+    def begin_with_agent_relation() -> int:
+        """Begin the charm with the initial hooks and an agent relation.
+
+        Returns:
+            The agent relation ID.
+        """
+        monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: None)
+        harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+        relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+        harness.add_relation_unit(relation_id, "jenkins/0")
+        harness.update_relation_data(
+            relation_id, "jenkins/0", get_valid_relation_data(state.AGENT_RELATION)
+        )
+        harness.begin_with_initial_hooks()
+        return relation_id
+
+    return begin_with_agent_relation
+
+
+@pytest.fixture(scope="function", name="add_agent_layer")
+def add_agent_layer_fixture(harness: Harness):
+    """Add the layer of an agent connecting to a Jenkins controller to the workload container."""
+
+    def add_agent_layer() -> None:
+        """Add the agent layer and the agent JAR to the workload container of the begun charm."""
+        container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+        container.add_layer(
+            "jenkins-agent-k8s-layer",
+            {
+                "services": {
+                    state.State.jenkins_agent_service_name: {
+                        "override": "replace",
+                        "command": str(server.ENTRYSCRIPT_PATH),
+                        "environment": {
+                            "JENKINS_URL": "http://jenkins:8080",
+                            "JENKINS_AGENT": "jenkins-agent-k8s-0",
+                            "JENKINS_TOKEN": "secret",
+                        },
+                    }
+                }
+            },
+        )
+        container.push(server.AGENT_JAR_PATH, "agent.jar", make_dirs=True)
+
+    return add_agent_layer
+
+
 @pytest.fixture(scope="function", name="get_event_relation_data")
 def get_event_relation_data_fixture(
     get_mock_relation_changed_event: typing.Callable[[str], unittest.mock.MagicMock],
@@ -3,8 +3,13 @@
 
 """Constants used in the unit tests module."""
 
-
 ACTIVE_STATUS_NAME = "active"
 BLOCKED_STATUS_NAME = "blocked"
 MAINTENANCE_STATUS_NAME = "maintenance"
 WAITING_STATUS_NAME = "waiting"
+# The cumulative import time budget of the charm modules, relative to the import time of ops so
+# that it holds on slower machines. The charm modules measured 0.43 to 0.51 times the import time
+# of ops, and importing requests again adds about 0.45.
+IMPORT_TIME_BUDGET_RATIO = 0.65
+# The number of imports measured, the fastest of which is checked against the budget.
+IMPORT_TIME_RUNS = 3
@@ -0,0 +1,313 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Jenkins-agent-k8s download admission module tests."""
+
+# Need access to protected functions for testing
+# pylint:disable=protected-access
+
+import json
+import time
+import typing
+from unittest.mock import MagicMock
+
+import pytest
+from ops.testing import Harness
+
+import admission
+import server
+import state
+from charm import JenkinsAgentCharm
+
+from .constants import WAITING_STATUS_NAME
+
+SERVER_URL = "http://test-jenkins-url"
+
+
+def add_peers(harness: Harness, requesting: typing.Iterable[str] = ()) -> int:
+    """Add the peer relation with two peer units.
+
+    Args:
+        harness: The harness.
+        requesting: The names of the peer units requesting a download slot.
+
+    Returns:
+        The peer relation ID.
+    """
+    relation_id = harness.add_relation(admission.PEER_RELATION, "jenkins-agent-k8s")
+    for unit_name in ("jenkins-agent-k8s/1", "jenkins-agent-k8s/2"):
+        harness.add_relation_unit(relation_id, unit_name)
+        if unit_name in requesting:
+            harness.update_relation_data(
+                relation_id, unit_name, {admission.REQUEST_KEY: SERVER_URL}
+            )
+    return relation_id
+
+
+def get_admitted(harness: Harness, relation_id: int) -> typing.List[str]:
+    """Get the units admitted by the leader.
+
+    Args:
+        harness: The harness.
+        relation_id: The peer relation ID.
+
+    Returns:
+        The names of the admitted units.
+    """
+    return json.loads(
+        harness.get_relation_data(relation_id, "jenkins-agent-k8s").get(
+            admission.ADMITTED_KEY, "[]"
+        )
+    )
+
+
+def test_request_without_peers(harness: Harness):
+    """
+    arrange: given a unit without peers.
+    act: when a download slot is requested.
+    assert: the unit may download.
+    """
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+
+    assert jenkins_charm.download_admission.request(SERVER_URL)
+
+
+def test_request_leader_admits_up_to_limit(harness: Harness):
+    """
+    arrange: given a leader unit limited to two concurrent downloaders and a requesting peer.
+    act: when the leader requests a download slot, then another peer requests one.
+    assert: the first two requesting units are admitted, the third once a slot is released.
+    """
+    harness.update_config({admission.CONCURRENCY_CONFIG: 2})
+    harness.set_leader(True)
+    relation_id = add_peers(harness, requesting=("jenkins-agent-k8s/1",))
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+
+    assert jenkins_charm.download_admission.request(SERVER_URL)
+    harness.update_relation_data(
+        relation_id, "jenkins-agent-k8s/2", {admission.REQUEST_KEY: SERVER_URL}
+    )
+
+    assert get_admitted(harness, relation_id) == ["jenkins-agent-k8s/0", "jenkins-agent-k8s/1"]
+    jenkins_charm.download_admission.release()
+    assert get_admitted(harness, relation_id) == ["jenkins-agent-k8s/1", "jenkins-agent-k8s/2"]
+
+
+def test_request_not_admitted(harness: Harness):
+    """
+    arrange: given a non-leader unit with peers and no download slot admitted to it.
+    act: when a download slot is requested.
+    assert: the unit requests a slot in its databag and may not download.
+    """
+    relation_id = add_peers(harness)
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+
+    admitted = jenkins_charm.download_admission.request(SERVER_URL)
+
+    assert not admitted
+    unit_databag = harness.get_relation_data(relation_id, "jenkins-agent-k8s/0")
+    assert unit_databag[admission.REQUEST_KEY] == SERVER_URL
+
+
+def test_request_admission_timeout(monkeypatch: pytest.MonkeyPatch, harness: Harness):
+    """
+    arrange: given a non-leader unit that requested a download slot that was not admitted.
+    act: when a download slot is requested after the jittered admission timeout.
+    assert: the unit may download.
+    """
+    add_peers(harness)
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    jenkins_charm.download_admission.request(SERVER_URL)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 2 * admission.ADMISSION_TIMEOUT_SECONDS + 1)
+
+    assert jenkins_charm.download_admission.request(SERVER_URL)
+
+
+def test_release_failed_backs_off(monkeypatch: pytest.MonkeyPatch, harness: Harness):
+    """
+    arrange: given a leader unit with peers admitted to download.
+    act: when the download fails twice, then succeeds.
+    assert: the unit backs off for a doubling delay after each failure and no longer once the
+        download succeeded.
+    """
+    monkeypatch.setattr(admission.random, "uniform", lambda _low, high: high)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    harness.set_leader(True)
+    add_peers(harness)
+    harness.begin()
+    download_admission = typing.cast(JenkinsAgentCharm, harness.charm).download_admission
+    assert download_admission.request(SERVER_URL)
+
+    download_admission.release(failed=True)
+
+    assert not download_admission.request(SERVER_URL)
+    monkeypatch.setattr(time, "time", lambda: now + admission.RETRY_DELAY_SECONDS)
+    assert download_admission.request(SERVER_URL)
+    download_admission.release(failed=True)
+    retry_time = typing.cast(float, download_admission._stored.retry_time)
+    assert retry_time == now + 3 * admission.RETRY_DELAY_SECONDS
+    download_admission.release()
+    assert download_admission._stored.failures == 0
+
+
+def test_reconcile_download_error_backs_off(
+    monkeypatch: pytest.MonkeyPatch,
+    harness: Harness,
+    raise_exception: typing.Callable,
+    config: typing.Dict[str, str],
+):
+    """
+    arrange: given a configured leader unit with peers and an unreachable Jenkins server.
+    act: when the config changed event is handled.
+    assert: the hook succeeds with the download slot released and the backoff committed.
+    """
+    monkeypatch.setattr(admission.random, "uniform", lambda _low, high: high)
+    monkeypatch.setattr(time, "time", lambda: 0.0)
+    monkeypatch.setattr(
+        server,
+        "download_jenkins_agent",
+        lambda *_args, **_kwargs: raise_exception(server.AgentJarDownloadError("unreachable")),
+    )
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config(config)
+    harness.set_leader(True)
+    relation_id = add_peers(harness)
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+
+    jenkins_charm.on.config_changed.emit()
+
+    harness.framework.commit()
+    stored = harness.framework._storage.load_snapshot(
+        jenkins_charm.download_admission._stored._data.handle.path
+    )
+    assert stored["failures"] == 1
+    assert stored["retry_time"] == admission.RETRY_DELAY_SECONDS
+    assert not get_admitted(harness, relation_id)
+    unit_databag = harness.get_relation_data(relation_id, "jenkins-agent-k8s/0")
+    assert admission.REQUEST_KEY not in unit_databag
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    assert jenkins_charm.unit.status.message == (
+        "Agent JAR download failed, retrying after 00:00:30 UTC."
+    )
+
+
+def test_reconcile_backing_off_without_peers(
+    monkeypatch: pytest.MonkeyPatch, harness: Harness, config: typing.Dict[str, str]
+):
+    """
+    arrange: given a configured unit without peers backing off after a failed download.
+    act: when reconcile is called.
+    assert: the agent JAR is not downloaded and the unit waits to retry the download.
+    """
+    mock_download = MagicMock(spec=server.download_jenkins_agent)
+    monkeypatch.setattr(server, "download_jenkins_agent", mock_download)
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config(config)
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    jenkins_charm.download_admission._stored.retry_time = time.time() + 60
+
+    jenkins_charm.reconciler.reconcile()
+
+    mock_download.assert_not_called()
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    assert jenkins_charm.unit.status.message.startswith("Agent JAR download failed")
+
+
+def test_reconcile_waits_for_download_slot(
+    monkeypatch: pytest.MonkeyPatch, harness: Harness, config: typing.Dict[str, str]
+):
+    """
+    arrange: given a configured non-leader unit with peers and no download slot admitted.
+    act: when reconcile is called.
+    assert: the agent JAR is not downloaded and the unit waits for a download slot.
+    """
+    mock_download = MagicMock(spec=server.download_jenkins_agent)
+    monkeypatch.setattr(server, "download_jenkins_agent", mock_download)
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config(config)
+    add_peers(harness)
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+
+    jenkins_charm.reconciler.reconcile()
+
+    mock_download.assert_not_called()
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    assert jenkins_charm.unit.status.message == "Waiting for agent JAR download slot."
+
+
+@pytest.mark.parametrize(
+    "digest, requested",
+    [
+        pytest.param(None, False, id="server unreachable"),
+        pytest.param(server.AgentJarDigest(size=9, sha256="sha256"), False, id="sha256 matches"),
+        pytest.param(server.AgentJarDigest(size=9, sha256="other"), True, id="sha256 differs"),
+        pytest.param(server.AgentJarDigest(size=9), False, id="size matches"),
+        pytest.param(server.AgentJarDigest(size=10), True, id="size differs"),
+    ],
+)
+def test_reconcile_downloaded_agent_jar(
+    monkeypatch: pytest.MonkeyPatch,
+    harness: Harness,
+    config: typing.Dict[str, str],
+    digest: typing.Optional[server.AgentJarDigest],
+    requested: bool,
+):
+    """
+    arrange: given a non-leader unit with peers that already downloaded an agent JAR.
+    act: when reconcile is called.
+    assert: a download slot is requested only if the agent JAR does not match the server.
+    """
+    monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: True)
+    monkeypatch.setattr(server, "get_agent_jar_digest", lambda _server_url: digest)
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config(config)
+    relation_id = add_peers(harness)
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+    container.push(server.AGENT_JAR_PATH, b"agent-jar", make_dirs=True)
+    jenkins_charm.reconciler._stored.jar_url = config["jenkins_url"]
+    jenkins_charm.reconciler._stored.jar_sha256 = "sha256"
+
+    jenkins_charm.reconciler.reconcile()
+
+    unit_databag = harness.get_relation_data(relation_id, "jenkins-agent-k8s/0")
+    assert (admission.REQUEST_KEY in unit_databag) == requested
+
+
+def test_agent_peers_changed_reconciles(
+    monkeypatch: pytest.MonkeyPatch, harness: Harness, config: typing.Dict[str, str]
+):
+    """
+    arrange: given a configured non-leader unit waiting for a download slot.
+    act: when the leader admits the unit.
+    assert: the agent JAR is downloaded and the download slot released.
+    """
+    mock_download = MagicMock(spec=server.download_jenkins_agent, return_value="sha256")
+    monkeypatch.setattr(server, "download_jenkins_agent", mock_download)
+    monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: True)
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config(config)
+    relation_id = add_peers(harness)
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    jenkins_charm.reconciler.reconcile()
+
+    harness.update_relation_data(
+        relation_id,
+        "jenkins-agent-k8s",
+        {admission.ADMITTED_KEY: json.dumps(["jenkins-agent-k8s/0"])},
+    )
+
+    mock_download.assert_called_once()
+    unit_databag = harness.get_relation_data(relation_id, "jenkins-agent-k8s/0")
+    assert admission.REQUEST_KEY not in unit_databag
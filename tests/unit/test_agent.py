@@ -6,12 +6,15 @@
 # Need access to protected functions for testing
 # pylint:disable=protected-access
 
+import os
 import typing
 import unittest.mock
 
 import ops.testing
 import pytest
 
+import admission
+import metrics
 import pebble
 import server
 import state
@@ -20,34 +23,28 @@ from charm import JenkinsAgentCharm
 from .constants import ACTIVE_STATUS_NAME, BLOCKED_STATUS_NAME, WAITING_STATUS_NAME
 
 
-def test_agent_relation_joined_config_priority(
+def test_agent_relation_joined_with_config(
+    monkeypatch: pytest.MonkeyPatch,
     harness: ops.testing.Harness,
     config: typing.Dict[str, str],
 ):
     """
-    arrange: given an agent.
-    act: when a agent relation joined event is triggered.
-    assert: the unit updates databag adhering to jenkins_agent_v0 interface.
+    arrange: given an agent with juju configuration values and four executors.
+    act: when an agent relation joined event is triggered.
+    assert: the unit databag advertises the share of executors of the relation controller.
     """
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: None)
+    monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: True)
     relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
     harness.add_relation_unit(relation_id, "jenkins/0")
     harness.update_config(config)
+
     harness.begin_with_initial_hooks()
-    model_relation = harness.model.get_relation(state.AGENT_RELATION, relation_id)
-    assert model_relation, "Relation cannot be None"
-    jenkins_unit = next(iter(model_relation.units))
-    mock_relation_data_content = unittest.mock.MagicMock(spec=ops.RelationDataContent)
-    mock_relation_data = {jenkins_unit: mock_relation_data_content}
-    mock_relation = unittest.mock.MagicMock(spec=ops.Relation)
-    mock_relation.name = state.AGENT_RELATION
-    mock_relation.data = mock_relation_data
-    mock_relation_joined_event = unittest.mock.MagicMock(sepc=ops.RelationJoinedEvent)
-    mock_relation_joined_event.relation = mock_relation
 
     jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
-    jenkins_charm.agent_observer._on_agent_relation_joined(mock_relation_joined_event)
-
-    mock_relation_data_content.update.assert_not_called()
+    relation_data = harness.get_relation_data(relation_id, jenkins_charm.unit.name)
+    assert relation_data["executors"] == "2"
 
 
 def test_agent_relation_joined_agent_relation(harness: ops.testing.Harness):
@@ -68,86 +65,282 @@ def test_agent_relation_joined_agent_relation(harness: ops.testing.Harness):
     assert "name" in relation_data and relation_data["name"]
 
 
-def test_agent_relation_changed_relation_config_priority(
+def test_agent_relation_joined_second_relation(
+    monkeypatch: pytest.MonkeyPatch, harness: ops.testing.Harness
+):
+    """
+    arrange: given an agent with four executors related to two Jenkins servers.
+    act: when the second agent relation joined handler is called.
+    assert: the executors are split between the controllers, the gauge is the unit total.
+    """
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+    relation_ids = []
+    for remote_app in ("jenkins", "jenkins-other"):
+        relation_ids.append(harness.add_relation(state.AGENT_RELATION, remote_app))
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    mock_event = unittest.mock.MagicMock(spec=ops.RelationJoinedEvent)
+    mock_event.relation = harness.model.get_relation(state.AGENT_RELATION, relation_ids[1])
+
+    jenkins_charm.agent_observer._on_agent_relation_joined(mock_event)
+
+    assert [
+        harness.get_relation_data(relation_id, jenkins_charm.unit.name)["executors"]
+        for relation_id in relation_ids
+    ] == ["2", "2"]
+    assert metrics.REGISTRY.gauges["jenkins_agent_executors"] == 4
+
+
+def test_agent_relation_joined_more_controllers_than_executors(
+    monkeypatch: pytest.MonkeyPatch, harness: ops.testing.Harness
+):
+    """
+    arrange: given an agent with one executor related to two Jenkins servers.
+    act: when the second agent relation joined handler is called.
+    assert: only the relation of the primary controller advertises the executor.
+    """
+    monkeypatch.setattr(os, "cpu_count", lambda: 1)
+    relation_ids = []
+    for remote_app in ("jenkins", "jenkins-other"):
+        relation_ids.append(harness.add_relation(state.AGENT_RELATION, remote_app))
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    mock_event = unittest.mock.MagicMock(spec=ops.RelationJoinedEvent)
+    mock_event.relation = harness.model.get_relation(state.AGENT_RELATION, relation_ids[1])
+
+    jenkins_charm.agent_observer._on_agent_relation_joined(mock_event)
+
+    assert harness.get_relation_data(relation_ids[0], jenkins_charm.unit.name)["executors"] == "1"
+    assert not harness.get_relation_data(relation_ids[1], jenkins_charm.unit.name)
+    assert metrics.REGISTRY.gauges["jenkins_agent_executors"] == 1
+
+
+def test_agent_peers_changed_applied_cpu(
+    monkeypatch: pytest.MonkeyPatch, harness: ops.testing.Harness
+):
+    """
+    arrange: given an agent on a node with four CPUs related to a Jenkins server.
+    act: when the leader records the CPU quantity of the applied pod template.
+    assert: the executors advertised to the Jenkins server follow the applied CPU quantity.
+    """
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+    peer_relation_id = harness.add_relation(admission.PEER_RELATION, "jenkins-agent-k8s")
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    jenkins_charm.agent_observer.publish_agent_metadata()
+    assert harness.get_relation_data(relation_id, jenkins_charm.unit.name)["executors"] == "4"
+
+    harness.update_relation_data(
+        peer_relation_id, "jenkins-agent-k8s", {state.APPLIED_CPU_KEY: "2"}
+    )
+    # The state is initialized on each hook, the harness reuses the charm.
+    jenkins_charm.agent_observer.state = state.State.from_charm(jenkins_charm)
+    harness.charm.on[admission.PEER_RELATION].relation_changed.emit(
+        harness.model.get_relation(admission.PEER_RELATION, peer_relation_id),
+        harness.model.app,
+    )
+
+    assert harness.get_relation_data(relation_id, jenkins_charm.unit.name)["executors"] == "2"
+
+
+def test_agent_relation_joined_unchanged_data(harness: ops.testing.Harness):
+    """
+    arrange: given an agent whose databag already holds the current agent metadata.
+    act: when an agent relation joined event is triggered.
+    assert: the unit databag is not written to.
+    """
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    relation_data = jenkins_charm.state.agent_meta.get_jenkins_agent_v0_interface_dict()
+    mock_relation_data_content = unittest.mock.MagicMock(spec=ops.RelationDataContent)
+    mock_relation_data_content.get.side_effect = relation_data.get
+    mock_relation = unittest.mock.MagicMock(spec=ops.Relation)
+    mock_relation.id = 0
+    mock_relation.name = state.AGENT_RELATION
+    mock_relation.data = {jenkins_charm.unit: mock_relation_data_content}
+    mock_relation_joined_event = unittest.mock.MagicMock(spec=ops.RelationJoinedEvent)
+    mock_relation_joined_event.relation = mock_relation
+
+    jenkins_charm.agent_observer._on_agent_relation_joined(mock_relation_joined_event)
+
+    mock_relation_data_content.update.assert_not_called()
+
+
+def test_agent_metadata_changed_republish(harness: ops.testing.Harness):
+    """
+    arrange: given an agent related to Jenkins with outdated labels in the unit databag.
+    act: when the agent metadata changed handler is called.
+    assert: only the labels key is written to the unit databag.
+    """
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+    harness.add_relation_unit(relation_id, "jenkins/0")
+    harness.update_config({"jenkins_agent_labels": "new-label"})
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    relation_data = jenkins_charm.state.agent_meta.get_jenkins_agent_v0_interface_dict()
+    harness.update_relation_data(
+        relation_id, jenkins_charm.unit.name, {**relation_data, "labels": "old-label"}
+    )
+    mock_update = unittest.mock.MagicMock(spec=ops.RelationDataContent.update)
+
+    with unittest.mock.patch.object(ops.RelationDataContent, "update", mock_update):
+        jenkins_charm.agent_observer._on_agent_metadata_changed(
+            unittest.mock.MagicMock(spec=ops.ConfigChangedEvent)
+        )
+
+    mock_update.assert_called_once_with({"labels": "new-label"})
+
+
+def test_agent_metadata_changed_partitions_executors(
+    monkeypatch: pytest.MonkeyPatch, harness: ops.testing.Harness
+):
+    """
+    arrange: given an agent with five executors related to two Jenkins servers.
+    act: when the agent metadata changed handler is called.
+    assert: the executors are split across the relations, the first relation getting the extra.
+    """
+    monkeypatch.setattr(os, "cpu_count", lambda: 5)
+    relation_ids = []
+    for remote_app in ("jenkins", "jenkins-other"):
+        relation_ids.append(harness.add_relation(state.AGENT_RELATION, remote_app))
+        harness.add_relation_unit(relation_ids[-1], f"{remote_app}/0")
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+
+    jenkins_charm.agent_observer._on_agent_metadata_changed(
+        unittest.mock.MagicMock(spec=ops.ConfigChangedEvent)
+    )
+
+    assert [
+        harness.get_relation_data(relation_id, jenkins_charm.unit.name)["executors"]
+        for relation_id in relation_ids
+    ] == ["3", "2"]
+
+
+def test_agent_relation_changed_config_and_relation(
+    monkeypatch: pytest.MonkeyPatch,
     harness: ops.testing.Harness,
     config: typing.Dict[str, str],
-    get_mock_relation_changed_event: typing.Callable[[str], unittest.mock.MagicMock],
+    get_event_relation_data: typing.Callable[
+        [str], typing.Tuple[unittest.mock.MagicMock, typing.Dict[str, str]]
+    ],
 ):
     """
-    arrange: given an agent with juju configuration values.
+    arrange: given an agent with two executors, juju configuration values and an agent relation.
     act: when relation changed event is triggered.
-    assert: nothing happens since configuration values take priority.
+    assert: an agent service is started for both the configured and the related controller.
     """
-    mock_event = get_mock_relation_changed_event(state.AGENT_RELATION)
+    mock_event, relation_data = get_event_relation_data(state.AGENT_RELATION)
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: None)
+    monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: True)
+    harness.set_can_connect("jenkins-agent-k8s", True)
     harness.update_config(config)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+    harness.add_relation_unit(relation_id, "jenkins/0")
+    harness.update_relation_data(relation_id, "jenkins/0", relation_data)
     harness.begin()
 
     jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
     jenkins_charm.agent_observer._on_agent_relation_changed(mock_event)
 
+    services = harness.get_container_pebble_plan("jenkins-agent-k8s").services
+    assert services["jenkins-agent-k8s"].environment["JENKINS_URL"] == config["jenkins_url"]
+    secondary_service = services[f"jenkins-agent-k8s-agent-{relation_id}"]
+    assert secondary_service.environment["JENKINS_URL"] == relation_data["url"]
+    assert jenkins_charm.unit.status.name == ACTIVE_STATUS_NAME
     mock_event.defer.assert_not_called()
 
 
 def test_agent_relation_changed_container_not_ready(
     harness: ops.testing.Harness,
-    get_mock_relation_changed_event: typing.Callable[[str], unittest.mock.MagicMock],
+    get_event_relation_data: typing.Callable[
+        [str], typing.Tuple[unittest.mock.MagicMock, typing.Dict[str, str]]
+    ],
 ):
     """
-    arrange: given an agent with the workload container not yet ready.
+    arrange: given an agent with complete relation data but the workload container not yet ready.
     act: when relation changed event is triggered.
-    assert: the relation changed event is deferred.
+    assert: the unit falls into WaitingStatus and the event is not deferred.
     """
-    mock_event = get_mock_relation_changed_event(state.AGENT_RELATION)
+    mock_event, relation_data = get_event_relation_data(state.AGENT_RELATION)
     harness.set_can_connect("jenkins-agent-k8s", False)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+    harness.add_relation_unit(relation_id, "jenkins/0")
+    harness.update_relation_data(relation_id, "jenkins/0", relation_data)
     harness.begin()
 
     jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
     jenkins_charm.agent_observer._on_agent_relation_changed(mock_event)
 
-    mock_event.defer.assert_called_once()
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    assert jenkins_charm.unit.status.message == "Waiting for workload container."
+    mock_event.defer.assert_not_called()
 
 
 def test_agent_relation_changed_service_running(
+    monkeypatch: pytest.MonkeyPatch,
     harness: ops.testing.Harness,
-    get_mock_relation_changed_event: typing.Callable[[str], unittest.mock.MagicMock],
+    get_event_relation_data: typing.Callable[
+        [str], typing.Tuple[unittest.mock.MagicMock, typing.Dict[str, str]]
+    ],
 ):
     """
-    arrange: given a workload container with existing $JENKINS_HOME/agents/.ready file.
+    arrange: given an agent that has been started from the agent relation.
     act: when relation changed event is triggered.
     assert: nothing happens since the agent is already registered.
     """
-    mock_event = get_mock_relation_changed_event(state.AGENT_RELATION)
+    mock_event, relation_data = get_event_relation_data(state.AGENT_RELATION)
+    mock_download = unittest.mock.MagicMock(
+        spec=server.download_jenkins_agent, return_value="agent-jar-sha256"
+    )
+    monkeypatch.setattr(server, "download_jenkins_agent", mock_download)
     harness.set_can_connect("jenkins-agent-k8s", True)
-    container = harness.model.unit.get_container("jenkins-agent-k8s")
-    container.push(server.AGENT_READY_PATH, "test", encoding="utf-8", make_dirs=True)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+    harness.add_relation_unit(relation_id, "jenkins/0")
+    harness.update_relation_data(relation_id, "jenkins/0", relation_data)
     harness.begin()
 
     jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
     jenkins_charm.agent_observer._on_agent_relation_changed(mock_event)
+    jenkins_charm.agent_observer._on_agent_relation_changed(mock_event)
 
+    mock_download.assert_called_once()
     mock_event.defer.assert_not_called()
 
 
 def test_agent_relation_changed_incomplete_relation_data(
+    monkeypatch: pytest.MonkeyPatch,
     harness: ops.testing.Harness,
     get_mock_relation_changed_event: typing.Callable[[str], ops.RelationChangedEvent],
 ):
     """
-    arrange: given an agent with incomplete relation data.
+    arrange: given an agent with relation data that has the server URL but not the secret.
     act: when relation changed event is triggered.
-    assert: charm falls into waiting status.
+    assert: the agent JAR is prefetched from the server and charm falls into waiting status.
     """
+    mock_download = unittest.mock.MagicMock(
+        spec=server.download_jenkins_agent, return_value="agent-jar-sha256"
+    )
+    monkeypatch.setattr(server, "download_jenkins_agent", mock_download)
     mock_event = get_mock_relation_changed_event(state.AGENT_RELATION)
     harness.set_can_connect("jenkins-agent-k8s", True)
     relation_id = harness.add_relation(state.AGENT_RELATION, remote_app="jenkins")
     harness.add_relation_unit(relation_id, "jenkins/0")
-    harness.update_relation_data(relation_id, "jenkins/0", {"url": "test"})
+    harness.update_relation_data(relation_id, "jenkins/0", {"url": "http://test"})
     harness.begin()
 
     jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
     jenkins_charm.agent_observer._on_agent_relation_changed(mock_event)
 
     assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    mock_download.assert_called_once_with(
+        server_url="http://test",
+        container=unittest.mock.ANY,
+        sources=server.AgentJarSources(),
+        agent_jar_path=server.AGENT_JAR_PATH,
+    )
 
 
 def test_agent_relation_changed_download_jenkins_agent_fail(
@@ -161,9 +354,9 @@ def test_agent_relation_changed_download_jenkins_agent_fail(
     """
     arrange: given a monkeypatched download_jenkins_agent that raises AgentJarDownloadError.
     act: when _on_agent_relation_changed is called.
-    assert: the unit falls into ErroredStatus.
+    assert: the unit waits to retry the download.
     """
-    (mock_event, relation_data) = get_event_relation_data(state.AGENT_RELATION)
+    mock_event, relation_data = get_event_relation_data(state.AGENT_RELATION)
     # The monkeypatched attribute download_jenkins_agent is used across unit tests.
     monkeypatch.setattr(
         server,  # pylint: disable=duplicate-code
@@ -181,10 +374,11 @@ def test_agent_relation_changed_download_jenkins_agent_fail(
     harness.begin()
 
     jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
-    with pytest.raises(server.AgentJarDownloadError) as exc:
-        jenkins_charm.agent_observer._on_agent_relation_changed(mock_event)
 
-        assert exc.value == "Failed to download Jenkins agent executable."
+    jenkins_charm.agent_observer._on_agent_relation_changed(mock_event)
+
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    assert jenkins_charm.unit.status.message.startswith("Agent JAR download failed")
 
 
 def test_agent_relation_changed(
@@ -199,7 +393,7 @@ def test_agent_relation_changed(
     act: when _on_agent_relation_changed is called.
     assert: the unit falls into ActiveStatus.
     """
-    (mock_event, relation_data) = get_event_relation_data(state.AGENT_RELATION)
+    mock_event, relation_data = get_event_relation_data(state.AGENT_RELATION)
     monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: None)
     monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: True)
     harness.set_can_connect("jenkins-agent-k8s", True)
@@ -218,6 +412,65 @@ def test_agent_relation_changed(
     assert jenkins_charm.unit.status.name == ACTIVE_STATUS_NAME
 
 
+def test_agent_relation_changed_credentials_unchanged(
+    monkeypatch: pytest.MonkeyPatch,
+    harness: ops.testing.Harness,
+    get_event_relation_data: typing.Callable[
+        [str], typing.Tuple[unittest.mock.MagicMock, typing.Dict[str, str]]
+    ],
+):
+    """
+    arrange: given an agent that has been started from the agent relation.
+    act: when relation changed event is triggered again with the same credentials.
+    assert: the workload container is not accessed.
+    """
+    mock_event, relation_data = get_event_relation_data(state.AGENT_RELATION)
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: None)
+    harness.set_can_connect("jenkins-agent-k8s", True)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+    harness.add_relation_unit(relation_id, "jenkins/0")
+    harness.update_relation_data(relation_id, "jenkins/0", relation_data)
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    jenkins_charm.agent_observer._on_agent_relation_changed(mock_event)
+    mock_can_connect = unittest.mock.MagicMock(spec=pebble.CachedContainer.can_connect)
+    monkeypatch.setattr(pebble.CachedContainer, "can_connect", mock_can_connect)
+
+    jenkins_charm.agent_observer._on_agent_relation_changed(mock_event)
+
+    mock_can_connect.assert_not_called()
+    assert jenkins_charm.unit.status.name == ACTIVE_STATUS_NAME
+
+
+def test_agent_relation_changed_scale_out(
+    harness: ops.testing.Harness,
+    begin_with_agent_relation: typing.Callable[[], int],
+    record_pebble_calls: typing.Callable[[], typing.List[str]],
+):
+    """
+    arrange: given an agent that has been started from the agent relation.
+    act: when the Jenkins server adds the secrets of 100 new agent units to the relation.
+    assert: no Pebble API requests are made by the agent, unlike on update status.
+    """
+    relation_id = begin_with_agent_relation()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    fingerprint = typing.cast(str, jenkins_charm.reconciler._stored.fingerprint)
+    assert fingerprint != "", "Agent should be started."
+    pebble_calls = record_pebble_calls()
+
+    for unit_number in range(1, 101):
+        # The harness reuses the charm, forget the memoized Pebble reads as a new hook would.
+        jenkins_charm.container._client._cache.clear()  # pylint: disable=protected-access
+        harness.update_relation_data(
+            relation_id, "jenkins/0", {f"jenkins-agent-k8s-{unit_number}_secret": "secret"}
+        )
+
+    assert not pebble_calls
+    jenkins_charm.container._client._cache.clear()  # pylint: disable=protected-access
+    harness.charm.on.update_status.emit()
+    assert pebble_calls
+
+
 def test_agent_relation_departed_container_not_ready(
     monkeypatch: pytest.MonkeyPatch, harness: ops.testing.Harness
 ):
@@ -228,9 +481,11 @@ def test_agent_relation_departed_container_not_ready(
     """
     mock_stop_agent = unittest.mock.MagicMock(spec=pebble.PebbleService.stop_agent)
     monkeypatch.setattr(pebble.PebbleService, "stop_agent", mock_stop_agent)
-    mock_event = unittest.mock.MagicMock(spec=ops.RelationDepartedEvent)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
     harness.set_can_connect("jenkins-agent-k8s", False)
     harness.begin()
+    mock_event = unittest.mock.MagicMock(spec=ops.RelationDepartedEvent)
+    mock_event.relation = harness.model.get_relation(state.AGENT_RELATION, relation_id)
 
     jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
     jenkins_charm.agent_observer._on_agent_relation_departed(mock_event)
@@ -244,13 +499,106 @@ def test_agent_relation_departed(monkeypatch: pytest.MonkeyPatch, harness: ops.t
     act: when _on_agent_relation_departed is called.
     assert: the unit falls into BlockedStatus.
     """
-    monkeypatch.setattr(pebble.PebbleService, "stop_agent", lambda *_args, **_kwargs: None)
-    mock_event = unittest.mock.MagicMock(spec=ops.RelationDepartedEvent)
+    mock_stop_agent = unittest.mock.MagicMock(spec=pebble.PebbleService.stop_agent)
+    monkeypatch.setattr(pebble.PebbleService, "stop_agent", mock_stop_agent)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
     harness.set_can_connect("jenkins-agent-k8s", True)
     harness.begin()
+    mock_event = unittest.mock.MagicMock(spec=ops.RelationDepartedEvent)
+    mock_event.relation = harness.model.get_relation(state.AGENT_RELATION, relation_id)
 
     jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
     jenkins_charm.agent_observer._on_agent_relation_departed(mock_event)
 
+    mock_stop_agent.assert_called_once()
     assert jenkins_charm.unit.status.name == BLOCKED_STATUS_NAME
     assert jenkins_charm.unit.status.message == "Waiting for config/relation."
+
+
+def test_agent_relation_departed_secondary_controller(
+    monkeypatch: pytest.MonkeyPatch,
+    harness: ops.testing.Harness,
+    config: typing.Dict[str, str],
+):
+    """
+    arrange: given an agent with two executors, juju configuration values and an agent relation.
+    act: when _on_agent_relation_departed is called for the agent relation.
+    assert: only the agent of the related controller is stopped and the unit is not blocked.
+    """
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+    mock_stop_agent = unittest.mock.MagicMock(spec=pebble.PebbleService.stop_agent)
+    monkeypatch.setattr(pebble.PebbleService, "stop_agent", mock_stop_agent)
+    harness.update_config(config)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+    harness.set_can_connect("jenkins-agent-k8s", True)
+    harness.begin()
+    mock_event = unittest.mock.MagicMock(spec=ops.RelationDepartedEvent)
+    mock_event.relation = harness.model.get_relation(state.AGENT_RELATION, relation_id)
+
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    jenkins_charm.agent_observer._on_agent_relation_departed(mock_event)
+
+    mock_stop_agent.assert_called_once()
+    assert jenkins_charm.unit.status.name != BLOCKED_STATUS_NAME
+
+
+def test_agent_relation_broken_container_not_ready(
+    monkeypatch: pytest.MonkeyPatch, harness: ops.testing.Harness
+):
+    """
+    arrange: given a container that is not ready.
+    act: when _on_agent_relation_broken is called.
+    assert: no agent service is stopped.
+    """
+    mock_stop_stale_agents = unittest.mock.MagicMock(spec=pebble.PebbleService.stop_stale_agents)
+    monkeypatch.setattr(pebble.PebbleService, "stop_stale_agents", mock_stop_stale_agents)
+    harness.set_can_connect("jenkins-agent-k8s", False)
+    harness.begin()
+
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    jenkins_charm.agent_observer._on_agent_relation_broken(
+        unittest.mock.MagicMock(spec=ops.RelationBrokenEvent)
+    )
+
+    mock_stop_stale_agents.assert_not_called()
+
+
+def test_agent_relation_broken_promotes_next_relation(
+    monkeypatch: pytest.MonkeyPatch,
+    harness: ops.testing.Harness,
+    get_valid_relation_data: typing.Callable[[str], typing.Dict[str, str]],
+):
+    """
+    arrange: given a running agent of a removed controller and a remaining agent relation.
+    act: when _on_agent_relation_broken is called.
+    assert: the agent service of the removed controller is stopped and the remaining relation
+        becomes the primary controller.
+    """
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: None)
+    harness.set_can_connect("jenkins-agent-k8s", True)
+    relation_data = get_valid_relation_data(state.AGENT_RELATION)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+    harness.add_relation_unit(relation_id, "jenkins/0")
+    harness.update_relation_data(relation_id, "jenkins/0", relation_data)
+    container = harness.model.unit.get_container("jenkins-agent-k8s")
+    stale_service_name = "jenkins-agent-k8s-agent-99"
+    container.add_layer(
+        "stale",
+        {"services": {stale_service_name: {"override": "replace", "command": "agent"}}},
+    )
+    container.start(stale_service_name)
+    harness.begin()
+
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    jenkins_charm.agent_observer._on_agent_relation_broken(
+        unittest.mock.MagicMock(spec=ops.RelationBrokenEvent)
+    )
+
+    assert not container.get_service(stale_service_name).is_running()
+    environment = (
+        harness.get_container_pebble_plan("jenkins-agent-k8s")
+        .services["jenkins-agent-k8s"]
+        .environment
+    )
+    assert environment["JENKINS_URL"] == relation_data["url"]
+    assert jenkins_charm.unit.status.name == ACTIVE_STATUS_NAME
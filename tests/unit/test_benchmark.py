@@ -0,0 +1,232 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Jenkins-agent-k8s benchmark module tests."""
+
+import json
+import typing
+
+import pytest
+from ops.testing import ActionFailed, ExecResult, Harness
+
+import benchmark
+import state
+
+REFERENCE_OUTPUT = {
+    "cpu_mib_per_second": 500.0,
+    "memory_gib_per_second": 5.0,
+    "disk_write_mib_per_second": 200.0,
+    "disk_read_mib_per_second": 500.0,
+}
+
+
+@pytest.mark.parametrize(
+    "factor, controller_round_trip_ms, expected_score, expected_tier",
+    [
+        pytest.param(1.0, None, 100, 2, id="reference"),
+        pytest.param(2.0, None, 200, 1, id="twice as fast"),
+        pytest.param(0.5, None, 50, 3, id="twice as slow"),
+        pytest.param(0.25, None, 25, 4, id="slowest"),
+        pytest.param(1.0, 5.0, 100, 2, id="reference round trip"),
+        pytest.param(1.0, 160.0, 50, 3, id="distant controller"),
+    ],
+)
+def test_results_score(
+    factor: float,
+    controller_round_trip_ms: typing.Optional[float],
+    expected_score: int,
+    expected_tier: int,
+):
+    """
+    arrange: given benchmark results relative to the reference unit.
+    act: when the score and tier are computed.
+    assert: the score is the geometric mean of the results relative to the reference unit.
+    """
+    results = benchmark.BenchmarkResults(
+        **{name: value * factor for name, value in REFERENCE_OUTPUT.items()},
+        controller_round_trip_ms=controller_round_trip_ms,
+    )
+
+    assert results.score == expected_score
+    assert results.tier == expected_tier
+
+
+def test_benchmark_action(harness: Harness):
+    """
+    arrange: given a unit with the performance tier published and an agent relation.
+    act: when the benchmark action is run twice.
+    assert: the results and the previous score are returned and the tier label is published.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config({"jenkins_agent_labels": "builder", "publish_performance_tier": True})
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+    harness.add_relation_unit(relation_id, "jenkins/0")
+    harness.begin()
+    harness.handle_exec(
+        state.State.jenkins_agent_service_name,
+        ["python3"],
+        result=ExecResult(stdout=json.dumps(REFERENCE_OUTPUT)),
+    )
+    harness.run_action("benchmark")
+    harness.handle_exec(
+        state.State.jenkins_agent_service_name,
+        ["python3"],
+        result=ExecResult(
+            stdout=json.dumps({name: value * 2 for name, value in REFERENCE_OUTPUT.items()})
+        ),
+    )
+
+    output = harness.run_action("benchmark")
+
+    assert output.results["cpu-mib-per-second"] == "1000.00"
+    assert output.results["score"] == 200
+    assert output.results["previous-score"] == 100
+    assert output.results["label"] == "perf-tier-1"
+    unit_databag = harness.get_relation_data(relation_id, "jenkins-agent-k8s/0")
+    assert unit_databag["labels"] == "builder,perf-tier-1"
+
+
+@pytest.mark.parametrize(
+    "controller_output, expected_round_trip_ms",
+    [
+        pytest.param({"controller_round_trip_ms": 5}, "5.00", id="reachable"),
+        pytest.param({"controller_error": "timed out"}, None, id="unreachable"),
+    ],
+)
+def test_benchmark_action_controller_url(
+    harness: Harness,
+    add_agent_layer: typing.Callable[[], None],
+    caplog: pytest.LogCaptureFixture,
+    controller_output: typing.Dict[str, typing.Any],
+    expected_round_trip_ms: typing.Optional[str],
+):
+    """
+    arrange: given a running agent connected to a Jenkins controller, reachable or not.
+    act: when the benchmark action is run.
+    assert: the round trip to the controller of the agent is benchmarked if it is reachable.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.begin()
+    add_agent_layer()
+    commands: typing.List[typing.List[str]] = []
+
+    def handle_benchmark(args: typing.Any) -> ExecResult:
+        """Record the benchmark command.
+
+        Args:
+            args: The exec arguments.
+
+        Returns:
+            The benchmark output.
+        """
+        commands.append(args.command)
+        return ExecResult(stdout=json.dumps({**REFERENCE_OUTPUT, **controller_output}))
+
+    harness.handle_exec(
+        state.State.jenkins_agent_service_name, ["python3"], handler=handle_benchmark
+    )
+
+    output = harness.run_action("benchmark")
+
+    assert commands[0][-2:] == ["--url", "http://jenkins:8080"]
+    assert output.results.get("controller-round-trip-ms") == expected_round_trip_ms
+    assert output.results["label"] == "not published"
+    assert ("Controller round trip not measured" in caplog.text) == (
+        expected_round_trip_ms is None
+    )
+
+
+def test_publish_performance_tier_enabled(harness: Harness):
+    """
+    arrange: given a unit benchmarked without publishing the performance tier.
+    act: when the charm is initialized with publish_performance_tier enabled and config changed.
+    assert: the performance tier label of the last benchmark is published.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+    harness.add_relation_unit(relation_id, "jenkins/0")
+    harness.begin()
+    harness.handle_exec(
+        state.State.jenkins_agent_service_name,
+        ["python3"],
+        result=ExecResult(stdout=json.dumps(REFERENCE_OUTPUT)),
+    )
+    harness.run_action("benchmark")
+
+    # The harness reuses the charm, initialize the state and the observer as a new hook would.
+    harness.charm.state.publish_performance_tier = True
+    harness.charm.benchmark_observer._set_performance_tier_label()  # pylint: disable=protected-access
+
+    harness.charm.on.config_changed.emit()
+
+    unit_databag = harness.get_relation_data(relation_id, "jenkins-agent-k8s/0")
+    assert "perf-tier-2" in unit_databag["labels"].split(",")
+
+
+@pytest.mark.parametrize(
+    "result",
+    [
+        pytest.param(ExecResult(exit_code=1, stderr="No such file"), id="script failure"),
+        pytest.param(ExecResult(stdout="{}"), id="unexpected output"),
+    ],
+)
+def test_benchmark_action_failure(harness: Harness, result: ExecResult):
+    """
+    arrange: given a benchmark script failing or printing unexpected results.
+    act: when the benchmark action is run.
+    assert: the action fails.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.begin()
+    harness.handle_exec(state.State.jenkins_agent_service_name, ["python3"], result=result)
+
+    with pytest.raises(ActionFailed):
+        harness.run_action("benchmark")
+
+
+def test_benchmark_action_container_not_ready(harness: Harness):
+    """
+    arrange: given a workload container that is not ready.
+    act: when the benchmark action is run.
+    assert: the action fails.
+    """
+    harness.begin()
+
+    with pytest.raises(ActionFailed):
+        harness.run_action("benchmark")
+
+
+@pytest.mark.parametrize(
+    "stored_results, expected_tier",
+    [
+        pytest.param({**REFERENCE_OUTPUT, "removed_field": 1.0}, 2, id="extra field"),
+        pytest.param({**REFERENCE_OUTPUT, "controller_round_trip_ms": 5.0}, 2, id="every field"),
+        pytest.param(REFERENCE_OUTPUT, 2, id="missing optional field"),
+        pytest.param(
+            {
+                name: value
+                for name, value in REFERENCE_OUTPUT.items()
+                if name != "cpu_mib_per_second"
+            },
+            None,
+            id="missing required field",
+        ),
+    ],
+)
+def test_get_stored_results_other_revision(
+    harness: Harness,
+    stored_results: typing.Dict[str, float],
+    expected_tier: typing.Optional[int],
+):
+    """
+    arrange: given benchmark results stored by another charm revision.
+    act: when the stored results are read.
+    assert: unknown fields are ignored and results missing a required field are not used.
+    """
+    harness.begin()
+    observer = harness.charm.benchmark_observer
+    observer._stored.results = stored_results  # pylint: disable=protected-access
+
+    results = observer._get_stored_results()  # pylint: disable=protected-access
+
+    assert (results.tier if results else None) == expected_tier
@@ -0,0 +1,245 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Jenkins-agent-k8s capabilities module tests."""
+
+import typing
+from pathlib import Path
+
+import ops
+import pytest
+from ops.testing import Harness
+
+import capabilities
+import server
+import state
+from tests.fake_kubernetes import FakeKubernetes
+
+CPUINFO = """processor	: 0
+flags		: fpu sse4_2 aes avx avx2 avx512f
+processor	: 1
+flags		: fpu sse4_2 aes avx avx2 avx512f
+"""
+MEMINFO = "MemTotal:       16318944 kB\nMemFree:         1000000 kB\n"
+MOUNTINFO = """1 0 0:1 / / rw - overlay overlay rw
+2 1 259:1 / /var/lib/jenkins rw - ext4 /dev/nvme0n1p1 rw
+3 1 8:1 / /var/lib/jenkins/cache rw - ext4 /dev/sda1 rw
+4 1 0:2 / /tmp rw - tmpfs tmpfs rw
+5 1 0:3 / /var/lib/jenkins/shared rw - nfs4 nfs-server:/export rw
+6 1 0:4 /
+"""
+CAPABILITIES = capabilities.Capabilities(
+    arch="x86_64",
+    cores=2,
+    memory_gib=4,
+    cpu_flags="aes,avx2",
+    storage="",
+    zone="eu-west-1a",
+)
+
+
+def push_capability_sources(
+    container: ops.Container, cpu_max: str = "max 100000", memory_max: str = "max"
+) -> None:
+    """Push the files the capabilities are detected from to the workload container.
+
+    Args:
+        container: The workload container.
+        cpu_max: The cgroup CPU quota.
+        memory_max: The cgroup memory limit.
+    """
+    for path, content in (
+        (capabilities.CPUINFO_PATH, CPUINFO),
+        (capabilities.MEMINFO_PATH, MEMINFO),
+        (capabilities.MOUNTINFO_PATH, MOUNTINFO),
+        (capabilities.CGROUP_CPU_MAX_PATH, cpu_max),
+        (capabilities.CGROUP_MEMORY_MAX_PATH, memory_max),
+        (capabilities.BLOCK_DEVICES_PATH / "sda" / "queue" / "rotational", "1\n"),
+    ):
+        container.push(path, content, make_dirs=True)
+
+
+@pytest.mark.parametrize(
+    "template, expected_labels",
+    [
+        pytest.param(
+            "cores-{cores},memory-{memory_gib}g",
+            ("cores-2", "memory-4g"),
+            id="values",
+        ),
+        pytest.param("{cpu_flags}", ("aes", "avx2"), id="label per CPU flag"),
+        pytest.param("storage-{storage},{zone}", ("eu-west-1a",), id="undetected capability"),
+        pytest.param(
+            "builder, {arch}-{cpu_flags}",
+            ("builder", "x86_64-aes", "x86_64-avx2"),
+            id="static label",
+        ),
+        pytest.param("builder,{cores},builder", ("builder", "2"), id="duplicate label"),
+    ],
+)
+def test_format_labels(template: str, expected_labels: typing.Tuple[str, ...]):
+    """
+    arrange: given unit capabilities without a detected storage type.
+    act: when format_labels is called with a label template.
+    assert: a label is generated per capability value, labels of undetected capabilities omitted.
+    """
+    labels = capabilities.format_labels(template, CAPABILITIES)
+
+    assert labels == expected_labels
+
+
+@pytest.mark.parametrize(
+    "workdir, cpu_max, memory_max, expected_cores, expected_memory_gib, expected_storage",
+    [
+        pytest.param(server.JENKINS_WORKDIR, "max 100000", "max", 2, 15, "nvme", id="unlimited"),
+        pytest.param(
+            server.JENKINS_WORKDIR / "cache",
+            "250000 100000",
+            str(6 * 2**30),
+            2,
+            6,
+            "hdd",
+            id="limited",
+        ),
+        pytest.param(server.JENKINS_WORKDIR.parent, "max 100000", "max", 2, 15, "", id="overlay"),
+        pytest.param(
+            server.JENKINS_WORKDIR / "shared", "max 100000", "max", 2, 15, "network", id="network"
+        ),
+        pytest.param(Path("/tmp/jenkins"), "max 100000", "max", 2, 15, "memory", id="memory"),
+    ],
+)
+def test_detect(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    harness: Harness,
+    workdir: Path,
+    cpu_max: str,
+    memory_max: str,
+    expected_cores: int,
+    expected_memory_gib: int,
+    expected_storage: str,
+):
+    """
+    arrange: given the CPU, memory, cgroup and mounts files of the workload container.
+    act: when the capabilities are detected.
+    assert: the cgroup limits, the CPU flags and the storage type of the workdir are detected.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.begin()
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+    push_capability_sources(container, cpu_max, memory_max)
+
+    detected = capabilities.detect(container, workdir, "zone-a")
+
+    assert detected.cores == expected_cores
+    assert detected.memory_gib == expected_memory_gib
+    assert detected.cpu_flags == "aes,avx,avx2,avx512f"
+    assert detected.storage == expected_storage
+    assert detected.zone == "zone-a"
+
+
+def test_detect_sources_not_readable(monkeypatch: pytest.MonkeyPatch, harness: Harness):
+    """
+    arrange: given a workload container without the CPU, memory, cgroup and mounts files.
+    act: when the capabilities are detected.
+    assert: the CPUs of the charm container are detected, the other capabilities are unknown.
+    """
+    monkeypatch.setattr(capabilities.os, "cpu_count", lambda: 3)
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.begin()
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+
+    detected = capabilities.detect(container, server.JENKINS_WORKDIR, "")
+
+    assert detected.cores == 3
+    assert detected.memory_gib == 0
+    assert detected.cpu_flags == ""
+    assert detected.storage == ""
+
+
+def test_pebble_ready_publishes_capability_labels(
+    harness: Harness,
+    fake_kubernetes: FakeKubernetes,
+):
+    """
+    arrange: given a label template and an agent relation.
+    act: when the workload container is ready, on a node in zone eu-west-1a.
+    assert: the capability labels are published next to the configured labels.
+    """
+    fake_kubernetes.add_node("node-0", {"topology.kubernetes.io/zone": "eu-west-1a"})
+    fake_kubernetes.add_pod("jenkins-agent-k8s-0", harness.model.name, "node-0")
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config(
+        {
+            "jenkins_agent_labels": "builder",
+            "jenkins_agent_label_template": "cores-{cores},{cpu_flags},storage-{storage},{zone}",
+        }
+    )
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+    harness.add_relation_unit(relation_id, "jenkins/0")
+    harness.begin()
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+    push_capability_sources(container)
+
+    harness.container_pebble_ready(state.State.jenkins_agent_service_name)
+
+    unit_databag = harness.get_relation_data(relation_id, "jenkins-agent-k8s/0")
+    assert unit_databag["labels"] == (
+        "builder,cores-2,aes,avx,avx2,avx512f,storage-nvme,eu-west-1a"
+    )
+
+
+def test_pebble_ready_zone_not_detected(harness: Harness, caplog: pytest.LogCaptureFixture):
+    """
+    arrange: given a label template and a Kubernetes API without the unit pod.
+    act: when the workload container is ready twice.
+    assert: the capability labels are set without a zone and the capabilities detected once.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config({"jenkins_agent_label_template": "cores-{cores},{zone}"})
+    harness.begin()
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+    push_capability_sources(container)
+
+    harness.container_pebble_ready(state.State.jenkins_agent_service_name)
+    harness.container_pebble_ready(state.State.jenkins_agent_service_name)
+
+    assert harness.charm.state.capability_labels == ("cores-2",)
+    assert caplog.text.count("Unit capabilities detected") == 1
+
+
+@pytest.mark.parametrize(
+    "stored, expected_labels",
+    [
+        pytest.param({}, ("cores-8",), id="current revision"),
+        pytest.param({"gpus": 1}, ("cores-8",), id="field removed"),
+        pytest.param({"zone": None}, (), id="field added"),
+    ],
+)
+def test_capability_labels_restored(
+    harness: Harness,
+    stored: typing.Dict[str, typing.Any],
+    expected_labels: typing.Tuple[str, ...],
+):
+    """
+    arrange: given capabilities detected in a previous hook, possibly by another charm revision.
+    act: when the charm is initialized.
+    assert: the capability labels are set on the state only if every capability was stored.
+    """
+    harness.update_config({"jenkins_agent_label_template": "cores-{cores}"})
+    harness.begin()
+    observer = harness.charm.capabilities_observer
+    capabilities_by_name = {
+        "arch": "x86_64",
+        "cores": 8,
+        "memory_gib": 32,
+        "cpu_flags": "",
+        "storage": "ssd",
+        "zone": "",
+        **stored,
+    }
+    observer._stored.capabilities = {  # pylint: disable=protected-access
+        name: value for name, value in capabilities_by_name.items() if value is not None
+    }
+
+    observer._set_capability_labels()  # pylint: disable=protected-access
+
+    assert harness.charm.state.capability_labels == expected_labels
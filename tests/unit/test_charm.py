@@ -6,19 +6,33 @@
 # Need access to protected functions for testing
 # pylint:disable=protected-access
 
+import os
+import re
 import secrets
+import subprocess  # nosec B404
+import sys
 import typing
+from pathlib import Path
 from unittest.mock import MagicMock
 
 import ops
 import pytest
-from ops.testing import Harness
+from ops.testing import ActionFailed, Harness
 
+import admission
+import charm as charm_module
 import server
 import state
 from charm import JenkinsAgentCharm
+from tests.fake_kubernetes import FakeKubernetes
 
-from .constants import ACTIVE_STATUS_NAME, BLOCKED_STATUS_NAME
+from .constants import (
+    ACTIVE_STATUS_NAME,
+    BLOCKED_STATUS_NAME,
+    IMPORT_TIME_BUDGET_RATIO,
+    IMPORT_TIME_RUNS,
+    WAITING_STATUS_NAME,
+)
 
 
 def test___init___invalid_state(
@@ -43,20 +57,25 @@ def test___init___invalid_state(
     assert jenkins_charm.unit.status.message == invalid_state_message
 
 
-def test__register_agent_from_config_container_not_ready(harness: Harness):
+def test__register_agent_from_config_container_not_ready(
+    harness: Harness, config: typing.Dict[str, str]
+):
     """
-    arrange: given a charm with a workload container that is not ready yet.
+    arrange: given a configured charm with a workload container that is not ready yet.
     act: when _register_agent_from_config is called.
-    assert: the event is deferred.
+    assert: the unit falls into WaitingStatus and the event is not deferred.
     """
     harness.set_can_connect("jenkins-agent-k8s", False)
+    harness.update_config(config)
     harness.begin()
     mock_event = MagicMock(spec=ops.HookEvent)
 
     jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
     jenkins_charm._on_config_changed(mock_event)
 
-    mock_event.defer.assert_called_once()
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    assert jenkins_charm.unit.status.message == "Waiting for workload container."
+    mock_event.defer.assert_not_called()
 
 
 def test__register_agent_from_config_no_config_state(harness: Harness):
@@ -102,7 +121,7 @@ def test__register_agent_from_config_download_agent_error(
     """
     arrange: given a charm with monkeypatched download_jenkins_agent that raises an exception.
     act: when _register_agent_from_config is called.
-    assert: unit falls into BlockedStatus.
+    assert: the unit waits to retry the download.
     """
     monkeypatch.setattr(
         server,
@@ -116,9 +135,10 @@ def test__register_agent_from_config_download_agent_error(
 
     jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
 
-    with pytest.raises(server.AgentJarDownloadError) as exc:
-        jenkins_charm._on_config_changed(mock_event)
-        assert exc.value == "Failed to download agent JAR executable."
+    jenkins_charm._on_config_changed(mock_event)
+
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    assert jenkins_charm.unit.status.message.startswith("Agent JAR download failed")
 
 
 def test__register_agent_from_config_no_valid_credentials(
@@ -151,7 +171,7 @@ def test__register_agent_from_config_fallback_relation_agent(
     """
     arrange: given a charm with reset config values and a agent relation.
     act: when _on_config_changed is called.
-    assert: unit falls into BlockedStatus, this should support fallback relation later.
+    assert: unit falls back to the agent relation and waits for the relation data.
     """
     harness.set_can_connect("jenkins-agent-k8s", True)
     harness.update_config({})
@@ -162,8 +182,8 @@ def test__register_agent_from_config_fallback_relation_agent(
     jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
     jenkins_charm._on_config_changed(mock_event)
 
-    assert jenkins_charm.unit.status.name == BLOCKED_STATUS_NAME
-    assert jenkins_charm.unit.status.message == "Please remove and re-relate agent relation."
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    assert jenkins_charm.unit.status.message == "Waiting for complete relation data."
 
 
 def test__register_agent_from_config(
@@ -210,6 +230,97 @@ def test__on_upgrade_charm(
     assert jenkins_charm.unit.status.name == ACTIVE_STATUS_NAME
 
 
+@pytest.mark.parametrize(
+    "handler_name, event_type",
+    [
+        pytest.param("_on_config_changed", ops.ConfigChangedEvent, id="config changed"),
+        pytest.param("_on_upgrade_charm", ops.UpgradeCharmEvent, id="upgrade charm"),
+    ],
+)
+@pytest.mark.parametrize(
+    "pod_config, expected_status_name",
+    [
+        pytest.param({}, ACTIVE_STATUS_NAME, id="no resources"),
+        pytest.param({"cpu": "2"}, BLOCKED_STATUS_NAME, id="resources"),
+        pytest.param({"zone_spread": True}, BLOCKED_STATUS_NAME, id="scheduling"),
+    ],
+)
+def test__on_config_changed_pod_template_not_patched(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    monkeypatch: pytest.MonkeyPatch,
+    harness: Harness,
+    config: typing.Dict[str, str],
+    fake_kubernetes: FakeKubernetes,
+    pod_config: typing.Dict[str, typing.Union[str, bool]],
+    expected_status_name: str,
+    handler_name: str,
+    event_type: typing.Type[ops.EventBase],
+):
+    """
+    arrange: given a leader unit of an application that is not trusted.
+    act: when _on_config_changed or _on_upgrade_charm is called.
+    assert: the unit is blocked only when resources or scheduling constraints are configured,
+        and no CPU quantity is recorded as applied.
+    """
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: None)
+    monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: True)
+    fake_kubernetes.forbidden = True
+    harness.set_can_connect("jenkins-agent-k8s", True)
+    harness.set_leader(True)
+    harness.update_config({**config, **pod_config})
+    relation_id = harness.add_relation(admission.PEER_RELATION, "jenkins-agent-k8s")
+    harness.begin()
+
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    getattr(jenkins_charm, handler_name)(MagicMock(spec=event_type))
+
+    assert jenkins_charm.unit.status.name == expected_status_name
+    app_databag = harness.get_relation_data(relation_id, "jenkins-agent-k8s")
+    assert state.APPLIED_CPU_KEY not in app_databag
+
+
+def test__on_config_changed_pod_template(
+    monkeypatch: pytest.MonkeyPatch,
+    harness: Harness,
+    config: typing.Dict[str, str],
+    fake_kubernetes: FakeKubernetes,
+):
+    """
+    arrange: given a leader unit with resources and scheduling constraints configured.
+    act: when _on_config_changed is called twice.
+    assert: the pod template of the application StatefulSet is patched once and the applied CPU
+        quantity is recorded.
+    """
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: None)
+    monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: True)
+    harness.set_can_connect("jenkins-agent-k8s", True)
+    harness.set_leader(True)
+    harness.update_config(
+        {
+            **config,
+            "cpu": "2",
+            "memory": "4Gi",
+            "pod_anti_affinity": "preferred",
+            "node_selector": "pool=builds",
+            "tolerations": "dedicated=builds:NoSchedule",
+        }
+    )
+    relation_id = harness.add_relation(admission.PEER_RELATION, "jenkins-agent-k8s")
+    harness.begin()
+
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    jenkins_charm._on_config_changed(MagicMock(spec=ops.ConfigChangedEvent))
+    jenkins_charm._on_config_changed(MagicMock(spec=ops.ConfigChangedEvent))
+
+    assert fake_kubernetes.template_revisions["jenkins-agent-k8s"] == 1
+    pod_spec = fake_kubernetes.get_pod_spec("jenkins-agent-k8s", harness.model.name)
+    assert pod_spec["containers"][1]["resources"]["requests"] == {"cpu": "2", "memory": "4Gi"}
+    assert pod_spec["affinity"]["podAntiAffinity"]
+    assert pod_spec["nodeSelector"] == {"pool": "builds"}
+    assert jenkins_charm.unit.status.name == ACTIVE_STATUS_NAME
+    app_databag = harness.get_relation_data(relation_id, "jenkins-agent-k8s")
+    assert app_databag[state.APPLIED_CPU_KEY] == "2"
+
+
 def test__on_jenkins_agent_k8s_pebble_ready_container_not_ready(
     harness: Harness, monkeypatch: pytest.MonkeyPatch
 ):
@@ -237,13 +348,15 @@ def test__on_jenkins_agent_k8s_pebble_ready_agent_download_error(
     """
     arrange: given a mocked server download that raises an error.
     act: when _on_jenkins_agent_k8s_pebble_ready is called.
-    assert: RuntimeError is raised.
+    assert: the unit waits to retry the download.
     """
     harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.add_relation(state.AGENT_RELATION, "jenkins")
     harness.begin()
     charm = typing.cast(JenkinsAgentCharm, harness.charm)
-    charm.state.agent_relation_credentials = server.Credentials(
-        address="test", secret=secrets.token_hex(16)
+    credentials = server.Credentials(address="test", secret=secrets.token_hex(16))
+    monkeypatch.setattr(
+        charm.state, "get_agent_relation_credentials", lambda _relation_id: credentials
     )
     monkeypatch.setattr(
         server,
@@ -251,8 +364,10 @@ def test__on_jenkins_agent_k8s_pebble_ready_agent_download_error(
         MagicMock(spec=server.download_jenkins_agent, side_effect=[server.AgentJarDownloadError]),
     )
 
-    with pytest.raises(server.AgentJarDownloadError):
-        charm._on_jenkins_agent_k8s_pebble_ready(MagicMock(spec=ops.PebbleReadyEvent))
+    charm._on_jenkins_agent_k8s_pebble_ready(MagicMock(spec=ops.PebbleReadyEvent))
+
+    assert charm.unit.status.name == WAITING_STATUS_NAME
+    assert charm.unit.status.message.startswith("Agent JAR download failed")
 
 
 def test__on_jenkins_agent_k8s_pebble_ready(harness: Harness, monkeypatch: pytest.MonkeyPatch):
@@ -262,17 +377,241 @@ def test__on_jenkins_agent_k8s_pebble_ready(harness: Harness, monkeypatch: pytes
     assert: the charm is in ActiveStatus.
     """
     harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.add_relation(state.AGENT_RELATION, "jenkins")
     harness.begin()
     charm = typing.cast(JenkinsAgentCharm, harness.charm)
-    charm.state.agent_relation_credentials = server.Credentials(
-        address="test", secret=secrets.token_hex(16)
+    credentials = server.Credentials(address="test", secret=secrets.token_hex(16))
+    monkeypatch.setattr(
+        charm.state, "get_agent_relation_credentials", lambda _relation_id: credentials
     )
     monkeypatch.setattr(
         server,
         "download_jenkins_agent",
-        MagicMock(spec=server.download_jenkins_agent),
+        MagicMock(spec=server.download_jenkins_agent, return_value="agent-jar-sha256"),
     )
 
     charm._on_jenkins_agent_k8s_pebble_ready(MagicMock(spec=ops.PebbleReadyEvent))
 
     assert charm.unit.status.name == ACTIVE_STATUS_NAME
+
+
+def test__on_update_status_agent_running(
+    harness: Harness, monkeypatch: pytest.MonkeyPatch, config: typing.Dict[str, str]
+):
+    """
+    arrange: given a configured charm with a running Jenkins agent.
+    act: when _on_update_status is called.
+    assert: the agent is not registered again.
+    """
+    monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: True)
+    monkeypatch.setattr(
+        server,
+        "download_jenkins_agent",
+        (
+            mock_download_func := MagicMock(
+                spec=server.download_jenkins_agent, return_value="agent-jar-sha256"
+            )
+        ),
+    )
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config(config)
+    harness.begin()
+    charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    charm._on_config_changed(MagicMock(spec=ops.ConfigChangedEvent))
+
+    charm._on_update_status(MagicMock(spec=ops.UpdateStatusEvent))
+
+    mock_download_func.assert_called_once()
+    assert charm.unit.status.name == ACTIVE_STATUS_NAME
+
+
+def test__on_update_status_agent_stopped(
+    harness: Harness, monkeypatch: pytest.MonkeyPatch, config: typing.Dict[str, str]
+):
+    """
+    arrange: given a configured charm whose Jenkins agent service has stopped.
+    act: when _on_update_status is called.
+    assert: the agent is registered again.
+    """
+    monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: True)
+    monkeypatch.setattr(
+        server,
+        "download_jenkins_agent",
+        (
+            mock_download_func := MagicMock(
+                spec=server.download_jenkins_agent, return_value="agent-jar-sha256"
+            )
+        ),
+    )
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config(config)
+    harness.begin()
+    charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    charm._on_config_changed(MagicMock(spec=ops.ConfigChangedEvent))
+    harness.model.unit.get_container(state.State.jenkins_agent_service_name).stop(
+        state.State.jenkins_agent_service_name
+    )
+
+    charm._on_update_status(MagicMock(spec=ops.UpdateStatusEvent))
+
+    assert mock_download_func.call_count == 2
+
+
+def test__on_config_changed_fingerprint_changed(
+    harness: Harness, monkeypatch: pytest.MonkeyPatch, config: typing.Dict[str, str]
+):
+    """
+    arrange: given a configured charm with a running Jenkins agent.
+    act: when the agent token is changed and _on_config_changed is called.
+    assert: the agent is registered again.
+    """
+    monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: True)
+    monkeypatch.setattr(
+        server,
+        "download_jenkins_agent",
+        (
+            mock_download_func := MagicMock(
+                spec=server.download_jenkins_agent, return_value="agent-jar-sha256"
+            )
+        ),
+    )
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config(config)
+    harness.begin()
+    charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    charm._on_config_changed(MagicMock(spec=ops.ConfigChangedEvent))
+    charm._on_config_changed(MagicMock(spec=ops.ConfigChangedEvent))
+    assert mock_download_func.call_count == 1
+    assert charm.state.jenkins_config, "Config should not be None."
+    charm.state.jenkins_config.agent_name_token_pairs = [
+        (config["jenkins_agent_name"], secrets.token_hex(16))
+    ]
+
+    charm._on_config_changed(MagicMock(spec=ops.ConfigChangedEvent))
+
+    assert mock_download_func.call_count == 2
+
+
+def test__on_update_status_agent_not_running(
+    harness: Harness, monkeypatch: pytest.MonkeyPatch, config: typing.Dict[str, str]
+):
+    """
+    arrange: given a configured charm whose Jenkins agent is not running.
+    act: when _on_update_status is called.
+    assert: the agent is registered and the unit falls into ActiveStatus.
+    """
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: None)
+    monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: True)
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config(config)
+    harness.begin()
+    charm = typing.cast(JenkinsAgentCharm, harness.charm)
+
+    charm._on_update_status(MagicMock(spec=ops.UpdateStatusEvent))
+
+    assert charm.unit.status.name == ACTIVE_STATUS_NAME
+
+
+def test__on_dump_jfr_action(monkeypatch: pytest.MonkeyPatch, tmp_path: Path, harness: Harness):
+    """
+    arrange: given a charm with flight recording enabled and completed recording chunks.
+    act: when the dump-jfr action is run.
+    assert: the completed chunks are concatenated into a single recording in the charm container.
+    """
+    monkeypatch.setattr(charm_module, "JFR_DUMP_DIR", tmp_path / "jfr")
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config({"jfr_recording": True})
+    harness.begin()
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+    for index in range(3):
+        container.push(
+            server.JFR_REPOSITORY_PATH / f"2024_01_01_00_00_00_1/2024_01_01_0{index}_00_00.jfr",
+            f"chunk-{index}".encode(),
+            make_dirs=True,
+        )
+
+    output = harness.run_action("dump-jfr")
+
+    assert output.results["chunks"] == 2
+    assert Path(output.results["path"]).read_bytes() == b"chunk-0chunk-1"
+
+
+@pytest.mark.parametrize(
+    "can_connect, expected_message",
+    [
+        pytest.param(False, "Workload container not ready.", id="container not ready"),
+        pytest.param(True, "No completed flight recording chunk yet.", id="no chunk"),
+    ],
+)
+def test__on_dump_jfr_action_no_recording(
+    harness: Harness, can_connect: bool, expected_message: str
+):
+    """
+    arrange: given a charm with flight recording enabled and no completed recording chunk.
+    act: when the dump-jfr action is run.
+    assert: the action fails with the reason.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, can_connect)
+    harness.update_config({"jfr_recording": True})
+    harness.begin()
+
+    with pytest.raises(ActionFailed) as exc_info:
+        harness.run_action("dump-jfr")
+
+    assert exc_info.value.message == expected_message
+
+
+def test__on_dump_jfr_action_not_enabled(harness: Harness):
+    """
+    arrange: given a charm without flight recording.
+    act: when the dump-jfr action is run.
+    assert: the action fails.
+    """
+    harness.begin()
+
+    with pytest.raises(ActionFailed):
+        harness.run_action("dump-jfr")
+
+
+def _get_import_times() -> typing.Dict[str, int]:
+    """Import ops, then the charm module, with import time profiling.
+
+    Returns:
+        The cumulative import time in microseconds of each module imported.
+    """
+    src_path = Path(state.__file__).parent
+    result = subprocess.run(  # nosec B603
+        [sys.executable, "-X", "importtime", "-c", "import ops, charm"],
+        env={**os.environ, "PYTHONPATH": str(src_path)},
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    # Each line is formatted as "import time: <self us> | <cumulative us> | <module>", with the
+    # module indented by its import depth.
+    return {
+        match.group("module"): int(match.group("cumulative"))
+        for match in re.finditer(
+            r"^import time:\s+\d+ \|\s+(?P<cumulative>\d+) \| +(?P<module>\S+)$",
+            result.stderr,
+            re.MULTILINE,
+        )
+    }
+
+
+def test_charm_import_time():
+    """
+    arrange: given the charm source directory.
+    act: when ops and then the charm module are imported with import time profiling.
+    assert: modules only needed for downloads or validation are not imported and the cumulative
+        import time of the charm module, without ops, is within budget relative to ops.
+    """
+    runs = [_get_import_times() for _ in range(IMPORT_TIME_RUNS)]
+
+    for import_times in runs:
+        assert "requests" not in import_times
+        assert "pydantic" not in import_times
+    assert (
+        min(import_times["charm"] / import_times["ops"] for import_times in runs)
+        < IMPORT_TIME_BUDGET_RATIO
+    )
@@ -0,0 +1,225 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Jenkins-agent-k8s connection diagnostics module tests."""
+
+import json
+import typing
+from unittest.mock import MagicMock
+
+import ops
+import pytest
+from ops.testing import ActionFailed, ExecResult, Harness
+
+import diagnostics
+import server
+import state
+
+NETWORK_OUTPUT = {
+    "phases": {"dns": 1.0, "tcp-connect": 2.0, "agent-jar-head": 10.0, "jnlp-fetch": 20.0},
+    "statuses": {"agent-jar-head": 200, "jnlp-fetch": 200},
+    "address": "10.0.0.1",
+}
+REMOTING_OUTPUT = """INFO: Setting up agent: jenkins-agent-k8s-0
+INFO: Locating server among [http://jenkins:8080/]
+INFO: Agent discovery successful
+INFO: Handshaking
+INFO: Connecting to jenkins:50000
+INFO: Remote identity confirmed: controller
+SEVERE: The server rejected the connection: Authorization failure
+"""
+
+
+def test_get_remoting_phases():
+    """
+    arrange: given the time the remoting phases were reached since the probe agent launch.
+    act: when get_remoting_phases is called.
+    assert: each phase lasts from the previous phase reached.
+    """
+    phases = diagnostics.get_remoting_phases(
+        {"first-output": 0.5, "locating-server": 0.6, "handshaking": 1.0}
+    )
+
+    assert phases == pytest.approx(
+        {
+            "remoting-first-output": 500.0,
+            "remoting-locating-server": 100.0,
+            "remoting-handshaking": 400.0,
+        }
+    )
+
+
+def test_compare():
+    """
+    arrange: given phase timings and the timings of previous runs.
+    act: when compare is called.
+    assert: each phase is compared with the previous run and the median of the runs reaching it.
+    """
+    comparison = diagnostics.compare(
+        {"dns": 1.0, "tcp-connect": 30.0},
+        [{"dns": 2.0}, {"dns": 4.0, "tcp-connect": 10.0}, {"dns": 3.0}],
+    )
+
+    assert comparison == {
+        "dns": {"ms": 1.0, "previous-ms": 3.0, "median-ms": 3.0},
+        "tcp-connect": {"ms": 30.0, "previous-ms": 10.0, "median-ms": 10.0},
+    }
+
+
+def test_diagnose_connection_action(harness: Harness, add_agent_layer: typing.Callable[[], None]):
+    """
+    arrange: given an agent connecting to a controller whose TCP connect time tripled.
+    act: when the diagnose-connection action is run.
+    assert: the network and remoting phases up to the handshake are returned next to the
+        previous run, the probe agent does not present the agent secret.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.begin()
+    add_agent_layer()
+    probe_handler = MagicMock(return_value=ExecResult(stdout=REMOTING_OUTPUT))
+    harness.handle_exec(state.State.jenkins_agent_service_name, ["java"], handler=probe_handler)
+    harness.handle_exec(
+        state.State.jenkins_agent_service_name,
+        ["python3"],
+        result=ExecResult(stdout=json.dumps(NETWORK_OUTPUT)),
+    )
+    harness.run_action("diagnose-connection")
+    slow_output = json.loads(json.dumps(NETWORK_OUTPUT))
+    slow_output["phases"]["tcp-connect"] = 6.0
+    harness.handle_exec(
+        state.State.jenkins_agent_service_name,
+        ["python3"],
+        result=ExecResult(stdout=json.dumps(slow_output)),
+    )
+
+    output = harness.run_action("diagnose-connection")
+
+    phases = json.loads(output.results["phases"])
+    assert list(phases)[:4] == ["dns", "tcp-connect", "agent-jar-head", "jnlp-fetch"]
+    assert phases["tcp-connect"] == {"ms": 6.0, "previous-ms": 2.0, "median-ms": 2.0}
+    assert "remoting-remote-identity-confirmed" in phases
+    assert "remoting-connected" not in phases
+    assert probe_handler.call_count == 2
+    for call in probe_handler.call_args_list:
+        command = call.args[0].command
+        assert "jenkins-agent-k8s-0" in command and "secret" not in command
+    assert output.results["slower-phases"].split(",")[0] == "tcp-connect"
+    assert output.results["address"] == "10.0.0.1"
+    assert output.results["error"] == "none"
+
+
+def test_diagnose_connection_action_network_error(
+    harness: Harness, add_agent_layer: typing.Callable[[], None]
+):
+    """
+    arrange: given a controller whose host name cannot be resolved.
+    act: when the diagnose-connection action is run.
+    assert: the failed phase is returned and no probe agent is launched.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.begin()
+    add_agent_layer()
+    harness.handle_exec(
+        state.State.jenkins_agent_service_name,
+        ["python3"],
+        result=ExecResult(
+            stdout=json.dumps(
+                {"phases": {}, "statuses": {}, "error": "dns: Name or service not known"}
+            )
+        ),
+    )
+
+    output = harness.run_action("diagnose-connection")
+
+    assert json.loads(output.results["phases"]) == {}
+    assert output.results["error"] == "dns: Name or service not known"
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        pytest.param(ops.pebble.APIError({}, 500, "Internal Server Error", "error"), id="API"),
+        pytest.param(
+            ops.pebble.ChangeError("error", MagicMock(spec=ops.pebble.Change, tasks=[])),
+            id="change",
+        ),
+    ],
+)
+def test_diagnose_connection_action_probe_error(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    monkeypatch: pytest.MonkeyPatch,
+    harness: Harness,
+    add_agent_layer: typing.Callable[[], None],
+    raise_exception: typing.Callable,
+    error: ops.pebble.Error,
+):
+    """
+    arrange: given a probe agent that cannot be launched in the workload container.
+    act: when the diagnose-connection action is run.
+    assert: the action fails on the remoting handshake probe.
+    """
+    monkeypatch.setattr(
+        server, "probe_remoting_handshake", lambda *_args, **_kwargs: raise_exception(error)
+    )
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.begin()
+    add_agent_layer()
+    harness.handle_exec(
+        state.State.jenkins_agent_service_name,
+        ["python3"],
+        result=ExecResult(stdout=json.dumps(NETWORK_OUTPUT)),
+    )
+
+    with pytest.raises(ActionFailed) as exc:
+        harness.run_action("diagnose-connection")
+
+    assert exc.value.message == "Remoting handshake probe failed, see the unit logs."
+
+
+def test_diagnose_connection_action_not_configured(harness: Harness):
+    """
+    arrange: given a unit without an agent service.
+    act: when the diagnose-connection action is run.
+    assert: the action fails.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.begin()
+
+    with pytest.raises(ActionFailed):
+        harness.run_action("diagnose-connection")
+
+
+@pytest.mark.parametrize(
+    "result",
+    [
+        pytest.param(ExecResult(exit_code=2, stderr="can't open file"), id="script failure"),
+        pytest.param(ExecResult(stdout="Traceback"), id="unexpected output"),
+        pytest.param(ExecResult(stdout="{}"), id="no phases"),
+    ],
+)
+def test_diagnose_connection_action_failure(
+    harness: Harness, add_agent_layer: typing.Callable[[], None], result: ExecResult
+):
+    """
+    arrange: given a diagnose script failing or printing unexpected output.
+    act: when the diagnose-connection action is run.
+    assert: the action fails.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.begin()
+    add_agent_layer()
+    harness.handle_exec(state.State.jenkins_agent_service_name, ["python3"], result=result)
+
+    with pytest.raises(ActionFailed):
+        harness.run_action("diagnose-connection")
+
+
+def test_diagnose_connection_action_container_not_ready(harness: Harness):
+    """
+    arrange: given a workload container that is not ready.
+    act: when the diagnose-connection action is run.
+    assert: the action fails.
+    """
+    harness.begin()
+
+    with pytest.raises(ActionFailed):
+        harness.run_action("diagnose-connection")
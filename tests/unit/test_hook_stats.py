@@ -0,0 +1,189 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Jenkins-agent-k8s hook statistics module tests."""
+
+# Need access to protected functions for testing
+# pylint:disable=protected-access
+
+import json
+import time
+import typing
+
+import ops
+import ops.testing
+import pytest
+from ops.testing import Harness
+
+import hook_stats
+import io_timing
+import server
+import state
+from charm import JenkinsAgentCharm
+
+
+def test_timed(
+    begin_charm: typing.Callable[..., JenkinsAgentCharm], config: typing.Dict[str, str]
+):
+    """
+    arrange: given a charm with valid configuration.
+    act: when the config changed handler runs.
+    assert: the handler timing is recorded with the time spent in Pebble calls.
+    """
+    jenkins_charm = begin_charm(config)
+
+    jenkins_charm._on_config_changed(None)  # type: ignore[arg-type]
+
+    assert len(hook_stats.TIMINGS) == 1
+    timing = hook_stats.TIMINGS[0]
+    assert timing.handler == "JenkinsAgentCharm._on_config_changed"
+    assert timing.wall_seconds >= timing.pebble_seconds > 0
+    assert timing.http_seconds == 0
+
+
+def test_timed_io_breakdown(harness: Harness):
+    """
+    arrange: given a handler that waits on the network and on a process in the workload.
+    act: when the handler runs.
+    assert: the HTTP and exec time of the handler are recorded apart from its Pebble time.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.handle_exec(
+        state.State.jenkins_agent_service_name, ["true"], result=ops.testing.ExecResult()
+    )
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+
+    @hook_stats.timed
+    def handler(_: ops.Object) -> None:
+        """Wait on the network and on a process in the workload container."""
+        with io_timing.timed(io_timing.HTTP):
+            time.sleep(0.01)
+        jenkins_charm.container.exec(["true"]).wait()
+
+    handler(jenkins_charm)
+
+    assert len(hook_stats.TIMINGS) == 1
+    timing = hook_stats.TIMINGS[0]
+    assert timing.http_seconds >= 0.01
+    assert timing.pebble_seconds > 0
+    assert timing.wall_seconds >= timing.http_seconds + timing.pebble_seconds
+
+
+def test_summarize():
+    """
+    arrange: given the recent timings of two handlers.
+    act: when the timings are summarized.
+    assert: the percentiles, means and histogram are computed, slowest handler first.
+    """
+    samples = {
+        "fast": [[0.05, 0.01, 0.0, 0.0]] * 4,
+        "never-run": [],
+        "slow": [[0.2, 0.1, 0.0, 0.0], [2.0, 0.1, 1.5, 0.0], [40.0, 0.1, 0.0, 35.0]],
+    }
+
+    summary = hook_stats.summarize(samples)
+
+    assert list(summary) == ["slow", "fast"]
+    assert summary["slow"]["wall-p50"] == 2.0
+    assert summary["slow"]["wall-p95"] == 40.0
+    assert summary["slow"]["exec-mean"] == round(35.0 / 3, 4)
+    assert summary["slow"]["histogram"]["le-0.5"] == 1
+    assert summary["slow"]["histogram"]["le-5"] == 2
+    assert summary["slow"]["histogram"]["le-inf"] == 3
+    assert summary["fast"]["histogram"]["le-0.1"] == 4
+
+
+def test_pre_commit_rolling_window(harness: Harness):
+    """
+    arrange: given more handler timings than the rolling window holds.
+    act: when the framework commits.
+    assert: only the most recent timings are kept.
+    """
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    hook_stats.TIMINGS.extend(
+        hook_stats.HookTiming("handler", float(i), 0.0, 0.0, 0.0)
+        for i in range(hook_stats.ROLLING_WINDOW + 5)
+    )
+
+    harness.framework.commit()
+
+    samples = typing.cast(
+        typing.Dict[str, typing.List[typing.List[float]]],
+        jenkins_charm.hook_stats_observer._stored.samples,
+    )["handler"]
+    assert len(samples) == hook_stats.ROLLING_WINDOW
+    assert samples[0][0] == 5.0
+    assert not hook_stats.TIMINGS
+
+
+def test_show_hook_stats_action(harness: Harness):
+    """
+    arrange: given a charm with persisted handler timings.
+    act: when the show-hook-stats action is run.
+    assert: the summary of the handler timings is returned.
+    """
+    harness.begin()
+    hook_stats.TIMINGS.append(hook_stats.HookTiming("handler", 1.0, 0.5, 0.0, 0.0))
+    harness.framework.commit()
+
+    output = harness.run_action(hook_stats.SHOW_HOOK_STATS_ACTION)
+
+    stats = json.loads(output.results["stats"])
+    assert stats["handler"]["count"] == 1
+    assert stats["handler"]["pebble-mean"] == 0.5
+
+
+def test_hook_profiling(
+    begin_charm: typing.Callable[..., JenkinsAgentCharm],
+    harness: Harness,
+    config: typing.Dict[str, str],
+):
+    """
+    arrange: given a charm with hook profiling enabled.
+    act: when the config changed handler runs and the framework commits.
+    assert: the profile of the handler is written to the workload container.
+    """
+    jenkins_charm = begin_charm({**config, hook_stats.PROFILING_CONFIG: True})
+
+    jenkins_charm._on_config_changed(None)  # type: ignore[arg-type]
+    harness.framework.commit()
+
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+    profile = container.pull(server.HOOK_PROFILE_PATH).read()
+    assert profile.startswith("JenkinsAgentCharm._on_config_changed: ")
+    assert "Top memory allocations:" in profile
+    assert (
+        typing.cast(float, jenkins_charm.hook_stats_observer._stored.slowest_profile_seconds) > 0
+    )
+
+
+@pytest.mark.parametrize(
+    "slowest_profile_seconds, can_connect",
+    [
+        pytest.param(2.0, True, id="not slower"),
+        pytest.param(0.0, False, id="container not ready"),
+    ],
+)
+def test_pre_commit_profile_not_written(
+    harness: Harness, slowest_profile_seconds: float, can_connect: bool
+):
+    """
+    arrange: given a handler profile and the wall time of the slowest profile written.
+    act: when the framework commits.
+    assert: the profile is not written unless slower and the container ready.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, can_connect)
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    jenkins_charm.hook_stats_observer._stored.slowest_profile_seconds = slowest_profile_seconds
+    hook_stats.PROFILES.append(hook_stats.HookProfile("handler", 1.0, "profile"))
+
+    harness.framework.commit()
+
+    assert (
+        jenkins_charm.hook_stats_observer._stored.slowest_profile_seconds
+        == slowest_profile_seconds
+    )
+    assert not hook_stats.PROFILES
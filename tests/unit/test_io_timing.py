@@ -0,0 +1,27 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Jenkins-agent-k8s I/O timing module tests."""
+
+import time
+
+import pytest
+
+import io_timing
+
+
+def test_timed(monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: given blocks waiting on the network, one of which fails.
+    act: when the blocks are timed.
+    assert: the time of both blocks is added to the HTTP seconds only.
+    """
+    monotonic_values = iter((1.0, 3.0, 4.0, 8.0))
+    monkeypatch.setattr(time, "monotonic", lambda: next(monotonic_values))
+
+    with io_timing.timed(io_timing.HTTP):
+        pass
+    with pytest.raises(OSError), io_timing.timed(io_timing.HTTP):
+        raise OSError
+
+    assert io_timing.get_seconds() == (0.0, 6.0, 0.0)
@@ -0,0 +1,341 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Jenkins-agent-k8s Kubernetes module tests."""
+
+import typing
+
+import pytest
+from ops.testing import Harness
+
+import k8s
+import state
+from tests.fake_kubernetes import FakeKubernetes
+
+APP_NAME = "jenkins-agent-k8s"
+
+
+def patch_pod_template(
+    harness: Harness,
+    resources: state.ResourceConfig = state.ResourceConfig(),
+    scheduling: state.SchedulingConfig = state.SchedulingConfig(),
+) -> bool:
+    """Patch the pod template of the application.
+
+    Args:
+        harness: The harness, whose model is the StatefulSet namespace.
+        resources: The compute resources of the workload container.
+        scheduling: The scheduling constraints of the unit pods.
+
+    Returns:
+        True if the StatefulSet was patched.
+    """
+    return k8s.patch_pod_template(
+        APP_NAME, harness.model.name, state.State.jenkins_agent_service_name, resources, scheduling
+    )
+
+
+def get_workload_container(
+    fake_kubernetes: FakeKubernetes, harness: Harness
+) -> typing.Dict[str, typing.Any]:
+    """Get the workload container of the pod template.
+
+    Args:
+        fake_kubernetes: The Kubernetes API.
+        harness: The harness, whose model is the StatefulSet namespace.
+
+    Returns:
+        The workload container as an API object.
+    """
+    return next(
+        container
+        for container in fake_kubernetes.get_pod_spec(APP_NAME, harness.model.name)["containers"]
+        if container["name"] == state.State.jenkins_agent_service_name
+    )
+
+
+@pytest.mark.parametrize(
+    "resources, expected_resources",
+    [
+        pytest.param(
+            state.ResourceConfig(cpu="2", memory="4Gi"),
+            {"requests": {"cpu": "2", "memory": "4Gi"}, "limits": {}},
+            id="burstable",
+        ),
+        pytest.param(
+            state.ResourceConfig(cpu="500m", memory="1Gi", guaranteed_qos=True),
+            {
+                "requests": {"cpu": "500m", "memory": "1Gi"},
+                "limits": {"cpu": "500m", "memory": "1Gi"},
+            },
+            id="guaranteed",
+        ),
+    ],
+)
+def test_patch_pod_template_resources(
+    harness: Harness,
+    fake_kubernetes: FakeKubernetes,
+    resources: state.ResourceConfig,
+    expected_resources: typing.Dict[str, typing.Dict[str, str]],
+):
+    """
+    arrange: given a StatefulSet without workload container resources.
+    act: when patch_pod_template is called.
+    assert: the workload container resources are set.
+    """
+    patched = patch_pod_template(harness, resources=resources)
+
+    assert patched
+    assert get_workload_container(fake_kubernetes, harness)["resources"] == expected_resources
+
+
+def test_patch_pod_template_resources_removed(harness: Harness, fake_kubernetes: FakeKubernetes):
+    """
+    arrange: given a StatefulSet with guaranteed workload container resources.
+    act: when patch_pod_template is called with a memory request only.
+    assert: the CPU request and the limits are removed.
+    """
+    patch_pod_template(
+        harness, resources=state.ResourceConfig(cpu="2", memory="4Gi", guaranteed_qos=True)
+    )
+
+    patch_pod_template(harness, resources=state.ResourceConfig(memory="4Gi"))
+
+    assert get_workload_container(fake_kubernetes, harness)["resources"] == {
+        "requests": {"memory": "4Gi"},
+        "limits": {},
+    }
+
+
+def test_patch_pod_template_unchanged(harness: Harness, fake_kubernetes: FakeKubernetes):
+    """
+    arrange: given a StatefulSet with resources and scheduling constraints already set.
+    act: when patch_pod_template is called with the same resources in another notation.
+    assert: the StatefulSet is not patched, so that the pods are not restarted.
+    """
+    scheduling = state.SchedulingConfig(
+        pod_anti_affinity="preferred",
+        zone_spread=True,
+        node_selector={"pool": "builds"},
+        tolerations=(state.Toleration(key="dedicated", value="builds", effect="NoSchedule"),),
+    )
+    patch_pod_template(harness, state.ResourceConfig(cpu="1500m", memory="4096Mi"), scheduling)
+
+    patched = patch_pod_template(
+        harness, state.ResourceConfig(cpu="1.5", memory="4Gi"), scheduling
+    )
+
+    assert not patched
+    assert fake_kubernetes.patches == 1
+    assert fake_kubernetes.template_revisions[APP_NAME] == 1
+
+
+@pytest.mark.parametrize(
+    "pod_anti_affinity, expected_pod_anti_affinity",
+    [
+        pytest.param(
+            "required",
+            {
+                "requiredDuringSchedulingIgnoredDuringExecution": [
+                    {
+                        "labelSelector": {"matchLabels": {k8s.APP_NAME_LABEL: APP_NAME}},
+                        "topologyKey": k8s.HOSTNAME_TOPOLOGY_KEY,
+                    }
+                ]
+            },
+            id="required",
+        ),
+        pytest.param(
+            "preferred",
+            {
+                "preferredDuringSchedulingIgnoredDuringExecution": [
+                    {
+                        "weight": 100,
+                        "podAffinityTerm": {
+                            "labelSelector": {"matchLabels": {k8s.APP_NAME_LABEL: APP_NAME}},
+                            "topologyKey": k8s.HOSTNAME_TOPOLOGY_KEY,
+                        },
+                    }
+                ]
+            },
+            id="preferred",
+        ),
+    ],
+)
+def test_patch_pod_template_pod_anti_affinity(
+    harness: Harness,
+    fake_kubernetes: FakeKubernetes,
+    pod_anti_affinity: str,
+    expected_pod_anti_affinity: typing.Dict[str, typing.Any],
+):
+    """
+    arrange: given a StatefulSet with the other pod anti-affinity mode.
+    act: when patch_pod_template is called with a pod anti-affinity mode.
+    assert: unit pods only avoid the nodes of other unit pods in that mode.
+    """
+    other_mode = "preferred" if pod_anti_affinity == "required" else "required"
+    patch_pod_template(harness, scheduling=state.SchedulingConfig(pod_anti_affinity=other_mode))
+
+    patch_pod_template(
+        harness, scheduling=state.SchedulingConfig(pod_anti_affinity=pod_anti_affinity)
+    )
+
+    pod_spec = fake_kubernetes.get_pod_spec(APP_NAME, harness.model.name)
+    assert pod_spec["affinity"]["podAntiAffinity"] == expected_pod_anti_affinity
+
+
+def test_patch_pod_template_scheduling(harness: Harness, fake_kubernetes: FakeKubernetes):
+    """
+    arrange: given a StatefulSet with a node selector of a former build node pool.
+    act: when patch_pod_template is called with zone spread, node labels and tolerations.
+    assert: the pod spec spreads unit pods across zones, onto the labelled and tainted nodes.
+    """
+    patch_pod_template(
+        harness, scheduling=state.SchedulingConfig(node_selector={"pool": "old-builds"})
+    )
+
+    patch_pod_template(
+        harness,
+        scheduling=state.SchedulingConfig(
+            zone_spread=True,
+            node_selector={"disk": "nvme"},
+            tolerations=(
+                state.Toleration(key="dedicated", value="builds", effect="NoSchedule"),
+                state.Toleration(key="gpu"),
+            ),
+        ),
+    )
+
+    pod_spec = fake_kubernetes.get_pod_spec(APP_NAME, harness.model.name)
+    assert pod_spec["topologySpreadConstraints"] == [
+        {
+            "maxSkew": 1,
+            "topologyKey": k8s.ZONE_TOPOLOGY_KEY,
+            "whenUnsatisfiable": "ScheduleAnyway",
+            "labelSelector": {"matchLabels": {k8s.APP_NAME_LABEL: APP_NAME}},
+        }
+    ]
+    assert pod_spec["nodeSelector"] == {"disk": "nvme"}
+    assert pod_spec["tolerations"] == [
+        {"key": "dedicated", "operator": "Equal", "value": "builds", "effect": "NoSchedule"},
+        {"key": "gpu", "operator": "Exists"},
+    ]
+
+
+def test_patch_pod_template_scheduling_removed(harness: Harness, fake_kubernetes: FakeKubernetes):
+    """
+    arrange: given a StatefulSet with scheduling constraints.
+    act: when patch_pod_template is called without scheduling constraints.
+    assert: the scheduling constraints are removed from the pod spec.
+    """
+    patch_pod_template(
+        harness,
+        scheduling=state.SchedulingConfig(
+            pod_anti_affinity="required",
+            zone_spread=True,
+            node_selector={"pool": "builds"},
+            tolerations=(state.Toleration(key="gpu"),),
+        ),
+    )
+
+    patch_pod_template(harness)
+
+    pod_spec = fake_kubernetes.get_pod_spec(APP_NAME, harness.model.name)
+    assert pod_spec["affinity"] == {}
+    assert "topologySpreadConstraints" not in pod_spec
+    assert "nodeSelector" not in pod_spec
+    assert "tolerations" not in pod_spec
+
+
+@pytest.mark.parametrize(
+    "failure",
+    [
+        pytest.param("forbidden", id="forbidden"),
+        pytest.param("unreachable", id="unreachable"),
+    ],
+)
+def test_patch_pod_template_request_failed(
+    harness: Harness, fake_kubernetes: FakeKubernetes, failure: str
+):
+    """
+    arrange: given a Kubernetes API that is forbidden to the application or unreachable.
+    act: when patch_pod_template is called.
+    assert: KubernetesError is raised.
+    """
+    setattr(fake_kubernetes, failure, True)
+
+    with pytest.raises(k8s.KubernetesError):
+        patch_pod_template(harness, resources=state.ResourceConfig(cpu="2"))
+
+
+def test_patch_pod_template_container_not_found(harness: Harness, fake_kubernetes: FakeKubernetes):
+    """
+    arrange: given a StatefulSet without the workload container.
+    act: when patch_pod_template is called.
+    assert: KubernetesError is raised.
+    """
+    fake_kubernetes.add_stateful_set(APP_NAME, harness.model.name, ["charm"])
+
+    with pytest.raises(k8s.KubernetesError):
+        patch_pod_template(harness, resources=state.ResourceConfig(cpu="2"))
+
+
+@pytest.mark.parametrize(
+    "node_labels, expected_zone",
+    [
+        pytest.param({k8s.ZONE_TOPOLOGY_KEY: "eu-west-1a"}, "eu-west-1a", id="zone"),
+        pytest.param({}, "", id="no zone"),
+    ],
+)
+def test_get_node_zone(
+    harness: Harness,
+    fake_kubernetes: FakeKubernetes,
+    node_labels: typing.Dict[str, str],
+    expected_zone: str,
+):
+    """
+    arrange: given a unit pod scheduled on a node.
+    act: when get_node_zone is called.
+    assert: the zone label of the node is returned.
+    """
+    fake_kubernetes.add_node("node-0", node_labels)
+    fake_kubernetes.add_pod(f"{APP_NAME}-0", harness.model.name, "node-0")
+
+    zone = k8s.get_node_zone(harness.model.name, f"{APP_NAME}-0")
+
+    assert zone == expected_zone
+
+
+def test_get_node_zone_not_scheduled(harness: Harness, fake_kubernetes: FakeKubernetes):
+    """
+    arrange: given a unit pod not scheduled on a node yet.
+    act: when get_node_zone is called.
+    assert: KubernetesError is raised.
+    """
+    fake_kubernetes.add_pod(f"{APP_NAME}-0", harness.model.name, "")
+
+    with pytest.raises(k8s.KubernetesError):
+        k8s.get_node_zone(harness.model.name, f"{APP_NAME}-0")
+
+
+@pytest.mark.parametrize(
+    "failure",
+    [
+        pytest.param("forbidden", id="forbidden"),
+        pytest.param("unreachable", id="unreachable"),
+    ],
+)
+def test_get_node_zone_request_failed(
+    harness: Harness, fake_kubernetes: FakeKubernetes, failure: str
+):
+    """
+    arrange: given a Kubernetes API that is forbidden to the application or unreachable.
+    act: when get_node_zone is called.
+    assert: KubernetesError is raised.
+    """
+    fake_kubernetes.add_node("node-0", {k8s.ZONE_TOPOLOGY_KEY: "eu-west-1a"})
+    fake_kubernetes.add_pod(f"{APP_NAME}-0", harness.model.name, "node-0")
+    setattr(fake_kubernetes, failure, True)
+
+    with pytest.raises(k8s.KubernetesError):
+        k8s.get_node_zone(harness.model.name, f"{APP_NAME}-0")
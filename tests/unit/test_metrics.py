@@ -0,0 +1,248 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Jenkins-agent-k8s metrics module tests."""
+
+# Need access to protected functions for testing
+# pylint:disable=protected-access
+
+import json
+import typing
+import unittest.mock
+
+import ops
+import pytest
+from ops.testing import Harness
+
+import metrics
+import server
+import state
+from charm import JenkinsAgentCharm
+
+
+def test_registry_merge_into():
+    """
+    arrange: given a registry with counter, summary and gauge samples.
+    act: when the samples are merged into previously accumulated samples.
+    assert: counters and summaries are incremented and gauges are replaced.
+    """
+    registry = metrics.Registry()
+    registry.inc("jenkins_agent_reconciles_total", result="applied")
+    registry.observe("jenkins_agent_jar_download_seconds", 2.0)
+    registry.set("jenkins_agent_executors", 4)
+
+    samples = registry.merge_into(
+        {
+            'jenkins_agent_reconciles_total{result="applied"}': 2.0,
+            "jenkins_agent_jar_download_seconds_sum": 1.0,
+            "jenkins_agent_jar_download_seconds_count": 1.0,
+            "jenkins_agent_executors": 2.0,
+        }
+    )
+
+    assert samples == {
+        'jenkins_agent_reconciles_total{result="applied"}': 3.0,
+        "jenkins_agent_jar_download_seconds_sum": 3.0,
+        "jenkins_agent_jar_download_seconds_count": 2.0,
+        "jenkins_agent_executors": 4,
+    }
+
+
+def test_render():
+    """
+    arrange: given accumulated samples of a summary and a counter with labels.
+    act: when the samples are rendered.
+    assert: the samples are grouped under the help and type lines of their metric.
+    """
+    samples = {
+        "jenkins_agent_credentials_validation_seconds_count": 1.0,
+        "jenkins_agent_credentials_validation_seconds_sum": 0.5,
+        'jenkins_agent_reconciles_total{result="skipped"}': 3.0,
+        "unknown_metric": 1.0,
+    }
+
+    content = metrics.render(samples)
+
+    assert content == (
+        "# HELP jenkins_agent_credentials_validation_seconds "
+        "Time spent validating agent-token pairs, by outcome.\n"
+        "# TYPE jenkins_agent_credentials_validation_seconds summary\n"
+        "jenkins_agent_credentials_validation_seconds_count 1.0\n"
+        "jenkins_agent_credentials_validation_seconds_sum 0.5\n"
+        "# HELP jenkins_agent_reconciles_total Reconciles of the agent workload, by result.\n"
+        "# TYPE jenkins_agent_reconciles_total counter\n"
+        'jenkins_agent_reconciles_total{result="skipped"} 3.0\n'
+    )
+
+
+def test_pre_commit_push_charm_metrics(
+    begin_charm: typing.Callable[..., JenkinsAgentCharm],
+    harness: Harness,
+    config: typing.Dict[str, str],
+):
+    """
+    arrange: given a charm that registered the agent, then reconciled without changes.
+    act: when the framework commits after each hook, then after update-status.
+    assert: the charm metrics are written when the agent started and on update-status only.
+    """
+    jenkins_charm = begin_charm(config)
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+
+    jenkins_charm.reconciler.reconcile()
+    harness.framework.commit()
+    jenkins_charm.reconciler.reconcile()
+    harness.framework.commit()
+
+    content = container.pull(server.CHARM_METRICS_PATH).read()
+    assert 'jenkins_agent_reconciles_total{result="applied"} 1.0\n' in content
+    assert 'jenkins_agent_pebble_call_seconds_count{operation="add_layer"} 1.0\n' in content
+    assert "skipped" not in content
+
+    harness.charm.on.update_status.emit()
+    harness.framework.commit()
+
+    content = container.pull(server.CHARM_METRICS_PATH).read()
+    assert 'jenkins_agent_reconciles_total{result="skipped"} 2.0\n' in content
+
+
+def test_pre_commit_no_op_hook(
+    harness: Harness,
+    begin_with_agent_relation: typing.Callable[[], int],
+    record_pebble_calls: typing.Callable[[], typing.List[str]],
+):
+    """
+    arrange: given an agent that has been started from the agent relation.
+    act: when the agent relation changes without changes for the agent, then the framework commits.
+    assert: no Pebble calls are made and the samples are accumulated in the charm state.
+    """
+    relation_id = begin_with_agent_relation()
+    harness.framework.commit()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    pebble_calls = record_pebble_calls()
+
+    harness.update_relation_data(
+        relation_id, "jenkins/0", {"jenkins-agent-k8s-1_secret": "secret"}
+    )
+    jenkins_charm.reconciler.reconcile()
+    harness.framework.commit()
+
+    assert not pebble_calls
+    samples = typing.cast(typing.Dict[str, float], jenkins_charm.metrics_observer._stored.samples)
+    assert samples['jenkins_agent_reconciles_total{result="skipped"}'] >= 1
+
+
+def test_pre_commit_container_not_ready(harness: Harness):
+    """
+    arrange: given a charm with recorded samples and an unreachable workload container.
+    act: when the framework commits after update-status.
+    assert: the samples are accumulated in the charm state for a later hook to write.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, False)
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    metrics.REGISTRY.set("jenkins_agent_executors", 2)
+
+    harness.charm.on.update_status.emit()
+    harness.framework.commit()
+
+    samples = typing.cast(typing.Dict[str, float], jenkins_charm.metrics_observer._stored.samples)
+    assert samples["jenkins_agent_executors"] == 2
+
+
+@pytest.mark.parametrize(
+    "leader",
+    [
+        pytest.param(True, id="leader"),
+        pytest.param(False, id="non-leader"),
+    ],
+)
+def test_metrics_endpoint_relation_joined(harness: Harness, leader: bool):
+    """
+    arrange: given a charm unit.
+    act: when the metrics endpoint relation is joined.
+    assert: the unit address is published, and the scrape job and metadata by the leader only.
+    """
+    harness.set_leader(leader)
+    harness.begin()
+
+    relation_id = harness.add_relation(metrics.METRICS_RELATION, "prometheus")
+    harness.add_relation_unit(relation_id, "prometheus/0")
+
+    unit_databag = harness.get_relation_data(relation_id, harness.charm.unit.name)
+    assert {key for key in unit_databag if key.startswith("prometheus_scrape_")} == {
+        "prometheus_scrape_unit_address",
+        "prometheus_scrape_unit_name",
+    }
+    assert unit_databag["prometheus_scrape_unit_name"] == harness.charm.unit.name
+    assert unit_databag["prometheus_scrape_unit_address"]
+    app_databag = harness.get_relation_data(relation_id, harness.charm.app.name)
+    if not leader:
+        assert not app_databag
+        return
+    assert set(app_databag) == {"scrape_jobs", "scrape_metadata"}
+    assert json.loads(app_databag["scrape_jobs"]) == [
+        {
+            "metrics_path": metrics.METRICS_PATH,
+            "static_configs": [{"targets": [f"*:{metrics.METRICS_PORT}"]}],
+        }
+    ]
+    assert json.loads(app_databag["scrape_metadata"]) == {
+        "model": harness.model.name,
+        "model_uuid": harness.model.uuid,
+        "application": harness.charm.app.name,
+        "charm_name": harness.charm.meta.name,
+    }
+
+
+def test_metrics_exporter_service(
+    begin_charm: typing.Callable[..., JenkinsAgentCharm],
+    harness: Harness,
+    config: typing.Dict[str, str],
+):
+    """
+    arrange: given a charm with valid configuration.
+    act: when the agent is registered.
+    assert: the metrics exporter service is part of the agent layer.
+    """
+    jenkins_charm = begin_charm(config)
+
+    jenkins_charm.reconciler.reconcile()
+
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+    service = container.get_service(jenkins_charm.pebble_service.metrics_service_name)
+    assert service.current == ops.pebble.ServiceStatus.ACTIVE
+
+
+def test_metrics_endpoint_jvm_scrape_job(harness: Harness):
+    """
+    arrange: given a leader unit with the JVM metrics exporter enabled.
+    act: when the metrics endpoint relation is joined.
+    assert: a scrape job for the JVM metrics exporter is published.
+    """
+    harness.set_leader(True)
+    harness.update_config({"jvm_metrics_exporter": True})
+    harness.begin()
+
+    relation_id = harness.add_relation(metrics.METRICS_RELATION, "prometheus")
+    harness.add_relation_unit(relation_id, "prometheus/0")
+
+    app_databag = harness.get_relation_data(relation_id, harness.charm.app.name)
+    scrape_jobs = json.loads(app_databag["scrape_jobs"])
+    assert scrape_jobs[1]["static_configs"][0]["targets"] == [f"*:{metrics.JVM_METRICS_PORT}"]
+
+
+def test_metrics_endpoint_unchanged(harness: Harness):
+    """
+    arrange: given a charm unit that published its metrics endpoint.
+    act: when the metrics endpoint is published again.
+    assert: the relation data is not written again.
+    """
+    harness.set_leader(True)
+    harness.begin()
+    relation_id = harness.add_relation(metrics.METRICS_RELATION, "prometheus")
+    harness.add_relation_unit(relation_id, "prometheus/0")
+
+    with unittest.mock.patch.object(ops.RelationDataContent, "update") as mock_update:
+        harness.charm.on.config_changed.emit()
+
+    mock_update.assert_not_called()
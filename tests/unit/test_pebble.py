@@ -7,12 +7,15 @@
 # pylint:disable=protected-access
 
 import secrets
+import time
 import typing
 import unittest.mock
 
 import ops
 import ops.testing
+import pytest
 
+import io_timing
 import pebble
 import server
 import state
@@ -99,3 +102,362 @@ def test_stop_agent():
 
     mock_container.stop.assert_called_once()
     mock_container.remove_path.assert_called_once()
+
+
+def test__get_pebble_layer_secondary_controller():
+    """
+    arrange: given the pebble service of a secondary controller.
+    act: when _get_pebble_layer is called.
+    assert: a layer with only the agent service of the controller, in its own workdir, is returned.
+    """
+    mock_state = unittest.mock.MagicMock(spec=state.State)
+    mock_state.jenkins_agent_service_name = state.State.jenkins_agent_service_name
+    mock_state.jvm_config = state.JvmConfig()
+    pebble_service = pebble.PebbleService(state=mock_state, controller_name="agent-1")
+
+    layer = pebble_service._get_pebble_layer(
+        server_url="http://test-url", agent_token_pair=("agent-1", secrets.token_hex(16))
+    )
+
+    assert list(layer.services) == ["jenkins-agent-k8s-agent-1"]
+    assert not layer.checks
+    environment = layer.services["jenkins-agent-k8s-agent-1"].environment
+    assert environment["JENKINS_CONTROLLER"] == "agent-1"
+    assert environment["JENKINS_WORKDIR"] == str(server.CONTROLLERS_WORKDIR / "agent-1")
+    assert pebble_service.agent_jar_path == server.CONTROLLERS_WORKDIR / "agent-1" / "agent.jar"
+
+
+def test_stop_stale_agents():
+    """
+    arrange: given running agent services of the primary, a current and a departed controller.
+    act: when stop_stale_agents is called with the current controller agent service names.
+    assert: only the agent service of the departed controller is stopped and its agent state
+        removed.
+    """
+    mock_state = unittest.mock.MagicMock(spec=state.State)
+    mock_state.jenkins_agent_service_name = state.State.jenkins_agent_service_name
+    mock_container = unittest.mock.MagicMock(spec=ops.Container)
+    running_service = unittest.mock.MagicMock(spec=ops.pebble.ServiceInfo)
+    running_service.is_running.return_value = True
+    mock_container.get_services.return_value = {
+        name: running_service
+        for name in (
+            "jenkins-agent-k8s",
+            "jenkins-agent-k8s-agent-1",
+            "jenkins-agent-k8s-agent-2",
+        )
+    }
+    pebble_service = pebble.PebbleService(state=mock_state)
+
+    pebble_service.stop_stale_agents(
+        ("jenkins-agent-k8s", "jenkins-agent-k8s-agent-1"), mock_container
+    )
+
+    mock_container.stop.assert_called_once_with("jenkins-agent-k8s-agent-2")
+    mock_container.remove_path.assert_called_once_with(
+        str(server.CONTROLLERS_WORKDIR / "agent-2" / "metrics" / "agent.state"), recursive=True
+    )
+
+
+def test_stop_stale_agents_none_stale():
+    """
+    arrange: given running agent services of the primary and a current controller only.
+    act: when stop_stale_agents is called with the current controller agent service names.
+    assert: no agent service is stopped.
+    """
+    mock_state = unittest.mock.MagicMock(spec=state.State)
+    mock_state.jenkins_agent_service_name = state.State.jenkins_agent_service_name
+    mock_container = unittest.mock.MagicMock(spec=ops.Container)
+    mock_container.get_services.return_value = {
+        "jenkins-agent-k8s": unittest.mock.MagicMock(spec=ops.pebble.ServiceInfo)
+    }
+    pebble_service = pebble.PebbleService(state=mock_state)
+
+    pebble_service.stop_stale_agents(("jenkins-agent-k8s",), mock_container)
+
+    mock_container.stop.assert_not_called()
+    mock_container.remove_path.assert_not_called()
+
+
+def test_get_fingerprint(harness: ops.testing.Harness):
+    """
+    arrange: given a server url, an agent_token pair and an agent JAR hash.
+    act: when get_fingerprint is called with the same and with a different token.
+    assert: the fingerprint only changes with the workload.
+    """
+    test_agent_token_pair = ("agent-1", secrets.token_hex(16))
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+
+    fingerprint = jenkins_charm.pebble_service.get_fingerprint(
+        server_url="http://test-url",
+        agent_token_pair=test_agent_token_pair,
+        agent_jar_sha256="agent-jar-sha256",
+    )
+
+    assert fingerprint == jenkins_charm.pebble_service.get_fingerprint(
+        server_url="http://test-url",
+        agent_token_pair=test_agent_token_pair,
+        agent_jar_sha256="agent-jar-sha256",
+    )
+    assert fingerprint != jenkins_charm.pebble_service.get_fingerprint(
+        server_url="http://test-url",
+        agent_token_pair=(test_agent_token_pair[0], secrets.token_hex(16)),
+        agent_jar_sha256="agent-jar-sha256",
+    )
+    assert fingerprint != jenkins_charm.pebble_service.get_fingerprint(
+        server_url="http://test-url",
+        agent_token_pair=test_agent_token_pair,
+        agent_jar_sha256="other-agent-jar-sha256",
+    )
+
+
+def test_cached_container_memoizes_reads(harness: ops.testing.Harness):
+    """
+    arrange: given a cached workload container.
+    act: when the same read-only calls are made twice, then a file is pushed.
+    assert: the repeated reads are answered from the cache until the container is written to.
+    """
+    harness.set_can_connect("jenkins-agent-k8s", True)
+    harness.begin()
+    container = pebble.CachedContainer(harness.model.unit.get_container("jenkins-agent-k8s"))
+    container.push(server.AGENT_JAR_PATH, "agent", make_dirs=True)
+
+    assert container.can_connect() and container.can_connect()
+    assert container.exists(server.AGENT_JAR_PATH)
+    assert container.exists(server.AGENT_JAR_PATH)
+    container.push(server.AGENT_JAR_PATH, "agent", make_dirs=True)
+
+    assert container.exists(server.AGENT_JAR_PATH)
+    assert container.call_stats["get_system_info"].count == 1
+    assert container.call_stats["get_system_info"].cache_hits == 1
+    assert container.call_stats["list_files"].count == 2
+    assert container.call_stats["list_files"].cache_hits == 1
+    assert container.call_stats["push"].count == 2
+    assert "list_files: 2 calls, 1 cached" in container.get_call_summary()
+    assert container.total_seconds >= 0
+
+
+def test_cached_container_errors_not_memoized(harness: ops.testing.Harness):
+    """
+    arrange: given a cached workload container that cannot be connected to.
+    act: when the container is checked twice, then again once it can be connected to.
+    assert: failed calls are made again rather than answered from the cache.
+    """
+    harness.set_can_connect("jenkins-agent-k8s", False)
+    harness.begin()
+    container = pebble.CachedContainer(harness.model.unit.get_container("jenkins-agent-k8s"))
+
+    assert not container.can_connect()
+    assert not container.can_connect()
+    harness.set_can_connect("jenkins-agent-k8s", True)
+
+    assert container.can_connect()
+    assert not container.exists(server.AGENT_JAR_PATH)
+    assert not container.exists(server.AGENT_JAR_PATH)
+    assert container.call_stats["get_system_info"].count == 3
+    assert container.call_stats["list_files"].count == 2
+    assert container.call_stats["list_files"].cache_hits == 0
+
+
+def test_cached_container_exists_error():
+    """
+    arrange: given a cached workload container whose Pebble API fails to list files.
+    act: when a path is checked for existence.
+    assert: the Pebble API error is raised and client attributes are passed through.
+    """
+    mock_container = unittest.mock.MagicMock(spec=ops.Container)
+    mock_container.name = "jenkins-agent-k8s"
+    mock_container.pebble.timeout = 5.0
+    mock_container.pebble.list_files.side_effect = ops.pebble.APIError(
+        body={}, code=500, status="Internal Server Error", message="error"
+    )
+    container = pebble.CachedContainer(mock_container)
+
+    with pytest.raises(ops.pebble.APIError):
+        container.exists(server.AGENT_JAR_PATH)
+    assert container.pebble.timeout == 5.0
+
+
+def test_cached_container_service_not_found(harness: ops.testing.Harness):
+    """
+    arrange: given a cached workload container without services.
+    act: when a service is looked up.
+    assert: ModelError is raised.
+    """
+    harness.set_can_connect("jenkins-agent-k8s", True)
+    harness.begin()
+    container = pebble.CachedContainer(harness.model.unit.get_container("jenkins-agent-k8s"))
+
+    with pytest.raises(ops.ModelError):
+        container.get_service("jenkins-agent")
+
+
+def test_timed_exec_process(monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: given a process executed in the workload container that takes time to output.
+    act: when its output lines are read and it is waited on.
+    assert: the time waited on the process is recorded as exec time.
+    """
+    mock_process = unittest.mock.MagicMock(spec=ops.pebble.ExecProcess)
+    mock_process.stdout = ["first\n", "second\n"]
+    mock_process.wait_output.return_value = ("output", None)
+    monotonic_values = iter(range(10))
+    monkeypatch.setattr(time, "monotonic", lambda: float(next(monotonic_values)))
+    process = pebble.TimedExecProcess(mock_process)
+
+    assert process.stdout is not None and list(process.stdout) == ["first\n", "second\n"]
+    assert process.wait_output() == ("output", None)
+    process.wait()
+
+    assert io_timing.SECONDS[io_timing.EXEC] == 5.0
+    mock_process.wait.assert_called_once()
+
+
+def test_timed_exec_process_no_stdout():
+    """
+    arrange: given a process executed in the workload container with redirected output.
+    act: when its output is read.
+    assert: there is no output to read.
+    """
+    mock_process = unittest.mock.MagicMock(spec=ops.pebble.ExecProcess)
+    mock_process.stdout = None
+
+    assert pebble.TimedExecProcess(mock_process).stdout is None
+
+
+def test_cached_container_registration_calls(
+    begin_charm: typing.Callable[..., JenkinsAgentCharm],
+    config: typing.Dict[str, str],
+):
+    """
+    arrange: given a charm with monkeypatched server functions that return passing values.
+    act: when the agent is registered on pebble ready.
+    assert: each Pebble operation is called once, repeated reads are answered from the cache.
+    """
+    jenkins_charm = begin_charm(config)
+
+    jenkins_charm._on_jenkins_agent_k8s_pebble_ready(
+        unittest.mock.MagicMock(spec=ops.PebbleReadyEvent)
+    )
+
+    assert {
+        operation: stats.count for operation, stats in jenkins_charm.container.call_stats.items()
+    } == {"get_system_info": 1, "add_layer": 1, "replan_services": 1}
+
+
+@pytest.mark.parametrize(
+    "jvm_config, expected_java_opts",
+    [
+        pytest.param(state.JvmConfig(), None, id="disabled"),
+        pytest.param(
+            state.JvmConfig(metrics_exporter=True),
+            f"-javaagent:{server.JMX_EXPORTER_JAR_PATH}=9404:{server.JMX_EXPORTER_CONFIG_PATH}",
+            id="metrics exporter",
+        ),
+        pytest.param(
+            state.JvmConfig(jfr_recording=True),
+            f"-XX:FlightRecorderOptions=repository={server.JFR_REPOSITORY_PATH} "
+            "-XX:StartFlightRecording=name=jenkins-agent,disk=true,maxsize=64m",
+            id="flight recording",
+        ),
+    ],
+)
+def test__get_pebble_layer_java_opts(
+    jvm_config: state.JvmConfig, expected_java_opts: typing.Optional[str]
+):
+    """
+    arrange: given a JVM observability configuration.
+    act: when _get_pebble_layer is called.
+    assert: JAVA_OPTS enables the configured features and is only set when needed.
+    """
+    mock_state = unittest.mock.MagicMock(spec=state.State)
+    mock_state.jenkins_agent_service_name = state.State.jenkins_agent_service_name
+    mock_state.jvm_config = jvm_config
+    pebble_service = pebble.PebbleService(state=mock_state)
+
+    layer = pebble_service._get_pebble_layer(
+        server_url="http://test-url", agent_token_pair=("agent-1", secrets.token_hex(16))
+    )
+
+    environment = layer.services[state.State.jenkins_agent_service_name].environment
+    assert environment.get("JAVA_OPTS") == expected_java_opts
+
+
+def test__get_pebble_layer_java_opts_secondary_controller():
+    """
+    arrange: given the pebble services of two controllers with all JVM features enabled.
+    act: when _get_pebble_layer is called for each controller.
+    assert: only the agent of the primary controller runs the JMX exporter and the recording.
+    """
+    mock_state = unittest.mock.MagicMock(spec=state.State)
+    mock_state.jenkins_agent_service_name = state.State.jenkins_agent_service_name
+    mock_state.jvm_config = state.JvmConfig(metrics_exporter=True, jfr_recording=True)
+    primary_service = pebble.PebbleService(state=mock_state)
+    secondary_service = pebble.PebbleService(state=mock_state, controller_name="agent-1")
+
+    primary_layer = primary_service._get_pebble_layer(
+        server_url="http://test-url", agent_token_pair=("agent-1", secrets.token_hex(16))
+    )
+    secondary_layer = secondary_service._get_pebble_layer(
+        server_url="http://test-url-1", agent_token_pair=("agent-2", secrets.token_hex(16))
+    )
+
+    primary_environment = primary_layer.services[primary_service.agent_service_name].environment
+    assert "-javaagent:" in primary_environment["JAVA_OPTS"]
+    assert "-XX:StartFlightRecording" in primary_environment["JAVA_OPTS"]
+    secondary_environment = secondary_layer.services[
+        secondary_service.agent_service_name
+    ].environment
+    assert "JAVA_OPTS" not in secondary_environment
+
+
+def test_get_jfr_chunk_paths(harness: ops.testing.Harness):
+    """
+    arrange: given flight recorder repositories of a previous and of the running agent JVM.
+    act: when get_jfr_chunk_paths is called.
+    assert: the completed chunks of the running agent recording are returned, oldest first.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+    for chunk in (
+        "2024_01_01_00_00_00_1/2024_01_01_00_00_00.jfr",
+        "2024_01_02_00_00_00_2/2024_01_02_00_00_01.jfr",
+        "2024_01_02_00_00_00_2/2024_01_02_01_00_00.jfr",
+        "2024_01_02_00_00_00_2/2024_01_02_02_00_00.jfr",
+    ):
+        container.push(server.JFR_REPOSITORY_PATH / chunk, b"chunk", make_dirs=True)
+
+    chunk_paths = jenkins_charm.pebble_service.get_jfr_chunk_paths(container)
+
+    assert chunk_paths == [
+        f"{server.JFR_REPOSITORY_PATH}/2024_01_02_00_00_00_2/2024_01_02_00_00_01.jfr",
+        f"{server.JFR_REPOSITORY_PATH}/2024_01_02_00_00_00_2/2024_01_02_01_00_00.jfr",
+    ]
+
+
+@pytest.mark.parametrize(
+    "repository_files",
+    [
+        pytest.param((), id="no repository"),
+        pytest.param(("stray.jfr",), id="no JVM repository"),
+    ],
+)
+def test_get_jfr_chunk_paths_no_recording(
+    harness: ops.testing.Harness, repository_files: typing.Tuple[str, ...]
+):
+    """
+    arrange: given no flight recorder repository, or a repository without a JVM directory.
+    act: when get_jfr_chunk_paths is called.
+    assert: no chunk is returned.
+    """
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+    for repository_file in repository_files:
+        container.push(server.JFR_REPOSITORY_PATH / repository_file, b"chunk", make_dirs=True)
+
+    assert not jenkins_charm.pebble_service.get_jfr_chunk_paths(container)
@@ -0,0 +1,691 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Jenkins-agent-k8s reconciler module tests."""
+
+# Need access to protected functions for testing
+# pylint:disable=protected-access
+
+import os
+import typing
+from unittest.mock import MagicMock
+
+import ops
+import pytest
+from ops.testing import Harness
+
+import pebble
+import reconciler
+import server
+import state
+from charm import JenkinsAgentCharm
+
+from .constants import ACTIVE_STATUS_NAME, BLOCKED_STATUS_NAME, WAITING_STATUS_NAME
+
+
+def test_reconcile_no_valid_credentials_not_applied(
+    begin_charm: typing.Callable[..., JenkinsAgentCharm], config: typing.Dict[str, str]
+):
+    """
+    arrange: given a charm with monkeypatched validate_credentials that returns false.
+    act: when reconcile is called.
+    assert: no fingerprint is stored so that the next reconcile retries the registration.
+    """
+    jenkins_charm = begin_charm(config, valid=False)
+
+    jenkins_charm.reconciler.reconcile()
+
+    assert jenkins_charm.unit.status.name == BLOCKED_STATUS_NAME
+    assert typing.cast(str, jenkins_charm.reconciler._stored.fingerprint) == ""
+
+
+def test_stop_agent(
+    monkeypatch: pytest.MonkeyPatch,
+    begin_charm: typing.Callable[..., JenkinsAgentCharm],
+    config: typing.Dict[str, str],
+):
+    """
+    arrange: given a charm with a registered Jenkins agent.
+    act: when stop_agent is called.
+    assert: the applied fingerprint is cleared and the next reconcile registers again.
+    """
+    jenkins_charm = begin_charm(config)
+    mock_download = MagicMock(spec=server.download_jenkins_agent, return_value="sha256")
+    monkeypatch.setattr(server, "download_jenkins_agent", mock_download)
+    jenkins_charm.reconciler.reconcile()
+
+    jenkins_charm.reconciler.stop_agent()
+    jenkins_charm.reconciler.reconcile()
+
+    assert mock_download.call_count == 2
+
+
+def test_reconcile_applied_agent_not_in_target(
+    begin_charm: typing.Callable[..., JenkinsAgentCharm], config: typing.Dict[str, str]
+):
+    """
+    arrange: given a charm with a registered Jenkins agent.
+    act: when the target no longer contains the registered agent.
+    assert: the target is not applied.
+    """
+    jenkins_charm = begin_charm(config)
+    jenkins_charm.reconciler.reconcile()
+
+    is_applied = jenkins_charm.reconciler._is_applied(
+        reconciler.Target(
+            server_url=config["jenkins_url"],
+            agent_name_token_pairs=(("other-agent", "token"),),
+            validate=True,
+        )
+    )
+
+    assert not is_applied
+
+
+def test_reconcile_unhealthy_container_not_ready(
+    begin_charm: typing.Callable[..., JenkinsAgentCharm],
+    harness: Harness,
+    config: typing.Dict[str, str],
+):
+    """
+    arrange: given a charm with a registered Jenkins agent.
+    act: when the workload container becomes unreachable.
+    assert: the agent is not healthy.
+    """
+    jenkins_charm = begin_charm(config)
+    jenkins_charm.reconciler.reconcile()
+
+    harness.set_can_connect(state.State.jenkins_agent_service_name, False)
+
+    assert not jenkins_charm.reconciler._is_healthy()
+
+
+def test_reconcile_background_validation(
+    monkeypatch: pytest.MonkeyPatch, harness: Harness, config: typing.Dict[str, str]
+):
+    """
+    arrange: given a charm configured to validate credentials in the background.
+    act: when reconcile is called, then the validation service reports a valid agent.
+    assert: the unit waits for the validation service, then the agent is started.
+    """
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: "sha256")
+    mock_find_valid_credentials = MagicMock(spec=server.find_valid_credentials)
+    monkeypatch.setattr(server, "find_valid_credentials", mock_find_valid_credentials)
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config({**config, "background_validation": True})
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+
+    jenkins_charm.reconciler.reconcile()
+
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    validation_service = jenkins_charm.pebble_service.validation_service_name
+    assert container.get_service(validation_service).is_running()
+    assert (
+        container.pull(server.VALIDATION_CANDIDATES_PATH).read()
+        == f"{config['jenkins_agent_name']} {config['jenkins_agent_token']}\n"
+    )
+
+    container.stop(validation_service)
+    container.push(server.VALIDATION_RESULT_PATH, f"{config['jenkins_agent_name']}\n")
+    harness.pebble_notify(state.State.jenkins_agent_service_name, pebble.VALIDATION_NOTICE_KEY)
+
+    assert jenkins_charm.unit.status.name == ACTIVE_STATUS_NAME
+    mock_find_valid_credentials.assert_not_called()
+
+
+def test_reconcile_background_validation_no_valid_credentials(
+    monkeypatch: pytest.MonkeyPatch, harness: Harness, config: typing.Dict[str, str]
+):
+    """
+    arrange: given a charm whose background validation found no valid agent.
+    act: when reconcile is called.
+    assert: the unit falls into BlockedStatus without starting the validation again.
+    """
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: "sha256")
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config({**config, "background_validation": True})
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+    jenkins_charm.reconciler.reconcile()
+    container.stop(jenkins_charm.pebble_service.validation_service_name)
+    container.push(server.VALIDATION_RESULT_PATH, "\n")
+    mock_start_validation = MagicMock(spec=pebble.PebbleService.start_validation)
+    monkeypatch.setattr(pebble.PebbleService, "start_validation", mock_start_validation)
+
+    jenkins_charm.reconciler.reconcile()
+
+    assert jenkins_charm.unit.status.name == BLOCKED_STATUS_NAME
+    mock_start_validation.assert_not_called()
+
+
+def test_reconcile_background_validation_restarted(
+    monkeypatch: pytest.MonkeyPatch, harness: Harness, config: typing.Dict[str, str]
+):
+    """
+    arrange: given a charm validating credentials in the background.
+    act: when reconcile is called while the validation runs, then after it stopped without result.
+    assert: the unit waits for the running validation, then the validation is started again.
+    """
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: "sha256")
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config({**config, "background_validation": True})
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    jenkins_charm.reconciler.reconcile()
+    mock_start_validation = MagicMock(spec=pebble.PebbleService.start_validation)
+    monkeypatch.setattr(pebble.PebbleService, "start_validation", mock_start_validation)
+
+    jenkins_charm.reconciler.reconcile()
+
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    mock_start_validation.assert_not_called()
+
+    jenkins_charm.container.stop(jenkins_charm.pebble_service.validation_service_name)
+    jenkins_charm.reconciler.reconcile()
+
+    mock_start_validation.assert_called_once()
+
+
+def test_reconcile_validation_budget_exceeded(
+    monkeypatch: pytest.MonkeyPatch, harness: Harness, config: typing.Dict[str, str]
+):
+    """
+    arrange: given a charm whose validation within the hook runs out of time budget.
+    act: when reconcile is called.
+    assert: the validation continues in the background and the unit waits for it.
+    """
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: "sha256")
+    monkeypatch.setattr(
+        server,
+        "find_valid_credentials",
+        MagicMock(
+            spec=server.find_valid_credentials, side_effect=server.ValidationBudgetExceededError
+        ),
+    )
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config(config)
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+
+    jenkins_charm.reconciler.reconcile()
+
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    assert typing.cast(str, jenkins_charm.reconciler._stored.validation_digest) != ""
+
+
+def test_reconcile_validation_too_many_pairs(
+    monkeypatch: pytest.MonkeyPatch, harness: Harness, config: typing.Dict[str, str]
+):
+    """
+    arrange: given a charm with more agent-token pairs than can be validated within a hook.
+    act: when reconcile is called.
+    assert: the pairs are validated in the background.
+    """
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: "sha256")
+    mock_find_valid_credentials = MagicMock(spec=server.find_valid_credentials)
+    monkeypatch.setattr(server, "find_valid_credentials", mock_find_valid_credentials)
+    num_pairs = reconciler.SYNC_VALIDATION_BUDGET_SECONDS // server.VALIDATION_TIMEOUT_SECONDS + 1
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config(
+        {
+            **config,
+            "jenkins_agent_name": ":".join(f"agent-{i}" for i in range(num_pairs)),
+            "jenkins_agent_token": ":".join(f"token-{i}" for i in range(num_pairs)),
+        }
+    )
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+
+    jenkins_charm.reconciler.reconcile()
+
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    mock_find_valid_credentials.assert_not_called()
+
+
+def test_agent_connected(
+    begin_charm: typing.Callable[..., JenkinsAgentCharm],
+    harness: Harness,
+    config: typing.Dict[str, str],
+):
+    """
+    arrange: given a charm with a registered agent that is waiting for the agent to reconnect.
+    act: when the agent entrypoint notifies that the agent connected.
+    assert: the unit is active.
+    """
+    jenkins_charm = begin_charm(config)
+    jenkins_charm.reconciler.reconcile()
+    jenkins_charm.unit.status = ops.WaitingStatus("Jenkins agent disconnected, reconnecting.")
+
+    harness.pebble_notify(
+        state.State.jenkins_agent_service_name,
+        pebble.AGENT_CONNECTED_NOTICE_KEY,
+        data={"agent": config["jenkins_agent_name"]},
+    )
+
+    assert jenkins_charm.unit.status.name == ACTIVE_STATUS_NAME
+
+
+@pytest.mark.parametrize(
+    "notice_key, agent_name",
+    [
+        pytest.param(pebble.AGENT_CONNECTED_NOTICE_KEY, "stale-agent", id="stale agent"),
+        pytest.param("jenkins.io/other", "", id="other notice"),
+    ],
+)
+def test_agent_connected_ignored(
+    begin_charm: typing.Callable[..., JenkinsAgentCharm],
+    harness: Harness,
+    config: typing.Dict[str, str],
+    notice_key: str,
+    agent_name: str,
+):
+    """
+    arrange: given a charm with a registered agent that is waiting for the agent to reconnect.
+    act: when a stale agent connects or another notice is received.
+    assert: the unit keeps waiting for the agent.
+    """
+    jenkins_charm = begin_charm(config)
+    jenkins_charm.reconciler.reconcile()
+    jenkins_charm.unit.status = ops.WaitingStatus("Jenkins agent disconnected, reconnecting.")
+
+    harness.pebble_notify(
+        state.State.jenkins_agent_service_name,
+        notice_key,
+        data={"agent": agent_name or config["jenkins_agent_name"]},
+    )
+
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+
+
+def test_agent_disconnected_rotate(
+    monkeypatch: pytest.MonkeyPatch, harness: Harness, config: typing.Dict[str, str]
+):
+    """
+    arrange: given a charm registered with the first of two valid configured agent-token pairs.
+    act: when the agent entrypoint notifies that the agent disconnected.
+    assert: the agent is started again with the second pair.
+    """
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: "sha256")
+    monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: True)
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config(
+        {
+            **config,
+            "jenkins_agent_name": "agent-0:agent-1",
+            "jenkins_agent_token": "token-0:token-1",
+        }
+    )
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    jenkins_charm.reconciler.reconcile()
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+    service_name = state.State.jenkins_agent_service_name
+    assert container.get_plan().services[service_name].environment["JENKINS_AGENT"] == "agent-0"
+
+    harness.pebble_notify(
+        service_name, pebble.AGENT_DISCONNECTED_NOTICE_KEY, data={"agent": "agent-0"}
+    )
+
+    assert container.get_plan().services[service_name].environment["JENKINS_AGENT"] == "agent-1"
+    assert jenkins_charm.unit.status.name == ACTIVE_STATUS_NAME
+
+
+def test_agent_disconnected_relation(
+    monkeypatch: pytest.MonkeyPatch,
+    harness: Harness,
+    get_valid_relation_data: typing.Callable[[str], typing.Dict[str, str]],
+):
+    """
+    arrange: given a charm registered through the agent relation.
+    act: when the agent entrypoint notifies that the agent disconnected.
+    assert: the unit waits for pebble to restart the agent without re-registering.
+    """
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: "sha256")
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins-k8s")
+    harness.add_relation_unit(relation_id, "jenkins-k8s/0")
+    harness.update_relation_data(
+        relation_id, "jenkins-k8s/0", get_valid_relation_data(state.AGENT_RELATION)
+    )
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    jenkins_charm.reconciler.reconcile()
+    fingerprint = jenkins_charm.reconciler._stored.fingerprint
+
+    harness.pebble_notify(
+        state.State.jenkins_agent_service_name,
+        pebble.AGENT_DISCONNECTED_NOTICE_KEY,
+        data={"agent": jenkins_charm.state.agent_meta.name},
+    )
+
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    assert jenkins_charm.reconciler._stored.fingerprint == fingerprint
+
+
+def test_agent_disconnected_stale_agent(
+    begin_charm: typing.Callable[..., JenkinsAgentCharm],
+    harness: Harness,
+    config: typing.Dict[str, str],
+):
+    """
+    arrange: given a charm with a registered agent.
+    act: when the agent entrypoint notifies that a previously registered agent disconnected.
+    assert: the notice is ignored.
+    """
+    jenkins_charm = begin_charm(config)
+    jenkins_charm.reconciler.reconcile()
+    fingerprint = jenkins_charm.reconciler._stored.fingerprint
+
+    harness.pebble_notify(
+        state.State.jenkins_agent_service_name,
+        pebble.AGENT_DISCONNECTED_NOTICE_KEY,
+        data={"agent": "stale-agent"},
+    )
+
+    assert jenkins_charm.unit.status.name == ACTIVE_STATUS_NAME
+    assert jenkins_charm.reconciler._stored.fingerprint == fingerprint
+
+
+def test_reconcile_prefetch_agent_jar(
+    monkeypatch: pytest.MonkeyPatch,
+    harness: Harness,
+    get_valid_relation_data: typing.Callable[[str], typing.Dict[str, str]],
+):
+    """
+    arrange: given an agent relation with the server URL but without the secret of this agent.
+    act: when reconcile is called, then the secret arrives and reconcile is called again.
+    assert: the agent JAR is downloaded once, before the secret arrives.
+    """
+    mock_download = MagicMock(spec=server.download_jenkins_agent, return_value="sha256")
+    monkeypatch.setattr(server, "download_jenkins_agent", mock_download)
+    monkeypatch.setattr(
+        server,
+        "get_agent_jar_digest",
+        lambda _server_url: server.AgentJarDigest(size=9, sha256="sha256"),
+    )
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins-k8s")
+    harness.add_relation_unit(relation_id, "jenkins-k8s/0")
+    relation_data = get_valid_relation_data(state.AGENT_RELATION)
+    harness.update_relation_data(relation_id, "jenkins-k8s/0", {"url": relation_data["url"]})
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+    # The harness does not run the download, the JAR is pushed to mark the download done.
+    container.push(server.AGENT_JAR_PATH, b"agent-jar", make_dirs=True)
+
+    jenkins_charm.reconciler.reconcile()
+
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    mock_download.assert_called_once()
+
+    harness.update_relation_data(relation_id, "jenkins-k8s/0", relation_data)
+    jenkins_charm.state = state.State.from_charm(jenkins_charm)
+    jenkins_charm.reconciler.state = jenkins_charm.state
+    jenkins_charm.reconciler.reconcile()
+
+    assert jenkins_charm.unit.status.name == ACTIVE_STATUS_NAME
+    mock_download.assert_called_once()
+
+
+def test_reconcile_prefetch_agent_jar_error(
+    monkeypatch: pytest.MonkeyPatch,
+    harness: Harness,
+    raise_exception: typing.Callable,
+):
+    """
+    arrange: given an agent relation with the server URL only and a failing agent JAR download.
+    act: when reconcile is called.
+    assert: the unit waits for the relation data rather than erroring.
+    """
+    monkeypatch.setattr(
+        server,
+        "download_jenkins_agent",
+        lambda *_args, **_kwargs: raise_exception(server.AgentJarDownloadError),
+    )
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins-k8s")
+    harness.add_relation_unit(relation_id, "jenkins-k8s/0")
+    harness.update_relation_data(relation_id, "jenkins-k8s/0", {"url": "http://test"})
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+
+    jenkins_charm.reconciler.reconcile()
+
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+
+
+def test_reconcile_prefetch_agent_jar_container_not_ready(
+    monkeypatch: pytest.MonkeyPatch, harness: Harness
+):
+    """
+    arrange: given an agent relation with the server URL only and an unreachable container.
+    act: when reconcile is called.
+    assert: the agent JAR is not downloaded and the unit waits for the relation data.
+    """
+    mock_download = MagicMock(spec=server.download_jenkins_agent, return_value="sha256")
+    monkeypatch.setattr(server, "download_jenkins_agent", mock_download)
+    harness.set_can_connect(state.State.jenkins_agent_service_name, False)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins-k8s")
+    harness.add_relation_unit(relation_id, "jenkins-k8s/0")
+    harness.update_relation_data(relation_id, "jenkins-k8s/0", {"url": "http://test"})
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+
+    jenkins_charm.reconciler.reconcile()
+
+    assert jenkins_charm.unit.status.name == WAITING_STATUS_NAME
+    mock_download.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "resource_content, expected_resource",
+    [
+        pytest.param(None, False, id="not attached"),
+        pytest.param(b"", False, id="empty"),
+        pytest.param(b"agent-jar", True, id="attached"),
+    ],
+)
+def test_reconcile_agent_jar_sources(
+    monkeypatch: pytest.MonkeyPatch,
+    harness: Harness,
+    config: typing.Dict[str, str],
+    resource_content: typing.Optional[bytes],
+    expected_resource: bool,
+):
+    """
+    arrange: given a configured agent JAR mirror and an agent-jar resource.
+    act: when reconcile is called.
+    assert: the agent JAR is downloaded with the mirror and the attached non-empty resource.
+    """
+    mock_download = MagicMock(spec=server.download_jenkins_agent, return_value="sha256")
+    monkeypatch.setattr(server, "download_jenkins_agent", mock_download)
+    monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: True)
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config({**config, "agent_jar_mirror_url": "http://mirror/agent.jar"})
+    if resource_content is not None:
+        harness.add_resource(reconciler.AGENT_JAR_RESOURCE, resource_content)
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+
+    jenkins_charm.reconciler.reconcile()
+
+    sources = mock_download.call_args.kwargs["sources"]
+    assert sources.mirror_url == "http://mirror/agent.jar"
+    assert (sources.resource_path is not None) == expected_resource
+
+
+def test_reconcile_endpoint_failover(
+    monkeypatch: pytest.MonkeyPatch, harness: Harness, config: typing.Dict[str, str]
+):
+    """
+    arrange: given two configured Jenkins server endpoints, the second one faster.
+    act: when reconcile is called, then the active endpoint becomes unhealthy on update status.
+    assert: the agent registers through the faster endpoint, then fails over to the other one.
+    """
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: "sha256")
+    monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: True)
+    latencies: typing.Dict[str, typing.Optional[float]] = {
+        "http://jenkins-a": 0.2,
+        "http://jenkins-b": 0.1,
+    }
+    monkeypatch.setattr(server, "measure_endpoint_latency", latencies.__getitem__)
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config({**config, "jenkins_url": "http://jenkins-a, http://jenkins-b"})
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    container = harness.model.unit.get_container(state.State.jenkins_agent_service_name)
+    service_name = state.State.jenkins_agent_service_name
+
+    jenkins_charm.reconciler.reconcile()
+
+    environment = container.get_plan().services[service_name].environment
+    assert environment["JENKINS_URL"] == "http://jenkins-b"
+
+    latencies["http://jenkins-b"] = None
+    harness.charm.on.update_status.emit()
+
+    environment = container.get_plan().services[service_name].environment
+    assert environment["JENKINS_URL"] == "http://jenkins-a"
+    assert jenkins_charm.unit.status.name == ACTIVE_STATUS_NAME
+
+
+def test_reconcile_endpoint_not_probed(
+    monkeypatch: pytest.MonkeyPatch, harness: Harness, config: typing.Dict[str, str]
+):
+    """
+    arrange: given two configured Jenkins server endpoints and a registered agent.
+    act: when reconcile is called without health check.
+    assert: the endpoints are not probed again.
+    """
+    monkeypatch.setattr(server, "download_jenkins_agent", lambda *_args, **_kwargs: "sha256")
+    monkeypatch.setattr(server, "validate_credentials", lambda *_args, **_kwargs: True)
+    mock_measure = MagicMock(spec=server.measure_endpoint_latency, return_value=0.1)
+    monkeypatch.setattr(server, "measure_endpoint_latency", mock_measure)
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config({**config, "jenkins_url": "http://jenkins-a, http://jenkins-b"})
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    jenkins_charm.reconciler.reconcile()
+    mock_measure.reset_mock()
+
+    jenkins_charm.reconciler.reconcile()
+
+    mock_measure.assert_not_called()
+    assert jenkins_charm.reconciler._stored.endpoint == "http://jenkins-a"
+
+
+@pytest.mark.parametrize(
+    "secondary_status, expected_status",
+    [
+        pytest.param(
+            ops.WaitingStatus("Waiting for workload container."),
+            ops.WaitingStatus("agent-1: Waiting for workload container."),
+            id="waiting",
+        ),
+        pytest.param(None, ops.ActiveStatus(), id="up to date"),
+    ],
+)
+def test_reconcile_all_secondary_controller_status(
+    harness: Harness,
+    secondary_status: typing.Optional[ops.StatusBase],
+    expected_status: ops.StatusBase,
+):
+    """
+    arrange: given an active primary controller and a waiting or up to date secondary one.
+    act: when reconcile_all is called.
+    assert: the unit status is the prefixed secondary controller status, or active.
+    """
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+    reconcilers = []
+    for controller, status in (
+        (state.Controller(name="", relation_id=None, num_executors=1), ops.ActiveStatus()),
+        (state.Controller(name="agent-1", relation_id=1, num_executors=1), secondary_status),
+    ):
+        mock_reconciler = MagicMock(spec=reconciler.Reconciler)
+        mock_reconciler.charm = jenkins_charm
+        mock_reconciler.state = jenkins_charm.state
+        mock_reconciler.controller = controller
+        if status:
+            mock_reconciler.reconcile.side_effect = lambda _status=status, **_kwargs: setattr(
+                jenkins_charm.unit, "status", _status
+            )
+        reconcilers.append(mock_reconciler)
+
+    reconciler.reconcile_all(reconcilers)
+
+    assert jenkins_charm.unit.status == expected_status
+
+
+def test_reconcile_all_more_controllers_than_executors(
+    monkeypatch: pytest.MonkeyPatch,
+    harness: Harness,
+    begin_charm: typing.Callable[..., JenkinsAgentCharm],
+    config: typing.Dict[str, str],
+):
+    """
+    arrange: given a charm with one executor, the Jenkins configuration and an agent relation.
+    act: when reconcile_all is called.
+    assert: the primary controller agent is started and the unit is blocked on the relation.
+    """
+    monkeypatch.setattr(os, "cpu_count", lambda: 1)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+    jenkins_charm = begin_charm(config)
+
+    reconciler.reconcile_all(jenkins_charm.reconcilers)
+
+    assert len(jenkins_charm.reconcilers) == 1
+    assert jenkins_charm.reconciler._stored.agent_name == config["jenkins_agent_name"]
+    assert jenkins_charm.unit.status == ops.BlockedStatus(
+        f"More controllers than executors, relations {relation_id} not served."
+    )
+
+
+def test_validation_notice_reconciles_all_controllers(
+    monkeypatch: pytest.MonkeyPatch, harness: Harness, config: typing.Dict[str, str]
+):
+    """
+    arrange: given a charm registered from the configuration and from an agent relation.
+    act: when the credentials validation service notifies that it is done.
+    assert: the agents of all controllers are reconciled.
+    """
+    mock_reconcile_all = MagicMock(spec=reconciler.reconcile_all)
+    monkeypatch.setattr(reconciler, "reconcile_all", mock_reconcile_all)
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config(config)
+    harness.add_relation(state.AGENT_RELATION, "jenkins")
+    harness.begin()
+    jenkins_charm = typing.cast(JenkinsAgentCharm, harness.charm)
+
+    harness.pebble_notify(state.State.jenkins_agent_service_name, pebble.VALIDATION_NOTICE_KEY)
+
+    mock_reconcile_all.assert_called_once_with(jenkins_charm.reconcilers)
+    assert len(jenkins_charm.reconcilers) == 2
+
+
+def test_agent_disconnected_departed_controller(
+    monkeypatch: pytest.MonkeyPatch, harness: Harness, config: typing.Dict[str, str]
+):
+    """
+    arrange: given a charm registered from the configuration.
+    act: when the agent of a departed secondary controller notifies that it disconnected.
+    assert: the notice is ignored.
+    """
+    mock_agent_disconnected = MagicMock(spec=reconciler.Reconciler.agent_disconnected)
+    monkeypatch.setattr(reconciler.Reconciler, "agent_disconnected", mock_agent_disconnected)
+    harness.set_can_connect(state.State.jenkins_agent_service_name, True)
+    harness.update_config(config)
+    harness.begin()
+
+    harness.pebble_notify(
+        state.State.jenkins_agent_service_name,
+        pebble.AGENT_DISCONNECTED_NOTICE_KEY,
+        data={"agent": "agent-0", "controller": "agent-9"},
+    )
+
+    mock_agent_disconnected.assert_not_called()
@@ -6,16 +6,24 @@
 # Need access to protected functions for testing
 # pylint:disable=protected-access
 
+import base64
+import hashlib
+import inspect
 import secrets
+import socket
+import ssl
 import typing
 import unittest.mock
+from pathlib import Path
 
 import ops
 import ops.testing
 import pytest
 import requests
 
+import metrics
 import server
+import tracing
 
 
 @pytest.mark.parametrize(
@@ -46,9 +54,9 @@ def test_download_jenkins_agent_download(
     """
     arrange: given a monkeypatched requests.get that returns the agent.jar content.
     act: when download_jenkins_agent is called.
-    assert: the agent.jar is installed in the workload container.
+    assert: the agent.jar is installed in the workload container and its hash is returned.
     """
-    response_content = "hello"
+    response_content = b"hello"
     mock_response = unittest.mock.MagicMock(spec=requests.Response)
     mock_response.content = response_content
     monkeypatch.setattr(requests, "get", lambda *_args, **_kwags: mock_response)
@@ -56,9 +64,12 @@ def test_download_jenkins_agent_download(
     harness.begin()
 
     container = harness.model.unit.get_container("jenkins-agent-k8s")
-    server.download_jenkins_agent(server_url="http://test-url", container=container)
+    agent_jar_sha256 = server.download_jenkins_agent(
+        server_url="http://test-url", container=container
+    )
 
-    assert str(container.pull(server.AGENT_JAR_PATH, encoding="utf-8").read()) == response_content
+    assert container.pull(server.AGENT_JAR_PATH, encoding=None).read() == response_content
+    assert agent_jar_sha256 == hashlib.sha256(response_content).hexdigest()
 
 
 @pytest.mark.parametrize(
@@ -111,3 +122,305 @@ def test_validate_credentials(jenkins_connection_log: str, random_delay: bool):
         container=mock_container,
         add_random_delay=random_delay,
     )
+
+
+def test_find_valid_credentials_time_budget_exceeded(monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: given a monkeypatched validate_credentials and an exhausted time budget.
+    act: when find_valid_credentials is called.
+    assert: ValidationBudgetExceededError is raised before any pair is validated.
+    """
+    mock_validate = unittest.mock.MagicMock(spec=server.validate_credentials)
+    monkeypatch.setattr(server, "validate_credentials", mock_validate)
+
+    with pytest.raises(server.ValidationBudgetExceededError):
+        server.find_valid_credentials(
+            agent_name_token_pairs=[("test-agent", secrets.token_hex(16))],
+            server_url="http://test-url",
+            container=unittest.mock.MagicMock(spec=ops.Container),
+            time_budget=0,
+        )
+
+    mock_validate.assert_not_called()
+
+
+def test_download_jenkins_agent_metrics(monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: given a monkeypatched requests.get that returns the agent JAR content.
+    act: when download_jenkins_agent is called.
+    assert: the download duration and bytes are recorded.
+    """
+    mock_response = unittest.mock.MagicMock(spec=requests.Response)
+    mock_response.content = b"agent-jar"
+    monkeypatch.setattr(requests, "get", lambda *_args, **_kwargs: mock_response)
+
+    server.download_jenkins_agent(
+        server_url="http://test-url", container=unittest.mock.MagicMock(spec=ops.Container)
+    )
+
+    assert metrics.REGISTRY.counters["jenkins_agent_jar_download_bytes_total"] == len(b"agent-jar")
+    assert metrics.REGISTRY.counters["jenkins_agent_jar_download_seconds_count"] == 1
+
+
+def get_mock_head(
+    content: bytes, headers: typing.Optional[typing.Dict[str, str]] = None
+) -> typing.Callable[..., unittest.mock.MagicMock]:
+    """Get a requests.head replacement advertising an agent JAR executable.
+
+    Args:
+        content: The advertised agent JAR executable.
+        headers: The additional response headers.
+
+    Returns:
+        The requests.head replacement.
+    """
+    mock_response = unittest.mock.MagicMock(spec=requests.Response)
+    mock_response.headers = {"Content-Length": str(len(content)), **(headers or {})}
+    return lambda *_args, **_kwargs: mock_response
+
+
+@pytest.mark.parametrize(
+    "headers, expected_sha256",
+    [
+        pytest.param({}, None, id="size only"),
+        pytest.param(
+            {"Repr-Digest": f"sha-512=:AA==:, sha-256=:{base64.b64encode(b'0' * 32).decode()}:"},
+            (b"0" * 32).hex(),
+            id="Repr-Digest",
+        ),
+        pytest.param(
+            {"Digest": f"SHA-256={base64.b64encode(b'0' * 32).decode()}"},
+            (b"0" * 32).hex(),
+            id="Digest",
+        ),
+        pytest.param({"Digest": "SHA-256=not base64!"}, None, id="invalid Digest"),
+    ],
+)
+def test_get_agent_jar_digest(
+    monkeypatch: pytest.MonkeyPatch,
+    headers: typing.Dict[str, str],
+    expected_sha256: typing.Optional[str],
+):
+    """
+    arrange: given a server advertising the agent JAR executable with digest headers.
+    act: when get_agent_jar_digest is called.
+    assert: the advertised size and sha256 digest are returned.
+    """
+    monkeypatch.setattr(requests, "head", get_mock_head(b"agent-jar", headers))
+
+    digest = server.get_agent_jar_digest("http://test-url")
+
+    assert digest == server.AgentJarDigest(size=len(b"agent-jar"), sha256=expected_sha256)
+
+
+def test_get_agent_jar_digest_error(
+    monkeypatch: pytest.MonkeyPatch, raise_exception: typing.Callable
+):
+    """
+    arrange: given a server that cannot be reached.
+    act: when get_agent_jar_digest is called.
+    assert: None is returned.
+    """
+    monkeypatch.setattr(
+        requests, "head", lambda *_args, **_kwargs: raise_exception(requests.ConnectionError)
+    )
+
+    assert server.get_agent_jar_digest("http://test-url") is None
+
+
+@pytest.mark.parametrize(
+    "resource_content, mirror_content, expected_source",
+    [
+        pytest.param(b"agent-jar", b"agent-jar", "resource", id="resource"),
+        pytest.param(b"stale-agent-jar", b"agent-jar", "mirror", id="stale resource"),
+        pytest.param(None, b"agent-jar", "mirror", id="mirror"),
+        pytest.param(None, b"stale-agent-jar", "server", id="stale mirror"),
+    ],
+)
+def test_download_jenkins_agent_sources(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    resource_content: typing.Optional[bytes],
+    mirror_content: bytes,
+    expected_source: str,
+):
+    """
+    arrange: given an agent JAR resource and mirror, with content matching the server or not.
+    act: when download_jenkins_agent is called.
+    assert: the agent JAR is read from the first source matching the server.
+    """
+    monkeypatch.setattr(requests, "head", get_mock_head(b"agent-jar"))
+    responses = {"http://mirror/agent.jar": mirror_content, "http://test-url": b"agent-jar"}
+
+    def mock_get(url: str, **_kwargs: typing.Any) -> unittest.mock.MagicMock:
+        """Serve the mirror and the server.
+
+        Args:
+            url: The requested URL.
+            _kwargs: The request arguments.
+
+        Returns:
+            The response.
+        """
+        mock_response = unittest.mock.MagicMock(spec=requests.Response)
+        mock_response.content = responses[url.removesuffix("/jnlpJars/agent.jar")]
+        return mock_response
+
+    monkeypatch.setattr(requests, "get", mock_get)
+    resource_path = tmp_path / "agent.jar"
+    if resource_content is not None:
+        resource_path.write_bytes(resource_content)
+    container = unittest.mock.MagicMock(spec=ops.Container)
+
+    agent_jar_sha256 = server.download_jenkins_agent(
+        server_url="http://test-url",
+        container=container,
+        sources=server.AgentJarSources(
+            resource_path=resource_path, mirror_url="http://mirror/agent.jar"
+        ),
+    )
+
+    assert agent_jar_sha256 == hashlib.sha256(b"agent-jar").hexdigest()
+    container.push.assert_called_once()
+    assert (
+        metrics.REGISTRY.counters[
+            f'jenkins_agent_jar_downloads_total{{source="{expected_source}"}}'
+        ]
+        == 1
+    )
+
+
+def test_download_jenkins_agent_sources_unverified(
+    monkeypatch: pytest.MonkeyPatch, raise_exception: typing.Callable, tmp_path: Path
+):
+    """
+    arrange: given an agent JAR resource and a server not advertising its agent JAR.
+    act: when download_jenkins_agent is called.
+    assert: the agent JAR is downloaded from the server.
+    """
+    monkeypatch.setattr(
+        requests, "head", lambda *_args, **_kwargs: raise_exception(requests.ConnectionError)
+    )
+    mock_response = unittest.mock.MagicMock(spec=requests.Response)
+    mock_response.content = b"agent-jar"
+    monkeypatch.setattr(requests, "get", lambda *_args, **_kwargs: mock_response)
+    resource_path = tmp_path / "agent.jar"
+    resource_path.write_bytes(b"resource-jar")
+
+    agent_jar_sha256 = server.download_jenkins_agent(
+        server_url="http://test-url",
+        container=unittest.mock.MagicMock(spec=ops.Container),
+        sources=server.AgentJarSources(resource_path=resource_path),
+    )
+
+    assert agent_jar_sha256 == hashlib.sha256(b"agent-jar").hexdigest()
+
+
+@pytest.mark.parametrize(
+    "url, expected_address, expected_tls",
+    [
+        pytest.param("http://jenkins", ("jenkins", 80), False, id="http"),
+        pytest.param("https://jenkins", ("jenkins", 443), True, id="https"),
+        pytest.param("https://jenkins:8443/ci", ("jenkins", 8443), True, id="port"),
+    ],
+)
+def test_measure_endpoint_latency(
+    monkeypatch: pytest.MonkeyPatch,
+    url: str,
+    expected_address: typing.Tuple[str, int],
+    expected_tls: bool,
+):
+    """
+    arrange: given a Jenkins server endpoint accepting connections.
+    act: when measure_endpoint_latency is called.
+    assert: the connection latency is measured, with a TLS handshake for https endpoints.
+    """
+    mock_connect = unittest.mock.MagicMock()
+    monkeypatch.setattr(socket, "create_connection", mock_connect)
+    mock_context = unittest.mock.MagicMock()
+    monkeypatch.setattr(ssl, "create_default_context", lambda: mock_context)
+
+    latency = server.measure_endpoint_latency(url)
+
+    assert latency is not None
+    assert mock_connect.call_args.args[0] == expected_address
+    assert mock_context.wrap_socket.called == expected_tls
+    assert f'jenkins_agent_endpoint_latency_seconds{{endpoint="{url}"}}' in (
+        metrics.REGISTRY.gauges
+    )
+
+
+def test_measure_endpoint_latency_outside_span(monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: given a Jenkins server endpoint accepting connections.
+    act: when the undecorated measure_endpoint_latency is called outside of any span.
+    assert: the connection latency is measured and no span is recorded.
+    """
+    monkeypatch.setattr(socket, "create_connection", unittest.mock.MagicMock())
+
+    latency = inspect.unwrap(server.measure_endpoint_latency)("http://jenkins")
+
+    assert latency is not None
+    assert not tracing.SPANS
+
+
+def test_measure_endpoint_latency_unhealthy(
+    monkeypatch: pytest.MonkeyPatch, raise_exception: typing.Callable
+):
+    """
+    arrange: given a Jenkins server endpoint refusing connections.
+    act: when measure_endpoint_latency is called.
+    assert: None is returned.
+    """
+    monkeypatch.setattr(
+        socket, "create_connection", lambda *_args, **_kwargs: raise_exception(OSError)
+    )
+
+    assert server.measure_endpoint_latency("http://jenkins") is None
+
+
+@pytest.mark.parametrize(
+    "latencies, active_url, expected_url, expected_failovers",
+    [
+        pytest.param({"http://a": 0.2, "http://b": 0.1}, "", "http://b", 0, id="fastest"),
+        pytest.param({"http://a": 0.1, "http://b": 0.1}, "", "http://a", 0, id="tie"),
+        pytest.param(
+            {"http://a": 0.3, "http://b": 0.1, "http://c": 0.2}, "", "http://c", 0, id="weighted"
+        ),
+        pytest.param({"http://a": 0.15, "http://b": 0.1}, "http://a", "http://a", 0, id="kept"),
+        pytest.param({"http://a": 0.5, "http://b": 0.1}, "http://a", "http://b", 1, id="degraded"),
+        pytest.param(
+            {"http://a": None, "http://b": 0.1}, "http://a", "http://b", 1, id="unhealthy"
+        ),
+        pytest.param(
+            {"http://a": None, "http://b": None}, "http://b", "http://b", 0, id="none healthy"
+        ),
+        pytest.param(
+            {"http://a": None, "http://b": None}, "", "http://a", 0, id="none healthy first"
+        ),
+    ],
+)
+def test_select_endpoint(
+    monkeypatch: pytest.MonkeyPatch,
+    latencies: typing.Dict[str, typing.Optional[float]],
+    active_url: str,
+    expected_url: str,
+    expected_failovers: int,
+):
+    """
+    arrange: given Jenkins server endpoints with measured latencies and an active endpoint.
+    act: when select_endpoint is called.
+    assert: the healthy endpoint with the lowest weighted latency is selected, keeping the
+        active endpoint unless it degraded.
+    """
+    monkeypatch.setattr(server, "measure_endpoint_latency", latencies.__getitem__)
+    endpoints = [server.Endpoint(url="http://a"), server.Endpoint(url="http://b")]
+    if "http://c" in latencies:
+        endpoints.append(server.Endpoint(url="http://c", weight=3))
+
+    selected_url = server.select_endpoint(endpoints, active_url)
+
+    assert selected_url == expected_url
+    assert metrics.REGISTRY.get_total("jenkins_agent_endpoint_failovers_total") == (
+        expected_failovers
+    )
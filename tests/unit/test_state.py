@@ -14,6 +14,9 @@ import ops
 import ops.testing
 import pytest
 
+import admission
+import metadata
+import server
 import state
 
 
@@ -71,13 +74,34 @@ def test_from_charm_invalid_charm_config(harness: ops.testing.Harness):
         state.State.from_charm(charm=harness.charm)
 
 
+@pytest.mark.parametrize(
+    "label_template",
+    [
+        pytest.param("cores-{cpus}", id="unknown capability"),
+        pytest.param("cores-{cores", id="unclosed field"),
+        pytest.param("{cores!r}", id="conversion"),
+    ],
+)
+def test_from_charm_invalid_label_template(harness: ops.testing.Harness, label_template: str):
+    """
+    arrange: given a label template with an invalid capability field.
+    act: when the state is initialized from_charm.
+    assert: InvalidStateError is raised.
+    """
+    harness.update_config({"jenkins_agent_label_template": label_template})
+    harness.begin()
+
+    with pytest.raises(state.InvalidStateError):
+        state.State.from_charm(charm=harness.charm)
+
+
 def test_from_charm_invalid_server_url(
     harness: ops.testing.Harness, config: typing.Dict[str, str]
 ):
     """
     arrange: given charm configuration data with invalid server_url attribute.
     act: when the state is initialized from_charm.
-    assert: InvalidStateError is raised. (due to pydantic's AnyHttpUrl validator).
+    assert: InvalidStateError is raised. (due to the http or https URL validation).
     """
     invalid_config = config
     # This configuration is invalid because schema (http or https) must be specified
@@ -89,6 +113,123 @@ def test_from_charm_invalid_server_url(
         state.State.from_charm(charm=harness.charm)
 
 
+def test_from_charm_invalid_agent_jar_mirror_url(
+    harness: ops.testing.Harness, config: typing.Dict[str, str]
+):
+    """
+    arrange: given charm configuration data with an agent JAR mirror URL without scheme.
+    act: when the state is initialized from_charm.
+    assert: InvalidStateError is raised.
+    """
+    harness.update_config({**config, "agent_jar_mirror_url": "mirror.example.com/agent.jar"})
+    harness.begin()
+
+    with pytest.raises(state.InvalidStateError):
+        state.State.from_charm(charm=harness.charm)
+
+
+@pytest.mark.parametrize(
+    "applied_cpu, expected_executors",
+    [
+        pytest.param(None, 4, id="no resources"),
+        pytest.param("2", 2, id="cores"),
+        pytest.param("2500m", 2, id="millicores"),
+        pytest.param("0.5", 1, id="fraction"),
+        pytest.param("two", 4, id="invalid"),
+    ],
+)
+def test_from_charm_resources_executors(
+    monkeypatch: pytest.MonkeyPatch,
+    harness: ops.testing.Harness,
+    applied_cpu: typing.Optional[str],
+    expected_executors: int,
+):
+    """
+    arrange: given a node with four CPUs and the CPU quantity of the applied pod template.
+    act: when the state is initialized from_charm.
+    assert: the advertised executors match the applied CPU cores.
+    """
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+    relation_id = harness.add_relation(admission.PEER_RELATION, harness.model.app.name)
+    if applied_cpu:
+        harness.update_relation_data(
+            relation_id, harness.model.app.name, {state.APPLIED_CPU_KEY: applied_cpu}
+        )
+    harness.begin()
+
+    charm_state = state.State.from_charm(harness.charm)
+
+    assert charm_state.agent_meta.num_executors == expected_executors
+
+
+def test_from_charm_resources_not_applied(
+    monkeypatch: pytest.MonkeyPatch, harness: ops.testing.Harness
+):
+    """
+    arrange: given a node with four CPUs and a CPU quantity configured but not applied.
+    act: when the state is initialized from_charm.
+    assert: the advertised executors match the node CPUs.
+    """
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+    harness.update_config({"cpu": "2"})
+    harness.add_relation(admission.PEER_RELATION, harness.model.app.name)
+    harness.begin()
+
+    charm_state = state.State.from_charm(harness.charm)
+
+    assert charm_state.resources.cpu == "2"
+    assert charm_state.agent_meta.num_executors == 4
+
+
+@pytest.mark.parametrize(
+    "resource_config",
+    [
+        pytest.param({"cpu": "two"}, id="invalid cpu"),
+        pytest.param({"memory": "4GB"}, id="invalid memory"),
+        pytest.param({"cpu": "2", "guaranteed_qos": True}, id="guaranteed without memory"),
+        pytest.param({"pod_anti_affinity": "always"}, id="invalid pod anti-affinity"),
+        pytest.param({"node_selector": "pool"}, id="node label without value"),
+        pytest.param({"tolerations": "dedicated=builds:Never"}, id="invalid taint effect"),
+    ],
+)
+def test_from_charm_invalid_pod_config(
+    harness: ops.testing.Harness, resource_config: typing.Dict[str, typing.Union[str, bool]]
+):
+    """
+    arrange: given invalid workload container resources or scheduling configuration.
+    act: when the state is initialized from_charm.
+    assert: InvalidStateError is raised.
+    """
+    harness.update_config(resource_config)
+    harness.begin()
+
+    with pytest.raises(state.InvalidStateError):
+        state.State.from_charm(charm=harness.charm)
+
+
+def test_from_charm_scheduling(harness: ops.testing.Harness):
+    """
+    arrange: given node labels and node taints configuration.
+    act: when the state is initialized from_charm.
+    assert: the node selector and the tolerations are parsed.
+    """
+    harness.update_config(
+        {
+            "node_selector": "pool=builds, disk=nvme",
+            "tolerations": "dedicated=builds:NoSchedule,gpu",
+        }
+    )
+    harness.begin()
+
+    charm_state = state.State.from_charm(harness.charm)
+
+    assert charm_state.scheduling.node_selector == {"pool": "builds", "disk": "nvme"}
+    assert charm_state.scheduling.tolerations == (
+        state.Toleration(key="dedicated", value="builds", effect="NoSchedule"),
+        state.Toleration(key="gpu"),
+    )
+
+
 def test_from_charm_valid_config(harness: ops.testing.Harness, config: typing.Dict[str, str]):
     """
     arrange: given valid charm configuration data.
@@ -104,3 +245,213 @@ def test_from_charm_valid_config(harness: ops.testing.Harness, config: typing.Di
     assert charm_state.jenkins_config.agent_name_token_pairs == [
         (config["jenkins_agent_name"], config["jenkins_agent_token"])
     ]
+
+
+@pytest.mark.parametrize(
+    "jenkins_url, expected_endpoints",
+    [
+        pytest.param(
+            "http://jenkins-a", (server.Endpoint(url="http://jenkins-a"),), id="single URL"
+        ),
+        pytest.param(
+            "http://jenkins-a, https://jenkins-b:8443 2.5",
+            (
+                server.Endpoint(url="http://jenkins-a"),
+                server.Endpoint(url="https://jenkins-b:8443", weight=2.5),
+            ),
+            id="weighted list",
+        ),
+    ],
+)
+def test_from_charm_server_endpoints(
+    harness: ops.testing.Harness,
+    config: typing.Dict[str, str],
+    jenkins_url: str,
+    expected_endpoints: typing.Tuple[server.Endpoint, ...],
+):
+    """
+    arrange: given charm configuration data with a list of Jenkins server URLs.
+    act: when the state is initialized from_charm.
+    assert: the endpoints are parsed in configured order.
+    """
+    harness.update_config({**config, "jenkins_url": jenkins_url})
+    harness.begin()
+
+    charm_state = state.State.from_charm(harness.charm)
+
+    assert charm_state.jenkins_config
+    assert charm_state.jenkins_config.endpoints == expected_endpoints
+    assert charm_state.jenkins_config.server_url == expected_endpoints[0].url
+
+
+@pytest.mark.parametrize(
+    "jenkins_url",
+    [
+        pytest.param("http://jenkins-a,", id="empty entry"),
+        pytest.param("http://jenkins-a 0", id="zero weight"),
+        pytest.param("http://jenkins-a heavy", id="non numeric weight"),
+        pytest.param("http://jenkins-a nan", id="nan weight"),
+        pytest.param("http://jenkins-a inf", id="infinite weight"),
+        pytest.param("http://jenkins-a 1 2", id="extra field"),
+    ],
+)
+def test_from_charm_invalid_server_endpoints(
+    harness: ops.testing.Harness, config: typing.Dict[str, str], jenkins_url: str
+):
+    """
+    arrange: given charm configuration data with an invalid list of Jenkins server URLs.
+    act: when the state is initialized from_charm.
+    assert: InvalidStateError is raised.
+    """
+    harness.update_config({**config, "jenkins_url": jenkins_url})
+    harness.begin()
+
+    with pytest.raises(state.InvalidStateError):
+        state.State.from_charm(charm=harness.charm)
+
+
+@pytest.mark.parametrize(
+    "configured, relation_count, expected_controllers",
+    [
+        pytest.param(False, 0, [("", None, 5)], id="no controller"),
+        pytest.param(True, 0, [("", None, 5)], id="config"),
+        pytest.param(False, 2, [("", 0, 3), ("agent-1", 1, 2)], id="relations"),
+        pytest.param(
+            True,
+            2,
+            [("", None, 2), ("agent-0", 0, 2), ("agent-1", 1, 1)],
+            id="config and relations",
+        ),
+    ],
+)
+def test_controllers(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    monkeypatch: pytest.MonkeyPatch,
+    harness: ops.testing.Harness,
+    config: typing.Dict[str, str],
+    configured: bool,
+    relation_count: int,
+    expected_controllers: typing.List[typing.Tuple[str, typing.Optional[int], int]],
+):
+    """
+    arrange: given five executors, the Jenkins configuration or not and agent relations.
+    act: when the state is initialized from the charm.
+    assert: the configured controller, or else the first relation, is the primary controller and
+        the executors are split across the controllers.
+    """
+    monkeypatch.setattr(os, "cpu_count", lambda: 5)
+    if configured:
+        harness.update_config(config)
+    for index in range(relation_count):
+        harness.add_relation(state.AGENT_RELATION, f"jenkins-{index}")
+    harness.begin()
+
+    charm_state = state.State.from_charm(harness.charm)
+
+    assert [
+        (controller.name, controller.relation_id, controller.num_executors)
+        for controller in charm_state.controllers
+    ] == expected_controllers
+
+
+def test_controllers_outnumber_executors(
+    monkeypatch: pytest.MonkeyPatch, harness: ops.testing.Harness, config: typing.Dict[str, str]
+):
+    """
+    arrange: given two executors, the Jenkins configuration and two agent relations.
+    act: when the state is initialized from the charm.
+    assert: each served controller gets one executor and the last relation is not served.
+    """
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+    harness.update_config(config)
+    relation_ids = [
+        harness.add_relation(state.AGENT_RELATION, f"jenkins-{index}") for index in range(2)
+    ]
+    harness.begin()
+
+    charm_state = state.State.from_charm(harness.charm)
+
+    assert [
+        (controller.name, controller.relation_id, controller.num_executors)
+        for controller in charm_state.controllers
+    ] == [("", None, 1), (f"agent-{relation_ids[0]}", relation_ids[0], 1)]
+    assert charm_state.unserved_relation_ids == (relation_ids[1],)
+
+
+def test_agent_relation_credentials_memoized(
+    harness: ops.testing.Harness,
+    get_valid_relation_data: typing.Callable[[str], typing.Dict[str, str]],
+):
+    """
+    arrange: given an agent relation with complete relation data.
+    act: when the agent relation credentials are accessed twice.
+    assert: the relation is looked up only on the first access.
+    """
+    relation_data = get_valid_relation_data(state.AGENT_RELATION)
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+    harness.add_relation_unit(relation_id, "jenkins/0")
+    harness.update_relation_data(relation_id, "jenkins/0", relation_data)
+    harness.begin()
+    charm_state = state.State.from_charm(harness.charm)
+
+    with unittest.mock.patch.object(
+        ops.Model, "get_relation", autospec=True, side_effect=ops.Model.get_relation
+    ) as mock_get_relation:
+        credentials = charm_state.agent_relation_credentials
+        assert credentials == charm_state.agent_relation_credentials
+
+    mock_get_relation.assert_called_once()
+    assert credentials and credentials.address == relation_data["url"]
+    assert credentials.secret == relation_data["jenkins-agent-k8s-0_secret"]
+
+
+def test_agent_relation_server_url_without_secret(harness: ops.testing.Harness):
+    """
+    arrange: given an agent relation with the server URL but not the secret of this agent.
+    act: when the state is initialized from the charm.
+    assert: the server URL is available while the credentials are not.
+    """
+    relation_id = harness.add_relation(state.AGENT_RELATION, "jenkins")
+    harness.add_relation_unit(relation_id, "jenkins/0")
+    harness.update_relation_data(relation_id, "jenkins/0", {"url": "http://test"})
+    harness.begin()
+
+    charm_state = state.State.from_charm(harness.charm)
+
+    assert charm_state.agent_relation_credentials is None
+    assert charm_state.agent_relation_server_url == "http://test"
+
+
+def test_agent_relation_no_relation(harness: ops.testing.Harness):
+    """
+    arrange: given a charm without agent relation.
+    act: when the state is initialized from the charm.
+    assert: neither the credentials nor the server URL are available.
+    """
+    harness.begin()
+
+    charm_state = state.State.from_charm(harness.charm)
+
+    assert charm_state.agent_relation_credentials is None
+    assert charm_state.agent_relation_server_url is None
+
+
+def test_jenkins_config_no_agent_name_token_pairs():
+    """
+    arrange: given a Jenkins server endpoint.
+    act: when the Jenkins config is initialized without agent name and token pairs.
+    assert: ValueError is raised.
+    """
+    with pytest.raises(ValueError):
+        state.JenkinsConfig(
+            endpoints=(server.Endpoint(url="http://test"),), agent_name_token_pairs=[]
+        )
+
+
+def test_agent_invalid_num_executors():
+    """
+    arrange: given no executors.
+    act: when the agent metadata is initialized.
+    assert: ValueError is raised.
+    """
+    with pytest.raises(ValueError):
+        metadata.Agent(num_executors=0, labels="", name="jenkins-agent-k8s-0")
@@ -0,0 +1,393 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Jenkins-agent-k8s tracing module tests."""
+
+# Need access to protected functions for testing
+# pylint:disable=protected-access
+
+import inspect
+import json
+import secrets
+import sys
+import typing
+import unittest.mock
+from pathlib import Path
+
+import ops
+import pytest
+import requests
+from ops.testing import Harness
+
+import diagnostics
+import server
+import tracing
+
+
+def test_span_nesting():
+    """
+    arrange: given nested spans, the inner one raising an exception.
+    act: when the spans end.
+    assert: the inner span is a child of the outer span and is marked as failed.
+    """
+    with pytest.raises(ValueError):
+        with tracing.span("outer") as outer:
+            with tracing.span("inner", key="value"):
+                raise ValueError("test")
+
+    assert len(tracing.SPANS) == 2
+    inner = tracing.SPANS[0]
+    assert tracing.SPANS[1] is outer
+    assert inner.parent_span_id == outer.span_id
+    assert not outer.parent_span_id
+    assert inner.error and outer.error
+    assert inner.to_otlp()["attributes"] == [{"key": "key", "value": {"stringValue": "value"}}]
+    assert tracing.get_current_span() is None
+
+
+def test_validate_credentials_remoting_phases(jenkins_connection_log: str):
+    """
+    arrange: given a mock container that returns successful jenkins agent connection logs.
+    act: when validate_credentials is called.
+    assert: a span is recorded with an event for each remoting phase.
+    """
+    mock_process = unittest.mock.MagicMock(spec=ops.pebble.ExecProcess)
+    mock_process.stdout = jenkins_connection_log.split("\n")
+    mock_container = unittest.mock.MagicMock(spec=ops.Container)
+    mock_container.exec.return_value = mock_process
+
+    server.validate_credentials(
+        agent_name="test-agent",
+        credentials=server.Credentials(address="http://test-url", secret=secrets.token_hex(16)),
+        container=mock_container,
+    )
+
+    assert len(tracing.SPANS) == 1
+    validation_span = tracing.SPANS[0]
+    assert validation_span.name == "validate_credentials"
+    assert [name for name, _ in validation_span.events] == list(diagnostics.REMOTING_PHASE_ORDER)
+    assert validation_span.attributes == {"agent_name": "test-agent", "valid": True}
+
+
+def test_span_to_otlp():
+    """
+    arrange: given a span with attributes of each type and an event.
+    act: when the span is encoded.
+    assert: each attribute is encoded with the OTLP value type of its Python type.
+    """
+    with tracing.span("test", flag=True, count=2, ratio=0.5, key="value") as recorded:
+        recorded.add_event("event")
+
+    otlp_span = recorded.to_otlp()
+
+    assert otlp_span["attributes"] == [
+        {"key": "flag", "value": {"boolValue": True}},
+        {"key": "count", "value": {"intValue": "2"}},
+        {"key": "ratio", "value": {"doubleValue": 0.5}},
+        {"key": "key", "value": {"stringValue": "value"}},
+    ]
+    assert [event["name"] for event in otlp_span["events"]] == ["event"]
+    assert "parentSpanId" not in otlp_span and "status" not in otlp_span
+
+
+def test_traced_functions_outside_span(
+    monkeypatch: pytest.MonkeyPatch, jenkins_connection_log: str
+):
+    """
+    arrange: given the undecorated download and validation functions and a mock container.
+    act: when the functions are called outside of any span.
+    assert: the functions succeed and no span is recorded.
+    """
+    mock_response = unittest.mock.MagicMock(spec=requests.Response)
+    mock_response.content = b"agent-jar"
+    monkeypatch.setattr(requests, "get", lambda *_args, **_kwargs: mock_response)
+    mock_process = unittest.mock.MagicMock(spec=ops.pebble.ExecProcess)
+    mock_process.stdout = jenkins_connection_log.split("\n")
+    mock_container = unittest.mock.MagicMock(spec=ops.Container)
+    mock_container.exec.return_value = mock_process
+
+    inspect.unwrap(server.download_jenkins_agent)(
+        server_url="http://test-url", container=mock_container
+    )
+    valid = inspect.unwrap(server.validate_credentials)(
+        agent_name="test-agent",
+        credentials=server.Credentials(address="http://test-url", secret=secrets.token_hex(16)),
+        container=mock_container,
+    )
+
+    assert valid
+    assert not tracing.SPANS
+
+
+def test_pre_commit_tracing_disabled(harness: Harness, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: given a charm with the default configuration and a recorded span.
+    act: when the framework commits.
+    assert: the spans are neither exported nor written to the local traces file.
+    """
+    mock_start_export = unittest.mock.MagicMock(spec=tracing._start_export)
+    monkeypatch.setattr(tracing, "_start_export", mock_start_export)
+    harness.begin()
+    with tracing.span("test"):
+        pass
+
+    harness.framework.commit()
+
+    mock_start_export.assert_not_called()
+    assert not tracing.TRACES_PATH.exists()
+    assert not tracing.SPANS
+
+
+def test_pre_commit_write_jsonl(harness: Harness):
+    """
+    arrange: given a charm with the traces file enabled and a recorded span.
+    act: when the framework commits.
+    assert: the span is appended to the local traces file.
+    """
+    harness.update_config({tracing.TRACES_FILE_CONFIG: True})
+    harness.begin()
+    with tracing.span("test"):
+        pass
+
+    harness.framework.commit()
+
+    spans = [
+        json.loads(line) for line in tracing.TRACES_PATH.read_text(encoding="utf-8").splitlines()
+    ]
+    assert [otlp_span["name"] for otlp_span in spans] == ["State.from_charm", "test"]
+    assert spans[1]["resource"]["juju.unit"] == harness.charm.unit.name
+    assert not tracing.SPANS
+
+
+def test_pre_commit_write_jsonl_rotated(harness: Harness):
+    """
+    arrange: given a charm with the traces file enabled and a traces file over the size limit.
+    act: when the framework commits.
+    assert: the traces file is rotated and the spans are written to a new file.
+    """
+    tracing.TRACES_PATH.write_bytes(b"0" * (tracing.TRACES_MAX_BYTES + 1))
+    harness.update_config({tracing.TRACES_FILE_CONFIG: True})
+    harness.begin()
+
+    harness.framework.commit()
+
+    assert tracing.TRACES_PATH.with_suffix(".jsonl.1").stat().st_size > tracing.TRACES_MAX_BYTES
+    assert tracing.TRACES_PATH.stat().st_size < tracing.TRACES_MAX_BYTES
+
+
+def test_pre_commit_write_jsonl_error(
+    monkeypatch: pytest.MonkeyPatch, harness: Harness, caplog: pytest.LogCaptureFixture
+):
+    """
+    arrange: given a charm with the traces file enabled and an unwritable traces directory.
+    act: when the framework commits.
+    assert: a warning is logged and the hook completes.
+    """
+    monkeypatch.setattr(tracing, "TRACES_PATH", tracing.TRACES_PATH / "file" / "traces.jsonl")
+    tracing.TRACES_PATH.parent.parent.write_text("", encoding="utf-8")
+    harness.update_config({tracing.TRACES_FILE_CONFIG: True})
+    harness.begin()
+
+    harness.framework.commit()
+
+    assert "Failed to write spans" in caplog.text
+
+
+def add_tracing_relation(harness: Harness, receivers: typing.Optional[typing.List[typing.Any]]):
+    """Relate a tracing collector to the charm.
+
+    Args:
+        harness: The harness.
+        receivers: The receivers the collector published, None if not published yet.
+
+    Returns:
+        The tracing relation ID.
+    """
+    relation_id = harness.add_relation(tracing.TRACING_RELATION, "tempo")
+    harness.add_relation_unit(relation_id, "tempo/0")
+    if receivers is not None:
+        harness.update_relation_data(relation_id, "tempo", {"receivers": json.dumps(receivers)})
+    return relation_id
+
+
+@pytest.mark.parametrize(
+    "export_error",
+    [
+        pytest.param(None, id="exported"),
+        pytest.param(OSError("no process"), id="export failed"),
+    ],
+)
+def test_pre_commit_export_otlp(
+    monkeypatch: pytest.MonkeyPatch,
+    harness: Harness,
+    caplog: pytest.LogCaptureFixture,
+    export_error: typing.Optional[Exception],
+):
+    """
+    arrange: given a charm with the traces file enabled, related to a tracing collector.
+    act: when the framework commits.
+    assert: the spans are handed over to the export process and not written locally.
+    """
+    mock_start_export = unittest.mock.MagicMock(
+        spec=tracing._start_export, side_effect=export_error
+    )
+    monkeypatch.setattr(tracing, "_start_export", mock_start_export)
+    harness.update_config({tracing.TRACES_FILE_CONFIG: True})
+    add_tracing_relation(
+        harness,
+        [
+            {"protocol": {"name": "otlp_grpc", "type": "grpc"}, "url": "collector:4317"},
+            {"protocol": {"name": "otlp_http", "type": "http"}, "url": "http://collector:4318"},
+        ],
+    )
+    harness.begin()
+
+    harness.framework.commit()
+
+    endpoint, resource_spans = mock_start_export.call_args.args
+    assert endpoint == "http://collector:4318"
+    assert len(resource_spans["resourceSpans"][0]["scopeSpans"]) == 1
+    scope_spans = resource_spans["resourceSpans"][0]["scopeSpans"][0]
+    assert scope_spans["spans"][0]["name"] == "State.from_charm"
+    assert not tracing.TRACES_PATH.exists()
+    assert ("Failed to export spans" in caplog.text) == bool(export_error)
+
+
+@pytest.mark.parametrize(
+    "receivers",
+    [
+        pytest.param(None, id="not published"),
+        pytest.param([{"protocol": {"name": "otlp_grpc"}, "url": "collector:4317"}], id="grpc"),
+        pytest.param([{"url": "http://collector:4318"}], id="invalid"),
+    ],
+)
+def test_pre_commit_receiver_not_published(
+    monkeypatch: pytest.MonkeyPatch,
+    harness: Harness,
+    receivers: typing.Optional[typing.List[typing.Any]],
+):
+    """
+    arrange: given the traces file enabled and a collector without an OTLP/HTTP receiver.
+    act: when the framework commits.
+    assert: the spans are neither exported nor written to the local traces file.
+    """
+    mock_start_export = unittest.mock.MagicMock(spec=tracing._start_export)
+    monkeypatch.setattr(tracing, "_start_export", mock_start_export)
+    harness.update_config({tracing.TRACES_FILE_CONFIG: True})
+    add_tracing_relation(harness, receivers)
+    harness.begin()
+
+    harness.framework.commit()
+
+    mock_start_export.assert_not_called()
+    assert not tracing.TRACES_PATH.exists()
+
+
+def test_get_receiver_url_no_remote_app():
+    """
+    arrange: given a tracing relation whose remote application is not known yet.
+    act: when the receiver URL is read.
+    assert: no receiver URL is returned.
+    """
+    mock_relation = unittest.mock.MagicMock(spec=ops.Relation)
+    mock_relation.app = None
+
+    assert tracing._get_receiver_url(mock_relation) == ""
+
+
+@pytest.mark.parametrize(
+    "leader",
+    [
+        pytest.param(True, id="leader"),
+        pytest.param(False, id="non-leader"),
+    ],
+)
+def test_tracing_relation_created(harness: Harness, leader: bool):
+    """
+    arrange: given a charm unit.
+    act: when a tracing collector is related.
+    assert: the leader requests an OTLP/HTTP receiver from the collector.
+    """
+    harness.set_leader(leader)
+    harness.begin()
+
+    relation_id = add_tracing_relation(harness, None)
+
+    app_databag = harness.get_relation_data(relation_id, harness.charm.app.name)
+    assert app_databag.get("receivers") == ('["otlp_http"]' if leader else None)
+
+
+@pytest.mark.parametrize(
+    "related",
+    [
+        pytest.param(True, id="related"),
+        pytest.param(False, id="not related"),
+    ],
+)
+def test_leader_elected(harness: Harness, related: bool):
+    """
+    arrange: given a non-leader unit, related to a tracing collector or not.
+    act: when the unit is elected leader, twice.
+    assert: an OTLP/HTTP receiver is requested from the related collector.
+    """
+    harness.begin()
+    relation_id = add_tracing_relation(harness, None) if related else None
+
+    harness.set_leader(True)
+    harness.charm.on.leader_elected.emit()
+
+    if relation_id is not None:
+        app_databag = harness.get_relation_data(relation_id, harness.charm.app.name)
+        assert app_databag["receivers"] == '["otlp_http"]'
+    assert (harness.model.get_relation(tracing.TRACING_RELATION) is not None) == related
+
+
+def test_start_export(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """
+    arrange: given a monkeypatched subprocess.Popen.
+    act: when the export is started.
+    assert: a detached process is started with the collector and the file holding the spans.
+    """
+    mock_popen = unittest.mock.MagicMock()
+    monkeypatch.setattr("subprocess.Popen", mock_popen)
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+
+    tracing._start_export("http://collector:4318", {"resourceSpans": []})
+
+    command = mock_popen.call_args.args[0]
+    assert command[:3] == [sys.executable, tracing.__file__, "http://collector:4318"]
+    assert json.loads(Path(command[3]).read_text(encoding="utf-8")) == {"resourceSpans": []}
+    assert mock_popen.call_args.kwargs["start_new_session"]
+
+
+@pytest.mark.parametrize(
+    "export_error",
+    [
+        pytest.param(None, id="exported"),
+        pytest.param(OSError("unreachable"), id="export failed"),
+    ],
+)
+def test_main(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path, export_error: typing.Optional[Exception]
+):
+    """
+    arrange: given a file holding the spans and a monkeypatched urlopen.
+    act: when the export process runs.
+    assert: the spans are posted to the collector and the file is removed.
+    """
+    spans_path = tmp_path / "traces.json"
+    spans_path.write_text(json.dumps({"resourceSpans": []}), encoding="utf-8")
+    monkeypatch.setattr(sys, "argv", ["tracing.py", "http://collector:4318/", str(spans_path)])
+    mock_urlopen = unittest.mock.MagicMock(side_effect=export_error)
+    monkeypatch.setattr("urllib.request.urlopen", mock_urlopen)
+
+    if export_error:
+        with pytest.raises(OSError):
+            tracing.main()
+    else:
+        tracing.main()
+
+    request = mock_urlopen.call_args.args[0]
+    assert request.full_url == "http://collector:4318/v1/traces"
+    assert json.loads(request.data) == {"resourceSpans": []}
+    assert not spans_path.exists()